@@ -0,0 +1,555 @@
+"""
+Almacén local del proyecto: geometría leída de archivos LandXML y DXF en
+una base SQLite indexada.
+
+Los lectores (lector_landxml.py, lector_dxf.py) recorren los archivos en
+streaming y escriben aquí por lotes, así la memoria no depende del tamaño
+del archivo. Las rutas de análisis pueden trabajar contra el almacén sin
+AutoCAD: directamente (rutas /almacen/...) o a través de BackendAlmacen,
+que implementa la parte de lectura de BackendDibujo
+(ADDEC_BACKEND=almacen).
+
+Cada entidad guarda su tipo con el mismo ObjectName que devuelven los
+backends (AcDbPoint, AeccDbAlignment...), la caja que la contiene y sus
+coordenadas como un BLOB de float64 (x0, y0, z0, x1...). Los perfiles
+guardan (estación, 0, cota). Los puntos y caras de las superficies TIN van
+en tablas propias.
+"""
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+from array import array
+from typing import NamedTuple
+
+import numpy as np
+from flask import Blueprint, jsonify, request
+
+from backend_dibujo import BackendDibujo
+from superficie_tin import SuperficieTIN
+
+logger = logging.getLogger(__name__)
+
+almacen_bp = Blueprint('almacen', __name__)
+
+RUTA_POR_DEFECTO = 'almacen_proyecto.db'
+TAMANO_LOTE = 5000
+LIMITE_CONSULTA = 1000
+
+ESQUEMA_SQL = """
+CREATE TABLE IF NOT EXISTS origenes (
+    id INTEGER PRIMARY KEY,
+    nombre TEXT UNIQUE NOT NULL,
+    formato TEXT NOT NULL,
+    entidades INTEGER NOT NULL DEFAULT 0,
+    fecha TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS entidades (
+    id INTEGER PRIMARY KEY,
+    origen INTEGER NOT NULL REFERENCES origenes(id),
+    handle TEXT,
+    tipo TEXT NOT NULL,
+    capa TEXT,
+    nombre TEXT,
+    xmin REAL, ymin REAL, xmax REAL, ymax REAL,
+    vertices INTEGER NOT NULL,
+    coordenadas BLOB NOT NULL,
+    atributos TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_entidades_tipo ON entidades(tipo);
+CREATE INDEX IF NOT EXISTS idx_entidades_handle ON entidades(handle);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_entidades_origen_handle ON entidades(origen, handle);
+CREATE INDEX IF NOT EXISTS idx_entidades_nombre ON entidades(nombre);
+CREATE INDEX IF NOT EXISTS idx_entidades_caja ON entidades(xmin, xmax);
+CREATE INDEX IF NOT EXISTS idx_entidades_origen ON entidades(origen);
+CREATE TABLE IF NOT EXISTS puntos_superficie (
+    superficie INTEGER NOT NULL,
+    id INTEGER NOT NULL,
+    x REAL NOT NULL, y REAL NOT NULL, z REAL NOT NULL,
+    PRIMARY KEY (superficie, id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS caras_superficie (
+    superficie INTEGER NOT NULL,
+    a INTEGER NOT NULL, b INTEGER NOT NULL, c INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_caras_superficie ON caras_superficie(superficie);
+"""
+
+
+class Entidad(NamedTuple):
+    id: int
+    handle: str
+    tipo: str
+    capa: str
+    nombre: str
+    coordenadas: tuple
+    atributos: dict
+
+
+def _caja(coordenadas):
+    if not coordenadas:
+        return None, None, None, None
+    xs, ys = coordenadas[0::3], coordenadas[1::3]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+class AlmacenProyecto:
+    """
+    Base SQLite del proyecto.
+
+    Las altas (agregar_entidad, agregar_puntos_superficie...) se acumulan y
+    se escriben en lotes de tamano_lote filas; confirmar() escribe lo
+    pendiente y hace commit. Si una importación falla dentro de un bloque
+    with, se deshace entera. Cada hilo debe abrir su propio AlmacenProyecto.
+    """
+
+    def __init__(self, ruta=None, tamano_lote=TAMANO_LOTE):
+        self.ruta = ruta or os.environ.get('ADDEC_ALMACEN', RUTA_POR_DEFECTO)
+        self.tamano_lote = tamano_lote
+        self.conexion = sqlite3.connect(self.ruta, check_same_thread=False)
+        self.conexion.execute('PRAGMA journal_mode=WAL')
+        self.conexion.execute('PRAGMA synchronous=NORMAL')
+        self.conexion.executescript(ESQUEMA_SQL)
+        self._pendientes = {'entidades': [], 'puntos_superficie': [], 'caras_superficie': []}
+        self._siguiente_id = (self.conexion.execute('SELECT MAX(id) FROM entidades').fetchone()[0] or 0) + 1
+        self._origen = None
+        self._entidades_origen = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, valor, traza):
+        if tipo is not None and self.conexion is not None:
+            self.descartar()
+        self.cerrar()
+
+    def cerrar(self):
+        if self.conexion is not None:
+            self.confirmar()
+            self.conexion.close()
+            self.conexion = None
+
+    # --- Altas -----------------------------------------------------------------
+
+    def iniciar_origen(self, nombre, formato):
+        """
+        Registra el archivo del que se van a leer entidades. Si ya se había
+        importado, sus entidades anteriores se borran (reimportar es idempotente).
+        """
+        self.confirmar()
+        anterior = self.conexion.execute('SELECT id FROM origenes WHERE nombre = ?', (nombre,)).fetchone()
+        if anterior is not None:
+            self._borrar_origen(anterior[0])
+        cursor = self.conexion.execute('INSERT INTO origenes (nombre, formato) VALUES (?, ?)', (nombre, formato))
+        self._origen = cursor.lastrowid
+        self._entidades_origen = 0
+        return self._origen
+
+    def _borrar_origen(self, origen):
+        superficies = [f[0] for f in self.conexion.execute(
+            "SELECT id FROM entidades WHERE origen = ? AND tipo = 'AeccDbSurface'", (origen,))]
+        for superficie in superficies:
+            self.conexion.execute('DELETE FROM puntos_superficie WHERE superficie = ?', (superficie,))
+            self.conexion.execute('DELETE FROM caras_superficie WHERE superficie = ?', (superficie,))
+        self.conexion.execute('DELETE FROM entidades WHERE origen = ?', (origen,))
+        self.conexion.execute('DELETE FROM origenes WHERE id = ?', (origen,))
+
+    def agregar_entidad(self, tipo, coordenadas=(), handle=None, capa=None, nombre=None, atributos=None):
+        """Encola una entidad; coordenadas es una secuencia plana x0, y0, z0... Devuelve su id."""
+        if self._origen is None:
+            raise RuntimeError("Hay que llamar a iniciar_origen antes de agregar entidades.")
+        identificador = self._siguiente_id
+        self._siguiente_id += 1
+        coordenadas = array('d', coordenadas)
+        self._pendientes['entidades'].append((
+            identificador, self._origen, handle if handle is not None else format(identificador, 'X'), tipo, capa,
+            nombre, *_caja(coordenadas), len(coordenadas) // 3, coordenadas.tobytes(),
+            json.dumps(atributos, ensure_ascii=False) if atributos else None,
+        ))
+        self._entidades_origen += 1
+        self._vaciar_si_lleno('entidades')
+        return identificador
+
+    def agregar_puntos_superficie(self, superficie, puntos):
+        """puntos: iterable de (id, x, y, z)."""
+        self._pendientes['puntos_superficie'].extend((superficie, *p) for p in puntos)
+        self._vaciar_si_lleno('puntos_superficie')
+
+    def agregar_caras_superficie(self, superficie, caras):
+        """caras: iterable de (a, b, c) con los id de los puntos de la superficie."""
+        self._pendientes['caras_superficie'].extend((superficie, *c) for c in caras)
+        self._vaciar_si_lleno('caras_superficie')
+
+    def actualizar_caja(self, identificador, caja):
+        """Fija la caja (xmin, ymin, xmax, ymax) de una entidad sin coordenadas propias (superficies)."""
+        self._vaciar('entidades')
+        self.conexion.execute('UPDATE entidades SET xmin = ?, ymin = ?, xmax = ?, ymax = ? WHERE id = ?',
+                              (*caja, identificador))
+
+    _INSERCIONES = {
+        'entidades': 'INSERT INTO entidades VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        'puntos_superficie': 'INSERT OR REPLACE INTO puntos_superficie VALUES (?, ?, ?, ?, ?)',
+        'caras_superficie': 'INSERT INTO caras_superficie VALUES (?, ?, ?, ?)',
+    }
+
+    def _vaciar_si_lleno(self, tabla):
+        if len(self._pendientes[tabla]) >= self.tamano_lote:
+            self._vaciar(tabla)
+
+    def _vaciar(self, tabla):
+        filas, self._pendientes[tabla] = self._pendientes[tabla], []
+        if filas:
+            self.conexion.executemany(self._INSERCIONES[tabla], filas)
+
+    def confirmar(self):
+        """Escribe lo pendiente y hace commit."""
+        for tabla in self._pendientes:
+            self._vaciar(tabla)
+        if self._origen is not None:
+            self.conexion.execute('UPDATE origenes SET entidades = ? WHERE id = ?',
+                                  (self._entidades_origen, self._origen))
+        self.conexion.commit()
+
+    def descartar(self):
+        """Deshace todo lo escrito desde el último confirmar()."""
+        self._pendientes = {tabla: [] for tabla in self._pendientes}
+        self.conexion.rollback()
+        self._origen = None
+        self._siguiente_id = (self.conexion.execute('SELECT MAX(id) FROM entidades').fetchone()[0] or 0) + 1
+
+    # --- Consultas ---------------------------------------------------------------
+
+    _COLUMNAS = 'id, handle, tipo, capa, nombre, coordenadas, atributos'
+
+    @staticmethod
+    def _entidad(fila):
+        identificador, handle, tipo, capa, nombre, coordenadas, atributos = fila
+        valores = array('d')
+        valores.frombytes(coordenadas)
+        return Entidad(identificador, handle, tipo, capa, nombre, tuple(valores),
+                       json.loads(atributos) if atributos else {})
+
+    def obtener(self, identificador):
+        """
+        Entidad por id (int) o handle (str), o None. Un handle solo es único
+        dentro de su origen: si está en varios archivos importados se lanza
+        ValueError y hay que pedir la entidad por su id.
+        """
+        if isinstance(identificador, int):
+            fila = self.conexion.execute(f'SELECT {self._COLUMNAS} FROM entidades WHERE id = ?',
+                                         (identificador,)).fetchone()
+            return self._entidad(fila) if fila else None
+        filas = self.conexion.execute(
+            f'SELECT {self._COLUMNAS}, (SELECT nombre FROM origenes WHERE id = origen) FROM entidades '
+            'WHERE handle = ? ORDER BY id', (str(identificador),)).fetchall()
+        if len(filas) > 1:
+            raise ValueError(f"El handle '{identificador}' está en varios orígenes "
+                             f"({', '.join(fila[-1] for fila in filas)}); indique el id de la entidad.")
+        return self._entidad(filas[0][:-1]) if filas else None
+
+    def _filtro(self, tipo=None, capa=None, nombre=None, ventana=None, desde_id=0):
+        condiciones, parametros = ['id > ?'], [desde_id]
+        for columna, valor in (('tipo', tipo), ('capa', capa), ('nombre', nombre)):
+            if valor is not None:
+                condiciones.append(f'{columna} = ?')
+                parametros.append(valor)
+        if ventana is not None:
+            # Solapamiento de cajas: la entidad toca la ventana (xmin, ymin, xmax, ymax).
+            condiciones.append('xmax >= ? AND xmin <= ? AND ymax >= ? AND ymin <= ?')
+            parametros.extend((ventana[0], ventana[2], ventana[1], ventana[3]))
+        return ' AND '.join(condiciones), parametros
+
+    def iterar(self, tipo=None, capa=None, nombre=None, ventana=None, desde_id=0, limite=None):
+        """Entidades que cumplen los filtros, por id. Se leen del cursor según se consumen."""
+        where, parametros = self._filtro(tipo, capa, nombre, ventana, desde_id)
+        consulta = f'SELECT {self._COLUMNAS} FROM entidades WHERE {where} ORDER BY id'
+        if limite is not None:
+            consulta += ' LIMIT ?'
+            parametros.append(limite)
+        for fila in self.conexion.execute(consulta, parametros):
+            yield self._entidad(fila)
+
+    def contar(self, tipo=None, capa=None, nombre=None, ventana=None):
+        where, parametros = self._filtro(tipo, capa, nombre, ventana)
+        return self.conexion.execute(f'SELECT COUNT(*) FROM entidades WHERE {where}', parametros).fetchone()[0]
+
+    def puntos_superficie(self, superficie):
+        """(ids, xyz) de los puntos de una superficie como arrays de NumPy."""
+        filas = self.conexion.execute('SELECT id, x, y, z FROM puntos_superficie WHERE superficie = ? ORDER BY id',
+                                      (superficie,)).fetchall()
+        datos = np.array(filas, dtype=np.float64).reshape(-1, 4)
+        return datos[:, 0].astype(np.int64), datos[:, 1:]
+
+    def caras_superficie(self, superficie):
+        """Array (N, 3) con los id de los puntos de cada cara."""
+        filas = self.conexion.execute('SELECT a, b, c FROM caras_superficie WHERE superficie = ?',
+                                      (superficie,)).fetchall()
+        return np.array(filas, dtype=np.int64).reshape(-1, 3)
+
+    def iterar_perfiles(self):
+        """Perfiles con el formato de BackendDibujo.iterar_perfiles."""
+        for entidad in self.iterar(tipo='AeccDbProfile'):
+            yield {
+                "Alineación": entidad.atributos.get('alineacion', ''),
+                "Perfil": entidad.nombre,
+                "Tipo": entidad.atributos.get('tipo', ''),
+                "Estilo": entidad.atributos.get('estilo', ''),
+            }
+
+    def resumen(self):
+        tipos = dict(self.conexion.execute('SELECT tipo, COUNT(*) FROM entidades GROUP BY tipo ORDER BY tipo'))
+        origenes = [
+            {'nombre': nombre, 'formato': formato, 'entidades': entidades, 'fecha': fecha}
+            for nombre, formato, entidades, fecha in self.conexion.execute(
+                'SELECT nombre, formato, entidades, fecha FROM origenes ORDER BY id')
+        ]
+        puntos_tin = self.conexion.execute('SELECT COUNT(*) FROM puntos_superficie').fetchone()[0]
+        caras_tin = self.conexion.execute('SELECT COUNT(*) FROM caras_superficie').fetchone()[0]
+        return {'ruta': self.ruta, 'entidades_por_tipo': tipos, 'origenes': origenes,
+                'puntos_superficie': puntos_tin, 'caras_superficie': caras_tin}
+
+
+def importar_archivo(almacen, ruta, nombre=None):
+    """Importa un .xml (LandXML) o .dxf en el almacén según su extensión. Devuelve el resumen del lector."""
+    extension = os.path.splitext(nombre or ruta)[1].lower()
+    if extension == '.dxf':
+        from lector_dxf import importar_dxf
+        return importar_dxf(almacen, ruta, nombre)
+    if extension in ('.xml', '.landxml'):
+        from lector_landxml import importar_landxml
+        return importar_landxml(almacen, ruta, nombre)
+    raise ValueError(f"Formato no soportado: '{extension}'. Se esperaba .xml (LandXML) o .dxf.")
+
+
+class BackendAlmacen(BackendDibujo):
+    """
+    Backend de solo lectura sobre un AlmacenProyecto.
+
+    Permite ejecutar las rutas que leen geometría (obtener_objetos,
+    obtener_perfiles, etiquetado...) contra un proyecto importado, sin
+    AutoCAD. Los objetos son Entidad; las escrituras no están soportadas.
+    """
+
+    nombre = 'almacen'
+
+    def __init__(self, almacen):
+        self.almacen = almacen
+        self._conjuntos = {}
+        self._superficies = {}  # id de la superficie -> SuperficieTIN
+        self._perfiles_por_alineamiento = {}  # id del alineamiento -> perfiles, leídos en una pasada
+        self._revision_perfiles = None
+        self._version_datos = None
+        self._revision_cambios = None
+        self.marcar_cambio()
+
+    @property
+    def revision(self):
+        # PRAGMA data_version cambia cuando otra conexión escribe en el almacén (una importación).
+        version = self.almacen.conexion.execute('PRAGMA data_version').fetchone()[0]
+        if version != self._version_datos:
+            self._version_datos = version
+            self.marcar_cambio()
+        return self._revision
+
+    def cambios(self):
+        # No hay registro por entidad: tras una importación hay que recorrerlo todo.
+        revision, self._revision_cambios = self._revision_cambios, self.revision
+        return (set(), set()) if revision == self._revision_cambios else None
+
+    @property
+    def civil3d_disponible(self):
+        return True
+
+    def verificar(self):
+        return self.almacen.conexion is not None
+
+    def cerrar(self):
+        self.almacen.cerrar()
+
+    def nombre_aplicacion(self):
+        return 'Almacén de proyecto'
+
+    def nombre_documento(self):
+        return os.path.basename(self.almacen.ruta)
+
+    def obtener_objeto(self, identificador):
+        return self.almacen.obtener(identificador)
+
+    def iterar_objetos(self):
+        return self.almacen.iterar()
+
+    def contar_objetos(self):
+        return self.almacen.contar()
+
+    def handle(self, objeto):
+        return objeto.handle
+
+    def id_objeto(self, objeto):
+        return objeto.id
+
+    def tipo_objeto(self, objeto):
+        return objeto.tipo
+
+    def capa(self, objeto):
+        return objeto.capa
+
+    def coordenadas(self, objeto):
+        return objeto.coordenadas or None
+
+    def xdata(self, objeto, aplicacion=''):
+        # lector_dxf guarda las XData por aplicación en atributos['xdata'].
+        return [par for nombre, pares in objeto.atributos.get('xdata', {}).items()
+                if not aplicacion or nombre == aplicacion
+                for par in [(1001, nombre), *(tuple(p) for p in pares)]]
+
+    def _superficie(self, objeto):
+        superficie = self._superficies.get(objeto.id)
+        if superficie is None:
+            superficie = self._superficies[objeto.id] = SuperficieTIN.desde_almacen(self.almacen, objeto.id)
+        return superficie
+
+    def altura_en_punto(self, objeto, x, y, z):
+        return self.alturas_en_puntos(objeto, [(x, y, z)])[0]
+
+    def alturas_en_puntos(self, objeto, vertices):
+        """
+        Cotas interpoladas en el TIN si el objeto es una superficie; si no,
+        la cota del vértice más cercano en planta.
+        """
+        vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 3)
+        if objeto.tipo == 'AeccDbSurface':
+            cotas = self._superficie(objeto).cotas(vertices[:, 0], vertices[:, 1])
+            return [None if np.isnan(c) else float(c) for c in cotas]
+        xyz = np.asarray(objeto.coordenadas, dtype=np.float64).reshape(-1, 3)
+        if not len(xyz):
+            return [None] * len(vertices)
+        return [float(xyz[np.argmin(np.hypot(xyz[:, 0] - x, xyz[:, 1] - y)), 2]) for x, y, _ in vertices]
+
+    def linea_rasante(self, objeto):
+        # Como en memoria, un perfil es su propia línea de rasante.
+        return objeto
+
+    def conjunto_seleccion(self, nombre, crear=True):
+        if nombre not in self._conjuntos:
+            if not crear:
+                return None
+            self._conjuntos[nombre] = []
+        return list(self._conjuntos[nombre])
+
+    def iterar_perfiles(self):
+        return self.almacen.iterar_perfiles()
+
+    def iterar_alineamientos(self):
+        return self.almacen.iterar(tipo='AeccDbAlignment')
+
+    def nombre_alineamiento(self, alineamiento):
+        return alineamiento.nombre
+
+    def perfiles_de(self, alineamiento):
+        if self._revision_perfiles != self.revision:
+            self._perfiles_por_alineamiento = {}
+            for perfil in self.almacen.iterar(tipo='AeccDbProfile'):
+                self._perfiles_por_alineamiento.setdefault(perfil.atributos.get('id_alineacion'), []).append(perfil)
+            self._revision_perfiles = self.revision
+        return self._perfiles_por_alineamiento.get(alineamiento.id, [])
+
+    def datos_perfil(self, perfil):
+        return {"Perfil": perfil.nombre, "Tipo": perfil.atributos.get('tipo', ''),
+                "Estilo": perfil.atributos.get('estilo', '')}
+
+
+def crear_conector_almacen(ruta=None):
+    """Conector para SesionCAD que abre el almacén del proyecto con un BackendAlmacen."""
+
+    def conectar(try_create=False, auxiliar=False):
+        return BackendAlmacen(AlmacenProyecto(ruta))
+
+    return conectar
+
+
+def _entidad_json(entidad, con_coordenadas=True):
+    datos = entidad._asdict()
+    if not con_coordenadas:
+        datos['vertices'] = len(datos.pop('coordenadas')) // 3
+    return datos
+
+
+@almacen_bp.route('/almacen/importar', methods=['POST'])
+def importar():
+    """Importa un archivo LandXML (.xml) o DXF (.dxf) subido en el campo 'archivo'."""
+    archivo = request.files.get('archivo')
+    if not archivo or not archivo.filename:
+        return jsonify({'error': "No se proporcionó el archivo ('archivo')."}), 400
+    extension = os.path.splitext(archivo.filename)[1].lower()
+    if extension not in ('.xml', '.landxml', '.dxf'):
+        return jsonify({'error': 'Por favor, sube un archivo LandXML (.xml) o DXF (.dxf).'}), 400
+
+    descriptor, ruta = tempfile.mkstemp(suffix=extension)
+    os.close(descriptor)
+    try:
+        archivo.save(ruta)
+        with AlmacenProyecto() as almacen:
+            resumen = importar_archivo(almacen, ruta, archivo.filename)
+        logger.info(f"{archivo.filename} importado en el almacén: {resumen}")
+        return jsonify({'message': f"{archivo.filename} importado.", **resumen}), 200
+    except Exception as e:
+        logger.error(f"Error al importar {archivo.filename} en el almacén: {e}")
+        return jsonify({'error': f"Error al importar el archivo: {e}"}), 500
+    finally:
+        os.remove(ruta)
+
+
+@almacen_bp.route('/almacen/resumen', methods=['GET'])
+def resumen():
+    try:
+        with AlmacenProyecto() as almacen:
+            return jsonify(almacen.resumen()), 200
+    except Exception as e:
+        logger.error(f"Error al leer el almacén: {e}")
+        return jsonify({'error': f"Error al leer el almacén: {e}"}), 500
+
+
+@almacen_bp.route('/almacen/entidades', methods=['GET'])
+def entidades():
+    """
+    Entidades del almacén filtradas por ?tipo=, ?capa=, ?nombre= y
+    ?ventana=xmin,ymin,xmax,ymax. Se pagina con ?desde_id= (el último id
+    recibido) y ?limite= (máximo LIMITE_CONSULTA); ?coordenadas=0 omite las
+    coordenadas.
+    """
+    try:
+        ventana = request.args.get('ventana')
+        ventana = tuple(float(v) for v in ventana.split(',')) if ventana else None
+        if ventana is not None and len(ventana) != 4:
+            return jsonify({'error': 'ventana debe ser xmin,ymin,xmax,ymax.'}), 400
+        limite = min(int(request.args.get('limite', LIMITE_CONSULTA)), LIMITE_CONSULTA)
+        if limite < 1:
+            raise ValueError("limite debe ser al menos 1")
+        desde_id = int(request.args.get('desde_id', 0))
+        con_coordenadas = request.args.get('coordenadas', '1') != '0'
+    except ValueError as e:
+        return jsonify({'error': f"Parámetro no válido: {e}"}), 400
+
+    try:
+        with AlmacenProyecto() as almacen:
+            lista = [_entidad_json(e, con_coordenadas) for e in almacen.iterar(
+                request.args.get('tipo'), request.args.get('capa'), request.args.get('nombre'),
+                ventana, desde_id, limite)]
+        return jsonify({'entidades': lista, 'siguiente_desde_id': lista[-1]['id'] if len(lista) == limite else None}), 200
+    except Exception as e:
+        logger.error(f"Error al consultar el almacén: {e}")
+        return jsonify({'error': f"Error al consultar el almacén: {e}"}), 500
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if len(sys.argv) < 2:
+        sys.exit("Uso: python almacen_proyecto.py archivo.xml|archivo.dxf [almacen.db]")
+    inicio = time.perf_counter()
+    with AlmacenProyecto(sys.argv[2] if len(sys.argv) > 2 else None) as almacen:
+        print(importar_archivo(almacen, sys.argv[1]))
+        print(f"Importado en {time.perf_counter() - inicio:.2f} s: {almacen.resumen()}")
@@ -1,8 +1,5 @@
 import logging
 import sys
-import win32com.client
-import pythoncom
-from pyautocad import Autocad
 
 # Configuración del logger
 logger = logging.getLogger(__name__)
@@ -21,6 +18,11 @@ logger.addHandler(console_handler)
 
 
 def conectar_con_autocad_civil(try_create=False):
+    # Importaciones diferidas: importar este módulo no debe cargar COM ni conectar con AutoCAD.
+    import pythoncom
+    import win32com.client
+    from pyautocad import Autocad
+
     acad = None
     civil3d_app = None
 
@@ -128,6 +130,8 @@ def conectar_con_autocad_civil(try_create=False):
 
 
 def desconectar_autocad_civil(acad=None, civil3d_app=None):
+    import pythoncom
+
     try:
         logger.debug("Iniciando desconexión de AutoCAD y Civil 3D...")
         print("DEBUG: Iniciando desconexión...")
@@ -166,22 +170,23 @@ def desconectar_autocad_civil(acad=None, civil3d_app=None):
             print(f"ERROR al liberar COM en finally (desconexión): {e_uninitialize_finally}")
 
 
-# ** La llamada a la función a nivel superior .**
-acad, civil3d_app = conectar_con_autocad_civil(try_create=True)
+if __name__ == "__main__":
+    # Prueba manual de conexión. No se ejecuta al importar el módulo.
+    acad, civil3d_app = conectar_con_autocad_civil(try_create=True)
 
-if acad:
-    try:
-        if civil3d_app:
-            print("Civil 3D conectado (llamada principal)")
-        else:
-            print("AutoCAD conectado (llamada principal)")
-
-        doc = acad.doc
-        print(f"Nombre del documento activo: {doc.Name} (llamada principal)")
-
-    except Exception as e:
-        print(f"Ocurrió un error al interactuar con AutoCAD/Civil 3D (llamada principal): {e}")
-    finally:
-        desconectar_autocad_civil(acad, civil3d_app)
-else:
-    print("No se pudo establecer la conexión con AutoCAD/Civil 3D (llamada principal).")
\ No newline at end of file
+    if acad:
+        try:
+            if civil3d_app:
+                print("Civil 3D conectado (llamada principal)")
+            else:
+                print("AutoCAD conectado (llamada principal)")
+
+            doc = acad.doc
+            print(f"Nombre del documento activo: {doc.Name} (llamada principal)")
+
+        except Exception as e:
+            print(f"Ocurrió un error al interactuar con AutoCAD/Civil 3D (llamada principal): {e}")
+        finally:
+            desconectar_autocad_civil(acad, civil3d_app)
+    else:
+        print("No se pudo establecer la conexión con AutoCAD/Civil 3D (llamada principal).")
\ No newline at end of file
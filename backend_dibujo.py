@@ -0,0 +1,607 @@
+"""
+Backends de dibujo: la interfaz por la que pasan todas las rutas que leen o
+escriben geometría.
+
+BackendCOM habla con AutoCAD/Civil 3D por COM (pywin32/pyautocad).
+BackendMemoria (cad_memoria.py) guarda las entidades en arrays en memoria y
+permite perfilar y hacer benchmarks en Linux.
+
+Los objetos que devuelven los métodos (entidades, redes) son opacos: solo se
+deben pasar de vuelta al mismo backend.
+
+revision es un número que cambia cada vez que el dibujo puede haber
+cambiado; cache_objetos.py lo usa para saber si una instantánea sigue
+valiendo. Las revisiones salen de un contador común, así dos conexiones
+distintas nunca comparten número.
+"""
+import itertools
+import logging
+import time
+
+import geometria
+
+try:
+    import pythoncom
+except ImportError:  # Linux / backend en memoria
+    pythoncom = None
+
+logger = logging.getLogger(__name__)
+
+VT_ARRAY = 8192
+VT_R8 = 5
+
+CARACTERES_POR_COMANDO = 8000  # tope de cada SendCommand con entmake
+VARIABLE_RECUENTO = 'USERI5'  # donde cada comando deja cuántas entidades creó
+ESPERA_COMANDO_S = 60.0
+
+_REVISIONES = itertools.count(1)
+
+
+def _cadena_lisp(texto):
+    """Escapa un texto para usarlo como cadena AutoLISP."""
+    return str(texto).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def _contenido_mtext(texto):
+    """Contenido de un MTEXT: escapa los códigos de formato y cambia los saltos de línea por \\P."""
+    texto = str(texto).replace('\\', '\\\\').replace('{', '\\{').replace('}', '\\}')
+    return texto.replace('\r\n', '\n').replace('\r', '\n').replace('\n', '\\P')
+
+
+def _trozos_lisp(expresiones, caracteres):
+    """Agrupa las expresiones en trozos de hasta caracteres caracteres (una sola si es más larga)."""
+    trozo, longitud = [], 0
+    for expresion in expresiones:
+        if trozo and longitud + len(expresion) > caracteres:
+            yield trozo
+            trozo, longitud = [], 0
+        trozo.append(expresion)
+        longitud += len(expresion) + 1
+    if trozo:
+        yield trozo
+
+
+def agrupar_vertices(coordenadas):
+    """Agrupa una secuencia plana x0, y0, z0, x1... en una lista de vértices (x, y, z)."""
+    return [tuple(coordenadas[i:i + 3]) for i in range(0, len(coordenadas), 3)]
+
+
+class BackendDibujo:
+    """Interfaz común de los backends de dibujo."""
+
+    nombre = 'base'
+    _revision = 0
+
+    # --- Conexión ---------------------------------------------------------
+
+    @property
+    def civil3d_disponible(self):
+        """True si el backend puede crear objetos de Civil 3D (redes de tuberías, perfiles)."""
+        return False
+
+    def verificar(self):
+        """Comprueba que la conexión sigue viva."""
+        raise NotImplementedError
+
+    def cerrar(self):
+        """Libera la conexión."""
+
+    def nombre_aplicacion(self):
+        raise NotImplementedError
+
+    def nombre_documento(self):
+        raise NotImplementedError
+
+    # --- Revisión del dibujo ---------------------------------------------------
+
+    @property
+    def revision(self):
+        """Número de la revisión actual del dibujo (cambia con cada modificación conocida)."""
+        return self._revision
+
+    def marcar_cambio(self):
+        """Empieza una revisión nueva: lo leído antes deja de valer."""
+        self._revision = next(_REVISIONES)
+
+    def cambios(self):
+        """
+        Registro de cambios del espacio modelo desde la llamada anterior:
+        (handles añadidos o modificados, ObjectIDs borrados). Devuelve None
+        si el backend no lo lleva o lo ha perdido; entonces hay que
+        recorrer todos los objetos. Cada llamada empieza un registro nuevo.
+        """
+        return None
+
+    # --- Escritura ----------------------------------------------------------
+
+    def agregar_punto(self, x, y, z):
+        raise NotImplementedError
+
+    def agregar_texto(self, texto, x, y, z, altura):
+        raise NotImplementedError
+
+    def agregar_polilinea_3d(self, coordenadas):
+        """Crea una polilínea 3D a partir de una secuencia plana x0, y0, z0, x1, y1, z1..."""
+        raise NotImplementedError
+
+    def agregar_arco(self, centro, radio, angulo_inicio, angulo_fin):
+        raise NotImplementedError
+
+    def agregar_puntos_lote(self, coordenadas):
+        """
+        Crea un lote de puntos a partir de una secuencia plana x0, y0, z0, x1...
+
+        La implementación por defecto hace una llamada por punto; los backends
+        la sustituyen por una sola ida y vuelta por lote.
+        """
+        for x, y, z in agrupar_vertices(coordenadas):
+            self.agregar_punto(x, y, z)
+
+    def agregar_textos_lote(self, textos, coordenadas, alturas):
+        """Crea un lote de textos; coordenadas es plana (x, y, z por texto) y alturas una por texto."""
+        for texto, (x, y, z), altura in zip(textos, agrupar_vertices(coordenadas), alturas):
+            self.agregar_texto(texto, x, y, z, altura)
+
+    def agregar_polilineas_3d_lote(self, polilineas):
+        """Crea un lote de polilíneas 3D; cada una es una secuencia plana x0, y0, z0, x1..."""
+        for coordenadas in polilineas:
+            self.agregar_polilinea_3d(coordenadas)
+
+    def crear_red_tuberias(self, nombre):
+        raise NotImplementedError
+
+    def obtener_red_tuberias(self, nombre):
+        """
+        Devuelve la red de tuberías con ese nombre, creándola si no existe.
+
+        El backend recuerda la red resuelta, así las importaciones siguientes
+        de la misma sesión añaden sus tuberías a ella sin volver a buscarla.
+        """
+        raise NotImplementedError
+
+    def agregar_tuberia(self, red, inicio, fin, diametro):
+        raise NotImplementedError
+
+    # --- Lectura -------------------------------------------------------------
+
+    def obtener_objeto(self, identificador):
+        """Devuelve el objeto con ese handle (str) u ObjectID (int), o None si no existe."""
+        raise NotImplementedError
+
+    def iterar_objetos(self):
+        """Itera los objetos del espacio modelo."""
+        raise NotImplementedError
+
+    def contar_objetos(self):
+        raise NotImplementedError
+
+    def handle(self, objeto):
+        raise NotImplementedError
+
+    def id_objeto(self, objeto):
+        raise NotImplementedError
+
+    def tipo_objeto(self, objeto):
+        """ObjectName de la entidad (AcDbPoint, AcDb3dPolyline...)."""
+        raise NotImplementedError
+
+    def capa(self, objeto):
+        raise NotImplementedError
+
+    def coordenadas(self, objeto):
+        """Coordenadas como tupla plana x0, y0, z0, ... o None si el objeto no tiene."""
+        raise NotImplementedError
+
+    def vertices(self, objeto):
+        """Coordenadas como array (N, 3) de float64 (vacío si el objeto no tiene)."""
+        return geometria.vertices(self.coordenadas(objeto))
+
+    def xdata(self, objeto, aplicacion=''):
+        """
+        XData del objeto como lista de pares (código, valor); los de cada
+        aplicación van detrás de su (1001, nombre). Sin aplicación, las de
+        todas. Lista vacía si no tiene.
+        """
+        raise NotImplementedError
+
+    def altura_en_punto(self, objeto, x, y, z):
+        raise NotImplementedError
+
+    def alturas_en_puntos(self, objeto, vertices):
+        """Cotas de objeto en una lista de vértices (x, y, z); None donde no hay cota."""
+        return [self.altura_en_punto(objeto, x, y, z) for x, y, z in vertices]
+
+    def linea_rasante(self, objeto):
+        raise NotImplementedError
+
+    def conjunto_seleccion(self, nombre, crear=True):
+        """Objetos del conjunto de selección, o None si no existe y crear es False."""
+        raise NotImplementedError
+
+    def iterar_perfiles(self):
+        """Itera dicts con Alineación, Perfil, Tipo y Estilo de cada perfil, a medida que se leen."""
+        raise NotImplementedError
+
+    def listar_perfiles(self):
+        """Lista de dicts con Alineación, Perfil, Tipo y Estilo de cada perfil."""
+        return list(self.iterar_perfiles())
+
+    def iterar_alineamientos(self):
+        """Itera los alineamientos del documento."""
+        raise NotImplementedError
+
+    def nombre_alineamiento(self, alineamiento):
+        raise NotImplementedError
+
+    def perfiles_de(self, alineamiento):
+        """Lista de los perfiles de un alineamiento."""
+        raise NotImplementedError
+
+    def datos_perfil(self, perfil):
+        """Dict con Perfil, Tipo y Estilo."""
+        raise NotImplementedError
+
+    def geometria_perfil(self, perfil):
+        """
+        (estación inicial, estación final, vértices) del perfil. Por defecto
+        se leen de la línea de rasante, cuyos vértices son (estación, _, cota).
+        """
+        vertices = self.vertices(self.linea_rasante(perfil))
+        if not len(vertices):
+            return None, None, 0
+        return float(vertices[:, 0].min()), float(vertices[:, 0].max()), len(vertices)
+
+
+class BackendCOM(BackendDibujo):
+    """Backend sobre la API COM de AutoCAD/Civil 3D."""
+
+    nombre = 'com'
+
+    def __init__(self, acad, civil3d=None, eventos=True):
+        self.acad = acad
+        self.civil3d = civil3d
+        self._redes_tuberias = {}  # (documento, nombre de la red) -> handle
+        self.marcar_cambio()
+        # Sin eventos en las conexiones auxiliares: su hilo no atiende mensajes y AutoCAD esperaría.
+        self._eventos = self._escuchar_eventos() if eventos else None
+        self._eventos_documento = None
+        self._modificados, self._borrados = None, set()
+        if self._eventos is not None:
+            self._escuchar_documento()
+
+    def _escuchar_eventos(self):
+        """
+        Se suscribe a los eventos de la aplicación: al terminar cualquier
+        comando o expresión LISP empieza una revisión nueva; al abrir o crear
+        un dibujo o cambiar de ventana, además, se vuelven a escuchar los
+        eventos del documento activo. Devuelve None si no se puede.
+        """
+        try:
+            from win32com.client import WithEvents
+        except ImportError:
+            return None
+        backend = self
+
+        class _Eventos:
+            def OnEndCommand(self, *args):
+                backend.marcar_cambio()
+
+            def OnWindowChanged(self, *args):
+                backend._escuchar_documento()
+
+            OnEndLisp = OnLispCancelled = OnEndCommand
+            OnEndOpen = OnNewDrawing = OnWindowChanged
+
+        try:
+            return WithEvents(self.acad.Application, _Eventos)
+        except Exception as e:
+            logger.warning(f"No se pudo escuchar los eventos de AutoCAD; las instantáneas no se reutilizarán: {e}")
+            return None
+
+    def _escuchar_documento(self):
+        """
+        Se suscribe a los eventos del documento activo y empieza un registro
+        de cambios nuevo: ObjectAdded/ObjectModified apuntan el handle de las
+        entidades del espacio modelo y ObjectErased su ObjectID. Un objeto
+        que pertenece a una entidad del espacio modelo (un perfil a su
+        alineamiento, un atributo a su bloque) apunta el de esa entidad.
+        """
+        from win32com.client import WithEvents
+        backend = self
+
+        class _EventosDocumento:
+            def OnObjectAdded(self, objeto):
+                backend.marcar_cambio()
+                if backend._modificados is None:
+                    return
+                try:
+                    handle = backend._handle_en_modelo(objeto)
+                    if handle is not None:
+                        backend._modificados.add(handle)
+                except Exception:
+                    backend._modificados = None  # Cambio sin identificar: hay que recorrer todo.
+
+            OnObjectModified = OnObjectAdded
+
+            def OnObjectErased(self, id_objeto):
+                backend.marcar_cambio()
+                backend._borrados.add(id_objeto)
+
+        if self._eventos_documento is not None:
+            self._eventos_documento.close()
+            self._eventos_documento = None
+        self.marcar_cambio()
+        self._modificados, self._borrados = None, set()
+        self._propietarios = {}  # OwnerID -> handle de la entidad del espacio modelo, o None
+        try:
+            self._id_modelo = self.modelo.ObjectID
+            self._eventos_documento = WithEvents(self.documento, _EventosDocumento)
+        except Exception as e:
+            logger.warning(f"No se pudo escuchar los eventos del documento; el inventario se recorrerá entero: {e}")
+
+    def _handle_en_modelo(self, objeto):
+        """Handle de la entidad del espacio modelo afectada por un cambio en objeto, o None."""
+        propietario = objeto.OwnerID
+        if propietario == self._id_modelo:
+            return objeto.Handle
+        if propietario not in self._propietarios:
+            try:
+                entidad = self.documento.ObjectIdToObject(propietario)
+                self._propietarios[propietario] = entidad.Handle if entidad.OwnerID == self._id_modelo else None
+            except Exception:
+                self._propietarios[propietario] = None  # Tablas, diccionarios: no es una entidad.
+        return self._propietarios[propietario]
+
+    @property
+    def revision(self):
+        if self._eventos is None:
+            # Sin eventos no se sabe si el usuario ha editado el dibujo: cada lectura es una revisión nueva.
+            self.marcar_cambio()
+        elif pythoncom is not None:
+            # Los eventos llegan como mensajes al apartamento del hilo de la sesión.
+            pythoncom.PumpWaitingMessages()
+        return self._revision
+
+    def cambios(self):
+        self.revision  # Atiende los eventos pendientes.
+        modificados, borrados = self._modificados, self._borrados
+        self._modificados, self._borrados = (set() if self._eventos_documento is not None else None), set()
+        if modificados is None:
+            return None
+        return modificados, borrados
+
+    @property
+    def civil3d_disponible(self):
+        return self.civil3d is not None
+
+    @property
+    def documento(self):
+        return self.acad.ActiveDocument
+
+    @property
+    def modelo(self):
+        return self.acad.ActiveDocument.ModelSpace
+
+    def verificar(self):
+        return self.acad.ActiveDocument.Name is not None
+
+    def cerrar(self):
+        from autocad_civil import desconectar_autocad_civil
+        for eventos in (self._eventos, self._eventos_documento):
+            if eventos is not None:
+                eventos.close()
+        self._eventos = self._eventos_documento = None
+        desconectar_autocad_civil(self.acad, self.civil3d)
+        self.acad = None
+        self.civil3d = None
+
+    def nombre_aplicacion(self):
+        return getattr(self.acad.Application, "Name", "AutoCAD")
+
+    def nombre_documento(self):
+        return self.documento.Name
+
+    @staticmethod
+    def _variant(valores):
+        from win32com.client import VARIANT
+        return VARIANT(VT_ARRAY | VT_R8, tuple(float(v) for v in valores))
+
+    def agregar_punto(self, x, y, z):
+        return self.modelo.AddPoint(self._variant((x, y, z)))
+
+    def agregar_texto(self, texto, x, y, z, altura):
+        return self.modelo.AddText(texto, self._variant((x, y, z)), altura)
+
+    def agregar_polilinea_3d(self, coordenadas):
+        return self.modelo.Add3DPoly(self._variant(coordenadas))
+
+    def agregar_arco(self, centro, radio, angulo_inicio, angulo_fin):
+        return self.modelo.AddArc(self._variant(centro), radio, angulo_inicio, angulo_fin)
+
+    def _enviar_lisp(self, entidades):
+        """
+        Crea las entidades (cada una, la lista de sus expresiones entmake)
+        con SendCommand, en comandos de hasta CARACTERES_POR_COMANDO
+        caracteres: AutoCAD evalúa cada trozo sin cruzar la frontera entre
+        procesos por cada entidad. SendCommand no espera a que el comando
+        termine, así que cada trozo deja en VARIABLE_RECUENTO cuántas
+        entidades creó y se espera a ese recuento antes de seguir. Lanza
+        RuntimeError si alguna no se creó.
+        """
+        esperadas = creadas = 0
+        # Cada entidad cuenta si todos sus entmake devuelven algo distinto de nil.
+        expresiones = (f"(if (and {' '.join(entidad)}) (setq addec-creadas (1+ addec-creadas)))" for entidad in entidades)
+        for trozo in _trozos_lisp(expresiones, CARACTERES_POR_COMANDO):
+            self.documento.SetVariable(VARIABLE_RECUENTO, -1)
+            self.documento.SendCommand(f"(progn (setq addec-creadas 0) {' '.join(trozo)} "
+                                       f"(setvar \"{VARIABLE_RECUENTO}\" addec-creadas) (princ))\n")
+            esperadas += len(trozo)
+            creadas += self._esperar_recuento()
+        if creadas != esperadas:
+            raise RuntimeError(f"AutoCAD creó {creadas} de {esperadas} entidades del lote.")
+
+    def _esperar_recuento(self):
+        limite = time.monotonic() + ESPERA_COMANDO_S
+        while True:
+            recuento = self.documento.GetVariable(VARIABLE_RECUENTO)
+            if recuento != -1:
+                return recuento
+            if time.monotonic() > limite:
+                raise RuntimeError(f"AutoCAD no terminó el lote en {ESPERA_COMANDO_S:.0f} s.")
+            time.sleep(0.005)
+
+    def agregar_puntos_lote(self, coordenadas):
+        self._enviar_lisp(
+            [f"(entmake '((0 . \"POINT\") (10 {x!r} {y!r} {z!r})))"]
+            for x, y, z in agrupar_vertices([float(v) for v in coordenadas])
+        )
+
+    def agregar_textos_lote(self, textos, coordenadas, alturas):
+        # Los textos de varias líneas van como MTEXT (TEXT es de una línea).
+        entidades = []
+        for texto, (x, y, z), altura in zip(textos, agrupar_vertices([float(v) for v in coordenadas]), alturas):
+            texto = str(texto)
+            if '\n' in texto or '\r' in texto:
+                entidades.append([f"(entmake '((0 . \"MTEXT\") (100 . \"AcDbEntity\") (100 . \"AcDbMText\") "
+                                  f"(10 {x!r} {y!r} {z!r}) (40 . {float(altura)!r}) "
+                                  f"(1 . \"{_cadena_lisp(_contenido_mtext(texto))}\")))"])
+            else:
+                entidades.append([f"(entmake '((0 . \"TEXT\") (10 {x!r} {y!r} {z!r}) (40 . {float(altura)!r}) "
+                                  f"(1 . \"{_cadena_lisp(texto)}\")))"])
+        self._enviar_lisp(entidades)
+
+    def agregar_polilineas_3d_lote(self, polilineas):
+        # POLYLINE con el bit 8 (3D) y sus VERTEX con el bit 32, cerrada por SEQEND.
+        # Las que no caben en un comando se crean una a una con Add3DPoly.
+        entidades = []
+        for coordenadas in polilineas:
+            expresiones = ["(entmake '((0 . \"POLYLINE\") (66 . 1) (10 0.0 0.0 0.0) (70 . 8)))"]
+            expresiones.extend(f"(entmake '((0 . \"VERTEX\") (10 {x!r} {y!r} {z!r}) (70 . 32)))"
+                               for x, y, z in agrupar_vertices([float(v) for v in coordenadas]))
+            expresiones.append("(entmake '((0 . \"SEQEND\")))")
+            if sum(len(e) for e in expresiones) > CARACTERES_POR_COMANDO:
+                self.agregar_polilinea_3d(coordenadas)
+            else:
+                entidades.append(expresiones)
+        self._enviar_lisp(entidades)
+
+    def crear_red_tuberias(self, nombre):
+        return self.civil3d.ActiveDocument.PipeNetworks.Add(nombre)
+
+    def obtener_red_tuberias(self, nombre):
+        documento = self.civil3d.ActiveDocument
+        clave = (documento.Name, nombre)
+        handle = self._redes_tuberias.get(clave)
+        if handle is not None:
+            try:
+                return documento.HandleToObject(handle)
+            except Exception:
+                logger.debug(f"La red de tuberías '{nombre}' ya no existe en {clave[0]}; se buscará de nuevo.")
+                del self._redes_tuberias[clave]
+
+        redes = documento.PipeNetworks
+        red = next((r for r in redes if r.Name == nombre), None)
+        if red is None:
+            red = redes.Add(nombre)
+            logger.info(f"Red de tuberías '{nombre}' creada.")
+        self._redes_tuberias[clave] = red.Handle
+        return red
+
+    def agregar_tuberia(self, red, inicio, fin, diametro):
+        return red.Pipes.AddByDiameter(self._variant(inicio), self._variant(fin), diametro)
+
+    def obtener_objeto(self, identificador):
+        if isinstance(identificador, int):
+            return self.documento.ObjectIdToObject(identificador)
+        return self.documento.HandleToObject(str(identificador))
+
+    def iterar_objetos(self):
+        return iter(self.modelo)
+
+    def contar_objetos(self):
+        return self.modelo.Count
+
+    def handle(self, objeto):
+        return objeto.Handle
+
+    def id_objeto(self, objeto):
+        return objeto.ObjectID
+
+    def tipo_objeto(self, objeto):
+        return objeto.ObjectName
+
+    def capa(self, objeto):
+        return objeto.Layer
+
+    def coordenadas(self, objeto):
+        if hasattr(objeto, 'Coordinates'):
+            coordenadas = tuple(objeto.Coordinates)
+            if objeto.ObjectName == 'AcDbPolyline':
+                # Las polilíneas ligeras dan (x, y) por vértice; la cota es Elevation.
+                elevacion = float(objeto.Elevation)
+                return tuple(valor for i in range(0, len(coordenadas) - 1, 2)
+                             for valor in (coordenadas[i], coordenadas[i + 1], elevacion))
+            return coordenadas
+        if hasattr(objeto, 'InsertionPoint'):
+            return tuple(objeto.InsertionPoint)
+        return None
+
+    def altura_en_punto(self, objeto, x, y, z):
+        return objeto.GetHeightAtPoint(self._variant((x, y, z)))
+
+    def linea_rasante(self, objeto):
+        return objeto.GetGradeline()
+
+    def xdata(self, objeto, aplicacion=''):
+        tipos, valores = objeto.GetXData(aplicacion)
+        if not tipos:
+            return []
+        return list(zip(tipos, valores))
+
+    def conjunto_seleccion(self, nombre, crear=True):
+        conjuntos = self.documento.SelectionSets
+        try:
+            conjunto = conjuntos.Item(nombre)
+        except Exception:
+            if not crear:
+                return None
+            conjunto = conjuntos.Add(nombre)
+        return list(conjunto)
+
+    def iterar_perfiles(self):
+        for alignment in self.civil3d.ActiveDocument.AlignmentsSiteless:
+            nombre_alineacion = alignment.Name
+            for perfil in alignment.Profiles:
+                yield {
+                    "Alineación": nombre_alineacion,
+                    "Perfil": perfil.Name,
+                    "Tipo": str(perfil.Type),
+                    "Estilo": perfil.StyleName,
+                }
+
+    def iterar_alineamientos(self):
+        return iter(self.civil3d.ActiveDocument.AlignmentsSiteless)
+
+    def nombre_alineamiento(self, alineamiento):
+        return alineamiento.Name
+
+    def perfiles_de(self, alineamiento):
+        return list(alineamiento.Profiles)
+
+    def datos_perfil(self, perfil):
+        return {"Perfil": perfil.Name, "Tipo": str(perfil.Type), "Estilo": perfil.StyleName}
+
+    def geometria_perfil(self, perfil):
+        return float(perfil.StartingStation), float(perfil.EndingStation), perfil.PVIs.Count
+
+
+def conectar_backend_com(try_create=False, auxiliar=False):
+    """
+    Conecta con AutoCAD/Civil 3D y devuelve un BackendCOM, o None si no hay
+    conexión. Las conexiones auxiliares (SesionCAD.repartir) no escuchan eventos.
+    """
+    from autocad_civil import conectar_con_autocad_civil
+    acad, civil3d = conectar_con_autocad_civil(try_create=try_create)
+    if acad is None:
+        return None
+    return BackendCOM(acad, civil3d, eventos=not auxiliar)
@@ -0,0 +1,177 @@
+"""
+Caché de instantáneas de los objetos del dibujo.
+
+Leer un objeto por COM cuesta varias idas y vueltas (HandleToObject,
+ObjectName, Layer, Coordinates...) y el etiquetado, los perfiles y los
+trabajos vuelven a leer una y otra vez los mismos alineamientos.
+instantanea(backend, identificador) hace esas lecturas una vez y guarda el
+resultado (Instantanea: el objeto, su handle, tipo, capa, vértices (N, 3) y
+caja en planta) en una caché LRU por (backend, identificador).
+
+Una instantánea vale mientras backend.revision no cambie. BackendCOM abre
+una revisión nueva con los eventos de AutoCAD (fin de un comando o de una
+expresión LISP, abrir o crear un dibujo, cambiar de ventana) y
+POST /objetos/cache/invalidar la abre a mano. Los vértices de una
+instantánea son de solo lectura porque se comparten entre peticiones.
+
+Las instantáneas guardan el objeto del backend: solo se deben usar dentro
+de la sesión CAD (sesion_cad.py).
+
+Uso desde la línea de comandos:
+    python cache_objetos.py [objetos] [vertices] [lecturas]   # mide la caché con el backend en memoria
+"""
+import collections
+import logging
+import threading
+from typing import Any, NamedTuple, Optional
+
+import numpy as np
+from flask import Blueprint, jsonify
+
+import geometria
+from sesion_cad import obtener_sesion, ErrorSesionCAD
+
+logger = logging.getLogger(__name__)
+
+cache_objetos_bp = Blueprint('cache_objetos', __name__)
+
+CAPACIDAD_CACHE = 256
+
+
+class Instantanea(NamedTuple):
+    objeto: Any
+    handle: str
+    tipo: str
+    capa: str
+    vertices: np.ndarray
+    caja: Optional[tuple]
+    revision: int
+
+
+def leer_instantanea(backend, objeto, revision=None):
+    """Lee de una vez el handle, tipo, capa y vértices de un objeto del backend."""
+    if revision is None:
+        revision = backend.revision
+    vertices = backend.vertices(objeto)
+    vertices.setflags(write=False)
+    return Instantanea(objeto, backend.handle(objeto), backend.tipo_objeto(objeto), backend.capa(objeto),
+                       vertices, geometria.caja(vertices), revision)
+
+
+class CacheObjetos:
+    """Instantáneas por (backend, identificador) con desalojo LRU y contadores de aciertos."""
+
+    def __init__(self, capacidad=CAPACIDAD_CACHE):
+        self.capacidad = capacidad
+        self._entradas = collections.OrderedDict()
+        self._bloqueo = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.caducadas = 0
+
+    def obtener(self, backend, identificador):
+        """Instantánea del objeto con ese handle u ObjectID, o None si no existe."""
+        clave = (backend.nombre, identificador)
+        # La revisión se toma antes de leer: si el dibujo cambia a mitad, la
+        # siguiente consulta ya no reutiliza lo leído.
+        revision = backend.revision
+        with self._bloqueo:
+            entrada = self._entradas.get(clave)
+            if entrada is not None and entrada.revision == revision:
+                self._entradas.move_to_end(clave)
+                self.aciertos += 1
+                return entrada
+            self.fallos += 1
+            if entrada is not None:
+                self.caducadas += 1
+        objeto = backend.obtener_objeto(identificador)
+        if objeto is None:
+            return None
+        instantanea = leer_instantanea(backend, objeto, revision)
+        with self._bloqueo:
+            self._entradas[clave] = instantanea
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.capacidad:
+                self._entradas.popitem(last=False)
+        return instantanea
+
+    def invalidar(self, identificador=None):
+        """Olvida un objeto (por el identificador con que se pidió) o, sin identificador, todos."""
+        with self._bloqueo:
+            if identificador is None:
+                self._entradas.clear()
+            else:
+                for clave in [c for c in self._entradas if c[1] == identificador]:
+                    del self._entradas[clave]
+
+    def estadisticas(self):
+        with self._bloqueo:
+            total = self.aciertos + self.fallos
+            return {'entradas': len(self._entradas), 'capacidad': self.capacidad, 'aciertos': self.aciertos,
+                    'fallos': self.fallos, 'caducadas': self.caducadas,
+                    'tasa_aciertos': round(self.aciertos / total, 3) if total else None}
+
+
+cache_objetos = CacheObjetos()
+
+
+def instantanea(backend, identificador):
+    """Instantánea del objeto desde la caché compartida, o None si no existe."""
+    return cache_objetos.obtener(backend, identificador)
+
+
+def _nueva_revision(backend):
+    backend.marcar_cambio()
+    return backend.revision
+
+
+@cache_objetos_bp.route('/objetos/cache', methods=['GET'])
+def estado_cache():
+    return jsonify(cache_objetos.estadisticas()), 200
+
+
+@cache_objetos_bp.route('/objetos/cache/invalidar', methods=['POST'])
+def invalidar_cache():
+    """Abre una revisión nueva del dibujo: ninguna instantánea anterior se reutiliza."""
+    try:
+        revision = obtener_sesion().ejecutar(_nueva_revision)
+        cache_objetos.invalidar()
+        return jsonify({'message': 'Caché de objetos invalidada.', 'revision': revision}), 200
+    except ErrorSesionCAD as e:
+        logger.error(f"Error de conexión al invalidar la caché de objetos: {e}")
+        return jsonify({'error': 'No se pudo conectar con AutoCAD.'}), 500
+    except Exception as e:
+        logger.error(f"Error al invalidar la caché de objetos: {e}")
+        return jsonify({'error': f'Error al invalidar la caché de objetos: {e}'}), 500
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    from cad_memoria import BackendMemoria
+
+    objetos = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    lecturas = int(sys.argv[3]) if len(sys.argv) > 3 else 2000
+
+    backend = BackendMemoria(latencia=0.0005)
+    angulos = np.linspace(0, 6 * np.pi, n)
+    polilinea = np.column_stack((angulos * 50, 200 * np.sin(angulos), np.zeros(n))).ravel().tolist()
+    handles = [backend.handle(backend.agregar_polilinea_3d(polilinea)) for _ in range(objetos)]
+    pedidos = np.random.default_rng(0).integers(0, objetos, lecturas).tolist()
+
+    backend.llamadas = 0
+    inicio = time.perf_counter()
+    for i in pedidos:
+        objeto = backend.obtener_objeto(handles[i])
+        backend.tipo_objeto(objeto)
+        backend.vertices(objeto)
+    print(f"{lecturas} lecturas directas: {(time.perf_counter() - inicio) * 1000:.1f} ms, {backend.llamadas} llamadas")
+
+    backend.llamadas = 0
+    inicio = time.perf_counter()
+    for i in pedidos:
+        instantanea(backend, handles[i])
+    print(f"{lecturas} lecturas con caché: {(time.perf_counter() - inicio) * 1000:.1f} ms, {backend.llamadas} llamadas, "
+          f"{cache_objetos.estadisticas()}")
@@ -0,0 +1,354 @@
+"""
+Backend de dibujo en memoria, sin AutoCAD.
+
+Las entidades se guardan en arrays contiguos (array.array): un array de tipos,
+uno de desplazamientos y uno único de coordenadas para todas las entidades.
+Cada llamada pública cuenta como una "llamada COM" y puede simular una latencia
+configurable, así los benchmarks de nuestras rutas en Linux reflejan cuántas
+idas y vueltas harían contra AutoCAD.
+"""
+import logging
+import time
+from array import array
+
+import numpy as np
+
+from backend_dibujo import BackendDibujo
+
+logger = logging.getLogger(__name__)
+
+BASE_HANDLE = 0x100
+
+TIPOS = (
+    'AcDbPoint',
+    'AcDbText',
+    'AcDb3dPolyline',
+    'AcDbArc',
+    'AeccDbPipe',
+    'AeccDbAlignment',
+    'AeccDbProfile',
+)
+_INDICE_TIPO = {nombre: i for i, nombre in enumerate(TIPOS)}
+
+
+class BackendMemoria(BackendDibujo):
+    """Backend de dibujo en memoria con almacenamiento en arrays."""
+
+    nombre = 'memoria'
+
+    def __init__(self, latencia=0.0, nombre_documento='Dibujo1.dwg', civil3d=True):
+        self.latencia = latencia
+        self.abierto = True
+        self.llamadas = 0
+        self._nombre_documento = nombre_documento
+        self._civil3d = civil3d
+
+        # Tabla de entidades: la fila i es la entidad con handle BASE_HANDLE + i.
+        self._tipos = array('B')
+        self._inicio = array('q')
+        self._longitud = array('q')
+        self._vivo = bytearray()
+        self._coordenadas = array('d')
+
+        # Atributos que solo tienen algunas entidades, indexados por fila.
+        self._textos = {}
+        self._extra = {}
+        self._xdata = {}  # fila -> pares (código, valor)
+
+        self._redes = []
+        self._indice_redes = {}
+        self._conjuntos = {}
+        self._alineamientos = []
+        self._perfiles = []
+        self._filas_registradas = 0  # Filas ya entregadas por cambios().
+        self._filas_modificadas = set()  # Filas anteriores a _filas_registradas cambiadas desde entonces.
+        self.marcar_cambio()
+
+    # --- Utilidades internas --------------------------------------------------
+
+    def _llamada(self):
+        if not self.abierto:
+            raise RuntimeError("El documento en memoria está cerrado (conexión perdida)")
+        self.llamadas += 1
+        if self.latencia:
+            time.sleep(self.latencia)
+
+    def _agregar(self, tipo, coordenadas):
+        fila = len(self._tipos)
+        self._tipos.append(_INDICE_TIPO[tipo])
+        self._inicio.append(len(self._coordenadas))
+        self._coordenadas.extend(coordenadas)
+        self._longitud.append(len(self._coordenadas) - self._inicio[fila])
+        self._vivo.append(1)
+        return fila
+
+    def _fila(self, identificador):
+        if isinstance(identificador, str):
+            try:
+                identificador = int(identificador, 16)
+            except ValueError:
+                return None
+        fila = identificador - BASE_HANDLE
+        if 0 <= fila < len(self._tipos) and self._vivo[fila]:
+            return fila
+        return None
+
+    # --- Conexión -------------------------------------------------------------
+
+    @property
+    def civil3d_disponible(self):
+        return self._civil3d
+
+    def verificar(self):
+        return self.abierto
+
+    def nombre_aplicacion(self):
+        self._llamada()
+        return 'AutoCAD (memoria)'
+
+    def nombre_documento(self):
+        self._llamada()
+        return self._nombre_documento
+
+    # --- Escritura ------------------------------------------------------------
+
+    def agregar_punto(self, x, y, z):
+        self._llamada()
+        return self._agregar('AcDbPoint', (x, y, z))
+
+    def agregar_texto(self, texto, x, y, z, altura):
+        self._llamada()
+        fila = self._agregar('AcDbText', (x, y, z))
+        self._textos[fila] = (texto, altura)
+        return fila
+
+    def agregar_polilinea_3d(self, coordenadas):
+        self._llamada()
+        if len(coordenadas) % 3:
+            raise ValueError("Las coordenadas de la polilínea 3D deben ser múltiplo de 3.")
+        return self._agregar('AcDb3dPolyline', coordenadas)
+
+    def agregar_arco(self, centro, radio, angulo_inicio, angulo_fin):
+        self._llamada()
+        fila = self._agregar('AcDbArc', centro)
+        self._extra[fila] = {'radio': radio, 'angulo_inicio': angulo_inicio, 'angulo_fin': angulo_fin}
+        return fila
+
+    def agregar_puntos_lote(self, coordenadas):
+        # Un lote es una sola ida y vuelta, como el SendCommand de BackendCOM.
+        self._llamada()
+        if len(coordenadas) % 3:
+            raise ValueError("Las coordenadas del lote deben ser múltiplo de 3.")
+        for i in range(0, len(coordenadas), 3):
+            self._agregar('AcDbPoint', coordenadas[i:i + 3])
+
+    def agregar_polilineas_3d_lote(self, polilineas):
+        self._llamada()
+        for coordenadas in polilineas:
+            if len(coordenadas) % 3:
+                raise ValueError("Las coordenadas de la polilínea 3D deben ser múltiplo de 3.")
+            self._agregar('AcDb3dPolyline', coordenadas)
+
+    def agregar_textos_lote(self, textos, coordenadas, alturas):
+        self._llamada()
+        for i, (texto, altura) in enumerate(zip(textos, alturas)):
+            fila = self._agregar('AcDbText', coordenadas[3 * i:3 * i + 3])
+            self._textos[fila] = (texto, altura)
+
+    def crear_red_tuberias(self, nombre):
+        self._llamada()
+        self._redes.append({'nombre': nombre, 'tuberias': array('q')})
+        red = len(self._redes) - 1
+        self._indice_redes.setdefault(nombre, red)
+        return red
+
+    def obtener_red_tuberias(self, nombre):
+        self._llamada()
+        red = self._indice_redes.get(nombre)
+        if red is None:
+            red = self.crear_red_tuberias(nombre)
+        return red
+
+    def tuberias_de_red(self, red):
+        """Solo en memoria: filas de las tuberías de una red."""
+        return list(self._redes[red]['tuberias'])
+
+    def agregar_tuberia(self, red, inicio, fin, diametro):
+        self._llamada()
+        fila = self._agregar('AeccDbPipe', (*inicio, *fin))
+        self._extra[fila] = {'red': red, 'diametro': float(diametro)}
+        self._redes[red]['tuberias'].append(fila)
+        return fila
+
+    def agregar_alineamiento(self, nombre, coordenadas):
+        """Solo en memoria: crea un alineamiento para preparar datos de prueba."""
+        self._llamada()
+        fila = self._agregar('AeccDbAlignment', coordenadas)
+        self._extra[fila] = {'nombre': nombre, 'perfiles': []}
+        self._alineamientos.append(fila)
+        return fila
+
+    def agregar_perfil(self, alineamiento, nombre, coordenadas, tipo='Terreno', estilo='Estándar'):
+        """Solo en memoria: crea un perfil asociado a un alineamiento."""
+        self._llamada()
+        fila = self._agregar('AeccDbProfile', coordenadas)
+        self._extra[fila] = {'alineamiento': alineamiento, 'nombre': nombre, 'tipo': tipo, 'estilo': estilo}
+        self._extra[alineamiento]['perfiles'].append(fila)
+        self._perfiles.append(fila)
+        self._filas_modificadas.add(alineamiento)  # Como en COM: el perfil pertenece al alineamiento.
+        return fila
+
+    def agregar_xdata(self, objeto, aplicacion, pares):
+        """Solo en memoria: sustituye las XData de una aplicación en el objeto."""
+        self._llamada()
+        anteriores = self._xdata.get(objeto, [])
+        conservados, actual = [], None
+        for codigo, valor in anteriores:
+            if codigo == 1001:
+                actual = valor
+            if actual != aplicacion:
+                conservados.append((codigo, valor))
+        self._xdata[objeto] = conservados + [(1001, aplicacion), *pares]
+        self._filas_modificadas.add(objeto)
+        self.marcar_cambio()
+
+    def seleccionar(self, nombre, objetos):
+        """Solo en memoria: rellena un conjunto de selección (equivale a seleccionar en pantalla)."""
+        self._conjuntos[nombre] = array('q', objetos)
+
+    # --- Lectura ----------------------------------------------------------------
+
+    def obtener_objeto(self, identificador):
+        self._llamada()
+        return self._fila(identificador)
+
+    def iterar_objetos(self):
+        self._llamada()
+        return (fila for fila in range(len(self._tipos)) if self._vivo[fila])
+
+    def contar_objetos(self):
+        self._llamada()
+        return sum(self._vivo)
+
+    def handle(self, objeto):
+        self._llamada()
+        return format(BASE_HANDLE + objeto, 'X')
+
+    def id_objeto(self, objeto):
+        self._llamada()
+        return BASE_HANDLE + objeto
+
+    def tipo_objeto(self, objeto):
+        self._llamada()
+        return TIPOS[self._tipos[objeto]]
+
+    def cambios(self):
+        # Las entidades en memoria solo se añaden: lo nuevo son las filas desde la llamada anterior.
+        desde, self._filas_registradas = self._filas_registradas, len(self._tipos)
+        filas = {fila for fila in self._filas_modificadas if fila < desde} | set(range(desde, len(self._tipos)))
+        self._filas_modificadas = set()
+        return [format(BASE_HANDLE + fila, 'X') for fila in sorted(filas) if self._vivo[fila]], []
+
+    def capa(self, objeto):
+        self._llamada()
+        return '0'  # El dibujo en memoria no tiene capas.
+
+    def coordenadas(self, objeto):
+        self._llamada()
+        inicio = self._inicio[objeto]
+        return tuple(self._coordenadas[inicio:inicio + self._longitud[objeto]])
+
+    def vertices(self, objeto):
+        # Copia directa del trozo del buffer, sin pasar por una tupla.
+        self._llamada()
+        inicio = self._inicio[objeto]
+        return np.frombuffer(self._coordenadas, dtype=np.float64, count=self._longitud[objeto],
+                             offset=inicio * self._coordenadas.itemsize).reshape(-1, 3).copy()
+
+    def texto(self, objeto):
+        """Solo en memoria: (texto, altura) de una entidad de texto."""
+        return self._textos.get(objeto)
+
+    def xdata(self, objeto, aplicacion=''):
+        self._llamada()
+        pares = self._xdata.get(objeto, [])
+        if not aplicacion:
+            return list(pares)
+        resultado, actual = [], None
+        for codigo, valor in pares:
+            if codigo == 1001:
+                actual = valor
+            if actual == aplicacion:
+                resultado.append((codigo, valor))
+        return resultado
+
+    def altura_en_punto(self, objeto, x, y, z):
+        """Cota del vértice más cercano en planta (aproximación suficiente para benchmarks)."""
+        self._llamada()
+        inicio = self._inicio[objeto]
+        vertices = np.frombuffer(self._coordenadas, dtype=np.float64, count=self._longitud[objeto],
+                                 offset=inicio * self._coordenadas.itemsize).reshape(-1, 3)
+        mejor = int(np.argmin((vertices[:, 0] - x) ** 2 + (vertices[:, 1] - y) ** 2))
+        return float(vertices[mejor, 2])
+
+    def linea_rasante(self, objeto):
+        # En memoria, un perfil es su propia línea de rasante.
+        self._llamada()
+        return objeto
+
+    def conjunto_seleccion(self, nombre, crear=True):
+        self._llamada()
+        if nombre not in self._conjuntos:
+            if not crear:
+                return None
+            self._conjuntos[nombre] = array('q')
+        return [fila for fila in self._conjuntos[nombre] if self._vivo[fila]]
+
+    def iterar_perfiles(self):
+        self._llamada()
+        for fila in self._perfiles:
+            datos = self._extra[fila]
+            yield {
+                "Alineación": self._extra[datos['alineamiento']]['nombre'],
+                "Perfil": datos['nombre'],
+                "Tipo": datos['tipo'],
+                "Estilo": datos['estilo'],
+            }
+
+    def iterar_alineamientos(self):
+        self._llamada()
+        return (fila for fila in self._alineamientos if self._vivo[fila])
+
+    def nombre_alineamiento(self, alineamiento):
+        self._llamada()
+        return self._extra[alineamiento]['nombre']
+
+    def perfiles_de(self, alineamiento):
+        self._llamada()
+        return [fila for fila in self._extra[alineamiento]['perfiles'] if self._vivo[fila]]
+
+    def datos_perfil(self, perfil):
+        self._llamada()
+        datos = self._extra[perfil]
+        return {"Perfil": datos['nombre'], "Tipo": datos['tipo'], "Estilo": datos['estilo']}
+
+
+def crear_conector_memoria(latencia=0.0, nombre_documento='Dibujo1.dwg'):
+    """
+    Crea un conector para SesionCAD que siempre devuelve el mismo BackendMemoria.
+
+    Reconectar reabre el mismo documento, igual que volver a conectar con una
+    instancia de AutoCAD que sigue abierta.
+    """
+    backend = BackendMemoria(latencia, nombre_documento)
+
+    def conectar(try_create=False, auxiliar=False):
+        if auxiliar:
+            # Las conexiones auxiliares leen el mismo documento desde otro hilo.
+            return backend
+        backend.abierto = True
+        logger.debug(f"Conectado al backend en memoria ({nombre_documento}).")
+        return backend
+
+    conectar.backend = backend
+    return conectar
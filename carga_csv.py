@@ -0,0 +1,231 @@
+"""
+Lectura incremental de CSV subidos como multipart/form-data.
+
+iterar_multipart recorre el cuerpo de la petición por trozos y
+FilasCSVIncrementales convierte los bytes de cada archivo en filas (dict)
+a medida que llegan, sin cargar el archivo entero en memoria.
+leer_csv_multipart reúne ambas piezas y entrega las filas a una "carga"
+(CargaCSV en crear_puntos, ExportacionDXF en exportar_dxf).
+"""
+import codecs
+import csv
+import io
+import tempfile
+from array import array
+
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+from validacion import validar_tabla
+
+TAMANO_LECTURA = 64 * 1024
+
+
+def iterar_multipart(stream, boundary, tamano_lectura=TAMANO_LECTURA):
+    """
+    Genera eventos del cuerpo multipart leyendo stream por trozos.
+
+    Cada evento es ('parte', nombre, nombre_archivo) al empezar una parte
+    (nombre_archivo es None en los campos de texto) o ('datos', bytes) con un
+    trozo de su contenido.
+    """
+    decoder = MultipartDecoder(boundary.encode('latin-1'))
+    terminado = False
+    while not terminado:
+        trozo = stream.read(tamano_lectura)
+        decoder.receive_data(trozo or None)
+        while True:
+            evento = decoder.next_event()
+            if isinstance(evento, NeedData):
+                break
+            if isinstance(evento, Epilogue):
+                terminado = True
+                break
+            if isinstance(evento, File):
+                yield 'parte', evento.name, evento.filename
+            elif isinstance(evento, Field):
+                yield 'parte', evento.name, None
+            elif isinstance(evento, Data) and evento.data:
+                yield 'datos', evento.data
+        if not trozo:
+            terminado = True
+
+
+class FilasCSVIncrementales:
+    """
+    Convierte trozos de bytes de un CSV en filas dict.
+
+    alimentar(bytes) devuelve las filas completas recibidas hasta ese momento;
+    terminar() devuelve la última si el archivo no acababa en salto de línea.
+    La primera línea es la cabecera (disponible en .columnas).
+    """
+
+    def __init__(self, encoding='utf-8-sig'):
+        self._decodificador = codecs.getincrementaldecoder(encoding)(errors='replace')
+        self._pendiente = ''
+        self.columnas = None
+        self.lineas = 0
+
+    def alimentar(self, datos):
+        texto = self._pendiente + self._decodificador.decode(datos)
+        lineas = texto.split('\n')
+        self._pendiente = lineas.pop()
+        return self._filas(lineas)
+
+    def terminar(self):
+        texto = self._pendiente + self._decodificador.decode(b'', final=True)
+        self._pendiente = ''
+        return self._filas([texto]) if texto.strip() else []
+
+    def _filas(self, lineas):
+        filas = []
+        registro = ''
+        for linea in lineas:
+            # Un campo entre comillas puede contener saltos de línea: se
+            # acumula hasta que las comillas quedan cerradas.
+            registro = f"{registro}\n{linea}" if registro else linea
+            if registro.count('"') % 2:
+                continue
+            self.lineas += 1
+            valores = next(csv.reader(io.StringIO(registro.rstrip('\r'))), [])
+            registro = ''
+            if not valores:
+                continue
+            if self.columnas is None:
+                self.columnas = [v.strip() for v in valores]
+                continue
+            filas.append(dict(zip(self.columnas, (v.strip() for v in valores))))
+        if registro:
+            self._pendiente = registro + '\n' + self._pendiente
+        return filas
+
+
+class IndicePuntos:
+    """
+    Mapa ID -> (x, y, z) compacto para enlazar tuberías con puntos.
+
+    Las coordenadas se guardan en un único array('d'); el dict solo guarda el
+    desplazamiento de cada ID. Se usa como el dict que devuelve crear_puntos.
+    """
+
+    def __init__(self):
+        self._posiciones = {}
+        self._coordenadas = array('d')
+
+    def actualizar(self, puntos):
+        for id_punto, (x, y, z) in puntos.items():
+            posicion = self._posiciones.get(id_punto)
+            if posicion is None:
+                self._posiciones[id_punto] = len(self._coordenadas)
+                self._coordenadas.extend((x, y, z))
+            else:
+                self._coordenadas[posicion:posicion + 3] = array('d', (x, y, z))
+
+    def __contains__(self, id_punto):
+        return id_punto in self._posiciones
+
+    def __getitem__(self, id_punto):
+        posicion = self._posiciones[id_punto]
+        return tuple(self._coordenadas[posicion:posicion + 3])
+
+    def __len__(self):
+        return len(self._posiciones)
+
+    def keys(self):
+        return self._posiciones.keys()
+
+
+def leer_tabla_csv(ruta, esquema):
+    """Lee un CSV del disco y lo valida entero con el esquema. Devuelve (tabla, errores) como validar_tabla."""
+    lector = FilasCSVIncrementales()
+    filas = []
+    with open(ruta, 'rb') as archivo:
+        for trozo in iter(lambda: archivo.read(TAMANO_LECTURA), b''):
+            filas.extend(lector.alimentar(trozo))
+    filas.extend(lector.terminar())
+    return validar_tabla(filas, esquema)
+
+
+def leer_csv_en_partes(carga, tipo, trozos, columnas_requeridas):
+    """Pasa los trozos de un archivo CSV a la carga fila a fila. Devuelve un error si faltan columnas."""
+    lector = FilasCSVIncrementales()
+    columnas_validadas = False
+    for trozo in trozos:
+        filas = lector.alimentar(trozo)
+        if not columnas_validadas and lector.columnas is not None:
+            if not all(c in lector.columnas for c in columnas_requeridas):
+                return f"El archivo de {tipo} no contiene las columnas necesarias: {', '.join(columnas_requeridas)}."
+            columnas_validadas = True
+        for row in filas:
+            carga.agregar(tipo, row)
+    for row in lector.terminar():
+        carga.agregar(tipo, row)
+    return None
+
+
+def leer_csv_multipart(carga, stream, boundary, columnas):
+    """
+    Recorre un envío multipart y pasa a la carga las filas de cada archivo.
+
+    columnas es un dict {campo: columnas requeridas} con los campos de
+    archivo que se aceptan; debe incluir 'coordenadas'. El campo de texto
+    'red_tuberias' (opcional) se guarda en carga.nombre_red. carga debe
+    tener agregar(tipo, fila) y vaciar(); tipo es el nombre del campo.
+
+    Las coordenadas se vacían antes de leer los demás archivos, que las
+    necesitan; si alguno llega antes, se guarda en un temporal (en disco a
+    partir de 1 MB) hasta haber leído las coordenadas. Devuelve un mensaje
+    de error o None.
+    """
+    diferidos = {}
+    vistos = set()
+    try:
+        eventos = iterar_multipart(stream, boundary)
+        parte = None
+
+        def trozos_de_parte():
+            # Consume los eventos 'datos' de la parte actual y se detiene en la siguiente.
+            nonlocal parte
+            for evento in eventos:
+                if evento[0] == 'parte':
+                    parte = evento
+                    return
+                yield evento[1]
+            parte = None
+
+        parte = next(eventos, None)
+        while parte is not None:
+            _, nombre, _ = parte
+            if nombre in columnas and nombre != 'coordenadas' and 'coordenadas' not in vistos:
+                vistos.add(nombre)
+                diferidos[nombre] = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+                for trozo in trozos_de_parte():
+                    diferidos[nombre].write(trozo)
+            elif nombre in columnas:
+                vistos.add(nombre)
+                error = leer_csv_en_partes(carga, nombre, trozos_de_parte(), columnas[nombre])
+                if error:
+                    return error
+                if nombre == 'coordenadas':
+                    carga.vaciar()
+            elif nombre == 'red_tuberias':
+                valor = b''.join(trozos_de_parte()).decode('utf-8').strip()
+                if valor:
+                    carga.nombre_red = valor
+            else:
+                for _ in trozos_de_parte():
+                    pass
+
+        if 'coordenadas' not in vistos:
+            return "Falta el archivo de coordenadas ('coordenadas')."
+
+        for nombre, archivo in diferidos.items():
+            archivo.seek(0)
+            trozos = iter(lambda: archivo.read(TAMANO_LECTURA), b'')
+            error = leer_csv_en_partes(carga, nombre, trozos, columnas[nombre])
+            if error:
+                return error
+        carga.vaciar()
+        return None
+    finally:
+        for archivo in diferidos.values():
+            archivo.close()
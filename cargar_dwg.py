@@ -1,17 +1,17 @@
 import logging
 import os
 import time
-from pyautocad import Autocad
-import pythoncom
 from werkzeug.utils import secure_filename
 from flask import Flask, request, jsonify
-import win32com.client
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
 def abrir_dwg(ruta_archivo):
     """Abre un archivo DWG y hace visible la interfaz de AutoCAD, intentando una nueva pestaña si está ocupado."""
+    import pythoncom
+    import win32com.client
+
     acad_app = None
     com_initialized = False
     try:
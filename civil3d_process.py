@@ -1,13 +1,110 @@
+"""
+Servicio de trabajos de Civil 3D en un proceso aparte.
+
+La web envía comandos ({'action': ..., ...}) con ServicioTrabajos.enviar, que
+devuelve enseguida un identificador de trabajo. Un proceso hijo
+(civil3d_process) ejecuta los comandos contra el backend de dibujo y devuelve
+(id, resultado); un hilo despachador del proceso web entrega cada resultado al
+Future de su trabajo, así dos peticiones concurrentes nunca reciben el
+resultado de la otra.
+
+Rutas:
+    POST /jobs                     encola un comando y responde 202 con su id
+    GET  /jobs/<id>                estado del trabajo (y resultado si terminó)
+    GET  /jobs/<id>/resultado      espera el resultado (?esperar=segundos)
+    GET  /jobs/metricas            profundidad de colas, esperas, fusiones y preempciones
+
+En el proceso hijo, PlanificadorTrabajos da prioridad a los comandos
+interactivos (seleccionar_objetos, generar_polilinea) sobre los masivos
+(crear_puntos, crear_tuberias). Los masivos contiguos de la misma acción se
+fusionan en un único lote y se ejecutan por bloques, atendiendo a los
+interactivos entre bloque y bloque. Un comando puede forzar su clase con
+'prioridad': 'interactivo' | 'masivo'.
+"""
+import collections
+import logging
 import multiprocessing
+import os
 import queue
-import pythoncom
-from pyautocad import Autocad, ACAD, APoint
-import logging
-import win32com.client
+import threading
+import time
+import uuid
+from concurrent.futures import Future, TimeoutError as FuturesTimeoutError
+
+from flask import Blueprint, jsonify, request
+
+import geometria
+from cache_objetos import instantanea
+from escritor_masivo import EscritorMasivo
+from validacion import ESQUEMA_COORDENADAS, mensajes_de_error, validar_tabla
+
+logger = logging.getLogger(__name__)
+
+trabajos_bp = Blueprint('trabajos', __name__)
+
+PENDIENTE = 'pendiente'
+TERMINADO = 'terminado'
+ERROR = 'error'
+EXPIRADO = 'expirado'
+
+ACCION_METRICAS = '_metricas'
+
+
+class TrabajoExpirado(Exception):
+    """El trabajo no terminó dentro de su tiempo límite."""
+
+
+def _punto_de_mapa(puntos_map, pk):
+    # Las claves llegan como int desde Python y como str si el mapa pasó por JSON.
+    punto = puntos_map.get(pk)
+    if punto is None:
+        punto = puntos_map.get(str(pk))
+    return tuple(punto) if punto is not None else None
+
+
+def _leer_puntos(coordenadas):
+    """Convierte las filas en {ID: [x, y, z]} y {ID: etiqueta}. Las filas inválidas se registran y se omiten."""
+    tabla, errores = validar_tabla(coordenadas, ESQUEMA_COORDENADAS)
+    for mensaje in mensajes_de_error(errores):
+        logging.error(f"Error al crear punto: {mensaje}")
+    ids = tabla['ID'].tolist()
+    puntos = dict(zip(ids, tabla.coordenadas().tolist()))
+    descripciones = dict(zip(ids, tabla['Etiqueta'].tolist()))
+    return puntos, descripciones
+
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+def _escribir_puntos(backend, puntos, descripciones):
+    """Escribe por lotes los puntos y sus etiquetas (5 unidades por encima del punto)."""
+    xs, ys, zs = (list(c) for c in zip(*puntos)) if puntos else ([], [], [])
+    escritor = EscritorMasivo(backend)
+    escritor.agregar_puntos(xs, ys, zs)
+    escritor.agregar_textos(descripciones, xs, ys, [z + 5 for z in zs], 2.5)
+    escritor.vaciar()
 
-def perform_civil3d_operation(acad, civil3d_app, command):
+
+def _crear_tuberia(backend, pipe_network, tuberia, puntos_map):
+    """Crea una tubería entre dos puntos del mapa. Devuelve su ID_TUBERIA, o None si no se creó."""
+    pk_inicio = int(tuberia.get('PK_INICIO'))
+    pk_fin = int(tuberia.get('PK_FIN'))
+    diametro = float(tuberia.get('DIAMETRO'))
+    id_tuberia = tuberia.get('ID_TUBERIA')
+
+    start_point = _punto_de_mapa(puntos_map, pk_inicio)
+    end_point = _punto_de_mapa(puntos_map, pk_fin)
+
+    if start_point is None or end_point is None:
+        logging.warning(f"Puntos PK_INICIO {pk_inicio} o PK_FIN {pk_fin} no encontrados para tubería {id_tuberia}.")
+        return None
+
+    pipe = backend.agregar_tuberia(pipe_network, start_point, end_point, diametro)
+    if pipe is None:
+        logging.warning(f"No se pudo crear la tubería {id_tuberia}.")
+        return None
+    logging.info(f"Tubería {id_tuberia} creada.")
+    return id_tuberia
+
+
+def perform_civil3d_operation(backend, command):
     """
     Realiza la operación de Civil 3D según el comando recibido.
     """
@@ -24,33 +121,15 @@ def perform_civil3d_operation(acad, civil3d_app, command):
             if not coordenadas:
                 return {'error': 'No se proporcionaron datos de coordenadas.'}
 
-            puntos_creados = {}
-            model = acad.model
-            for row in coordenadas:
-                try:
-                    x, y, z = float(row['X']), float(row['Y']), float(row['Z'])
-                    descripcion = row.get('Etiqueta', 'Sin descripción')
-                    id_punto = int(row['ID'])
-
-                    logging.debug(f"Creando punto {id_punto} en ({x}, {y}, {z}) con descripción: {descripcion}")
-
-                    point = APoint(x, y, z)
-                    logging.debug(f"Punto APoint creado: {point}")
-                    model.AddPoint(point)
-                    logging.debug(f"Punto agregado a AutoCAD")
-                    model.AddText(descripcion, APoint(x, y, z + 5), 2.5)
-                    logging.debug(f"Texto agregado a AutoCAD")
-
-                    puntos_creados[id_punto] = point
-                    logging.info(f"Punto {id_punto} agregado: {descripcion} en ({x}, {y}, {z})")
-                except Exception as e:
-                    logging.error(f"Error al crear punto {row.get('ID')}: {e}")
+            puntos_creados, descripciones = _leer_puntos(coordenadas)
+            _escribir_puntos(backend, list(puntos_creados.values()), list(descripciones.values()))
+            logging.info(f"{len(puntos_creados)} puntos agregados.")
             return {'message': f"{len(puntos_creados)} puntos creados.", 'puntos': puntos_creados}
 
         elif action == 'seleccionar_objetos':
-            seleccion = acad.get_selection()
+            seleccion = backend.conjunto_seleccion(command.get('conjunto', 'TempSelection'))
             if seleccion:
-                object_ids = [obj.ObjectId for obj in seleccion]
+                object_ids = [backend.id_objeto(obj) for obj in seleccion]
                 return {'object_ids': object_ids}
             else:
                 return {'error': 'No se seleccionaron objetos.'}
@@ -60,17 +139,14 @@ def perform_civil3d_operation(acad, civil3d_app, command):
             if not object_ids:
                 return {'error': 'No se proporcionaron identificadores de objetos.'}
 
-            model = acad.model
             points = []
 
             for obj_id in object_ids:
                 try:
-                    obj = acad.doc.GetObject(obj_id)
-                    if obj.ObjectName == 'AcDb3dPolyline' and hasattr(obj, 'Coordinates'):
-                        coords = obj.Coordinates
-                        if len(coords) % 3 == 0:
-                            for i in range(0, len(coords), 3):
-                                points.extend(coords[i:i+3])
+                    obj = instantanea(backend, obj_id)
+                    if obj is not None and obj.tipo == 'AcDb3dPolyline':
+                        if len(obj.vertices):
+                            points.append(obj.vertices)
                         else:
                             return {'error': 'Las coordenadas del objeto no son válidas para una polilínea 3D.'}
                 except Exception as e:
@@ -78,40 +154,24 @@ def perform_civil3d_operation(acad, civil3d_app, command):
                     return {'error': f"Error al procesar el objeto {obj_id}: {str(e)}"}
 
             if points:
-                model.Add3DPoly(points)
+                backend.agregar_polilinea_3d(geometria.plana(geometria.concatenar(points)))
                 return {'message': 'Polilínea 3D generada correctamente.'}
             else:
                 return {'error': 'No se encontraron coordenadas válidas para la polilínea.'}
 
-        elif action == 'crear_tuberias' and civil3d_app:
+        elif action == 'crear_tuberias' and backend.civil3d_disponible:
             tuberias_data = command.get('tuberias', [])
             puntos_map = command.get('puntos', {})
             if not tuberias_data:
                 return {'error': 'No se proporcionaron datos de tuberías.'}
 
             try:
-                doc = civil3d_app.ActiveDocument
-                pipe_network = doc.PipeNetworks.Add("Red desde Flask")
+                pipe_network = backend.obtener_red_tuberias(command.get('red_tuberias') or "Red desde Flask")
                 tuberias_creadas = []
                 for tuberia in tuberias_data:
-                    pk_inicio = int(tuberia.get('PK_INICIO'))
-                    pk_fin = int(tuberia.get('PK_FIN'))
-                    diametro = float(tuberia.get('DIAMETRO'))
-                    id_tuberia = tuberia.get('ID_TUBERIA')
-
-                    start_point = puntos_map.get(pk_inicio)
-                    end_point = puntos_map.get(pk_fin)
-
-                    if not start_point or not end_point:
-                        logging.warning(f"Puntos PK_INICIO {pk_inicio} o PK_FIN {pk_fin} no encontrados para tubería {id_tuberia}.")
-                        continue
-
-                    pipe = pipe_network.Pipes.AddByDiameter(start_point, end_point, diametro)
-                    if pipe:
+                    id_tuberia = _crear_tuberia(backend, pipe_network, tuberia, puntos_map)
+                    if id_tuberia is not None:
                         tuberias_creadas.append(id_tuberia)
-                        logging.info(f"Tubería {id_tuberia} creada.")
-                    else:
-                        logging.warning(f"No se pudo crear la tubería {id_tuberia}.")
                 return {'message': f"{len(tuberias_creadas)} tuberías creadas."}
             except Exception as e:
                 logging.error(f"Error al crear tuberías en Civil 3D: {e}")
@@ -127,65 +187,592 @@ def perform_civil3d_operation(acad, civil3d_app, command):
         logging.error(f"Error en Civil 3D: {e}")
         return {'error': f'Error en Civil 3D: {e}'}
 
-def civil3d_process(command_queue, result_queue):
+
+INTERACTIVO = 'interactivo'
+MASIVO = 'masivo'
+
+# Acciones masivas y la clave del comando que contiene sus filas.
+ACCIONES_MASIVAS = {'crear_puntos': 'coordenadas', 'crear_tuberias': 'tuberias'}
+
+TAMANO_BLOQUE = 2000      # filas por bloque; entre bloques se atienden los interactivos
+MAX_FILAS_FUSION = 100000  # filas máximas al fusionar comandos masivos contiguos
+
+
+def clase_de_comando(command):
+    """Clase de prioridad del comando: la indicada en 'prioridad' o la de su acción."""
+    if not isinstance(command, dict):
+        return INTERACTIVO
+    prioridad = command.get('prioridad')
+    if prioridad in (INTERACTIVO, MASIVO):
+        return prioridad
+    return MASIVO if command.get('action') in ACCIONES_MASIVAS else INTERACTIVO
+
+
+def _clave_fusion(command):
+    # Solo se fusionan comandos de la misma acción que escriben en la misma red.
+    return command.get('action'), command.get('red_tuberias')
+
+
+class PlanificadorTrabajos:
     """
-    Proceso para manejar la comunicación con Civil 3D.
+    Cola con dos clases de prioridad para el proceso de Civil 3D.
+
+    Los comandos interactivos (selecciones, polilíneas) siempre salen antes
+    que los masivos. Los comandos masivos contiguos con la misma acción se
+    entregan juntos para escribirlos como un único lote, y el ejecutor los
+    trocea en bloques para atender los interactivos entre bloque y bloque.
     """
-    civil3d_app = None
+
+    def __init__(self, max_filas_fusion=MAX_FILAS_FUSION, muestras=1000):
+        self.max_filas_fusion = max_filas_fusion
+        self._colas = {INTERACTIVO: collections.deque(), MASIVO: collections.deque()}
+        self._condicion = threading.Condition()
+        self._cerrado = False
+        self._esperas = {INTERACTIVO: collections.deque(maxlen=muestras), MASIVO: collections.deque(maxlen=muestras)}
+        self._contadores = {'encolados': 0, 'ejecutados': 0, 'fusionados': 0, 'lotes_masivos': 0, 'preempciones': 0}
+
+    def encolar(self, job_id, command):
+        with self._condicion:
+            self._colas[clase_de_comando(command)].append((job_id, command, time.monotonic()))
+            self._contadores['encolados'] += 1
+            self._condicion.notify()
+
+    def cerrar(self):
+        """Deja de aceptar trabajo: siguiente() devuelve None cuando las colas se vacían."""
+        with self._condicion:
+            self._cerrado = True
+            self._condicion.notify_all()
+
+    def hay_interactivos(self):
+        with self._condicion:
+            return bool(self._colas[INTERACTIVO])
+
+    def siguiente(self, timeout=None):
+        """
+        Devuelve (clase, [(job_id, comando), ...]) o None si se cerró la cola.
+
+        Los interactivos salen de uno en uno; los masivos se agrupan mientras
+        tengan la misma clave de fusión y no superen max_filas_fusion filas.
+        """
+        with self._condicion:
+            while not self._colas[INTERACTIVO] and not self._colas[MASIVO]:
+                if self._cerrado:
+                    return None
+                if not self._condicion.wait(timeout):
+                    return None
+            if self._colas[INTERACTIVO]:
+                return INTERACTIVO, [self._sacar(INTERACTIVO)]
+
+            cola = self._colas[MASIVO]
+            grupo = [self._sacar(MASIVO)]
+            clave = _clave_fusion(grupo[0][1])
+            filas = _filas(grupo[0][1])
+            while cola and _clave_fusion(cola[0][1]) == clave and filas + _filas(cola[0][1]) <= self.max_filas_fusion:
+                grupo.append(self._sacar(MASIVO))
+                filas += _filas(grupo[-1][1])
+            self._contadores['lotes_masivos'] += 1
+            self._contadores['fusionados'] += len(grupo) - 1
+            return MASIVO, grupo
+
+    def siguiente_interactivo(self):
+        """Saca un interactivo si hay alguno esperando (preempción entre bloques masivos)."""
+        with self._condicion:
+            if not self._colas[INTERACTIVO]:
+                return None
+            self._contadores['preempciones'] += 1
+            return self._sacar(INTERACTIVO)
+
+    def metricas(self):
+        """Profundidad de cada cola, esperas (ms) y contadores de fusión y preempción."""
+        with self._condicion:
+            datos = dict(self._contadores)
+            datos['profundidad'] = {clase: len(cola) for clase, cola in self._colas.items()}
+            esperas = {clase: sorted(muestras) for clase, muestras in self._esperas.items()}
+        datos['espera_ms'] = {
+            clase: {
+                'muestras': len(valores),
+                'media': round(1000 * sum(valores) / len(valores), 2) if valores else 0.0,
+                'p95': round(1000 * valores[int(0.95 * (len(valores) - 1))], 2) if valores else 0.0,
+                'max': round(1000 * valores[-1], 2) if valores else 0.0,
+            }
+            for clase, valores in esperas.items()
+        }
+        return datos
+
+    def _sacar(self, clase):
+        job_id, command, encolado = self._colas[clase].popleft()
+        self._esperas[clase].append(time.monotonic() - encolado)
+        self._contadores['ejecutados'] += 1
+        return job_id, command
+
+
+def _filas(command):
+    # Lo ejecuta el planificador: un comando mal formado cuenta como vacío y falla después, él solo.
+    filas = command.get(ACCIONES_MASIVAS.get(command.get('action'), ''))
+    return len(filas) if isinstance(filas, list) else 0
+
+
+def _ejecutar_interactivo(sesion, result_queue, job_id, command):
     try:
-        pythoncom.CoInitialize()
-        acad = Autocad(create_if_not_exists=True)
+        result = sesion.ejecutar(perform_civil3d_operation, command)
+    except Exception as e:
+        logging.error(f"Error al procesar el comando {job_id}: {e}")
+        result = {'error': str(e)}
+    result_queue.put((job_id, result))
+
 
+def _bloque_puntos(backend, puntos, descripciones):
+    _escribir_puntos(backend, puntos, descripciones)
+
+
+def _bloque_tuberias(backend, nombre_red, elementos):
+    pipe_network = backend.obtener_red_tuberias(nombre_red)
+    creadas = []
+    for puntos_map, tuberia in elementos:
         try:
-            civil3d_progid = "AeccXUiLand.AeccApplication.13.7"
-            civil3d_app = win32com.client.Dispatch(civil3d_progid)
-            logging.info("Conexión con Civil 3D establecida en el proceso.")
+            creadas.append(_crear_tuberia(backend, pipe_network, tuberia, puntos_map))
         except Exception as e:
-            logging.warning(f"No se pudo conectar con Civil 3D en el proceso: {e}")
+            logging.error(f"Error al crear la tubería {tuberia.get('ID_TUBERIA')}: {e}")
+            creadas.append(None)
+    return creadas
 
+
+def _ejecutar_masivo(sesion, planificador, result_queue, grupo, tamano_bloque):
+    """
+    Ejecuta un grupo de comandos masivos fusionados como un único lote.
+
+    Las filas de todos los comandos se escriben juntas en bloques de
+    tamano_bloque; entre bloque y bloque se ejecutan los interactivos que
+    hayan llegado. Cada trabajo recibe su propio resultado; si falla un
+    bloque, los trabajos que tenían filas en él reciben el error junto con lo
+    que ya se había escrito.
+    """
+    action = grupo[0][1]['action']
+
+    def atender_interactivos():
         while True:
-            command = command_queue.get()
-            if command is None:
+            siguiente = planificador.siguiente_interactivo()
+            if siguiente is None:
+                return
+            _ejecutar_interactivo(sesion, result_queue, *siguiente)
+
+    # Cada trabajo se valida por separado: uno con datos erróneos falla solo.
+    # Si falla un bloque, sus trabajos se quedan con lo escrito en los
+    # bloques anteriores y un error; los demás bloques siguen.
+    resultados = {}
+    errores = {}
+    elementos = []
+    if action == 'crear_puntos':
+        # (trabajo, ID, punto, descripción) de todos los comandos, en orden.
+        creados = {}
+        totales = {}
+        for job_id, command in grupo:
+            if not command.get('coordenadas'):
+                resultados[job_id] = {'error': 'No se proporcionaron datos de coordenadas.'}
+                continue
+            try:
+                puntos, descripciones = _leer_puntos(command['coordenadas'])
+            except Exception as e:
+                logging.error(f"Datos no válidos en el trabajo {job_id}: {e}")
+                resultados[job_id] = {'error': f'Datos no válidos: {e}'}
+                continue
+            creados[job_id] = {}
+            totales[job_id] = len(puntos)
+            elementos.extend((job_id, id_punto, punto, descripciones[id_punto]) for id_punto, punto in puntos.items())
+        for inicio in range(0, len(elementos), tamano_bloque):
+            bloque = elementos[inicio:inicio + tamano_bloque]
+            try:
+                sesion.ejecutar(_bloque_puntos, [e[2] for e in bloque], [e[3] for e in bloque])
+            except Exception as e:
+                logging.error(f"Error en un bloque del lote masivo {action}: {e}")
+                for job_id, _, _, _ in bloque:
+                    errores.setdefault(job_id, e)
+            else:
+                for job_id, id_punto, punto, _ in bloque:
+                    creados[job_id][id_punto] = punto
+            atender_interactivos()
+        for job_id, puntos in creados.items():
+            if job_id in errores:
+                resultados[job_id] = {'error': f'Error en Civil 3D: {errores[job_id]}',
+                                      'message': f"{len(puntos)} de {totales[job_id]} puntos creados.",
+                                      'puntos': puntos}
+            else:
+                resultados[job_id] = {'message': f"{len(puntos)} puntos creados.", 'puntos': puntos}
+
+    else:
+        nombre_red = grupo[0][1].get('red_tuberias') or "Red desde Flask"
+        creadas = {}
+        for job_id, command in grupo:
+            tuberias = command.get('tuberias') or []
+            if not tuberias:
+                resultados[job_id] = {'error': 'No se proporcionaron datos de tuberías.'}
+                continue
+            puntos_map = command.get('puntos', {})
+            if (not isinstance(puntos_map, dict) or not isinstance(tuberias, list)
+                    or not all(isinstance(t, dict) for t in tuberias)):
+                resultados[job_id] = {'error': 'Datos no válidos: puntos debe ser un objeto y tuberias una lista de objetos.'}
+                continue
+            creadas[job_id] = []
+            elementos.extend((job_id, puntos_map, tuberia) for tuberia in tuberias)
+        for inicio in range(0, len(elementos), tamano_bloque):
+            bloque = elementos[inicio:inicio + tamano_bloque]
+            try:
+                ids = sesion.ejecutar(_bloque_tuberias, nombre_red, [(e[1], e[2]) for e in bloque])
+            except Exception as e:
+                logging.error(f"Error en un bloque del lote masivo {action}: {e}")
+                for job_id, _, _ in bloque:
+                    errores.setdefault(job_id, e)
+            else:
+                for (job_id, _, _), id_tuberia in zip(bloque, ids):
+                    if id_tuberia is not None:
+                        creadas[job_id].append(id_tuberia)
+            atender_interactivos()
+        for job_id, ids in creadas.items():
+            if job_id in errores:
+                resultados[job_id] = {'error': f'Error en Civil 3D: {errores[job_id]}',
+                                      'message': f"{len(ids)} tuberías creadas antes del error."}
+            else:
+                resultados[job_id] = {'message': f"{len(ids)} tuberías creadas."}
+
+    for job_id, _ in grupo:
+        result_queue.put((job_id, resultados[job_id]))
+
+
+def _leer_comandos(command_queue, result_queue, planificador):
+    # Hilo lector del proceso hijo: reparte los comandos entre las colas del
+    # planificador y contesta las métricas sin esperar a la sesión CAD.
+    while True:
+        mensaje = command_queue.get()
+        if mensaje is None:
+            planificador.cerrar()
+            return
+        job_id, command = mensaje
+        if isinstance(command, dict) and command.get('action') == ACCION_METRICAS:
+            result_queue.put((job_id, planificador.metricas()))
+        else:
+            planificador.encolar(job_id, command)
+
+
+def civil3d_process(command_queue, result_queue, tamano_bloque=TAMANO_BLOQUE):
+    """
+    Proceso para manejar la comunicación con Civil 3D.
+
+    Lee (id, comando) de command_queue y escribe (id, resultado) en
+    result_queue. La conexión la mantiene una SesionCAD propia del proceso
+    (ADDEC_BACKEND se hereda del proceso web). El orden de ejecución lo
+    decide un PlanificadorTrabajos.
+    """
+    from sesion_cad import crear_sesion_desde_entorno
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    sesion = crear_sesion_desde_entorno()
+    planificador = PlanificadorTrabajos()
+    lector = threading.Thread(target=_leer_comandos, args=(command_queue, result_queue, planificador),
+                              name='LectorComandos', daemon=True)
+    lector.start()
+    try:
+        while True:
+            lote = planificador.siguiente()
+            if lote is None:
                 logging.info("Proceso de Civil 3D terminado.")
                 break
 
+            clase, grupo = lote
             try:
-                result = perform_civil3d_operation(acad, civil3d_app, command)
-                result_queue.put(result)
+                if clase == INTERACTIVO or grupo[0][1].get('action') not in ACCIONES_MASIVAS:
+                    for job_id, command in grupo:
+                        _ejecutar_interactivo(sesion, result_queue, job_id, command)
+                else:
+                    _ejecutar_masivo(sesion, planificador, result_queue, grupo, tamano_bloque)
             except Exception as e:
-                logging.error(f"Error al procesar el comando: {e}")
-                result_queue.put({'error': str(e)})
+                # Solo fallan los trabajos del lote; los que ya tenían resultado lo conservan.
+                logging.error(f"Error al procesar un lote {clase} ({len(grupo)} trabajos): {e}")
+                for job_id, _ in grupo:
+                    result_queue.put((job_id, {'error': str(e)}))
 
     except Exception as e:
         logging.error(f"Error en el proceso Civil 3D: {e}")
     finally:
-        pythoncom.CoUninitialize()
+        sesion.detener()
         logging.info("Finalización del proceso de Civil 3D.")
 
-if __name__ == "__main__":
-    command_queue = multiprocessing.Queue()
-    result_queue = multiprocessing.Queue()
 
-    process = multiprocessing.Process(target=civil3d_process, args=(command_queue, result_queue))
-    process.start()
+class ServicioTrabajos:
+    """
+    Cola de trabajos con identificador hacia el proceso de Civil 3D.
+
+    Cada trabajo tiene su Future; el hilo despachador lo resuelve cuando llega
+    su resultado, o lo marca como expirado si pasa timeout segundos. Un
+    resultado que llega tarde se descarta. Si el proceso hijo muere, los
+    trabajos pendientes fallan y el siguiente envío lo vuelve a arrancar.
+    """
+
+    def __init__(self, timeout=600.0, max_trabajos=1000, intervalo=0.5):
+        self.timeout = timeout
+        self.max_trabajos = max_trabajos
+        self.intervalo = intervalo
+
+        self._trabajos = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._proceso = None
+        self._despachador = None
+        self._command_queue = None
+        self._result_queue = None
+        self._detenido = threading.Event()
+
+    # --- API pública -----------------------------------------------------
+
+    def iniciar(self):
+        """Arranca el proceso de Civil 3D y el despachador si no están en marcha."""
+        with self._lock:
+            if self._proceso is not None and self._proceso.is_alive():
+                return
+            self._command_queue = multiprocessing.Queue()
+            self._result_queue = multiprocessing.Queue()
+            self._proceso = multiprocessing.Process(
+                target=civil3d_process, args=(self._command_queue, self._result_queue),
+                name='Civil3DProcess', daemon=True)
+            self._proceso.start()
+            self._detenido.clear()
+            if self._despachador is None or not self._despachador.is_alive():
+                self._despachador = threading.Thread(target=self._despachar, name='DespachadorTrabajos', daemon=True)
+                self._despachador.start()
+            logger.info(f"Proceso de Civil 3D iniciado (pid {self._proceso.pid}).")
+
+    def enviar(self, command, timeout=None):
+        """Encola un comando y devuelve el identificador de su trabajo."""
+        if not isinstance(command, dict) or not command.get('action'):
+            raise ValueError("El comando debe ser un diccionario con 'action'.")
+        campo = ACCIONES_MASIVAS.get(command['action'])
+        if campo is not None and command.get(campo) is not None and not isinstance(command[campo], list):
+            raise ValueError(f"'{campo}' debe ser una lista.")
+        self.iniciar()
+        job_id = uuid.uuid4().hex
+        ahora = time.time()
+        trabajo = {
+            'id': job_id,
+            'accion': command['action'],
+            'estado': PENDIENTE,
+            'creado': ahora,
+            'limite': ahora + (timeout or self.timeout),
+            'terminado': None,
+            'futuro': Future(),
+        }
+        with self._lock:
+            self._trabajos[job_id] = trabajo
+            self._podar()
+            command_queue = self._command_queue
+        command_queue.put((job_id, command))
+        logger.debug(f"Trabajo {job_id} ({command['action']}) encolado.")
+        return job_id
+
+    def estado(self, job_id):
+        """Estado público del trabajo, o None si no existe."""
+        with self._lock:
+            trabajo = self._trabajos.get(job_id)
+            if trabajo is None:
+                return None
+            datos = {k: v for k, v in trabajo.items() if k not in ('futuro', 'limite')}
+        futuro = trabajo['futuro']
+        if futuro.done():
+            if futuro.exception() is None:
+                datos['resultado'] = futuro.result()
+            else:
+                datos['error'] = str(futuro.exception())
+        return datos
+
+    def resultado(self, job_id, esperar=None):
+        """Espera el resultado del trabajo. Lanza KeyError si no existe y TimeoutError si no termina a tiempo."""
+        with self._lock:
+            trabajo = self._trabajos.get(job_id)
+        if trabajo is None:
+            raise KeyError(job_id)
+        return trabajo['futuro'].result(timeout=esperar)
+
+    def ejecutar(self, command, timeout=None):
+        """Envía el comando y espera su resultado."""
+        job_id = self.enviar(command, timeout=timeout)
+        return self.resultado(job_id, esperar=timeout or self.timeout)
+
+    def metricas(self, esperar=5.0):
+        """
+        Métricas del planificador del proceso hijo (profundidad de colas,
+        esperas, fusiones, preempciones) más el estado de los trabajos aquí.
+        """
+        with self._lock:
+            estados = collections.Counter(t['estado'] for t in self._trabajos.values())
+            esperas = [t['terminado'] - t['creado'] for t in self._trabajos.values() if t['terminado'] is not None]
+        datos = {
+            'trabajos': dict(estados),
+            'espera_total_media_ms': round(1000 * sum(esperas) / len(esperas), 2) if esperas else 0.0,
+            'proceso_activo': self._proceso is not None and self._proceso.is_alive(),
+        }
+        if datos['proceso_activo']:
+            job_id = self.enviar({'action': ACCION_METRICAS}, timeout=esperar)
+            try:
+                datos['planificador'] = self.resultado(job_id, esperar=esperar)
+            except Exception as e:
+                datos['planificador'] = {'error': str(e)}
+            with self._lock:
+                self._trabajos.pop(job_id, None)
+        return datos
+
+    def detener(self, timeout=10.0):
+        """Termina el proceso hijo y el despachador."""
+        with self._lock:
+            proceso, command_queue = self._proceso, self._command_queue
+            self._proceso = None
+        self._detenido.set()
+        if proceso is not None and proceso.is_alive():
+            command_queue.put(None)
+            proceso.join(timeout)
+            if proceso.is_alive():
+                proceso.terminate()
+        self._fallar_pendientes("El servicio de trabajos se detuvo.")
+
+    # --- Implementación ----------------------------------------------------
+
+    def _podar(self):
+        # Olvida los trabajos terminados más antiguos cuando se supera el máximo.
+        sobrantes = len(self._trabajos) - self.max_trabajos
+        for job_id in list(self._trabajos):
+            if sobrantes <= 0:
+                break
+            if self._trabajos[job_id]['estado'] != PENDIENTE:
+                del self._trabajos[job_id]
+                sobrantes -= 1
+
+    def _terminar(self, trabajo, estado, resultado=None, error=None):
+        with self._lock:
+            if trabajo['estado'] != PENDIENTE:
+                return False
+            trabajo['estado'] = estado
+            trabajo['terminado'] = time.time()
+        if error is not None:
+            trabajo['futuro'].set_exception(error)
+        else:
+            trabajo['futuro'].set_result(resultado)
+        return True
+
+    def _fallar_pendientes(self, mensaje):
+        with self._lock:
+            pendientes = [t for t in self._trabajos.values() if t['estado'] == PENDIENTE]
+        for trabajo in pendientes:
+            self._terminar(trabajo, ERROR, error=RuntimeError(mensaje))
+
+    def _expirar(self):
+        ahora = time.time()
+        with self._lock:
+            vencidos = [t for t in self._trabajos.values() if t['estado'] == PENDIENTE and t['limite'] < ahora]
+        for trabajo in vencidos:
+            if self._terminar(trabajo, EXPIRADO, error=TrabajoExpirado(f"El trabajo {trabajo['id']} superó su tiempo límite.")):
+                logger.warning(f"Trabajo {trabajo['id']} ({trabajo['accion']}) expirado.")
+
+    def _despachar(self):
+        while not self._detenido.is_set():
+            with self._lock:
+                proceso, result_queue = self._proceso, self._result_queue
+            if proceso is None:
+                self._detenido.wait(self.intervalo)
+                continue
+            try:
+                job_id, result = result_queue.get(timeout=self.intervalo)
+            except queue.Empty:
+                if not proceso.is_alive():
+                    logger.error("El proceso de Civil 3D terminó inesperadamente.")
+                    with self._lock:
+                        if self._proceso is proceso:
+                            self._proceso = None
+                    self._fallar_pendientes("El proceso de Civil 3D terminó inesperadamente.")
+                self._expirar()
+                continue
+            except (EOFError, OSError) as e:
+                logger.error(f"Error al leer los resultados del proceso de Civil 3D: {e}")
+                continue
+
+            # Primero se expiran los vencidos: un resultado fuera de plazo se descarta.
+            self._expirar()
+            with self._lock:
+                trabajo = self._trabajos.get(job_id)
+            if trabajo is None or not self._terminar(trabajo, ERROR if 'error' in result else TERMINADO, result):
+                logger.warning(f"Resultado descartado del trabajo {job_id} (desconocido o expirado).")
+
+
+_servicio = None
+_servicio_lock = threading.Lock()
+
+
+def obtener_servicio():
+    """Devuelve el servicio de trabajos compartido, creándolo la primera vez."""
+    global _servicio
+    with _servicio_lock:
+        if _servicio is None:
+            _servicio = ServicioTrabajos(timeout=float(os.environ.get('ADDEC_TIMEOUT_TRABAJOS', '600')))
+        return _servicio
+
+
+@trabajos_bp.route('/jobs', methods=['POST'])
+def crear_trabajo():
+    command = request.get_json(silent=True)
+    try:
+        job_id = obtener_servicio().enviar(command)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'id': job_id, 'estado': PENDIENTE}), 202
+
+
+@trabajos_bp.route('/jobs/metricas', methods=['GET'])
+def metricas_trabajos():
+    return jsonify(obtener_servicio().metricas()), 200
+
+
+@trabajos_bp.route('/jobs/<job_id>', methods=['GET'])
+def estado_trabajo(job_id):
+    datos = obtener_servicio().estado(job_id)
+    if datos is None:
+        return jsonify({'error': f'Trabajo {job_id} no encontrado.'}), 404
+    return jsonify(datos), 202 if datos['estado'] == PENDIENTE else 200
+
+
+@trabajos_bp.route('/jobs/<job_id>/resultado', methods=['GET'])
+def resultado_trabajo(job_id):
+    esperar = request.args.get('esperar', default=30.0, type=float)
+    servicio = obtener_servicio()
+    try:
+        servicio.resultado(job_id, esperar=esperar)
+    except KeyError:
+        return jsonify({'error': f'Trabajo {job_id} no encontrado.'}), 404
+    except FuturesTimeoutError:
+        return jsonify({'id': job_id, 'estado': PENDIENTE}), 202
+    except TrabajoExpirado as e:
+        return jsonify({'id': job_id, 'estado': EXPIRADO, 'error': str(e)}), 504
+    except Exception:
+        pass
+    datos = servicio.estado(job_id)
+    return jsonify(datos), 500 if datos['estado'] == ERROR else 200
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    servicio = ServicioTrabajos(timeout=30)
 
     coordenadas_ejemplo = [
         {'ID': 1, 'X': 0.0, 'Y': 0.0, 'Z': 0.0, 'Etiqueta': 'P1'},
         {'ID': 2, 'X': 10.0, 'Y': 0.0, 'Z': 0.0, 'Etiqueta': 'P2'}
     ]
-    command_queue.put({'action': 'crear_puntos', 'coordenadas': coordenadas_ejemplo})
-
-    command_queue.put({'action': 'seleccionar_objetos'})
-    command_queue.put({'action': 'generar_polilinea', 'object_ids': ['id1', 'id2']})
-    command_queue.put({'action': 'crear_tuberias', 'tuberias': [{'ID_TUBERIA': 'T1', 'PK_INICIO': 1, 'PK_FIN': 2, 'DIAMETRO': 0.3}]})
+    trabajos = [
+        servicio.enviar({'action': 'crear_puntos', 'coordenadas': coordenadas_ejemplo}),
+        servicio.enviar({'action': 'seleccionar_objetos'}),
+        servicio.enviar({'action': 'generar_polilinea', 'object_ids': ['id1', 'id2']}),
+        servicio.enviar({'action': 'crear_tuberias', 'puntos': {1: [0.0, 0.0, 0.0], 2: [10.0, 0.0, 0.0]},
+                         'tuberias': [{'ID_TUBERIA': 'T1', 'PK_INICIO': 1, 'PK_FIN': 2, 'DIAMETRO': 0.3}]}),
+    ]
 
-    while True:
+    for job_id in trabajos:
         try:
-            result = result_queue.get(timeout=10)
-            if result:
-                print(result)
-        except queue.Empty:
-            break
-
-    command_queue.put(None)
-    process.join()
\ No newline at end of file
+            servicio.resultado(job_id, esperar=30)
+        except Exception:
+            pass
+        print(servicio.estado(job_id))
+
+    servicio.detener()
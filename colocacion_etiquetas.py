@@ -0,0 +1,127 @@
+"""
+Colocación de etiquetas sin solapes.
+
+colocar_etiquetas recibe los puntos de anclaje de todas las etiquetas y el
+ancho de cada texto, y decide dónde va cada una: en su posición preferida,
+desplazada una o más líneas arriba o abajo, u omitida si no cabe en
+ninguna. El tamaño de las cajas (TEXT alineado a la izquierda sobre la línea
+base, ancho aproximado por FACTOR_ANCHO_TEXTO) y las posiciones candidatas
+se calculan con NumPy de una vez. Las etiquetas se colocan por orden de
+prioridad y los solapes se buscan en una rejilla hash: cada etiqueta
+colocada se apunta en las celdas que toca y una candidata solo se compara
+con las de sus celdas.
+
+separacion_minima amplía cada caja: dos etiquetas a menos de esa distancia
+cuentan como solapadas.
+
+Uso desde la línea de comandos:
+    python colocacion_etiquetas.py [etiquetas] [separacion]   # mide una polilínea densa
+"""
+import math
+
+import numpy as np
+
+FACTOR_ANCHO_TEXTO = 0.7
+ALTURA_TEXTO = 2.5
+DESPLAZAMIENTOS_MAXIMOS = 2
+
+
+def anchos_texto(textos, altura=ALTURA_TEXTO):
+    """Ancho aproximado de cada texto (número de caracteres por altura y FACTOR_ANCHO_TEXTO)."""
+    return np.fromiter((len(texto) for texto in textos), dtype=np.float64, count=len(textos)) * altura * FACTOR_ANCHO_TEXTO
+
+
+def orden_por_defecto(n):
+    """Prioridad por defecto: los extremos primero y luego en el orden de la polilínea."""
+    if n <= 2:
+        return np.arange(n)
+    return np.concatenate(([0, n - 1], np.arange(1, n - 1)))
+
+
+def colocar_etiquetas(xs, ys, anchos, altura=ALTURA_TEXTO, separacion_minima=0.0,
+                      desplazamientos_maximos=DESPLAZAMIENTOS_MAXIMOS, orden=None):
+    """
+    Coloca las etiquetas ancladas en (xs, ys) evitando solapes.
+
+    Cada etiqueta prueba su posición y después se desplaza 1, -1, 2, -2...
+    líneas (altura + separacion_minima) hasta desplazamientos_maximos. orden
+    es la prioridad (índices); por defecto orden_por_defecto. Devuelve
+    (xs, ys, colocadas, desplazamientos): las posiciones finales, una
+    máscara de las etiquetas que caben y el número de líneas que se ha
+    movido cada una.
+    """
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    anchos = np.broadcast_to(np.asarray(anchos, dtype=np.float64), xs.shape)
+    n = len(xs)
+    lineas = np.array([0] + [s * k for k in range(1, desplazamientos_maximos + 1) for s in (1, -1)])
+    colocadas = np.zeros(n, dtype=bool)
+    desplazamientos = np.zeros(n, dtype=np.int64)
+    if not n:
+        return xs.copy(), ys.copy(), colocadas, desplazamientos
+
+    # Cajas ampliadas de todas las candidatas: (n, candidatas).
+    margen = separacion_minima / 2
+    paso = altura + separacion_minima
+    x0 = np.repeat((xs - margen)[:, None], len(lineas), axis=1)
+    x1 = np.repeat((xs + anchos + margen)[:, None], len(lineas), axis=1)
+    y0 = ys[:, None] + lineas[None, :] * paso - margen
+    y1 = y0 + altura + separacion_minima
+
+    # Celdas de la rejilla: como una caja no es mayor que una celda, toca a
+    # lo sumo 2 x 2. Se guardan las claves de las cuatro (-1 si no la toca).
+    tamano = max(float(anchos.max(initial=0.0)), altura) + separacion_minima
+    cx0 = np.floor((x0 - x0.min()) / tamano).astype(np.int64)
+    cy0 = np.floor((y0 - y0.min()) / tamano).astype(np.int64)
+    dos_x = np.floor((x1 - x0.min()) / tamano).astype(np.int64) > cx0
+    dos_y = np.floor((y1 - y0.min()) / tamano).astype(np.int64) > cy0
+    filas = int(cy0.max()) + 2
+    base = cx0 * filas + cy0
+    claves = np.stack((base, np.where(dos_x, base + filas, -1), np.where(dos_y, base + 1, -1),
+                       np.where(dos_x & dos_y, base + filas + 1, -1)), axis=-1)
+
+    rejilla = {}
+    cajas = []  # (x0, y0, x1, y1) de las colocadas, por posición en la lista
+    candidatas = np.stack((x0, y0, x1, y1), axis=-1).tolist()
+    claves = claves.tolist()
+    elegida = np.zeros(n, dtype=np.int64)
+    for i in (orden_por_defecto(n) if orden is None else np.asarray(orden)).tolist():
+        for k, (a0, b0, a1, b1) in enumerate(candidatas[i]):
+            celdas = claves[i][k]
+            libre = True
+            for celda in celdas:
+                for j in rejilla.get(celda, ()):
+                    c0, d0, c1, d1 = cajas[j]
+                    if a0 < c1 and c0 < a1 and b0 < d1 and d0 < b1:
+                        libre = False
+                        break
+                if not libre:
+                    break
+            if libre:
+                for celda in celdas:
+                    if celda >= 0:
+                        rejilla.setdefault(celda, []).append(len(cajas))
+                cajas.append((a0, b0, a1, b1))
+                colocadas[i] = True
+                elegida[i] = k
+                break
+
+    desplazamientos = lineas[elegida] * colocadas
+    return xs, ys + desplazamientos * paso, colocadas, desplazamientos
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    separacion = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+    angulos = np.linspace(0, 20 * math.pi, n)
+    xs, ys = angulos * 40, 150 * np.sin(angulos)
+    textos = [f"X: {x:.2f}, Y: {y:.2f}" for x, y in zip(xs.tolist(), ys.tolist())]
+
+    inicio = time.perf_counter()
+    anchos = anchos_texto(textos)
+    _, _, colocadas, desplazamientos = colocar_etiquetas(xs, ys + 5, anchos, separacion_minima=separacion)
+    print(f"{n} etiquetas: {int(colocadas.sum())} colocadas ({int((desplazamientos != 0).sum())} desplazadas), "
+          f"{int((~colocadas).sum())} omitidas en {(time.perf_counter() - inicio) * 1000:.1f} ms")
@@ -1,14 +1,10 @@
-import csv
-import io
+from concurrent.futures import TimeoutError as FuturesTimeoutError
 from flask import Blueprint, request, jsonify
-import pythoncom
-from autocad_civil import conectar_con_autocad_civil, desconectar_autocad_civil
-from win32com import client
-from pyautocad import APoint
-
-VARIANT = client.VARIANT
-VT_ARRAY = 8192
-VT_R8 = 5
+from sesion_cad import obtener_sesion, ErrorSesionCAD
+from escritor_masivo import EscritorMasivo
+from carga_csv import IndicePuntos, leer_csv_multipart
+from validacion import ESQUEMA_COORDENADAS, ESQUEMA_TUBERIAS, mensajes_de_error, validar_tabla
+import numpy as np
 
 import logging
 
@@ -16,71 +12,36 @@ logger = logging.getLogger(__name__)
 
 crear_puntos_bp = Blueprint('crear_puntos', __name__)
 
-def validar_coordenadas(coordenadas):
-    """Valida las coordenadas de los puntos antes de ser procesadas."""
-    errores = []
-    for row in coordenadas:
-        try:
-            x, y, z = float(row['X']), float(row['Y']), float(row['Z'])
-            id_punto = int(row['ID'])
-            if id_punto < 0:
-                errores.append(f"ID del punto debe ser positivo: {row}")
-        except (ValueError, KeyError) as e:
-            errores.append(f"Datos de coordenadas inválidos: {row}. Error: {e}")
-    return errores
-
-def validar_tuberias(tuberias):
-    """Valida las tuberías antes de procesarlas."""
-    errores = []
-    for row in tuberias:
-        try:
-            pk_inicio = int(row['PK_INICIO'])
-            pk_fin = int(row['PK_FIN'])
-            if pk_inicio < 0 or pk_fin < 0:
-                errores.append(f"Los PK deben ser positivos: {row}")
-        except (ValueError, KeyError) as e:
-            errores.append(f"Datos de tuberías inválidos: {row}. Error: {e}")
-    return errores
-
-def crear_puntos(acad, coordenadas):
+RED_TUBERIAS_POR_DEFECTO = "Red de Tuberías"
+
+# Carga por streaming (/cargar_csv)
+TAMANO_BLOQUE_CSV = 5000
+MAX_ERRORES_INFORMADOS = 50
+COLUMNAS_COORDENADAS = ('ID', 'X', 'Y', 'Z')
+COLUMNAS_TUBERIAS = ('ID_TUBERIA', 'PK_INICIO', 'PK_FIN')
+COLUMNAS_CSV = {'coordenadas': COLUMNAS_COORDENADAS, 'tuberias': COLUMNAS_TUBERIAS}
+
+def crear_puntos(backend, coordenadas, escritor=None):
+    """Crea por lotes los puntos de una Tabla validada y devuelve {ID: (x, y, z)} de los puntos escritos."""
     puntos = {}
+    escritor = escritor or EscritorMasivo(backend)
     try:
         logging.debug("Entrando a la función crear_puntos")
-        doc = acad.ActiveDocument
-        logging.debug(f"Documento activo: {doc.Name if doc else None}")
-        model_space = doc.ModelSpace
-        logging.debug(f"Espacio modelo: {model_space if model_space else None}")
+        logging.debug(f"Documento activo: {backend.nombre_documento()}")
 
         try:
-            logging.debug(f"  Tipo del espacio modelo: {type(model_space)}")
-            logging.debug(f"  Nombre del espacio modelo (si existe): {model_space.Name}")
-            logging.debug(f"  Cantidad de objetos en el espacio modelo: {model_space.Count}")
+            logging.debug(f"  Backend de dibujo: {backend.nombre}")
+            logging.debug(f"  Cantidad de objetos en el espacio modelo: {backend.contar_objetos()}")
         except Exception as e:
             logging.warning(f"Error al inspeccionar el espacio modelo: {e}")
 
-        if coordenadas:
+        if len(coordenadas):
             logging.debug(f"Número de coordenadas a procesar: {len(coordenadas)}")
-            for row in coordenadas:
-                try:
-                    x = round(float(row['X']), 3)
-                    y = round(float(row['Y']), 3)
-                    z = round(float(row['Z']), 3)
-                    descripcion = row.get('Etiqueta', 'Sin descripción')
-                    id_punto = int(row['ID'])
-
-                    logging.debug(f"Creando punto {id_punto} - X: {x}, Y: {y}, Z: {z}, Desc: {descripcion} (Redondeado)")
-                    logging.debug(f"  ¿Documento activo válido? {acad.ActiveDocument is not None}")
-                    logging.debug(f"  ¿Espacio modelo válido? {model_space is not None}")
-
-                    point_array = (x, y, z)
-                    safe_array = VARIANT(VT_ARRAY | VT_R8, point_array)
-
-                    model_space.AddPoint(safe_array)
-                    logging.debug(f"  Punto añadido al espacio modelo.")
-                    puntos[id_punto] = (x, y, z)
-                    logging.info(f"Punto {id_punto} agregado: {descripcion} en ({x}, {y}, {z})")
-                except Exception as e:
-                    logging.error(f"Error al crear punto {row.get('ID')}: {e}")
+            xs, ys, zs = (np.round(coordenadas[c], 3).tolist() for c in ('X', 'Y', 'Z'))
+            escritor.agregar_puntos(xs, ys, zs)
+            escritor.vaciar()
+            puntos = dict(zip(coordenadas['ID'].tolist(), zip(xs, ys, zs)))
+            logging.info(f"{len(puntos)} puntos agregados en {escritor.estadisticas()['lotes']} lotes.")
         else:
             logging.debug("No hay coordenadas para procesar.")
     except Exception as e:
@@ -89,51 +50,54 @@ def crear_puntos(acad, coordenadas):
         logging.debug(f"Saliendo de la función crear_puntos. Puntos creados: {puntos.keys()}")
     return puntos
 
-def crear_tuberias(acad, civil3d, tuberias, puntos):
-    """Crea las tuberías en Civil 3D entre los puntos especificados"""
+def crear_tuberias(backend, tuberias, puntos, nombre_red=RED_TUBERIAS_POR_DEFECTO, escritor=None):
+    """Crea las tuberías (Tabla validada) en Civil 3D entre los puntos especificados, todas en la red nombre_red.
+
+    Las tuberías se crean de una en una (la API de Civil 3D no tiene alta por
+    lotes); sus textos descriptivos se escriben por lotes al final.
+    """
+    escritor = escritor or EscritorMasivo(backend)
     logging.debug("Entrando a la función crear_tuberias")
-    if not civil3d:
-        logging.warning("Objeto civil3d es None. No se crearán tuberías.")
+    if not backend.civil3d_disponible:
+        logging.warning("Civil 3D no está disponible. No se crearán tuberías.")
         logging.debug("Saliendo de la función crear_tuberias.")
         return
 
     logging.debug(f"Número de tuberías a procesar: {len(tuberias)}")
-    for row in tuberias:
+    try:
+        pipe_network = backend.obtener_red_tuberias(nombre_red)
+        logging.debug(f"  Red de tuberías '{nombre_red}': {pipe_network}")
+    except Exception as e:
+        logging.error(f"No se pudo obtener ni crear la red de tuberías '{nombre_red}': {e}")
+        return
+
+    columnas = zip(
+        tuberias['PK_INICIO'].tolist(), tuberias['PK_FIN'].tolist(), tuberias['ID_TUBERIA'].tolist(),
+        tuberias['DIAMETRO'].tolist(), tuberias['MATERIAL'].tolist(), tuberias['PRESION_NOMINAL'].tolist(),
+        tuberias['CONEXION_INICIO'].tolist(), tuberias['CONEXION_FIN'].tolist(),
+        tuberias['LONGITUD'].tolist(), tuberias['PENDIENTE'].tolist(),
+    )
+    for (pk_inicio, pk_fin, id_tuberia, diametro, material, presion_nominal,
+         conexion_inicio, conexion_fin, longitud, pendiente) in columnas:
         try:
-            pk_inicio = int(row['PK_INICIO'])
-            pk_fin = int(row['PK_FIN'])
-            id_tuberia = row['ID_TUBERIA']
-            diametro = row['DIAMETRO']
-            material = row['MATERIAL']
-            presion_nominal = row['PRESION_NOMINAL']
-            conexion_inicio = row['CONEXION_INICIO']
-            conexion_fin = row['CONEXION_FIN']
-            longitud = row['LONGITUD']
-            pendiente = row['PENDIENTE']
+            if diametro != diametro:  # NaN: la fila no traía diámetro
+                logging.warning(f"La tubería {id_tuberia} no tiene diámetro. Se omite la tubería.")
+                continue
 
             logging.debug(f"Creando tubería {id_tuberia} entre PK_INICIO: {pk_inicio} y PK_FIN: {pk_fin}")
-            logging.debug(f"  Puntos disponibles: {puntos.keys()}")
 
             if pk_inicio not in puntos or pk_fin not in puntos:
                 logging.warning(f"Puntos PK_INICIO ({pk_inicio}) o PK_FIN ({pk_fin}) no encontrados para tubería {id_tuberia}. Se omite la tubería.")
                 continue
 
-            start_point_coords = puntos[pk_inicio]
-            end_point_coords = puntos[pk_fin]
-            start_point = APoint(*start_point_coords)
-            end_point = APoint(*end_point_coords)
+            start_point = puntos[pk_inicio]
+            end_point = puntos[pk_fin]
 
             logging.debug(f"  Punto de inicio: {start_point}")
             logging.debug(f"  Punto de fin: {end_point}")
 
-            if not isinstance(start_point, APoint) or not isinstance(end_point, APoint):
-                logging.warning(f"Los puntos para la tubería {id_tuberia} no son válidos. Se omite la tubería.")
-                continue
-
-            pipe_network = civil3d.ActiveDocument.PipeNetworks.Add("Red de Tuberías")
-            logging.debug(f"  Red de tuberías creada: {pipe_network.Name if pipe_network else None}")
-            pipe = pipe_network.Pipes.AddByDiameter(start_point, end_point, diametro)
-            logging.debug(f"  Tubería creada: {pipe if pipe else None}, Diámetro: {diametro}")
+            pipe = backend.agregar_tuberia(pipe_network, start_point, end_point, diametro)
+            logging.debug(f"  Tubería creada: {pipe}, Diámetro: {diametro}")
             if pipe is None:
                 logging.warning(f"No se pudo crear la tubería {id_tuberia}.")
                 continue
@@ -144,25 +108,34 @@ def crear_tuberias(acad, civil3d, tuberias, puntos):
                 f"Presión Nominal: {presion_nominal}, Conexión: {conexion_inicio}-{conexion_fin}\n"
                 f"Longitud: {longitud}, Pendiente: {pendiente}"
             )
-            mid_point = APoint(
-                (start_point.x + end_point.x) / 2,
-                (start_point.y + end_point.y) / 2,
-                (start_point.z + end_point.z) / 2
+            mid_point = (
+                (start_point[0] + end_point[0]) / 2,
+                (start_point[1] + end_point[1]) / 2,
+                (start_point[2] + end_point[2]) / 2
             )
-            acad.model.AddText(descripcion_tuberia, mid_point, 3)
-            logging.debug(f"Texto agregado a AutoCAD para la tubería.")
+            escritor.agregar_textos([descripcion_tuberia], [mid_point[0]], [mid_point[1]], [mid_point[2]], 3)
 
             logging.info(f"Tubería {id_tuberia} agregada entre puntos {pk_inicio} y {pk_fin}.")
         except Exception as e:
-            logging.error(f"Error general al procesar la tubería {row.get('ID_TUBERIA')}: {e}")
+            logging.error(f"Error general al procesar la tubería {id_tuberia}: {e}")
+    try:
+        escritor.vaciar()
+    except Exception as e:
+        logging.error(f"Error al escribir los textos de las tuberías: {e}")
     logging.debug("Saliendo de la función crear_tuberias.")
 
+def importar_en_cad(backend, coordenadas, tuberias, nombre_red=RED_TUBERIAS_POR_DEFECTO):
+    """Crea los puntos y, si Civil 3D está disponible, las tuberías (Tablas validadas). Se ejecuta en la sesión CAD."""
+    puntos_creados = crear_puntos(backend, coordenadas)
+    logging.debug(f"Puntos creados: {puntos_creados.keys()}")
+
+    if backend.civil3d_disponible and puntos_creados:
+        logging.info("Intentando crear tuberías...")
+        crear_tuberias(backend, tuberias, puntos_creados, nombre_red)
+    return puntos_creados, backend.civil3d_disponible
+
 @crear_puntos_bp.route('/cargar_datos', methods=['POST'])
 def cargar_datos():
-    pythoncom.CoInitialize()
-    acad = None
-    civil3d = None
-    puntos_creados = {}
     try:
         logging.info("Inicio de la ruta /cargar_datos")
         data = request.get_json(force=True)
@@ -173,6 +146,7 @@ def cargar_datos():
 
         coordenadas = data.get('coordenadas')
         tuberias = data.get('tuberias', [])
+        nombre_red = data.get('red_tuberias') or RED_TUBERIAS_POR_DEFECTO
         logging.debug(f"Coordenadas recibidas: {coordenadas is not None}")
         logging.debug(f"Tuberías recibidas: {tuberias is not None}")
 
@@ -180,43 +154,155 @@ def cargar_datos():
             logging.error("Datos de coordenadas faltantes o en formato incorrecto.")
             return jsonify({'error': 'Datos de coordenadas faltantes o en formato incorrecto.'}), 400
 
-        errores_coordenadas = validar_coordenadas(coordenadas)
+        coordenadas, errores_coordenadas = validar_tabla(coordenadas, ESQUEMA_COORDENADAS)
         if errores_coordenadas:
-            logging.error(f"Errores en los datos de coordenadas: {errores_coordenadas}")
-            return jsonify({'error': 'Errores en las coordenadas', 'detalles': errores_coordenadas}), 400
-
-        logging.debug("Intentando conectar con AutoCAD...")
-        acad, civil3d = conectar_con_autocad_civil(try_create=True)
-        logging.debug(f"Resultado de la conexión - acad: {acad}, civil3d: {civil3d}")
-        if acad is None:
-            return jsonify({'error': 'Error al conectar con AutoCAD.'}), 500
-
-        # Crear los puntos
-        puntos_creados = crear_puntos(acad, coordenadas)
-        logging.debug(f"Puntos creados: {puntos_creados.keys()}")
-
-        if civil3d and puntos_creados:
-            logging.info("Intentando crear tuberías...")
-            errores_tuberias = validar_tuberias(tuberias)
-            if errores_tuberias:
-                logging.warning(f"Errores en los datos de tuberías (se omitirán algunas tuberías): {errores_tuberias}")
-
-            crear_tuberias(acad, civil3d, tuberias, puntos_creados)
+            detalles = mensajes_de_error(errores_coordenadas, MAX_ERRORES_INFORMADOS)
+            logging.error(f"Errores en los datos de coordenadas: {detalles}")
+            return jsonify({'error': 'Errores en las coordenadas', 'detalles': detalles,
+                            'filas_invalidas': len({e['fila'] for e in errores_coordenadas})}), 400
+
+        tuberias, errores_tuberias = validar_tabla(tuberias if isinstance(tuberias, list) else [], ESQUEMA_TUBERIAS)
+        if errores_tuberias:
+            logging.warning("Errores en los datos de tuberías (se omitirán algunas tuberías): "
+                            f"{mensajes_de_error(errores_tuberias, MAX_ERRORES_INFORMADOS)}")
+
+        puntos_creados, con_civil3d = obtener_sesion().ejecutar(importar_en_cad, coordenadas, tuberias, nombre_red)
+
+        if con_civil3d and puntos_creados:
             logging.info("Proceso de creación de puntos y (intento de) tuberías completado.")
             return jsonify({'message': 'Proceso completado. Puntos creados, se intentó crear tuberías (se omitieron datos faltantes).'}), 200
-        elif acad and puntos_creados:
+        elif puntos_creados:
             logging.info("Proceso de creación de puntos completado (solo AutoCAD).")
             return jsonify({'message': 'Proceso de creación de puntos completado (solo AutoCAD).'}), 200
         else:
             return jsonify({'message': 'No se pudieron crear los puntos.'}), 500
 
-    except pythoncom.com_error as com_err:
-        logging.error(f"Error COM en cargar_datos: {com_err}")
-        return jsonify({'error': f"Error COM: {com_err}"}), 500
+    except ErrorSesionCAD as e:
+        logging.error(f"Error de conexión en cargar_datos: {e}")
+        return jsonify({'error': 'Error al conectar con AutoCAD.'}), 500
     except Exception as e:
+        if type(e).__name__ == 'com_error':
+            logging.error(f"Error COM en cargar_datos: {e}")
+            return jsonify({'error': f"Error COM: {e}"}), 500
         logging.error(f"Error general en cargar_datos: {e}")
         return jsonify({'error': f"Error general: {e}"}), 500
-    finally:
-        logging.debug("Desconectando AutoCAD/Civil 3D y desinicializando COM.")
-        desconectar_autocad_civil(acad, civil3d)
-        pythoncom.CoUninitialize()
\ No newline at end of file
+
+
+class CargaCSV:
+    """
+    Estado de una carga por streaming: valida las filas según llegan y las
+    envía a la sesión CAD en bloques de tamano_bloque.
+
+    Mientras la sesión escribe un bloque, la petición sigue leyendo y
+    validando el siguiente; nunca hay más de un bloque en vuelo, así la
+    memoria no depende del tamaño del archivo. Solo crece el índice de
+    puntos (ID -> coordenadas) que necesitan las tuberías.
+    """
+
+    ESQUEMAS = {'coordenadas': ESQUEMA_COORDENADAS, 'tuberias': ESQUEMA_TUBERIAS}
+
+    def __init__(self, sesion, nombre_red=RED_TUBERIAS_POR_DEFECTO, tamano_bloque=TAMANO_BLOQUE_CSV):
+        self.sesion = sesion
+        self.nombre_red = nombre_red
+        self.tamano_bloque = tamano_bloque
+        self.puntos = IndicePuntos()
+        self.tuberias = 0
+        self.filas_invalidas = 0
+        self.errores = []
+        self.bloques = 0
+        self._bloque = []
+        self._tipo = None
+        self._filas_leidas = 0
+        self._en_curso = None
+
+    def agregar(self, tipo, row):
+        if tipo != self._tipo:
+            self.vaciar()
+            self._tipo = tipo
+            self._filas_leidas = 0
+        self._bloque.append(row)
+        if len(self._bloque) >= self.tamano_bloque:
+            self._enviar_bloque()
+
+    def vaciar(self):
+        """Envía el bloque pendiente y espera a que la sesión termine de escribir."""
+        if self._bloque:
+            self._enviar_bloque()
+        self._esperar()
+
+    def _enviar_bloque(self):
+        # El bloque se valida por columnas; los índices de fila cuentan desde
+        # la primera fila de datos del archivo.
+        filas, self._bloque = self._bloque, []
+        bloque, errores = validar_tabla(filas, self.ESQUEMAS[self._tipo], desplazamiento=self._filas_leidas)
+        self._filas_leidas += len(filas)
+        self.filas_invalidas += len(filas) - len(bloque)
+        self.errores.extend(mensajes_de_error(errores, MAX_ERRORES_INFORMADOS - len(self.errores)))
+        self._esperar()
+        if not len(bloque):
+            return
+        self._escribir_bloque(bloque)
+        self.bloques += 1
+        logging.debug(f"Bloque {self.bloques} de {len(bloque)} filas de {self._tipo} enviado.")
+
+    def _escribir_bloque(self, bloque):
+        """Escribe un bloque ya validado. Las subclases cambian el destino (p. ej. ExportacionDXF)."""
+        if self._tipo == 'coordenadas':
+            self._en_curso = ('coordenadas', self.sesion.enviar(crear_puntos, bloque))
+        else:
+            self._en_curso = ('tuberias', self.sesion.enviar(crear_tuberias, bloque, self.puntos, self.nombre_red))
+            self.tuberias += len(bloque)
+
+    def _esperar(self):
+        if self._en_curso is None:
+            return
+        tipo, futuro = self._en_curso
+        self._en_curso = None
+        try:
+            resultado = futuro.result(timeout=self.sesion.timeout)
+        except FuturesTimeoutError:
+            raise ErrorSesionCAD("La escritura de un bloque del CSV no terminó a tiempo.")
+        if tipo == 'coordenadas':
+            self.puntos.actualizar(resultado)
+
+
+@crear_puntos_bp.route('/cargar_csv', methods=['POST'])
+def cargar_csv():
+    """
+    Importa coordenadas.csv e info_tuberias.csv subidos como multipart/form-data
+    (campos 'coordenadas' y 'tuberias', y 'red_tuberias' opcional).
+
+    El cuerpo se lee por trozos y las filas se escriben por bloques según
+    llegan. Las filas inválidas se omiten y se informan. Si el archivo de
+    tuberías llega antes que el de coordenadas, se guarda en un temporal
+    (en disco a partir de 1 MB) hasta haber creado los puntos.
+    """
+    boundary = request.mimetype_params.get('boundary')
+    if request.mimetype != 'multipart/form-data' or not boundary:
+        return jsonify({'error': 'Se esperaba un envío multipart/form-data con los archivos CSV.'}), 400
+
+    carga = CargaCSV(obtener_sesion())
+    try:
+        error = leer_csv_multipart(carga, request.stream, boundary, COLUMNAS_CSV)
+        if error:
+            return jsonify({'error': error}), 400
+
+        resumen = {
+            'puntos': len(carga.puntos),
+            'tuberias': carga.tuberias,
+            'filas_invalidas': carga.filas_invalidas,
+            'errores': carga.errores,
+            'bloques': carga.bloques,
+        }
+        if not carga.puntos:
+            return jsonify({'message': 'No se pudieron crear los puntos.', **resumen}), 500
+        logging.info(f"Carga CSV completada: {resumen['puntos']} puntos, {resumen['tuberias']} tuberías, "
+                     f"{resumen['filas_invalidas']} filas inválidas, {resumen['bloques']} bloques.")
+        return jsonify({'message': f"Carga completada: {resumen['puntos']} puntos y {resumen['tuberias']} tuberías procesadas.", **resumen}), 200
+
+    except ErrorSesionCAD as e:
+        logging.error(f"Error de conexión en cargar_csv: {e}")
+        return jsonify({'error': 'Error al conectar con AutoCAD.'}), 500
+    except Exception as e:
+        logging.error(f"Error general en cargar_csv: {e}")
+        return jsonify({'error': f"Error general: {e}"}), 500
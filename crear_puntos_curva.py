@@ -1,43 +1,14 @@
 import csv
-from pyautocad import Autocad, APoint
+import math
 from flask import Blueprint, jsonify
-import pythoncom
-from autocad_civil import conectar_con_autocad_civil, desconectar_autocad_civil
+from sesion_cad import obtener_sesion, ErrorSesionCAD
+from validacion import ESQUEMA_COORDENADAS, ESQUEMA_TUBERIAS_CURVA, mensajes_de_error, validar_tabla
 
 crear_puntos_curva_bp = Blueprint('crear_puntos_curva', __name__)
 
 COORDINATES_CSV = 'coordenadas.csv'
 PIPES_CSV = 'tuberias_con_curva.csv'
 
-def validar_coordenadas(datos):
-    for fila in datos:
-        try:
-            x = float(fila['X'])
-            y = float(fila['Y'])
-            z = float(fila['Z'])
-            id_punto = int(fila['ID'])
-            if id_punto < 0:
-                return False, "El ID del punto debe ser positivo."
-        except ValueError:
-            return False, f"Datos numéricos inválidos en las coordenadas: {fila}"
-        except KeyError:
-            return False, "Faltan columnas requeridas en las coordenadas."
-    return True, None
-
-def validar_tuberias(datos):
-    for fila in datos:
-        try:
-            pk_inicio = int(fila['PK_INICIO'])
-            pk_fin = int(fila['PK_FIN'])
-            id_tuberia = fila['ID_TUBERIA']
-            tipo_curva = fila.get('TIPO_CURVA')
-            radio_curva = float(fila.get('RADIO_CURVA')) if fila.get('RADIO_CURVA') else None
-        except ValueError:
-            return False, f"Datos numéricos inválidos en la tubería: {fila}"
-        except KeyError:
-            return False, "Faltan columnas requeridas en las tuberías."
-    return True, None
-
 def leer_csv(ruta_archivo, required_columns=None):
     datos = []
     try:
@@ -56,107 +27,94 @@ def leer_csv(ruta_archivo, required_columns=None):
 
     return datos, None
 
+def dibujar_puntos_y_tuberias_acad(backend, datos_coordenadas, datos_tuberias):
+    """Dibuja los puntos y las tuberías rectas o curvas (Tablas validadas). Se ejecuta en la sesión CAD."""
+    puntos = {}
+
+    # Crear puntos en AutoCAD
+    for id_punto, x, y, z, descripcion in zip(
+            datos_coordenadas['ID'].tolist(), datos_coordenadas['X'].tolist(), datos_coordenadas['Y'].tolist(),
+            datos_coordenadas['Z'].tolist(), datos_coordenadas['Etiqueta'].tolist()):
+        try:
+            backend.agregar_punto(x, y, z)
+            backend.agregar_texto(descripcion, x, y, z, 2.5)
+            puntos[id_punto] = (x, y, z)
+        except Exception as e:
+            print(f"Error al procesar el punto {id_punto}: {e}")
+            continue
+
+    # Crear tuberías en AutoCAD
+    for pk_inicio, pk_fin, id_tuberia, tipo_curva, radio_curva in zip(
+            datos_tuberias['PK_INICIO'].tolist(), datos_tuberias['PK_FIN'].tolist(),
+            datos_tuberias['ID_TUBERIA'].tolist(), datos_tuberias['TIPO_CURVA'].tolist(),
+            datos_tuberias['RADIO_CURVA'].tolist()):
+        try:
+            radio_curva = None if radio_curva != radio_curva else radio_curva  # NaN: sin radio
+
+            if pk_inicio in puntos and pk_fin in puntos:
+                punto_inicio = puntos[pk_inicio]
+                punto_fin = puntos[pk_fin]
+
+                if tipo_curva == "RECTO":
+                    backend.agregar_polilinea_3d((*punto_inicio, *punto_fin))
+
+                elif tipo_curva == "CURVO" and radio_curva:
+                    punto_medio = tuple((a + b) / 2 for a, b in zip(punto_inicio, punto_fin))
+                    dx = punto_fin[0] - punto_inicio[0]
+                    dy = punto_fin[1] - punto_inicio[1]
+                    longitud = math.hypot(dx, dy)
+
+                    if longitud > 0:
+                        # Vector unitario perpendicular a la tubería en el plano XY.
+                        normal = (-dy / longitud, dx / longitud)
+                        punto_central = (
+                            punto_medio[0] + normal[0] * radio_curva,
+                            punto_medio[1] + normal[1] * radio_curva,
+                            punto_medio[2],
+                        )
+                        # Para dibujar un arco, necesitas especificar el centro, radio, ángulo inicial y final.
+                        # Aquí estamos asumiendo un arco de 180 grados en el plano XY.
+                        # Puede que necesites ajustar esto según tus necesidades específicas (plano de la curva).
+                        start_angle = 0
+                        end_angle = math.pi  # 180 grados
+                        backend.agregar_arco(punto_central, radio_curva, start_angle, end_angle)
+                    else:
+                        print(f"Error al calcular el vector normal para la tubería {id_tuberia}")
+                        continue
+                else:
+                    print(f"Tipo de curva no válido o radio no especificado para la tubería {id_tuberia}")
+                    continue
+            else:
+                print(f"PK de inicio o fin no encontrados para la tubería {id_tuberia}")
+                continue
+
+        except Exception as e:
+            print(f"Error al procesar la tubería {id_tuberia}: {e}")
+            continue
+
+    return {'message': 'Proceso completado correctamente.'}
+
 @crear_puntos_curva_bp.route('/crear_puntos_curva')
 def crear_puntos_y_tuberias():
-    acad = None
-    civil3d = None
     try:
-        pythoncom.CoInitialize()
-        acad, civil3d = conectar_con_autocad_civil()
-        if not acad:
-            return jsonify({'error': 'No se pudo conectar con AutoCAD.'}), 500
-
         datos_coordenadas, error_coordenadas = leer_csv(COORDINATES_CSV, required_columns=['X', 'Y', 'Z', 'ID', 'Etiqueta'])
         datos_tuberias, error_tuberias = leer_csv(PIPES_CSV, required_columns=['PK_INICIO', 'PK_FIN', 'ID_TUBERIA', 'TIPO_CURVA'])
 
         if error_coordenadas or error_tuberias:
             return jsonify({'error': error_coordenadas or error_tuberias}), 400
 
-        valido, mensaje = validar_coordenadas(datos_coordenadas)
-        if not valido:
-            return jsonify({'error': mensaje}), 400
-
-        valido, mensaje = validar_tuberias(datos_tuberias)
-        if not valido:
-            return jsonify({'error': mensaje}), 400
-
-        puntos = {}
-
-        # Crear puntos en AutoCAD
-        for fila in datos_coordenadas:
-            try:
-                x = float(fila['X'])
-                y = float(fila['Y'])
-                z = float(fila['Z'])
-                descripcion = fila['Etiqueta']
-                id_punto = int(fila['ID'])
-                punto = APoint(x, y, z)
-                acad.model.AddPoint(punto)
-                acad.model.AddText(descripcion, punto, 2.5)
-                puntos[id_punto] = punto
-            except Exception as e:
-                print(f"Error al procesar el punto {fila['ID']}: {e}")
-                continue
-
-        # Crear tuberías en AutoCAD
-        for fila in datos_tuberias:
-            try:
-                pk_inicio = int(fila['PK_INICIO'])
-                pk_fin = int(fila['PK_FIN'])
-                id_tuberia = fila['ID_TUBERIA']
-                tipo_curva = fila['TIPO_CURVA']
-                radio_curva = float(fila.get('RADIO_CURVA')) if fila.get('RADIO_CURVA') else None
-
-                if pk_inicio in puntos and pk_fin in puntos:
-                    punto_inicio = puntos[pk_inicio]
-                    punto_fin = puntos[pk_fin]
-
-                    if tipo_curva == "RECTO":
-                        acad.model.AddPolyline3D([punto_inicio, punto_fin])
-
-                    elif tipo_curva == "CURVO" and radio_curva:
-                        punto_medio = APoint(
-                            (punto_inicio.x + punto_fin.x) / 2,
-                            (punto_inicio.y + punto_fin.y) / 2,
-                            (punto_inicio.z + punto_fin.z) / 2
-                        )
-                        vector_direccion = punto_fin - punto_inicio
-                        vector_normal = vector_direccion.normal()
-
-                        if vector_normal.length > 0:
-                            punto_central = punto_medio + vector_normal * radio_curva
-                            # Para dibujar un arco, necesitas especificar el centro, radio, ángulo inicial y final.
-                            # Aquí estamos asumiendo un arco de 180 grados en el plano XY.
-                            # Puede que necesites ajustar esto según tus necesidades específicas (plano de la curva).
-                            start_angle = 0
-                            end_angle = 3.14159  # Pi (180 grados)
-                            # Para asegurar que el arco va del punto inicial al final,
-                            # podríamos necesitar calcular un vector perpendicular al plano de la curva
-                            # y usarlo para orientar el arco. Sin más información sobre la orientación,
-                            # esta es una aproximación simple en el plano XY.
-                            acad.model.AddArc(punto_central, radio_curva, start_angle, end_angle)
-                        else:
-                            print(f"Error al calcular el vector normal para la tubería {fila['ID_TUBERIA']}")
-                            continue
-                    else:
-                        print(f"Tipo de curva no válido o radio no especificado para la tubería {fila['ID_TUBERIA']}")
-                        continue
-                else:
-                    print(f"PK de inicio o fin no encontrados para la tubería {fila['ID_TUBERIA']}")
-                    continue
+        datos_coordenadas, errores = validar_tabla(datos_coordenadas, ESQUEMA_COORDENADAS)
+        if errores:
+            return jsonify({'error': mensajes_de_error(errores, 1)[0], 'detalles': mensajes_de_error(errores, 50)}), 400
 
-            except Exception as e:
-                print(f"Error al procesar la tubería {fila['ID_TUBERIA']}: {e}")
-                continue
+        datos_tuberias, errores = validar_tabla(datos_tuberias, ESQUEMA_TUBERIAS_CURVA)
+        if errores:
+            return jsonify({'error': mensajes_de_error(errores, 1)[0], 'detalles': mensajes_de_error(errores, 50)}), 400
 
-        return jsonify({'message': 'Proceso completado correctamente.'}), 200
+        resultado = obtener_sesion().ejecutar(dibujar_puntos_y_tuberias_acad, datos_coordenadas, datos_tuberias)
+        return jsonify(resultado), 200
 
+    except ErrorSesionCAD:
+        return jsonify({'error': 'No se pudo conectar con AutoCAD.'}), 500
     except Exception as e:
-        return jsonify({'error': f'Error inesperado: {e}'}), 500
-    finally:
-        desconectar_autocad_civil(acad, civil3d)
-        try:
-            pythoncom.CoUninitialize()
-            print("Recursos COM liberados.")
-        except Exception as e:
-            print(f"Error al liberar recursos COM: {e}")
\ No newline at end of file
+        return jsonify({'error': f'Error inesperado: {e}'}), 500
\ No newline at end of file
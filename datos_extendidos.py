@@ -0,0 +1,333 @@
+"""
+Lectura de las XData de los objetos del dibujo.
+
+decodificar recorre una vez los pares (código, valor) de backend.xdata y
+devuelve un mapa por aplicación {aplicación: {atributo: valor}}. Las
+cadenas 'NOMBRE:valor' dan el atributo por su nombre; los valores sin
+nombre (los reales de diámetro, presión, longitud y pendiente que escriben
+crear_puntos_iron.py y exportar_dxf.py en TUBERIA_DATA) toman el nombre del
+hueco que les corresponde en el esquema de la aplicación (ESQUEMAS_XDATA).
+Los atributos REAL del esquema se convierten a float.
+
+CacheXData guarda el mapa de cada objeto por handle. Las entradas se usan
+mientras backend.revision no cambie; sincronizar(backend) las da por
+buenas en la revisión nueva con el historial del inventario
+(obtener_objetos.py): solo se olvidan las de los handles añadidos,
+modificados o borrados. Las consultas de tuberías leen así de la caché y
+solo van a COM por los objetos que cambiaron.
+
+Rutas:
+    POST /xdata/decodificar   {"handles": [...]} o {"seleccion": "nombre"}, "aplicacion"?
+    GET  /xdata/tuberias      ?material=&red=&diametro_min=&diametro_max=&limite=
+    GET  /xdata/cache
+
+Uso desde la línea de comandos:
+    python datos_extendidos.py [tuberias] [consultas]   # mide las consultas de tuberías con el backend en memoria
+"""
+import logging
+import threading
+
+from flask import Blueprint, jsonify, request
+
+from sesion_cad import obtener_sesion, ErrorSesionCAD
+from validacion import REAL, TEXTO
+
+logger = logging.getLogger(__name__)
+
+datos_extendidos_bp = Blueprint('datos_extendidos', __name__)
+
+APLICACION_TUBERIAS = 'TUBERIA_DATA'
+
+# Atributos de cada aplicación en el orden en que se escriben.
+ESQUEMAS_XDATA = {
+    APLICACION_TUBERIAS: (
+        ('ID_TUBERIA', TEXTO),
+        ('DIAMETRO', REAL),
+        ('MATERIAL', TEXTO),
+        ('PRESION_NOMINAL', REAL),
+        ('CONEXION_INICIO', TEXTO),
+        ('CONEXION_FIN', TEXTO),
+        ('LONGITUD', REAL),
+        ('PENDIENTE', REAL),
+        ('RED', TEXTO),
+    ),
+}
+
+# Entidades que pueden llevar los datos de una tubería (polilíneas de crear_puntos_iron.py y exportar_dxf.py).
+TIPOS_TUBERIA_XDATA = frozenset({'AcDb3dPolyline', 'AcDbPolyline', 'AcDb2dPolyline', 'AcDbLine'})
+LIMITE_TUBERIAS = 10000
+CODIGO_APLICACION = 1001
+CODIGO_LLAVE = 1002
+
+
+def _convertir(valor, tipo):
+    if tipo == REAL:
+        try:
+            return float(valor)
+        except (TypeError, ValueError):
+            return str(valor).strip()
+    return str(valor).strip() if isinstance(valor, str) else valor
+
+
+def decodificar(pares, esquemas=ESQUEMAS_XDATA):
+    """
+    Mapa {aplicación: {atributo: valor}} de una lista de pares (código,
+    valor). Los valores sin nombre que no caben en el esquema van a la
+    lista 'valores' de su aplicación.
+    """
+    resultado = {}
+    mapa, esquema, tipos, posicion = None, (), {}, 0
+    for codigo, valor in pares:
+        if codigo == CODIGO_APLICACION:
+            mapa = resultado.setdefault(str(valor).strip(), {})
+            esquema = esquemas.get(str(valor).strip(), ())
+            tipos = {nombre: (i, tipo) for i, (nombre, tipo) in enumerate(esquema)}
+            posicion = 0
+            continue
+        if mapa is None or codigo == CODIGO_LLAVE:
+            continue
+        if isinstance(valor, str) and ':' in valor:
+            nombre, texto = valor.split(':', 1)
+            if nombre in tipos:
+                indice, tipo = tipos[nombre]
+                mapa[nombre] = _convertir(texto, tipo)
+                posicion = indice + 1
+                continue
+            if not esquema:
+                mapa[nombre] = texto.strip()
+                continue
+        while posicion < len(esquema) and esquema[posicion][0] in mapa:
+            posicion += 1
+        if posicion < len(esquema):
+            nombre, tipo = esquema[posicion]
+            mapa[nombre] = _convertir(valor, tipo)
+            posicion += 1
+        else:
+            mapa.setdefault('valores', []).append(valor)
+    return resultado
+
+
+class CacheXData:
+    """Mapas de XData decodificados por handle, válidos por revisión del backend."""
+
+    def __init__(self):
+        self._mapas = {}  # handle -> mapa
+        self._revision = None  # Revisión del backend en la que se comprobaron los mapas.
+        self._origen = None  # (backend, documento, revisión del inventario) de la última sincronización.
+        self._bloqueo = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.sincronizaciones = 0
+
+    def sincronizar(self, backend):
+        """
+        Pone el inventario al día y conserva los mapas de los objetos que
+        no cambiaron. Sin historial de cambios, se olvidan todos. Devuelve
+        el inventario. Se ejecuta en la sesión CAD.
+        """
+        from obtener_objetos import inventario
+
+        # La revisión se toma antes de leer los cambios: si el dibujo cambia después, no se confía en nada.
+        revision = backend.revision
+        inventario.actualizar(backend)
+        origen = (backend.nombre, inventario.documento, inventario.revision)
+        with self._bloqueo:
+            cambios = None
+            if self._origen is not None and self._origen[:2] == origen[:2]:
+                cambios = inventario.cambios_desde(self._origen[2])
+            if cambios is None:
+                self._mapas.clear()
+            else:
+                for handle in set().union(*cambios):
+                    self._mapas.pop(handle, None)
+            self._revision, self._origen = revision, origen
+            self.sincronizaciones += 1
+        return inventario
+
+    def _guardado(self, backend, handle):
+        # Con otra revisión los mapas no se borran: se dejan sin usar hasta que sincronizar los compruebe.
+        revision = backend.revision
+        with self._bloqueo:
+            mapa = self._mapas.get(handle) if self._revision == revision else None
+            if mapa is not None:
+                self.aciertos += 1
+            return mapa
+
+    def _leer(self, backend, objeto, handle):
+        mapa = decodificar(backend.xdata(objeto))
+        with self._bloqueo:
+            self.fallos += 1
+            self._mapas[handle] = mapa
+        return mapa
+
+    def obtener(self, backend, objeto, handle=None):
+        """Mapa de las XData del objeto, decodificado una vez por revisión."""
+        handle = handle or backend.handle(objeto)
+        mapa = self._guardado(backend, handle)
+        return mapa if mapa is not None else self._leer(backend, objeto, handle)
+
+    def por_handle(self, backend, handle):
+        """Mapa de las XData del objeto con ese handle, o None si no existe."""
+        mapa = self._guardado(backend, handle)
+        if mapa is None:
+            objeto = backend.obtener_objeto(handle)
+            if objeto is None:
+                return None
+            mapa = self._leer(backend, objeto, handle)
+        return mapa
+
+    def decodificar_lote(self, backend, identificadores):
+        """{handle: mapa} de los objetos por handle u ObjectID; los que no existen se omiten."""
+        resultado = {}
+        for identificador in identificadores:
+            if isinstance(identificador, str):
+                mapa = self.por_handle(backend, identificador)
+                if mapa is not None:
+                    resultado[identificador] = mapa
+                continue
+            objeto = backend.obtener_objeto(identificador)
+            if objeto is not None:
+                handle = backend.handle(objeto)
+                resultado[handle] = self.obtener(backend, objeto, handle)
+        return resultado
+
+    def invalidar(self):
+        with self._bloqueo:
+            self._mapas.clear()
+            self._revision = self._origen = None
+
+    def estadisticas(self):
+        with self._bloqueo:
+            total = self.aciertos + self.fallos
+            return {'entradas': len(self._mapas), 'aciertos': self.aciertos, 'fallos': self.fallos,
+                    'sincronizaciones': self.sincronizaciones,
+                    'tasa_aciertos': round(self.aciertos / total, 3) if total else None}
+
+
+cache_xdata = CacheXData()
+
+
+def atributos_xdata(backend, objeto):
+    """Mapa {aplicación: {atributo: valor}} del objeto desde la caché compartida."""
+    return cache_xdata.obtener(backend, objeto)
+
+
+def decodificar_acad(backend, handles=None, seleccion=None, aplicacion=None):
+    """{handle: mapa} de los handles o del conjunto de selección. Se ejecuta en la sesión CAD."""
+    if seleccion is not None:
+        objetos = backend.conjunto_seleccion(seleccion, crear=False)
+        if objetos is None:
+            return {'error': f"No existe el conjunto de selección '{seleccion}'."}, 404
+        handles = [backend.handle(objeto) for objeto in objetos]
+    mapas = cache_xdata.decodificar_lote(backend, handles)
+    if aplicacion is not None:
+        mapas = {handle: {aplicacion: mapa[aplicacion]} for handle, mapa in mapas.items() if aplicacion in mapa}
+    return {'objetos': mapas, 'total': len(mapas), 'cache': cache_xdata.estadisticas()}, 200
+
+
+def tuberias_acad(backend, material=None, red=None, diametro_min=None, diametro_max=None, limite=LIMITE_TUBERIAS):
+    """Tuberías con XData TUBERIA_DATA que cumplen los filtros, desde la caché. Se ejecuta en la sesión CAD."""
+    inventario = cache_xdata.sincronizar(backend)
+    tuberias, total = [], 0
+    for fila in inventario.filas(tipos=TIPOS_TUBERIA_XDATA):
+        handle = fila['Handle']
+        mapa = cache_xdata.por_handle(backend, handle)
+        datos = mapa.get(APLICACION_TUBERIAS) if mapa is not None else None
+        if not datos:
+            continue
+        diametro = datos.get('DIAMETRO')
+        if ((material is not None and datos.get('MATERIAL') != material)
+                or (red is not None and datos.get('RED') != red)
+                or (diametro_min is not None and not (isinstance(diametro, float) and diametro >= diametro_min))
+                or (diametro_max is not None and not (isinstance(diametro, float) and diametro <= diametro_max))):
+            continue
+        total += 1
+        if len(tuberias) < limite:
+            tuberias.append({'Handle': handle, 'Layer': fila['Layer'], **datos})
+    return {'tuberias': tuberias, 'total': total, 'truncado': total > limite, 'cache': cache_xdata.estadisticas()}, 200
+
+
+@datos_extendidos_bp.route('/xdata/decodificar', methods=['POST'])
+def decodificar_objetos():
+    """Atributos de las XData de {"handles": [...]} o {"seleccion": "nombre"}, opcionalmente de una "aplicacion"."""
+    try:
+        data = request.get_json(silent=True) or {}
+        handles, seleccion, aplicacion = data.get('handles'), data.get('seleccion'), data.get('aplicacion')
+        if (handles is None) == (seleccion is None):
+            return jsonify({'error': "Se requiere 'handles' o 'seleccion'."}), 400
+        if handles is not None and (not isinstance(handles, list) or not all(isinstance(h, str) for h in handles)):
+            return jsonify({'error': 'Parámetros no válidos: handles debe ser una lista de textos.'}), 400
+        if any(v is not None and not isinstance(v, str) for v in (seleccion, aplicacion)):
+            return jsonify({'error': 'Parámetros no válidos: seleccion y aplicacion deben ser textos.'}), 400
+
+        resultado, codigo = obtener_sesion().ejecutar(decodificar_acad, handles, seleccion, aplicacion)
+        return jsonify(resultado), codigo
+
+    except ErrorSesionCAD as e:
+        logger.error(f"Error de conexión al leer las XData: {e}")
+        return jsonify({'error': 'No se pudo conectar con AutoCAD.'}), 500
+    except Exception as e:
+        logger.error(f"Error al leer las XData: {e}")
+        return jsonify({'error': f'Error al leer las XData: {e}'}), 500
+
+
+@datos_extendidos_bp.route('/xdata/tuberias', methods=['GET'])
+def consultar_tuberias():
+    """Tuberías por material, red y rango de diámetro según sus XData TUBERIA_DATA."""
+    try:
+        try:
+            filtros = {'material': request.args.get('material'), 'red': request.args.get('red')}
+            for clave in ('diametro_min', 'diametro_max'):
+                valor = request.args.get(clave)
+                filtros[clave] = float(valor) if valor not in (None, '') else None
+            limite = int(request.args.get('limite', LIMITE_TUBERIAS))
+            if not 0 < limite <= LIMITE_TUBERIAS:
+                raise ValueError(f"limite debe estar entre 1 y {LIMITE_TUBERIAS}.")
+        except ValueError as e:
+            return jsonify({'error': f'Parámetros no válidos: {e}'}), 400
+
+        resultado, codigo = obtener_sesion().ejecutar(tuberias_acad, limite=limite, **filtros)
+        return jsonify(resultado), codigo
+
+    except ErrorSesionCAD as e:
+        logger.error(f"Error de conexión al consultar las tuberías: {e}")
+        return jsonify({'error': 'No se pudo conectar con AutoCAD.'}), 500
+    except Exception as e:
+        logger.error(f"Error al consultar las tuberías: {e}")
+        return jsonify({'error': f'Error al consultar las tuberías: {e}'}), 500
+
+
+@datos_extendidos_bp.route('/xdata/cache', methods=['GET'])
+def estado_cache():
+    return jsonify(cache_xdata.estadisticas()), 200
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    from cad_memoria import BackendMemoria
+    from exportar_dxf import xdata_tuberia
+
+    logging.getLogger().setLevel(logging.WARNING)
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    consultas = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    backend = BackendMemoria(latencia=0.0002)
+    materiales = ('PVC', 'FUNDICION', 'PEAD')
+    for i in range(n):
+        objeto = backend.agregar_polilinea_3d([i, 0, 0, i + 1, 0, 0])
+        pares = [(codigo, float(valor) if codigo == 1040 else valor)
+                 for codigo, valor in xdata_tuberia(f"T{i}", 100 + 50 * (i % 5), materiales[i % 3], 10, 'A', 'B',
+                                                    1.0, 0.01, 'RED1')]
+        backend.agregar_xdata(objeto, APLICACION_TUBERIAS, pares)
+
+    for i in range(consultas):
+        if i == consultas // 2:
+            backend.agregar_xdata(0, APLICACION_TUBERIAS, [(1000, 'MATERIAL:ACERO')])
+        backend.llamadas = 0
+        inicio = time.perf_counter()
+        resultado, _ = tuberias_acad(backend, material='PVC', diametro_min=150)
+        print(f"Consulta {i + 1}: {resultado['total']} tuberías en {(time.perf_counter() - inicio) * 1000:.1f} ms, "
+              f"{backend.llamadas} llamadas al backend")
+    print(cache_xdata.estadisticas())
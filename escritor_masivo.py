@@ -0,0 +1,150 @@
+"""
+Escritura masiva de entidades en el espacio modelo.
+
+EscritorMasivo recibe columnas completas de coordenadas y etiquetas (o
+listas de polilíneas 3D) y las envía al backend en lotes de tamano_lote
+entidades; los lotes de polilíneas se cortan también a VERTICES_POR_LOTE
+vértices para acotar el tamaño de cada envío. Cada backend decide cómo
+escribir un lote: BackendCOM genera un entmake por entidad y los envía con
+SendCommand en comandos de hasta 8.000 caracteres, esperando a que AutoCAD
+confirme cuántas entidades creó cada uno; BackendMemoria lo cuenta como una
+sola llamada. Así una importación de 50.000 puntos hace unos cientos de
+idas y vueltas con AutoCAD en lugar de 50.000.
+
+Uso:
+    escritor = EscritorMasivo(backend, tamano_lote=500)
+    escritor.agregar_puntos(xs, ys, zs)
+    escritor.agregar_textos(textos, xs, ys, zs, altura=2.5)
+    escritor.agregar_polilineas_3d([[x0, y0, z0, x1, y1, z1, ...], ...])
+    escritor.vaciar()
+
+Ejecutar este módulo mide el rendimiento (entidades/s) por tamaño de lote con
+el backend en memoria y una latencia simulada por llamada: compara idas y
+vueltas, no la velocidad de escritura de AutoCAD.
+"""
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+TAMANO_LOTE_POR_DEFECTO = 500
+VERTICES_POR_LOTE = 5000
+
+
+class EscritorMasivo:
+    """Acumula entidades y las escribe en el backend por lotes."""
+
+    def __init__(self, backend, tamano_lote=TAMANO_LOTE_POR_DEFECTO):
+        if tamano_lote < 1:
+            raise ValueError("El tamaño de lote debe ser al menos 1.")
+        self.backend = backend
+        self.tamano_lote = tamano_lote
+        self._puntos = []
+        self._textos = []
+        self._coordenadas_textos = []
+        self._alturas = []
+        self._polilineas = []
+        self._vertices_polilineas = 0
+        self._estadisticas = {'entidades': 0, 'lotes': 0, 'tiempo_s': 0.0}
+
+    def agregar_puntos(self, xs, ys, zs):
+        """Encola una columna de puntos. Escribe los lotes que se vayan completando."""
+        if not len(xs) == len(ys) == len(zs):
+            raise ValueError("Las columnas X, Y y Z deben tener la misma longitud.")
+        for x, y, z in zip(xs, ys, zs):
+            self._puntos.extend((x, y, z))
+            if len(self._puntos) >= 3 * self.tamano_lote:
+                self._escribir_puntos()
+
+    def agregar_textos(self, textos, xs, ys, zs, altura):
+        """Encola una columna de textos. altura puede ser un número o una columna."""
+        alturas = altura if isinstance(altura, (list, tuple)) else [altura] * len(textos)
+        if not len(textos) == len(xs) == len(ys) == len(zs) == len(alturas):
+            raise ValueError("Las columnas de textos, coordenadas y alturas deben tener la misma longitud.")
+        for texto, x, y, z, h in zip(textos, xs, ys, zs, alturas):
+            self._textos.append(str(texto))
+            self._coordenadas_textos.extend((x, y, z))
+            self._alturas.append(h)
+            if len(self._textos) >= self.tamano_lote:
+                self._escribir_textos()
+
+    def agregar_polilineas_3d(self, polilineas):
+        """Encola polilíneas 3D, cada una como secuencia plana x0, y0, z0, x1..."""
+        for coordenadas in polilineas:
+            if len(coordenadas) % 3:
+                raise ValueError("Las coordenadas de la polilínea 3D deben ser múltiplo de 3.")
+            self._polilineas.append(coordenadas)
+            self._vertices_polilineas += len(coordenadas) // 3
+            if len(self._polilineas) >= self.tamano_lote or self._vertices_polilineas >= VERTICES_POR_LOTE:
+                self._escribir_polilineas()
+
+    def vaciar(self):
+        """Escribe lo que quede pendiente."""
+        if self._puntos:
+            self._escribir_puntos()
+        if self._textos:
+            self._escribir_textos()
+        if self._polilineas:
+            self._escribir_polilineas()
+
+    def estadisticas(self):
+        datos = dict(self._estadisticas)
+        datos['tamano_lote'] = self.tamano_lote
+        datos['entidades_por_s'] = round(datos['entidades'] / datos['tiempo_s'], 1) if datos['tiempo_s'] else 0.0
+        return datos
+
+    # --- Implementación ----------------------------------------------------
+
+    def _registrar(self, entidades, inicio):
+        self._estadisticas['entidades'] += entidades
+        self._estadisticas['lotes'] += 1
+        self._estadisticas['tiempo_s'] += time.perf_counter() - inicio
+
+    def _escribir_puntos(self):
+        coordenadas, self._puntos = self._puntos, []
+        inicio = time.perf_counter()
+        self.backend.agregar_puntos_lote(coordenadas)
+        self._registrar(len(coordenadas) // 3, inicio)
+        logger.debug(f"Lote de {len(coordenadas) // 3} puntos escrito.")
+
+    def _escribir_textos(self):
+        textos, coordenadas, alturas = self._textos, self._coordenadas_textos, self._alturas
+        self._textos, self._coordenadas_textos, self._alturas = [], [], []
+        inicio = time.perf_counter()
+        self.backend.agregar_textos_lote(textos, coordenadas, alturas)
+        self._registrar(len(textos), inicio)
+        logger.debug(f"Lote de {len(textos)} textos escrito.")
+
+    def _escribir_polilineas(self):
+        polilineas, self._polilineas, self._vertices_polilineas = self._polilineas, [], 0
+        inicio = time.perf_counter()
+        self.backend.agregar_polilineas_3d_lote(polilineas)
+        self._registrar(len(polilineas), inicio)
+        logger.debug(f"Lote de {len(polilineas)} polilíneas 3D escrito.")
+
+
+def medir_rendimiento(crear_backend, entidades=20000, tamanos=(1, 10, 100, 500, 2000)):
+    """Devuelve una lista de estadísticas (entidades/s) por tamaño de lote."""
+    resultados = []
+    xs = [float(i) for i in range(entidades)]
+    ys = [float(2 * i) for i in range(entidades)]
+    zs = [100.0] * entidades
+    for tamano in tamanos:
+        escritor = EscritorMasivo(crear_backend(), tamano_lote=tamano)
+        escritor.agregar_puntos(xs, ys, zs)
+        escritor.vaciar()
+        resultados.append(escritor.estadisticas())
+    return resultados
+
+
+if __name__ == "__main__":
+    import sys
+    from cad_memoria import BackendMemoria
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    entidades = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    latencia = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0002  # ~0,2 ms por ida y vuelta COM
+
+    for datos in medir_rendimiento(lambda: BackendMemoria(latencia), entidades):
+        print(f"lote={datos['tamano_lote']:>5}  lotes={datos['lotes']:>6}  "
+              f"{datos['entidades_por_s']:>12,.0f} entidades/s")
@@ -0,0 +1,346 @@
+"""
+Estacionamiento (PK) de alineamientos y polilíneas.
+
+Estacionamiento calcula una vez las estaciones acumuladas de los vértices
+y responde por lotes:
+
+- puntos_en(estaciones): estación -> (x, y, z), con searchsorted e
+  interpolación lineal dentro del tramo.
+- proyectar(puntos): punto -> (estación, desplazamiento), proyectando cada
+  punto sobre el tramo más cercano en planta. El desplazamiento es positivo
+  a la derecha del sentido de avance, como en Civil 3D.
+
+estacionamiento_de(backend, objeto) guarda los estacionamientos por handle
+en una caché LRU; una entrada solo se reutiliza si las coordenadas del
+objeto no han cambiado. Lo usan el etiquetado de vértices, el muestreo de
+perfiles de terreno y el PK de las tuberías (POST /estaciones).
+"""
+import collections
+import logging
+import threading
+
+import numpy as np
+from flask import Blueprint, jsonify, request
+
+import geometria
+from cache_objetos import Instantanea, instantanea
+from carga_csv import leer_tabla_csv
+from sesion_cad import obtener_sesion, ErrorSesionCAD
+from validacion import ESQUEMA_COORDENADAS, ESQUEMA_TUBERIAS
+
+logger = logging.getLogger(__name__)
+
+estacionamiento_bp = Blueprint('estacionamiento', __name__)
+
+COORDINATES_CSV = 'coordenadas.csv'
+PIPES_CSV = 'info_tuberias.csv'
+CAPACIDAD_CACHE = 128
+ELEMENTOS_POR_TRAMO_PROYECCION = 2_000_000
+TAMANO_BLOQUE_MINIMO = 64
+
+
+class Estacionamiento:
+    """
+    Estaciones acumuladas de una polilínea.
+
+    vertices es un array (N, 3) o una secuencia plana x0, y0, z0...; con
+    en_planta las distancias son horizontales (alineamientos), si no se
+    miden en 3D. estaciones[i] es la estación del vértice i.
+    """
+
+    def __init__(self, vertices, estacion_inicial=0.0, en_planta=True):
+        self.vertices = geometria.vertices(vertices)
+        if len(self.vertices) < 2:
+            raise ValueError("Se necesitan al menos dos vértices para estacionar.")
+        self.en_planta = en_planta
+        self.longitudes = geometria.longitudes(self.vertices, en_planta)
+        self.estaciones = estacion_inicial + np.concatenate(([0.0], np.cumsum(self.longitudes)))
+
+    @property
+    def estacion_inicial(self):
+        return float(self.estaciones[0])
+
+    @property
+    def estacion_final(self):
+        return float(self.estaciones[-1])
+
+    @property
+    def longitud(self):
+        return self.estacion_final - self.estacion_inicial
+
+    def estaciones_cada(self, intervalo, incluir_vertices=True):
+        """Estaciones cada intervalo desde la inicial, más las de los vértices (ordenadas, sin repetir)."""
+        return geometria.estaciones_cada(self.estaciones, intervalo, incluir_vertices)
+
+    def puntos_en(self, estaciones):
+        """Array (M, 3) con el punto de cada estación; NaN fuera del estacionamiento."""
+        return geometria.puntos_en(self.vertices, self.estaciones, estaciones)
+
+    def _preparar_bloques(self):
+        """
+        Cajas en planta de bloques de tramos consecutivos, para descartar los
+        lejanos. Con unos raíz(N) tramos por bloque hay tantos bloques como
+        tramos en cada uno, y ambas pasadas de proyectar cuestan lo mismo.
+        """
+        tramos = len(self.longitudes)
+        self._tamano_bloque = max(TAMANO_BLOQUE_MINIMO, int(np.ceil(np.sqrt(tramos))))
+        primeros = np.arange(0, tramos, self._tamano_bloque)
+        extremos = np.minimum(self.vertices[:-1, :2], self.vertices[1:, :2]), \
+            np.maximum(self.vertices[:-1, :2], self.vertices[1:, :2])
+        self._caja_min = np.minimum.reduceat(extremos[0], primeros)
+        self._caja_max = np.maximum.reduceat(extremos[1], primeros)
+        self._primer_vertice = self.vertices[primeros, :2]
+
+    def proyectar(self, puntos):
+        """
+        (estaciones, desplazamientos) de cada punto (array (M, 2) o (M, 3))
+        proyectado en planta sobre el tramo más cercano.
+
+        Solo se miden los tramos de los bloques cuya caja está más cerca que
+        el primer vértice del bloque más próximo; el resultado es exacto.
+        Los pares (punto, tramo) se miden en trozos de como mucho
+        ELEMENTOS_POR_TRAMO_PROYECCION, así un punto lejos de un
+        alineamiento denso no reserva memoria sin límite.
+        """
+        if not len(puntos):
+            return np.empty(0), np.empty(0)
+        puntos = np.asarray(puntos, dtype=np.float64).reshape(len(puntos), -1)[:, :2]
+        if not hasattr(self, '_caja_min'):
+            self._preparar_bloques()
+        tramos = len(self.longitudes)
+        direcciones = np.diff(self.vertices[:, :2], axis=0)
+        longitud2 = (direcciones ** 2).sum(axis=1)
+        longitud2 = np.where(longitud2 > 0, longitud2, 1.0)
+        estaciones = np.empty(len(puntos))
+        desplazamientos = np.empty(len(puntos))
+        paso = max(1, ELEMENTOS_POR_TRAMO_PROYECCION // len(self._caja_min))
+        for desde in range(0, len(puntos), paso):
+            bloque = puntos[desde:desde + paso]
+            # Cota inferior (distancia a la caja) y superior (distancia a un vértice) por bloque de tramos.
+            fuera = np.maximum(np.maximum(self._caja_min[None] - bloque[:, None], bloque[:, None] - self._caja_max[None]), 0)
+            inferior = (fuera ** 2).sum(axis=2)
+            superior = ((self._primer_vertice[None] - bloque[:, None]) ** 2).sum(axis=2).min(axis=1)
+            consulta, candidato = np.nonzero(inferior <= superior[:, None])
+
+            # Pares (consulta, tramo) de los bloques candidatos: el mejor tramo de cada bloque.
+            tamano = self._tamano_bloque
+            pares_por_trozo = max(1, ELEMENTOS_POR_TRAMO_PROYECCION // tamano)
+            distancia2_bloque = np.empty(len(consulta))
+            tramo_bloque = np.empty(len(consulta), dtype=np.int64)
+            t_bloque = np.empty(len(consulta))
+            for inicio in range(0, len(consulta), pares_por_trozo):
+                trozo = slice(inicio, inicio + pares_por_trozo)
+                tramo = np.minimum(candidato[trozo, None] * tamano + np.arange(tamano), tramos - 1)
+                d = bloque[consulta[trozo]][:, None, :] - self.vertices[tramo, :2]
+                t = np.clip((d * direcciones[tramo]).sum(axis=2) / longitud2[tramo], 0.0, 1.0)
+                distancia2 = ((d - t[..., None] * direcciones[tramo]) ** 2).sum(axis=2)
+                mejor_en_bloque = np.argmin(distancia2, axis=1)
+                filas = np.arange(len(tramo))
+                distancia2_bloque[trozo] = distancia2[filas, mejor_en_bloque]
+                tramo_bloque[trozo] = tramo[filas, mejor_en_bloque]
+                t_bloque[trozo] = t[filas, mejor_en_bloque]
+
+            # Mínimo por consulta: los pares vienen ordenados por consulta.
+            primeros = np.flatnonzero(np.diff(consulta, prepend=-1))
+            minimos = np.minimum.reduceat(distancia2_bloque, primeros)
+            elegido = np.flatnonzero(distancia2_bloque == minimos[consulta])
+            elegido = elegido[np.flatnonzero(np.diff(consulta[elegido], prepend=-1))]
+            tramo_elegido = tramo_bloque[elegido]
+            t_elegido = t_bloque[elegido]
+
+            estaciones[desde:desde + paso] = self.estaciones[tramo_elegido] + t_elegido * self.longitudes[tramo_elegido]
+            relativo = bloque - self.vertices[tramo_elegido, :2]
+            # Producto vectorial > 0: el punto queda a la izquierda del tramo.
+            lado = direcciones[tramo_elegido, 0] * relativo[:, 1] - direcciones[tramo_elegido, 1] * relativo[:, 0]
+            desplazamientos[desde:desde + paso] = np.where(lado > 0, -1.0, 1.0) * np.sqrt(minimos)
+        return estaciones, desplazamientos
+
+
+class CacheEstacionamientos:
+    """Estacionamientos por (backend, handle) con desalojo LRU y contadores de aciertos."""
+
+    def __init__(self, capacidad=CAPACIDAD_CACHE):
+        self.capacidad = capacidad
+        self._entradas = collections.OrderedDict()
+        self._bloqueo = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, clave, coordenadas, estacion_inicial=0.0, en_planta=True):
+        coordenadas = geometria.vertices(coordenadas)
+        huella = (len(coordenadas), hash(coordenadas.tobytes()))
+        clave = (clave, estacion_inicial, en_planta)
+        with self._bloqueo:
+            entrada = self._entradas.get(clave)
+            if entrada is not None and entrada[0] == huella:
+                self._entradas.move_to_end(clave)
+                self.aciertos += 1
+                return entrada[1]
+            self.fallos += 1
+        estacionamiento = Estacionamiento(coordenadas, estacion_inicial, en_planta)
+        with self._bloqueo:
+            self._entradas[clave] = (huella, estacionamiento)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.capacidad:
+                self._entradas.popitem(last=False)
+        return estacionamiento
+
+    def invalidar(self, clave=None):
+        """Olvida un objeto (clave = (backend, handle)) o, sin clave, todos."""
+        with self._bloqueo:
+            if clave is None:
+                self._entradas.clear()
+            else:
+                for guardada in [c for c in self._entradas if c[0] == clave]:
+                    del self._entradas[guardada]
+
+    def estadisticas(self):
+        with self._bloqueo:
+            total = self.aciertos + self.fallos
+            return {'entradas': len(self._entradas), 'aciertos': self.aciertos, 'fallos': self.fallos,
+                    'tasa_aciertos': round(self.aciertos / total, 3) if total else None}
+
+
+cache_estacionamientos = CacheEstacionamientos()
+
+
+def estacionamiento_de(backend, objeto, estacion_inicial=0.0, en_planta=True, coordenadas=None):
+    """
+    Estacionamiento de un objeto del dibujo, reutilizado mientras sus
+    coordenadas no cambien. objeto puede ser una Instantanea de
+    cache_objetos.py, que ya trae el handle y los vértices. coordenadas
+    (vértices o secuencia plana) evita leerlas otra vez si ya se tienen.
+    """
+    if isinstance(objeto, Instantanea):
+        handle = objeto.handle
+        if coordenadas is None:
+            coordenadas = objeto.vertices
+    else:
+        handle = backend.handle(objeto)
+        if coordenadas is None:
+            coordenadas = backend.vertices(objeto)
+    if not len(coordenadas):
+        raise ValueError("El objeto no tiene coordenadas válidas.")
+    return cache_estacionamientos.obtener((backend.nombre, handle), coordenadas, estacion_inicial, en_planta)
+
+
+def extremos_tuberias(ruta_coordenadas=COORDINATES_CSV, ruta_tuberias=PIPES_CSV):
+    """
+    Lee los CSV y enlaza cada tubería con sus puntos. Devuelve (tabla de
+    tuberías, xyz de inicio, xyz de fin, máscara de las tuberías cuyos dos
+    puntos existen); los xyz son solo de las válidas.
+    """
+    puntos, _ = leer_tabla_csv(ruta_coordenadas, ESQUEMA_COORDENADAS)
+    tuberias, _ = leer_tabla_csv(ruta_tuberias, ESQUEMA_TUBERIAS)
+    orden = np.argsort(puntos['ID'], kind='stable')
+    ids = puntos['ID'][orden]
+    xyz = puntos.coordenadas()[orden]
+
+    def posiciones(columna):
+        posicion = np.minimum(np.searchsorted(ids, tuberias[columna]), max(len(ids) - 1, 0))
+        return posicion, (ids[posicion] == tuberias[columna]) if len(ids) else np.zeros(len(tuberias), dtype=bool)
+
+    inicio, inicio_valido = posiciones('PK_INICIO')
+    fin, fin_valido = posiciones('PK_FIN')
+    validas = inicio_valido & fin_valido
+    return tuberias, xyz[inicio[validas]], xyz[fin[validas]], validas
+
+
+def estaciones_tuberias(estacionamiento, ruta_coordenadas=COORDINATES_CSV, ruta_tuberias=PIPES_CSV):
+    """PK de inicio y fin de cada tubería de los CSV sobre el estacionamiento, con sus desplazamientos."""
+    tuberias, inicios, fines, validas = extremos_tuberias(ruta_coordenadas, ruta_tuberias)
+    estaciones, desplazamientos = estacionamiento.proyectar(np.concatenate((inicios, fines)))
+    n = int(validas.sum())
+    resultado = []
+    for i, id_tuberia in enumerate(tuberias['ID_TUBERIA'][validas]):
+        resultado.append({
+            'ID_TUBERIA': id_tuberia,
+            'estacion_inicio': round(float(estaciones[i]), 3),
+            'estacion_fin': round(float(estaciones[n + i]), 3),
+            'desplazamiento_inicio': round(float(desplazamientos[i]), 3),
+            'desplazamiento_fin': round(float(desplazamientos[n + i]), 3),
+        })
+    return resultado, int((~validas).sum())
+
+
+def estacionar_acad(backend, alineamiento_id, estacion_inicial, estaciones=None, puntos=None, tuberias=False):
+    """Consultas de estacionamiento sobre un alineamiento o polilínea del dibujo. Se ejecuta en la sesión CAD."""
+    objeto = instantanea(backend, alineamiento_id)
+    if objeto is None:
+        return {'error': 'Alineamiento no encontrado'}, 404
+    estacionamiento = estacionamiento_de(backend, objeto, estacion_inicial)
+
+    resultado = {'longitud': estacionamiento.longitud, 'estacion_inicial': estacionamiento.estacion_inicial}
+    if estaciones is not None:
+        resultado['puntos'] = [None if np.isnan(p[0]) else p for p in estacionamiento.puntos_en(estaciones).tolist()]
+    if puntos is not None:
+        proyectadas, desplazamientos = estacionamiento.proyectar(puntos)
+        resultado['estaciones'] = proyectadas.tolist()
+        resultado['desplazamientos'] = desplazamientos.tolist()
+    if tuberias:
+        resultado['tuberias'], resultado['tuberias_omitidas'] = estaciones_tuberias(estacionamiento)
+    return resultado, 200
+
+
+@estacionamiento_bp.route('/estaciones', methods=['POST'])
+def estaciones():
+    """
+    Estacionamiento de un alineamiento: {"alineamiento_id", "estacion_inicial"?,
+    "estaciones"?: [...] -> puntos, "puntos"?: [[x, y], ...] -> estaciones y
+    desplazamientos, "tuberias"?: true -> PK de las tuberías de info_tuberias.csv}.
+    """
+    try:
+        data = request.get_json()
+        alineamiento_id = data.get('alineamiento_id')
+        if not alineamiento_id:
+            return jsonify({'error': 'Se requiere alineamiento_id'}), 400
+        try:
+            estacion_inicial = float(data.get('estacion_inicial', 0.0))
+            consultas = data.get('estaciones')
+            consultas = np.asarray(consultas, dtype=np.float64).ravel() if consultas is not None else None
+            puntos = data.get('puntos')
+            if puntos is not None:
+                puntos = np.asarray(puntos, dtype=np.float64)
+                if puntos.ndim != 2 or puntos.shape[1] not in (2, 3):
+                    raise ValueError("puntos debe ser una lista de [x, y] o [x, y, z]")
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': f'Parámetros no válidos: {e}'}), 400
+
+        resultado, codigo = obtener_sesion().ejecutar(estacionar_acad, alineamiento_id, estacion_inicial,
+                                                      consultas, puntos, bool(data.get('tuberias')))
+        return jsonify(resultado), codigo
+
+    except ErrorSesionCAD as e:
+        logger.error(f"Error de conexión al estacionar: {e}")
+        return jsonify({'error': 'No se pudo conectar con AutoCAD.'}), 500
+    except Exception as e:
+        logger.error(f"Error al estacionar: {e}")
+        return jsonify({'error': f'Error al estacionar: {e}'}), 500
+
+
+@estacionamiento_bp.route('/estaciones/cache', methods=['GET'])
+def estado_cache():
+    return jsonify(cache_estacionamientos.estadisticas()), 200
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    consultas = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    angulos = np.linspace(0, 6 * np.pi, n)
+    vertices = np.column_stack((angulos * 50, 200 * np.sin(angulos), np.zeros(n)))
+
+    inicio = time.perf_counter()
+    estacionamiento = Estacionamiento(vertices)
+    print(f"{n} vértices estacionados en {(time.perf_counter() - inicio) * 1000:.1f} ms "
+          f"(longitud {estacionamiento.longitud:.1f})")
+    estaciones_consulta = np.random.default_rng(0).uniform(0, estacionamiento.longitud, consultas)
+    inicio = time.perf_counter()
+    puntos = estacionamiento.puntos_en(estaciones_consulta)
+    print(f"{consultas} estaciones -> puntos en {(time.perf_counter() - inicio) * 1000:.1f} ms")
+    inicio = time.perf_counter()
+    recuperadas, _ = estacionamiento.proyectar(puntos[:1000])
+    print(f"1000 puntos -> estaciones en {(time.perf_counter() - inicio) * 1000:.1f} ms "
+          f"(error máximo {np.abs(recuperadas - estaciones_consulta[:1000]).max():.2e})")
@@ -1,22 +1,30 @@
 import logging
+import numpy as np
+import geometria
 from flask import Blueprint, jsonify, request
-from pyautocad import Autocad, APoint
-import pythoncom
-from autocad_civil import conectar_con_autocad_civil, desconectar_autocad_civil
+from sesion_cad import obtener_sesion, ErrorSesionCAD
+from colocacion_etiquetas import ALTURA_TEXTO, anchos_texto, colocar_etiquetas
+from cache_objetos import instantanea
+from escritor_masivo import EscritorMasivo
+from estacionamiento import Estacionamiento, estacionamiento_de
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 etiquetado_bp = Blueprint('etiquetado', __name__)
 
-def obtener_objeto_acad(acad, identificador, tipo_objeto):
-    """Función utilitaria para obtener objetos en AutoCAD."""
+def obtener_objeto_acad(backend, identificador, tipo_objeto):
+    """
+    Función utilitaria para obtener objetos en AutoCAD. Devuelve la
+    Instantanea del objeto (cache_objetos.py): las peticiones repetidas
+    sobre el mismo objeto no lo vuelven a leer mientras el dibujo no cambie.
+    """
     try:
-        if not acad:
+        if not backend:
             return None, "No hay conexión con AutoCAD."
 
-        objeto = acad.doc.GetObject(identificador)
-        if not objeto:
+        objeto = instantanea(backend, identificador)
+        if objeto is None:
             return None, f"{tipo_objeto} no encontrado"
 
         logger.info(f"{tipo_objeto} con identificador {identificador} encontrado.")
@@ -25,113 +33,146 @@ def obtener_objeto_acad(acad, identificador, tipo_objeto):
         logger.error(f"Error al obtener {tipo_objeto} con identificador {identificador}: {e}")
         return None, str(e)
 
-def etiquetar_vertices(puntos, tipo="vertical", offset=5):
-    """Función común para etiquetar puntos, ya sea verticales u horizontales."""
-    etiquetas = []
-    distancia_acumulada = 0
-    for i, punto in enumerate(puntos):
-        if i > 0:
-            distancia_acumulada += puntos[i].distance_to(puntos[i - 1])
-
-        if tipo == "vertical":
-            etiqueta = f"Elevación: {punto.z:.2f}, Distancia: {distancia_acumulada:.2f}"
-            posicion = APoint(punto.x, punto.y, punto.z + offset)
-        else:
-            etiqueta = f"X: {punto.x:.2f}, Y: {punto.y:.2f}, Distancia: {distancia_acumulada:.2f}"
-            posicion = APoint(punto.x, punto.y + offset, punto.z)
-
-        etiquetas.append((etiqueta, posicion, 2.5))
-
-    return etiquetas
+def etiquetar_vertices(puntos, tipo="vertical", offset=5, estaciones=None, altura=ALTURA_TEXTO):
+    """
+    Función común para etiquetar puntos, ya sea verticales u horizontales.
+    estaciones es la distancia acumulada de cada punto; si no se da, se
+    calcula en 3D. Devuelve una lista de (etiqueta, posición, altura).
+    """
+    puntos = geometria.vertices(puntos)
+    if estaciones is None:
+        estaciones = Estacionamiento(puntos, en_planta=False).estaciones if len(puntos) > 1 else np.zeros(len(puntos))
+    posiciones = puntos.copy()
+    x, y, z = puntos.T.tolist()
+    distancias = np.asarray(estaciones, dtype=np.float64).tolist()
+    if tipo == "vertical":
+        etiquetas = [f"Elevación: {e:.2f}, Distancia: {d:.2f}" for e, d in zip(z, distancias)]
+        posiciones[:, 2] += offset
+    else:
+        etiquetas = [f"X: {a:.2f}, Y: {b:.2f}, Distancia: {d:.2f}" for a, b, d in zip(x, y, distancias)]
+        posiciones[:, 1] += offset
+    return [(etiqueta, posicion, altura) for etiqueta, posicion in zip(etiquetas, map(tuple, posiciones.tolist()))]
+
+def escribir_etiquetas(backend, etiquetas, separacion_minima=0.0, evitar_colisiones=True):
+    """
+    Escribe las etiquetas (etiqueta, posición, altura) en un solo envío por
+    lotes. Con evitar_colisiones se colocan antes con colocar_etiquetas: las
+    que solapan se desplazan o se omiten. Devuelve los contadores.
+    """
+    if not etiquetas:
+        return {'total_etiquetas': 0, 'etiquetas_desplazadas': 0, 'etiquetas_omitidas': 0}
+    textos = [etiqueta for etiqueta, _, _ in etiquetas]
+    posiciones = np.array([posicion for _, posicion, _ in etiquetas], dtype=np.float64)
+    altura = etiquetas[0][2]
+    desplazadas = 0
+    if evitar_colisiones:
+        xs, ys, colocadas, desplazamientos = colocar_etiquetas(
+            posiciones[:, 0], posiciones[:, 1], anchos_texto(textos, altura), altura, separacion_minima)
+        posiciones[:, 1] = ys
+        posiciones = posiciones[colocadas]
+        textos = [texto for texto, colocada in zip(textos, colocadas.tolist()) if colocada]
+        desplazadas = int((desplazamientos != 0).sum())
+
+    escritor = EscritorMasivo(backend)
+    escritor.agregar_textos(textos, *posiciones.T.tolist(), altura=altura)
+    escritor.vaciar()
+    return {'total_etiquetas': len(textos), 'etiquetas_desplazadas': desplazadas,
+            'etiquetas_omitidas': len(etiquetas) - len(textos)}
+
+def opciones_colocacion(data):
+    """separacion_minima y evitar_colisiones de la petición. Lanza ValueError si no son válidas."""
+    separacion_minima = data.get('separacion_minima', 0.0)
+    if not isinstance(separacion_minima, (int, float)) or isinstance(separacion_minima, bool) or separacion_minima < 0:
+        raise ValueError('separacion_minima debe ser un número no negativo.')
+    return {'separacion_minima': float(separacion_minima), 'evitar_colisiones': bool(data.get('evitar_colisiones', True))}
+
+def etiquetar_vertices_acad(backend, identificador, tipo_objeto, tipo, opciones=None):
+    """Etiqueta los vértices de un perfil o alineamiento. Se ejecuta en la sesión CAD."""
+    objeto, error = obtener_objeto_acad(backend, identificador, tipo_objeto)
+    if error:
+        return {'error': error}, 404
+
+    vertices = objeto.vertices
+    if not len(vertices):
+        return {'error': f'El {tipo_objeto.lower()} no tiene coordenadas válidas.'}, 400
+
+    if len(vertices) >= 2:
+        estacionamiento = estacionamiento_de(backend, objeto, en_planta=False)
+        etiquetas = etiquetar_vertices(estacionamiento.vertices, tipo=tipo, estaciones=estacionamiento.estaciones)
+    else:
+        etiquetas = etiquetar_vertices(vertices, tipo=tipo)
+
+    contadores = escribir_etiquetas(backend, etiquetas, **(opciones or {}))
+    return {'message': f'Vértices {tipo}es etiquetados correctamente', **contadores}, 200
+
+def etiquetar_distancias_acad(backend, polilinea_id, punto_referencia, opciones=None):
+    """Etiqueta la distancia de cada vértice a un punto de referencia. Se ejecuta en la sesión CAD."""
+    polilinea, error = obtener_objeto_acad(backend, polilinea_id, "Polilínea")
+    if error:
+        return {'error': error}, 404
+
+    vertices = polilinea.vertices
+    if not len(vertices):
+        return {'error': 'La polilínea no tiene coordenadas válidas.'}, 400
+
+    punto_ref = np.array([punto_referencia['x'], punto_referencia['y'], punto_referencia['z']], dtype=np.float64)
+    distancias = np.linalg.norm(vertices - punto_ref, axis=1).tolist()
+    posiciones = geometria.desplazar(vertices, (0.0, 5.0, 0.0))
+    etiquetas = [(f"Distancia: {distancia:.2f}", posicion, ALTURA_TEXTO)
+                 for distancia, posicion in zip(distancias, map(tuple, posiciones.tolist()))]
+
+    contadores = escribir_etiquetas(backend, etiquetas, **(opciones or {}))
+    return {'message': 'Distancias etiquetadas correctamente', **contadores}, 200
 
 @etiquetado_bp.route('/etiquetar_vertices_verticales', methods=['POST'])
 def etiquetar_vertices_verticales():
-    acad = None
-    civil3d = None
     try:
         data = request.get_json()
         perfil_id = data.get('perfil_id')
 
         if not perfil_id:
             return jsonify({'error': 'Se requiere perfil_id'}), 400
+        try:
+            opciones = opciones_colocacion(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
-        pythoncom.CoInitialize()
-        acad, civil3d = conectar_con_autocad_civil()
-        if not acad:
-            return jsonify({'error': 'No se pudo conectar con AutoCAD.'}), 500
-
-        perfil, error = obtener_objeto_acad(acad, perfil_id, "Perfil")
-        if error:
-            return jsonify({'error': error}), 404
-
-        if not hasattr(perfil, 'Coordinates'):
-            return jsonify({'error': 'El perfil no tiene coordenadas válidas.'}), 400
-
-        puntos = [APoint(p.x, p.y, p.z) for p in perfil.Coordinates]
-        etiquetas = etiquetar_vertices(puntos, tipo="vertical")
-
-        for etiqueta, posicion, altura in etiquetas:
-            acad.model.AddText(etiqueta, posicion, altura)
-
-        return jsonify({'message': 'Vértices verticales etiquetados correctamente', 'total_etiquetas': len(etiquetas)}), 200
+        resultado, codigo = obtener_sesion().ejecutar(etiquetar_vertices_acad, perfil_id, "Perfil", "vertical", opciones)
+        return jsonify(resultado), codigo
 
+    except ErrorSesionCAD as e:
+        logger.error(f"Error de conexión al etiquetar vértices verticales: {e}")
+        return jsonify({'error': 'No se pudo conectar con AutoCAD.'}), 500
     except Exception as e:
         logger.error(f"Error al etiquetar vértices verticales: {e}")
         return jsonify({'error': f'Error al etiquetar vértices verticales: {e}'}), 500
-    finally:
-        desconectar_autocad_civil(acad, civil3d)
-        try:
-            pythoncom.CoUninitialize()
-            logger.info("Recursos COM liberados.")
-        except Exception as e:
-            logger.error(f"Error al liberar recursos COM: {e}")
 
 @etiquetado_bp.route('/etiquetar_vertices_horizontales', methods=['POST'])
 def etiquetar_vertices_horizontales():
-    acad = None
-    civil3d = None
     try:
         data = request.get_json()
         alineamiento_id = data.get('alineamiento_id')
 
         if not alineamiento_id:
             return jsonify({'error': 'Se requiere alineamiento_id'}), 400
+        try:
+            opciones = opciones_colocacion(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
-        pythoncom.CoInitialize()
-        acad, civil3d = conectar_con_autocad_civil()
-        if not acad:
-            return jsonify({'error': 'No se pudo conectar con AutoCAD.'}), 500
-
-        alineamiento, error = obtener_objeto_acad(acad, alineamiento_id, "Alineamiento")
-        if error:
-            return jsonify({'error': error}), 404
-
-        if not hasattr(alineamiento, 'Coordinates'):
-            return jsonify({'error': 'El alineamiento no tiene coordenadas válidas.'}), 400
-
-        puntos = [APoint(p.x, p.y, p.z) for p in alineamiento.Coordinates]
-        etiquetas = etiquetar_vertices(puntos, tipo="horizontal")
-
-        for etiqueta, posicion, altura in etiquetas:
-            acad.model.AddText(etiqueta, posicion, altura)
-
-        return jsonify({'message': 'Vértices horizontales etiquetados correctamente', 'total_etiquetas': len(etiquetas)}), 200
+        resultado, codigo = obtener_sesion().ejecutar(etiquetar_vertices_acad, alineamiento_id, "Alineamiento", "horizontal",
+                                                      opciones)
+        return jsonify(resultado), codigo
 
+    except ErrorSesionCAD as e:
+        logger.error(f"Error de conexión al etiquetar vértices horizontales: {e}")
+        return jsonify({'error': 'No se pudo conectar con AutoCAD.'}), 500
     except Exception as e:
         logger.error(f"Error al etiquetar vértices horizontales: {e}")
         return jsonify({'error': f'Error al etiquetar vértices horizontales: {e}'}), 500
-    finally:
-        desconectar_autocad_civil(acad, civil3d)
-        try:
-            pythoncom.CoUninitialize()
-            logger.info("Recursos COM liberados.")
-        except Exception as e:
-            logger.error(f"Error al liberar recursos COM: {e}")
 
 @etiquetado_bp.route('/etiquetar_distancias', methods=['POST'])
 def etiquetar_distancias():
-    acad = None
-    civil3d = None
     try:
         data = request.get_json()
         polilinea_id = data.get('polilinea_id')
@@ -139,40 +180,17 @@ def etiquetar_distancias():
 
         if not polilinea_id or not punto_referencia:
             return jsonify({'error': 'Se requieren polilinea_id y punto_referencia'}), 400
+        try:
+            opciones = opciones_colocacion(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
-        pythoncom.CoInitialize()
-        acad, civil3d = conectar_con_autocad_civil()
-        if not acad:
-            return jsonify({'error': 'No se pudo conectar con AutoCAD.'}), 500
-
-        polilinea, error = obtener_objeto_acad(acad, polilinea_id, "Polilínea")
-        if error:
-            return jsonify({'error': error}), 404
-
-        if not hasattr(polilinea, 'Coordinates'):
-            return jsonify({'error': 'La polilínea no tiene coordenadas válidas.'}), 400
-
-        punto_ref = APoint(punto_referencia['x'], punto_referencia['y'], punto_referencia['z'])
-        puntos = [APoint(p.x, p.y, p.z) for p in polilinea.Coordinates]
-
-        etiquetas = []
-        for punto in puntos:
-            distancia = punto_ref.distance_to(punto)
-            etiqueta = f"Distancia: {distancia:.2f}"
-            etiquetas.append((etiqueta, APoint(punto.x, punto.y + 5, punto.z), 2.5))
-
-        for etiqueta, posicion, altura in etiquetas:
-            acad.model.AddText(etiqueta, posicion, altura)
-
-        return jsonify({'message': 'Distancias etiquetadas correctamente', 'total_etiquetas': len(etiquetas)}), 200
+        resultado, codigo = obtener_sesion().ejecutar(etiquetar_distancias_acad, polilinea_id, punto_referencia, opciones)
+        return jsonify(resultado), codigo
 
+    except ErrorSesionCAD as e:
+        logger.error(f"Error de conexión al etiquetar distancias: {e}")
+        return jsonify({'error': 'No se pudo conectar con AutoCAD.'}), 500
     except Exception as e:
         logger.error(f"Error al etiquetar distancias: {e}")
-        return jsonify({'error': f'Error al etiquetar distancias: {e}'}), 500
-    finally:
-        desconectar_autocad_civil(acad, civil3d)
-        try:
-            pythoncom.CoUninitialize()
-            logger.info("Recursos COM liberados.")
-        except Exception as e:
-            logger.error(f"Error al liberar recursos COM: {e}")
\ No newline at end of file
+        return jsonify({'error': f'Error al etiquetar distancias: {e}'}), 500
\ No newline at end of file
@@ -0,0 +1,328 @@
+"""
+Exportación de una importación (coordenadas y tuberías) a un archivo DXF,
+sin pasar por AutoCAD.
+
+Los mismos CSV que /cargar_csv escribe entidad a entidad por COM se
+convierten aquí en un DXF (R12, ASCII) en una sola pasada: cada punto es un
+POINT, su etiqueta un TEXT y cada tubería una POLYLINE 3D con un texto en el
+punto medio y los atributos en XData (aplicación TUBERIA_DATA, como en
+crear_puntos_iron.py). El archivo se inserta luego en el dibujo con una sola
+operación (INSERTAR o DXFIN) y se puede generar y probar en Linux.
+
+Las filas se validan por bloques con validacion.validar_tabla, igual que en
+la carga por streaming; la memoria solo crece con el índice de puntos que
+necesitan las tuberías.
+
+Uso desde la línea de comandos:
+    python exportar_dxf.py coordenadas.csv info_tuberias.csv salida.dxf
+Sin argumentos, mide el rendimiento con datos sintéticos.
+"""
+import codecs
+import io
+import logging
+import os
+import tempfile
+import time
+
+import numpy as np
+from flask import Blueprint, jsonify, request, send_file
+
+from crear_puntos import COLUMNAS_CSV, RED_TUBERIAS_POR_DEFECTO, TAMANO_BLOQUE_CSV, CargaCSV
+from carga_csv import TAMANO_LECTURA, leer_csv_en_partes, leer_csv_multipart
+
+logger = logging.getLogger(__name__)
+
+exportar_dxf_bp = Blueprint('exportar_dxf', __name__)
+
+CAPA_PUNTOS = 'PUNTOS'
+CAPA_ETIQUETAS = 'ETIQUETAS'
+CAPA_TUBERIAS = 'TUBERIAS'
+COLORES_CAPAS = {CAPA_PUNTOS: 7, CAPA_ETIQUETAS: 2, CAPA_TUBERIAS: 5}
+APLICACION_XDATA = 'TUBERIA_DATA'
+ALTURA_ETIQUETA_PUNTO = 2.5
+ALTURA_ETIQUETA_TUBERIA = 3
+MAX_CADENA_XDATA = 255
+
+
+def _escape_unicode(error):
+    # Los caracteres que no caben en ANSI_1252 se escriben como \U+XXXX, que
+    # AutoCAD interpreta en los textos.
+    return ''.join(f"\\U+{ord(c):04X}" for c in error.object[error.start:error.end]), error.end
+
+
+codecs.register_error('dxf_unicode', _escape_unicode)
+
+
+def _texto_dxf(texto):
+    """Un valor de grupo DXF ocupa una línea: los saltos de línea pasan a espacios."""
+    texto = str(texto)
+    if '\n' not in texto and '\r' not in texto:
+        return texto
+    return texto.replace('\r\n', ' ').replace('\n', ' ').replace('\r', ' ')
+
+
+def abrir_dxf(destino):
+    """
+    Abre destino (una ruta o un archivo binario) para escribir un DXF con la
+    codificación que declara la cabecera.
+    """
+    opciones = {'encoding': 'cp1252', 'errors': 'dxf_unicode', 'newline': '\r\n'}
+    if isinstance(destino, (str, os.PathLike)):
+        return open(destino, 'w', buffering=1024 * 1024, **opciones)
+    return io.TextIOWrapper(destino, **opciones)
+
+
+class EscritorDXF:
+    """
+    Escribe entidades en un DXF R12 a medida que llegan.
+
+    Las capas y las aplicaciones de XData se declaran al abrir (la sección
+    TABLES va antes que ENTITIES); cerrar() termina el archivo. Las
+    coordenadas se reciben por columnas, como en EscritorMasivo.
+    """
+
+    def __init__(self, archivo, capas=COLORES_CAPAS, aplicaciones=(APLICACION_XDATA,)):
+        self.archivo = archivo
+        self.entidades = 0
+        self._escribir_cabecera(capas, aplicaciones)
+
+    def _escribir_cabecera(self, capas, aplicaciones):
+        partes = [
+            "0\nSECTION\n2\nHEADER\n9\n$ACADVER\n1\nAC1009\n9\n$DWGCODEPAGE\n3\nANSI_1252\n0\nENDSEC\n",
+            "0\nSECTION\n2\nTABLES\n",
+            "0\nTABLE\n2\nLTYPE\n70\n1\n0\nLTYPE\n2\nCONTINUOUS\n70\n0\n3\nSolid line\n72\n65\n73\n0\n40\n0.0\n0\nENDTAB\n",
+            f"0\nTABLE\n2\nLAYER\n70\n{len(capas) + 1}\n",
+        ]
+        for nombre, color in {'0': 7, **capas}.items():
+            partes.append(f"0\nLAYER\n2\n{nombre}\n70\n0\n62\n{color}\n6\nCONTINUOUS\n")
+        partes.append(f"0\nENDTAB\n0\nTABLE\n2\nAPPID\n70\n{len(aplicaciones) + 1}\n")
+        for nombre in ('ACAD', *aplicaciones):
+            partes.append(f"0\nAPPID\n2\n{nombre}\n70\n0\n")
+        partes.append("0\nENDTAB\n0\nENDSEC\n0\nSECTION\n2\nENTITIES\n")
+        self.archivo.write(''.join(partes))
+
+    def puntos(self, xs, ys, zs, capa=CAPA_PUNTOS):
+        """Escribe una columna de puntos (listas de float)."""
+        self.archivo.write(''.join(
+            f"0\nPOINT\n8\n{capa}\n10\n{x!r}\n20\n{y!r}\n30\n{z!r}\n" for x, y, z in zip(xs, ys, zs)
+        ))
+        self.entidades += len(xs)
+
+    def textos(self, textos, xs, ys, zs, altura, capa=CAPA_ETIQUETAS):
+        """Escribe una columna de textos de una línea con la misma altura."""
+        altura = float(altura)
+        self.archivo.write(''.join(
+            f"0\nTEXT\n8\n{capa}\n10\n{x!r}\n20\n{y!r}\n30\n{z!r}\n40\n{altura!r}\n1\n{_texto_dxf(texto)}\n"
+            for texto, x, y, z in zip(textos, xs, ys, zs)
+        ))
+        self.entidades += len(textos)
+
+    def polilineas_3d(self, polilineas, capa=CAPA_TUBERIAS):
+        """
+        Escribe POLYLINE 3D con sus VERTEX y SEQEND; polilineas es una lista
+        de (vértices, xdata).
+
+        xdata es una lista de pares (código, valor) que se añade tras el
+        registro de la aplicación APLICACION_XDATA, o None.
+        """
+        partes = []
+        for vertices, xdata in polilineas:
+            partes.append(f"0\nPOLYLINE\n8\n{capa}\n66\n1\n10\n0.0\n20\n0.0\n30\n0.0\n70\n8\n")
+            if xdata:
+                partes.append(f"1001\n{APLICACION_XDATA}\n")
+                partes.extend(f"{codigo}\n{valor}\n" for codigo, valor in xdata)
+            partes.extend(f"0\nVERTEX\n8\n{capa}\n10\n{x!r}\n20\n{y!r}\n30\n{z!r}\n70\n32\n" for x, y, z in vertices)
+            partes.append(f"0\nSEQEND\n8\n{capa}\n")
+        self.archivo.write(''.join(partes))
+        self.entidades += len(polilineas)
+
+    def cerrar(self):
+        self.archivo.write("0\nENDSEC\n0\nEOF\n")
+
+
+def _cadena_xdata(nombre, valor):
+    return 1000, _texto_dxf(f"{nombre}:{valor}")[:MAX_CADENA_XDATA]
+
+
+def _real_xdata(nombre, valor):
+    """Par 1040 si el valor es numérico; si no (vacío o texto libre), cadena 'NOMBRE:valor'."""
+    try:
+        return 1040, repr(float(valor))
+    except (TypeError, ValueError):
+        return _cadena_xdata(nombre, valor)
+
+
+def xdata_tuberia(id_tuberia, diametro, material, presion_nominal, conexion_inicio, conexion_fin,
+                  longitud, pendiente, nombre_red):
+    """Atributos de una tubería en el mismo orden que crear_puntos_iron.py, más la red."""
+    return [
+        _cadena_xdata('ID_TUBERIA', id_tuberia),
+        _real_xdata('DIAMETRO', diametro),
+        _cadena_xdata('MATERIAL', material),
+        _real_xdata('PRESION_NOMINAL', presion_nominal),
+        _cadena_xdata('CONEXION_INICIO', conexion_inicio),
+        _cadena_xdata('CONEXION_FIN', conexion_fin),
+        _real_xdata('LONGITUD', longitud),
+        _real_xdata('PENDIENTE', pendiente),
+        _cadena_xdata('RED', nombre_red),
+    ]
+
+
+class ExportacionDXF(CargaCSV):
+    """
+    Carga que escribe los bloques validados en un EscritorDXF en lugar de
+    enviarlos a la sesión CAD. Se usa con leer_csv_multipart igual que
+    CargaCSV; la escritura es síncrona, así que nunca hay bloques en vuelo.
+    """
+
+    def __init__(self, escritor, nombre_red=RED_TUBERIAS_POR_DEFECTO, tamano_bloque=TAMANO_BLOQUE_CSV):
+        super().__init__(None, nombre_red, tamano_bloque)
+        self.escritor = escritor
+        self.tuberias_omitidas = 0
+
+    def _escribir_bloque(self, bloque):
+        if self._tipo == 'coordenadas':
+            self._escribir_puntos(bloque)
+        else:
+            self._escribir_tuberias(bloque)
+
+    def _escribir_puntos(self, coordenadas):
+        xs, ys, zs = (np.round(coordenadas[c], 3).tolist() for c in ('X', 'Y', 'Z'))
+        self.escritor.puntos(xs, ys, zs)
+        self.escritor.textos(coordenadas['Etiqueta'].tolist(), xs, ys, zs, ALTURA_ETIQUETA_PUNTO)
+        self.puntos.actualizar(dict(zip(coordenadas['ID'].tolist(), zip(xs, ys, zs))))
+
+    def _escribir_tuberias(self, tuberias):
+        polilineas, etiquetas, xs, ys, zs = [], [], [], [], []
+        columnas = zip(
+            tuberias['PK_INICIO'].tolist(), tuberias['PK_FIN'].tolist(), tuberias['ID_TUBERIA'].tolist(),
+            tuberias['DIAMETRO'].tolist(), tuberias['MATERIAL'].tolist(), tuberias['PRESION_NOMINAL'].tolist(),
+            tuberias['CONEXION_INICIO'].tolist(), tuberias['CONEXION_FIN'].tolist(),
+            tuberias['LONGITUD'].tolist(), tuberias['PENDIENTE'].tolist(),
+        )
+        for (pk_inicio, pk_fin, id_tuberia, diametro, material, presion_nominal,
+             conexion_inicio, conexion_fin, longitud, pendiente) in columnas:
+            # Mismas reglas que crear_tuberias: sin diámetro o sin puntos no hay tubería.
+            if diametro != diametro or pk_inicio not in self.puntos or pk_fin not in self.puntos:
+                self.tuberias_omitidas += 1
+                continue
+            inicio, fin = self.puntos[pk_inicio], self.puntos[pk_fin]
+            polilineas.append(((inicio, fin), xdata_tuberia(
+                id_tuberia, diametro, material, presion_nominal, conexion_inicio, conexion_fin,
+                longitud, pendiente, self.nombre_red)))
+            etiquetas.append(f"Tubería {id_tuberia} - Diámetro: {diametro}, Material: {material}")
+            xs.append((inicio[0] + fin[0]) / 2)
+            ys.append((inicio[1] + fin[1]) / 2)
+            zs.append((inicio[2] + fin[2]) / 2)
+        self.tuberias += len(polilineas)
+        self.escritor.polilineas_3d(polilineas)
+        self.escritor.textos(etiquetas, xs, ys, zs, ALTURA_ETIQUETA_TUBERIA)
+
+    def resumen(self):
+        return {
+            'puntos': len(self.puntos),
+            'tuberias': self.tuberias,
+            'tuberias_omitidas': self.tuberias_omitidas,
+            'entidades': self.escritor.entidades,
+            'filas_invalidas': self.filas_invalidas,
+            'errores': self.errores,
+            'bloques': self.bloques,
+        }
+
+
+def exportar_csv_a_dxf(ruta_coordenadas, ruta_tuberias, ruta_dxf, nombre_red=RED_TUBERIAS_POR_DEFECTO):
+    """Convierte los CSV de coordenadas y tuberías (ruta_tuberias puede ser None) en un DXF. Devuelve el resumen."""
+    with abrir_dxf(ruta_dxf) as salida:
+        escritor = EscritorDXF(salida)
+        exportacion = ExportacionDXF(escritor, nombre_red)
+        for tipo, ruta in (('coordenadas', ruta_coordenadas), ('tuberias', ruta_tuberias)):
+            if not ruta:
+                continue
+            with open(ruta, 'rb') as archivo:
+                error = leer_csv_en_partes(exportacion, tipo, iter(lambda: archivo.read(TAMANO_LECTURA), b''),
+                                           COLUMNAS_CSV[tipo])
+            if error:
+                raise ValueError(error)
+        exportacion.vaciar()
+        escritor.cerrar()
+    return exportacion.resumen()
+
+
+@exportar_dxf_bp.route('/exportar_dxf', methods=['POST'])
+def exportar_dxf():
+    """
+    Convierte coordenadas.csv e info_tuberias.csv (multipart/form-data, los
+    mismos campos que /cargar_csv) en un DXF y lo devuelve como descarga.
+
+    El DXF se escribe en un temporal mientras se lee el cuerpo; no hace falta
+    AutoCAD. El resumen de la exportación va en la cabecera X-Resumen-DXF.
+    """
+    boundary = request.mimetype_params.get('boundary')
+    if request.mimetype != 'multipart/form-data' or not boundary:
+        return jsonify({'error': 'Se esperaba un envío multipart/form-data con los archivos CSV.'}), 400
+
+    # Temporal anónimo: se borra solo cuando se cierra, también si la
+    # descarga se interrumpe.
+    archivo = tempfile.TemporaryFile(suffix='.dxf')
+    enviado = False
+    try:
+        inicio = time.perf_counter()
+        salida = abrir_dxf(archivo)
+        escritor = EscritorDXF(salida)
+        exportacion = ExportacionDXF(escritor)
+        error = leer_csv_multipart(exportacion, request.stream, boundary, COLUMNAS_CSV)
+        if error:
+            return jsonify({'error': error}), 400
+        escritor.cerrar()
+        salida.flush()
+        salida.detach()
+
+        resumen = exportacion.resumen()
+        if not resumen['puntos']:
+            return jsonify({'message': 'No hay puntos válidos que exportar.', **resumen}), 400
+        logger.info(f"DXF exportado en {time.perf_counter() - inicio:.2f} s: {resumen['puntos']} puntos, "
+                    f"{resumen['tuberias']} tuberías, {resumen['filas_invalidas']} filas inválidas.")
+
+        archivo.seek(0)
+        respuesta = send_file(archivo, mimetype='application/dxf', as_attachment=True, download_name='importacion.dxf')
+        respuesta.headers['X-Resumen-DXF'] = (
+            f"puntos={resumen['puntos']}; tuberias={resumen['tuberias']}; "
+            f"tuberias_omitidas={resumen['tuberias_omitidas']}; filas_invalidas={resumen['filas_invalidas']}"
+        )
+        enviado = True
+        return respuesta
+    except Exception as e:
+        logger.error(f"Error general en exportar_dxf: {e}")
+        return jsonify({'error': f"Error general: {e}"}), 500
+    finally:
+        if not enviado:
+            archivo.close()
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if len(sys.argv) >= 4:
+        inicio = time.perf_counter()
+        resumen = exportar_csv_a_dxf(sys.argv[1], sys.argv[2], sys.argv[3])
+        print(f"{sys.argv[3]} escrito en {time.perf_counter() - inicio:.2f} s: {resumen}")
+        sys.exit(0)
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta_coordenadas = os.path.join(directorio, 'coordenadas.csv')
+        ruta_tuberias = os.path.join(directorio, 'tuberias.csv')
+        with open(ruta_coordenadas, 'w', newline='') as archivo:
+            archivo.write('ID,X,Y,Z,Etiqueta\n')
+            archivo.writelines(f"{i},{i * 0.5:.3f},{i * 0.25:.3f},100.0,P{i}\n" for i in range(n))
+        with open(ruta_tuberias, 'w', newline='') as archivo:
+            archivo.write('ID_TUBERIA,PK_INICIO,PK_FIN,DIAMETRO,MATERIAL,PRESION_NOMINAL,CONEXION_INICIO,CONEXION_FIN,LONGITUD,PENDIENTE\n')
+            archivo.writelines(f"T{i},{i},{i + 1},110,PVC,10,J,J,0.56,0.5\n" for i in range(n - 1))
+
+        ruta_dxf = os.path.join(directorio, 'salida.dxf')
+        inicio = time.perf_counter()
+        resumen = exportar_csv_a_dxf(ruta_coordenadas, ruta_tuberias, ruta_dxf)
+        duracion = time.perf_counter() - inicio
+        print(f"{n} puntos y {n - 1} tuberías -> {resumen['entidades']} entidades en {duracion:.2f} s "
+              f"({resumen['entidades'] / duracion:,.0f} entidades/s, {os.path.getsize(ruta_dxf) / 1e6:.1f} MB)")
@@ -0,0 +1,390 @@
+"""
+Exportación de puntos, redes de tuberías y alineaciones a LandXML 1.2.
+
+Civil 3D importa en una sola operación (Insertar > LandXML) los CgPoints,
+las redes de tuberías y las alineaciones de un archivo LandXML. Este módulo
+lo genera a partir de los mismos CSV que crean las entidades por COM
+(coordenadas.csv, info_tuberias.csv y tuberias_con_curva.csv):
+
+- cada punto es un CgPoint ("norte este cota");
+- cada punto usado por una tubería es una estructura (Struct) de la red;
+- cada tubería es un Pipe con CircPipe (diámetro en mm y material) y los
+  demás atributos en un Feature;
+- las tuberías de tuberias_con_curva.csv forman además alineaciones: cada
+  tramo de tuberías encadenadas (PK_FIN de una = PK_INICIO de la siguiente)
+  es un Alignment con sus Line y Curve.
+
+El archivo se escribe en streaming: los puntos se escriben según llegan y
+las tuberías y alineaciones se acumulan en temporales (en disco a partir de
+unos MB) hasta conocer las estructuras que usan.
+
+Uso desde la línea de comandos:
+    python exportar_landxml.py coordenadas.csv info_tuberias.csv tuberias_con_curva.csv salida.xml
+Sin argumentos, mide el rendimiento con datos sintéticos.
+"""
+import datetime
+import io
+import logging
+import math
+import os
+import shutil
+import tempfile
+import time
+from xml.sax.saxutils import escape
+
+import numpy as np
+from flask import Blueprint, jsonify, request, send_file
+
+from crear_puntos import COLUMNAS_CSV, RED_TUBERIAS_POR_DEFECTO, TAMANO_BLOQUE_CSV, CargaCSV
+from carga_csv import TAMANO_LECTURA, leer_csv_en_partes, leer_csv_multipart
+from validacion import ESQUEMA_TUBERIAS_CON_GEOMETRIA
+
+logger = logging.getLogger(__name__)
+
+exportar_landxml_bp = Blueprint('exportar_landxml', __name__)
+
+COORDINATES_CSV = 'coordenadas.csv'
+PIPES_CSV = 'info_tuberias.csv'
+CURVED_PIPES_CSV = 'tuberias_con_curva.csv'
+
+COLUMNAS_LANDXML = {**COLUMNAS_CSV, 'tuberias_curva': COLUMNAS_CSV['tuberias']}
+TAMANO_MAXIMO_EN_MEMORIA = 8 * 1024 * 1024
+ATRIBUTOS_FEATURE = ('PRESION_NOMINAL', 'CONEXION_INICIO', 'CONEXION_FIN', 'TIPO_CURVA', 'RADIO_CURVA')
+
+
+def _atributo(valor):
+    return escape(str(valor), {'"': '&quot;', '\n': '&#10;', '\r': '&#13;'})
+
+
+def _numero(valor):
+    """float del valor o None si no es un número finito (LONGITUD y PENDIENTE llegan como texto)."""
+    try:
+        numero = float(valor)
+    except (TypeError, ValueError):
+        return None
+    return numero if math.isfinite(numero) else None
+
+
+def _ne(punto):
+    # LandXML escribe las coordenadas como "norte este [cota]".
+    return f"{punto[1]!r} {punto[0]!r}"
+
+
+def geometria_curva(inicio, fin, radio):
+    """
+    Centro (x, y) y longitud del arco menor de radio que une inicio y fin en
+    planta, con el centro a la izquierda del sentido inicio -> fin (giro
+    antihorario). Devuelve None si el radio es menor que media cuerda.
+    """
+    dx, dy = fin[0] - inicio[0], fin[1] - inicio[1]
+    cuerda = math.hypot(dx, dy)
+    if cuerda == 0 or radio < cuerda / 2:
+        return None
+    flecha = math.sqrt(radio * radio - cuerda * cuerda / 4)
+    centro = ((inicio[0] + fin[0]) / 2 - dy / cuerda * flecha, (inicio[1] + fin[1]) / 2 + dx / cuerda * flecha)
+    return centro, 2 * radio * math.asin(cuerda / (2 * radio))
+
+
+class ExportacionLandXML(CargaCSV):
+    """
+    Carga que escribe los bloques validados en un LandXML en lugar de
+    enviarlos a la sesión CAD. Se usa con leer_csv_multipart igual que
+    CargaCSV; los tipos son 'coordenadas', 'tuberias' y 'tuberias_curva'.
+    """
+
+    ESQUEMAS = {**CargaCSV.ESQUEMAS, 'tuberias_curva': ESQUEMA_TUBERIAS_CON_GEOMETRIA}
+
+    def __init__(self, archivo, nombre_red=RED_TUBERIAS_POR_DEFECTO, tamano_bloque=TAMANO_BLOQUE_CSV):
+        super().__init__(None, nombre_red, tamano_bloque)
+        self.archivo = archivo
+        self.tuberias_omitidas = 0
+        self.curvas_invalidas = 0
+        self.alineaciones = 0
+        self.tuberias_renombradas = 0
+        self._estructuras = set()
+        self._nombres_tuberias = set()
+        self._tuberias = tempfile.SpooledTemporaryFile(max_size=TAMANO_MAXIMO_EN_MEMORIA, mode='w+', encoding='utf-8')
+        self._alineaciones = tempfile.SpooledTemporaryFile(max_size=TAMANO_MAXIMO_EN_MEMORIA, mode='w+', encoding='utf-8')
+        self._tramo = []  # [(pk_inicio, pk_fin, elemento CoordGeom, longitud)] de la alineación en curso
+        ahora = datetime.datetime.now()
+        self.archivo.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<LandXML xmlns="http://www.landxml.org/schema/LandXML-1.2" version="1.2" '
+            f'date="{ahora:%Y-%m-%d}" time="{ahora:%H:%M:%S}">\n'
+            '<Units><Metric linearUnit="meter" areaUnit="squareMeter" volumeUnit="cubicMeter" '
+            'angularUnit="radians" directionUnit="radians" diameterUnit="millimeter"/></Units>\n'
+            '<Application name="ADDEC" manufacturer="ADDEC" version="1.0"/>\n'
+            '<CgPoints>\n'
+        )
+
+    def _escribir_bloque(self, bloque):
+        if self._tipo == 'coordenadas':
+            self._escribir_puntos(bloque)
+        else:
+            self._escribir_tuberias(bloque, con_geometria=self._tipo == 'tuberias_curva')
+
+    def _escribir_puntos(self, coordenadas):
+        xs, ys, zs = (np.round(coordenadas[c], 3).tolist() for c in ('X', 'Y', 'Z'))
+        ids = coordenadas['ID'].tolist()
+        self.archivo.write(''.join(
+            f'<CgPoint name="{id_punto}" desc="{_atributo(etiqueta)}">{y!r} {x!r} {z!r}</CgPoint>\n'
+            for id_punto, etiqueta, x, y, z in zip(ids, coordenadas['Etiqueta'].tolist(), xs, ys, zs)
+        ))
+        self.puntos.actualizar(dict(zip(ids, zip(xs, ys, zs))))
+
+    def _escribir_tuberias(self, tuberias, con_geometria):
+        n = len(tuberias)
+        columnas = {nombre: tuberias[nombre].tolist() for nombre in tuberias.columnas}
+        if not con_geometria:
+            columnas['TIPO_CURVA'], columnas['RADIO_CURVA'] = ['RECTO'] * n, [math.nan] * n
+        elementos = []
+        for i in range(n):
+            id_tuberia = columnas['ID_TUBERIA'][i]
+            pk_inicio, pk_fin, diametro = columnas['PK_INICIO'][i], columnas['PK_FIN'][i], columnas['DIAMETRO'][i]
+            # Mismas reglas que crear_tuberias: sin diámetro o sin puntos no hay tubería.
+            if diametro != diametro or pk_inicio not in self.puntos or pk_fin not in self.puntos:
+                self.tuberias_omitidas += 1
+                continue
+            self._estructuras.add(pk_inicio)
+            self._estructuras.add(pk_fin)
+
+            nombre = self._nombre_tuberia(id_tuberia or f"{pk_inicio}-{pk_fin}")
+            atributos = [f'name="{_atributo(nombre)}"', f'refStart="{pk_inicio}"', f'refEnd="{pk_fin}"']
+            material = columnas['MATERIAL'][i]
+            if material:
+                atributos.append(f'desc="{_atributo(material)}"')
+            for columna, atributo in (('LONGITUD', 'length'), ('PENDIENTE', 'slope')):
+                valor = _numero(columnas[columna][i])
+                if valor is not None:
+                    atributos.append(f'{atributo}="{valor!r}"')
+            circ_pipe = f'<CircPipe diameter="{diametro!r}"'
+            if material:
+                circ_pipe += f' material="{_atributo(material)}"'
+            propiedades = ''.join(
+                f'<Property label="{columna}" value="{_atributo(columnas[columna][i])}"/>'
+                for columna in ATRIBUTOS_FEATURE
+                if columnas[columna][i] not in ('', None) and columnas[columna][i] == columnas[columna][i]
+            )
+            if id_tuberia and nombre != id_tuberia:
+                propiedades += f'<Property label="ID_TUBERIA" value="{_atributo(id_tuberia)}"/>'
+            feature = f'<Feature code="ADDEC">{propiedades}</Feature>' if propiedades else ''
+            elementos.append(f'<Pipe {" ".join(atributos)}>{circ_pipe}/>{feature}</Pipe>\n')
+            if con_geometria:
+                self._agregar_a_alineacion(id_tuberia, pk_inicio, pk_fin, columnas['TIPO_CURVA'][i],
+                                           columnas['RADIO_CURVA'][i])
+        self._tuberias.write(''.join(elementos))
+        self.tuberias += len(elementos)
+
+    def _nombre_tuberia(self, nombre):
+        # Civil 3D no importa una red con dos Pipe del mismo nombre, y los dos
+        # CSV de tuberías suelen numerar igual (T1, T2...): las repetidas
+        # reciben un sufijo -2, -3... y conservan su ID en el Feature.
+        if nombre in self._nombres_tuberias:
+            sufijo = 2
+            while f'{nombre}-{sufijo}' in self._nombres_tuberias:
+                sufijo += 1
+            nombre = f'{nombre}-{sufijo}'
+            self.tuberias_renombradas += 1
+        self._nombres_tuberias.add(nombre)
+        return nombre
+
+    # --- Alineaciones -------------------------------------------------------
+
+    def _agregar_a_alineacion(self, id_tuberia, pk_inicio, pk_fin, tipo_curva, radio):
+        if self._tramo and self._tramo[-1][1] != pk_inicio:
+            self._cerrar_alineacion()
+        inicio, fin = self.puntos[pk_inicio], self.puntos[pk_fin]
+        geometria = geometria_curva(inicio, fin, radio) if tipo_curva == 'CURVO' and radio == radio else None
+        if tipo_curva == 'CURVO' and geometria is None:
+            self.curvas_invalidas += 1
+            logger.warning(f"La tubería {id_tuberia} es curva pero el radio ({radio}) no une sus extremos. "
+                           "Se exporta recta en la alineación.")
+        if geometria is None:
+            longitud = math.hypot(fin[0] - inicio[0], fin[1] - inicio[1])
+            elemento = f'<Line length="{longitud!r}"><Start>{_ne(inicio)}</Start><End>{_ne(fin)}</End></Line>'
+        else:
+            centro, longitud = geometria
+            elemento = (f'<Curve rot="ccw" radius="{radio!r}" length="{longitud!r}"><Start>{_ne(inicio)}</Start>'
+                        f'<Center>{_ne(centro)}</Center><End>{_ne(fin)}</End></Curve>')
+        self._tramo.append((pk_inicio, pk_fin, elemento, longitud))
+
+    def _cerrar_alineacion(self):
+        if not self._tramo:
+            return
+        tramo, self._tramo = self._tramo, []
+        self.alineaciones += 1
+        longitud = sum(t[3] for t in tramo)
+        self._alineaciones.write(
+            f'<Alignment name="Alineación {self.alineaciones} ({tramo[0][0]}-{tramo[-1][1]})" '
+            f'length="{longitud!r}" staStart="0.0"><CoordGeom>'
+            + ''.join(t[2] for t in tramo)
+            + '</CoordGeom></Alignment>\n'
+        )
+
+    # --- Cierre -------------------------------------------------------------
+
+    def cerrar(self):
+        """Escribe la red y las alineaciones acumuladas y termina el documento."""
+        self._cerrar_alineacion()
+        self.archivo.write('</CgPoints>\n')
+        if self.tuberias:
+            self.archivo.write(
+                f'<PipeNetworks>\n<PipeNetwork name="{_atributo(self.nombre_red)}" pipeNetType="water">\n<Structs>\n'
+            )
+            partes = []
+            for id_punto in sorted(self._estructuras):
+                x, y, z = self.puntos[id_punto]
+                partes.append(f'<Struct name="{id_punto}" elevRim="{z!r}" elevSump="{z!r}">'
+                              f'<Center>{y!r} {x!r}</Center><CircStruct diameter="0.0"/></Struct>\n')
+            self.archivo.write(''.join(partes))
+            self.archivo.write('</Structs>\n<Pipes>\n')
+            self._copiar(self._tuberias)
+            self.archivo.write('</Pipes>\n</PipeNetwork>\n</PipeNetworks>\n')
+        if self.alineaciones:
+            self.archivo.write('<Alignments>\n')
+            self._copiar(self._alineaciones)
+            self.archivo.write('</Alignments>\n')
+        self.archivo.write('</LandXML>\n')
+        self._tuberias.close()
+        self._alineaciones.close()
+
+    def _copiar(self, temporal):
+        temporal.seek(0)
+        shutil.copyfileobj(temporal, self.archivo, 1024 * 1024)
+
+    def resumen(self):
+        return {
+            'puntos': len(self.puntos),
+            'estructuras': len(self._estructuras),
+            'tuberias': self.tuberias,
+            'tuberias_omitidas': self.tuberias_omitidas,
+            'tuberias_renombradas': self.tuberias_renombradas,
+            'alineaciones': self.alineaciones,
+            'curvas_invalidas': self.curvas_invalidas,
+            'filas_invalidas': self.filas_invalidas,
+            'errores': self.errores,
+            'bloques': self.bloques,
+        }
+
+
+def _leer_archivos(exportacion, rutas):
+    """
+    Pasa a la exportación las filas de cada (tipo, ruta) con el mismo lector
+    que los envíos multipart (salta líneas en blanco, comprueba columnas) y
+    vacía el último bloque. Devuelve un mensaje de error o None.
+    """
+    for tipo, ruta in rutas:
+        with open(ruta, 'rb') as archivo:
+            error = leer_csv_en_partes(exportacion, tipo, iter(lambda: archivo.read(TAMANO_LECTURA), b''),
+                                       COLUMNAS_LANDXML[tipo])
+        if error:
+            return error
+    exportacion.vaciar()
+    return None
+
+
+def exportar_csv_a_landxml(ruta_coordenadas, ruta_tuberias, ruta_tuberias_curva, ruta_xml,
+                           nombre_red=RED_TUBERIAS_POR_DEFECTO):
+    """Convierte los CSV en un LandXML; las rutas de tuberías pueden ser None. Devuelve el resumen."""
+    with open(ruta_xml, 'w', encoding='utf-8', buffering=1024 * 1024) as salida:
+        exportacion = ExportacionLandXML(salida, nombre_red)
+        rutas = (('coordenadas', ruta_coordenadas), ('tuberias', ruta_tuberias), ('tuberias_curva', ruta_tuberias_curva))
+        error = _leer_archivos(exportacion, [(tipo, ruta) for tipo, ruta in rutas if ruta])
+        if error:
+            raise ValueError(error)
+        exportacion.cerrar()
+    return exportacion.resumen()
+
+
+def _respuesta_landxml(archivo, salida, exportacion):
+    """Respuesta de descarga con el resumen en la cabecera X-Resumen-LandXML."""
+    salida.flush()
+    salida.detach()
+    archivo.seek(0)
+    resumen = exportacion.resumen()
+    respuesta = send_file(archivo, mimetype='application/xml', as_attachment=True, download_name='importacion.xml')
+    respuesta.headers['X-Resumen-LandXML'] = '; '.join(
+        f"{clave}={resumen[clave]}" for clave in ('puntos', 'tuberias', 'tuberias_omitidas', 'tuberias_renombradas',
+                                                  'alineaciones', 'curvas_invalidas', 'filas_invalidas'))
+    return respuesta
+
+
+@exportar_landxml_bp.route('/exportar_landxml', methods=['GET', 'POST'])
+def exportar_landxml():
+    """
+    Genera el LandXML y lo devuelve como descarga.
+
+    POST: multipart/form-data con 'coordenadas' y, opcionales, 'tuberias'
+    (formato de info_tuberias.csv), 'tuberias_curva' (formato de
+    tuberias_con_curva.csv) y 'red_tuberias'.
+    GET: usa los CSV del directorio de trabajo, como /crear_puntos_curva.
+    """
+    # Temporal anónimo: se borra solo cuando se cierra, también si la
+    # descarga se interrumpe.
+    archivo = tempfile.TemporaryFile(suffix='.xml')
+    enviado = False
+    try:
+        inicio = time.perf_counter()
+        salida = io.TextIOWrapper(archivo, encoding='utf-8')
+        if request.method == 'GET':
+            if not os.path.exists(COORDINATES_CSV):
+                return jsonify({'error': f"Error: Archivo no encontrado: {COORDINATES_CSV}"}), 400
+            exportacion = ExportacionLandXML(salida)
+            error = _leer_archivos(exportacion, [('coordenadas', COORDINATES_CSV)] + [
+                (tipo, ruta) for tipo, ruta in (('tuberias', PIPES_CSV), ('tuberias_curva', CURVED_PIPES_CSV))
+                if os.path.exists(ruta)
+            ])
+        else:
+            boundary = request.mimetype_params.get('boundary')
+            if request.mimetype != 'multipart/form-data' or not boundary:
+                return jsonify({'error': 'Se esperaba un envío multipart/form-data con los archivos CSV.'}), 400
+            exportacion = ExportacionLandXML(salida)
+            error = leer_csv_multipart(exportacion, request.stream, boundary, COLUMNAS_LANDXML)
+        if error:
+            return jsonify({'error': error}), 400
+        exportacion.cerrar()
+
+        if not exportacion.puntos:
+            return jsonify({'message': 'No hay puntos válidos que exportar.', **exportacion.resumen()}), 400
+        logger.info(f"LandXML exportado en {time.perf_counter() - inicio:.2f} s: {len(exportacion.puntos)} puntos, "
+                    f"{exportacion.tuberias} tuberías, {exportacion.alineaciones} alineaciones.")
+        respuesta = _respuesta_landxml(archivo, salida, exportacion)
+        enviado = True
+        return respuesta
+    except Exception as e:
+        logger.error(f"Error general en exportar_landxml: {e}")
+        return jsonify({'error': f"Error general: {e}"}), 500
+    finally:
+        if not enviado:
+            archivo.close()
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if len(sys.argv) >= 5:
+        inicio = time.perf_counter()
+        resumen = exportar_csv_a_landxml(*sys.argv[1:5])
+        print(f"{sys.argv[4]} escrito en {time.perf_counter() - inicio:.2f} s: {resumen}")
+        sys.exit(0)
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta_coordenadas = os.path.join(directorio, 'coordenadas.csv')
+        ruta_tuberias = os.path.join(directorio, 'tuberias_con_curva.csv')
+        with open(ruta_coordenadas, 'w', newline='') as archivo:
+            archivo.write('ID,X,Y,Z,Etiqueta\n')
+            archivo.writelines(f"{i},{i * 10.0:.3f},{(i % 7) * 3.0:.3f},100.0,P{i}\n" for i in range(n + 1))
+        with open(ruta_tuberias, 'w', newline='') as archivo:
+            archivo.write('ID_TUBERIA,PK_INICIO,PK_FIN,DIAMETRO,MATERIAL,PRESION_NOMINAL,CONEXION_INICIO,'
+                          'CONEXION_FIN,LONGITUD,PENDIENTE,TIPO_CURVA,RADIO_CURVA\n')
+            archivo.writelines(f"T{i},{i},{i + 1},110,PVC,10,EF,EF,10.0,0.5,{'CURVO' if i % 3 == 0 else 'RECTO'},50\n"
+                               for i in range(n))
+
+        ruta_xml = os.path.join(directorio, 'salida.xml')
+        inicio = time.perf_counter()
+        resumen = exportar_csv_a_landxml(ruta_coordenadas, None, ruta_tuberias, ruta_xml)
+        duracion = time.perf_counter() - inicio
+        print(f"{resumen['puntos']} puntos, {resumen['tuberias']} tuberías y {resumen['alineaciones']} alineaciones "
+              f"en {duracion:.2f} s ({os.path.getsize(ruta_xml) / 1e6:.1f} MB)")
@@ -0,0 +1,146 @@
+"""
+Geometría de polilíneas sobre arrays (N, 3) de float64.
+
+Las coordenadas de un objeto se convierten una sola vez en un array
+contiguo (vertices) desde la tupla plana de COM (o el buffer del backend en
+memoria) y todas las operaciones trabajan sobre él, sin crear un objeto de
+Python por vértice:
+
+- longitudes / longitud: en planta o en 3D.
+- desplazar: traslada los vértices; con varios desplazamientos devuelve
+  todas las copias de una vez (D, N, 3).
+- puntos_en / estaciones_cada: puntos a distancias dadas a lo largo de la
+  polilínea.
+- caja: (xmin, ymin, xmax, ymax) en planta, como las cajas del almacén.
+- punto_mas_cercano: distancia en planta de un punto a la polilínea.
+
+plana devuelve la secuencia x0, y0, z0, x1... que esperan los métodos de
+escritura de los backends.
+
+Uso desde la línea de comandos:
+    python geometria.py [vertices]   # mide las operaciones
+"""
+from array import array
+
+import numpy as np
+
+
+def vertices(coordenadas):
+    """
+    Array (N, 3) contiguo de float64 a partir de una secuencia plana
+    x0, y0, z0, x1... (tupla COM, lista, array('d')) o de un array (N, 3).
+    """
+    if coordenadas is None:
+        return np.empty((0, 3))
+    if isinstance(coordenadas, array):
+        resultado = np.frombuffer(coordenadas, dtype=np.float64).copy()
+    else:
+        resultado = np.asarray(coordenadas, dtype=np.float64)
+    if resultado.ndim == 1:
+        if resultado.size % 3:
+            raise ValueError("Las coordenadas deben ser múltiplo de 3 (x, y, z por vértice).")
+        resultado = resultado.reshape(-1, 3)
+    elif resultado.ndim != 2 or resultado.shape[1] != 3:
+        raise ValueError("Los vértices deben ser un array (N, 3).")
+    return np.ascontiguousarray(resultado)
+
+
+def plana(vertices):
+    """Secuencia plana x0, y0, z0, x1... (lista de float) para escribir en el backend."""
+    return np.asarray(vertices, dtype=np.float64).ravel().tolist()
+
+
+def concatenar(lista_vertices):
+    """Une varias polilíneas (arrays (N, 3)) en un solo array."""
+    lista_vertices = [v for v in lista_vertices if len(v)]
+    return np.concatenate(lista_vertices) if lista_vertices else np.empty((0, 3))
+
+
+def longitudes(vertices, en_planta=False):
+    """Longitud de cada tramo (N - 1), en planta o en 3D."""
+    direcciones = np.diff(vertices[:, :2] if en_planta else vertices, axis=0)
+    return np.sqrt((direcciones * direcciones).sum(axis=1))
+
+
+def longitud(vertices, en_planta=False):
+    return float(longitudes(vertices, en_planta).sum())
+
+
+def caja(vertices):
+    """(xmin, ymin, xmax, ymax) en planta, o None si no hay vértices."""
+    if not len(vertices):
+        return None
+    minimo, maximo = vertices[:, :2].min(axis=0), vertices[:, :2].max(axis=0)
+    return float(minimo[0]), float(minimo[1]), float(maximo[0]), float(maximo[1])
+
+
+def punto_mas_cercano(vertices, x, y):
+    """
+    Punto de la polilínea más cercano en planta a (x, y). Devuelve
+    (distancia en planta, punto (3,) con la cota interpolada, índice del
+    vértice más cercano).
+    """
+    objetivo = np.array((x, y), dtype=np.float64)
+    vertice = int(np.argmin(((vertices[:, :2] - objetivo) ** 2).sum(axis=1)))
+    if len(vertices) == 1:
+        return float(np.hypot(*(vertices[0, :2] - objetivo))), vertices[0].copy(), 0
+    tramos = np.diff(vertices, axis=0)
+    cuadrados = (tramos[:, :2] ** 2).sum(axis=1)
+    t = np.divide(((objetivo - vertices[:-1, :2]) * tramos[:, :2]).sum(axis=1), cuadrados,
+                  out=np.zeros(len(tramos)), where=cuadrados > 0)
+    proyecciones = vertices[:-1] + np.clip(t, 0.0, 1.0)[:, None] * tramos
+    distancias = ((proyecciones[:, :2] - objetivo) ** 2).sum(axis=1)
+    tramo = int(np.argmin(distancias))
+    return float(np.sqrt(distancias[tramo])), proyecciones[tramo], vertice
+
+
+def desplazar(vertices, desplazamientos):
+    """
+    Traslada los vértices. desplazamientos es un vector (dx, dy, dz) -> (N, 3)
+    o una lista de D vectores -> (D, N, 3), una copia por vector.
+    """
+    desplazamientos = np.asarray(desplazamientos, dtype=np.float64)
+    if desplazamientos.ndim == 1:
+        return vertices + desplazamientos
+    return vertices[None, :, :] + desplazamientos[:, None, :]
+
+
+def puntos_en(vertices, acumuladas, estaciones):
+    """Array (M, 3) con el punto a cada distancia acumulada; NaN fuera de la polilínea."""
+    estaciones = np.atleast_1d(np.asarray(estaciones, dtype=np.float64))
+    tramos = np.diff(acumuladas)
+    tramo = np.clip(np.searchsorted(acumuladas, estaciones, side='right') - 1, 0, len(tramos) - 1)
+    t = np.divide(estaciones - acumuladas[tramo], tramos[tramo], out=np.zeros(len(estaciones)),
+                  where=tramos[tramo] > 0)
+    puntos = vertices[tramo] + t[:, None] * (vertices[tramo + 1] - vertices[tramo])
+    puntos[(estaciones < acumuladas[0]) | (estaciones > acumuladas[-1])] = np.nan
+    return puntos
+
+
+def estaciones_cada(acumuladas, intervalo, incluir_vertices=True):
+    """Distancias cada intervalo desde la inicial, más las de los vértices (ordenadas, sin repetir)."""
+    estaciones = np.arange(acumuladas[0], acumuladas[-1], intervalo)
+    if incluir_vertices:
+        return np.union1d(estaciones, acumuladas)
+    return np.append(estaciones, acumuladas[-1])
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    angulos = np.linspace(0, 40 * np.pi, n)
+    coordenadas = tuple(np.column_stack((angulos * 30, 200 * np.sin(angulos), 100 + angulos)).ravel().tolist())
+
+    for nombre, operacion in (
+            ('vertices (tupla COM)', lambda: vertices(coordenadas)),
+            ('longitud', lambda: longitud(v, en_planta=True)),
+            ('desplazar x3', lambda: desplazar(v, [(0, 0, 0.8), (0, 0, 1.0), (0, 0, 1.2)])),
+            ('caja', lambda: caja(v)),
+            ('plana', lambda: plana(v))):
+        inicio = time.perf_counter()
+        resultado = operacion()
+        if nombre.startswith('vertices'):
+            v = resultado
+        print(f"{nombre}: {(time.perf_counter() - inicio) * 1000:.1f} ms")
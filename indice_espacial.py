@@ -0,0 +1,552 @@
+"""
+Índice espacial (STR empaquetado) de las entidades del dibujo o de los CSV.
+
+ArbolSTR agrupa las cajas (xmin, ymin, xmax, ymax) en nodos de
+CAPACIDAD_NODO con Sort-Tile-Recursive: las ordena por el centro en x, las
+corta en franjas y dentro de cada franja las ordena por y. Cada nivel es un
+array (K, 4) con las cajas de sus nodos; los hijos del nodo i son los
+elementos i * CAPACIDAD_NODO ... del nivel de abajo, así el árbol no guarda
+punteros. Las consultas por ventana bajan nivel a nivel con NumPy; las de
+los k más cercanos recorren los nodos por distancia con un montículo.
+
+IndiceEspacial guarda por clave (el handle en el dibujo) el tipo, la capa
+y los vértices de cada entidad. Las distancias se miden en planta hasta la
+geometría (punto o polilínea), no hasta la caja. Las entidades añadidas o
+modificadas después de construir el árbol se consultan aparte, sin árbol,
+y las quitadas se marcan; cuando esos pendientes superan
+FRACCION_RECONSTRUCCION del índice, se reconstruye el árbol.
+
+Orígenes:
+- 'dibujo': las entidades del inventario (obtener_objetos.py) con
+  coordenadas. Se pone al día en cada consulta con los cambios del
+  inventario (cambios_desde): solo se leen los handles que cambiaron.
+- 'csv': los puntos de coordenadas.csv (su Etiqueta hace de capa) y
+  las tuberías de info_tuberias.csv; se reconstruye si cambian los archivos.
+
+Rutas:
+    POST /indice_espacial/ventana    {"caja": [xmin, ymin, xmax, ymax]}
+    POST /indice_espacial/radio      {"punto": [x, y], "radio": r}
+    POST /indice_espacial/cercanos   {"punto": [x, y], "k": 10, "radio"?}
+    GET  /indice_espacial/estado
+Todas admiten "origen" ('dibujo' por defecto o 'csv'), "tipo" y "capa"
+(listas) y "limite".
+
+Uso desde la línea de comandos:
+    python indice_espacial.py [entidades] [consultas]   # mide construcción y consultas
+"""
+import heapq
+import logging
+import math
+import os
+import threading
+
+import numpy as np
+from flask import Blueprint, jsonify, request
+
+import geometria
+from carga_csv import leer_tabla_csv
+from estacionamiento import COORDINATES_CSV, PIPES_CSV, extremos_tuberias
+from sesion_cad import obtener_sesion, ErrorSesionCAD
+from validacion import ESQUEMA_COORDENADAS
+
+logger = logging.getLogger(__name__)
+
+indice_espacial_bp = Blueprint('indice_espacial', __name__)
+
+CAPACIDAD_NODO = 16
+FRACCION_RECONSTRUCCION = 0.25
+MINIMO_RECONSTRUCCION = 1024
+LIMITE_RESULTADOS = 10000
+
+
+def _cruzan(cajas, caja):
+    """Máscara de las cajas (N, 4) que tocan caja."""
+    return ((cajas[:, 0] <= caja[2]) & (cajas[:, 2] >= caja[0]) &
+            (cajas[:, 1] <= caja[3]) & (cajas[:, 3] >= caja[1]))
+
+
+def _distancias_cajas(cajas, x, y):
+    """Distancia en planta de (x, y) a cada caja (0 si está dentro)."""
+    dx = np.maximum(np.maximum(cajas[:, 0] - x, x - cajas[:, 2]), 0.0)
+    dy = np.maximum(np.maximum(cajas[:, 1] - y, y - cajas[:, 3]), 0.0)
+    return np.hypot(dx, dy)
+
+
+class ArbolSTR:
+    """Árbol STR empaquetado sobre un array (N, 4) de cajas. Es inmutable: se reconstruye entero."""
+
+    def __init__(self, cajas, capacidad=CAPACIDAD_NODO):
+        cajas = np.asarray(cajas, dtype=np.float64).reshape(-1, 4)
+        self.capacidad = capacidad
+        n = len(cajas)
+        centros = (cajas[:, :2] + cajas[:, 2:]) / 2
+        hojas = max(math.ceil(n / capacidad), 1)
+        por_franja = capacidad * math.ceil(hojas / math.ceil(math.sqrt(hojas)))
+        orden = np.argsort(centros[:, 0], kind='stable')
+        franjas = np.arange(n) // por_franja
+        self.orden = orden[np.lexsort((centros[orden, 1], franjas))]
+
+        # niveles[0] son las cajas de los elementos en el orden del árbol; el
+        # último nivel tiene un solo nodo.
+        self.niveles = [cajas[self.orden]]
+        while len(self.niveles[-1]) > 1:
+            anterior = self.niveles[-1]
+            inicios = np.arange(0, len(anterior), capacidad)
+            self.niveles.append(np.column_stack((
+                np.minimum.reduceat(anterior[:, 0], inicios), np.minimum.reduceat(anterior[:, 1], inicios),
+                np.maximum.reduceat(anterior[:, 2], inicios), np.maximum.reduceat(anterior[:, 3], inicios))))
+
+    def __len__(self):
+        return len(self.orden)
+
+    def _hijos(self, nodos, nivel):
+        hijos = (nodos[:, None] * self.capacidad + np.arange(self.capacidad)).ravel()
+        return hijos[hijos < len(self.niveles[nivel - 1])]
+
+    def en_ventana(self, caja):
+        """Índices (en el array de construcción) de los elementos cuya caja toca caja."""
+        if not len(self.orden):
+            return np.empty(0, dtype=np.int64)
+        nodos = np.arange(len(self.niveles[-1]))
+        for nivel in range(len(self.niveles) - 1, 0, -1):
+            nodos = nodos[_cruzan(self.niveles[nivel][nodos], caja)]
+            if not len(nodos):
+                return np.empty(0, dtype=np.int64)
+            nodos = self._hijos(nodos, nivel)
+        return self.orden[nodos[_cruzan(self.niveles[0][nodos], caja)]]
+
+    def cercanos(self, x, y, k, distancia=None, aceptar=None, maxima=math.inf):
+        """
+        Los k elementos más cercanos a (x, y), como lista de (índice,
+        distancia) ordenada. distancia(índice) da la distancia exacta a la
+        geometría (mayor o igual que a la caja); sin ella se usa la de la
+        caja. aceptar(índice) descarta elementos; maxima limita la búsqueda.
+        """
+        resultado = []
+        if not len(self.orden) or k <= 0:
+            return resultado
+        cima = len(self.niveles) - 1
+        # Entradas (distancia, nivel, índice); el nivel -1 es un elemento con su distancia exacta.
+        monticulo = [(d, cima, i) for i, d in enumerate(_distancias_cajas(self.niveles[cima], x, y).tolist())]
+        heapq.heapify(monticulo)
+        while monticulo and len(resultado) < k:
+            d, nivel, i = heapq.heappop(monticulo)
+            if d > maxima:
+                break
+            if nivel == -1:
+                resultado.append((i, d))
+            elif nivel == 0:
+                elemento = int(self.orden[i])
+                if aceptar is None or aceptar(elemento):
+                    heapq.heappush(monticulo, (distancia(elemento) if distancia else d, -1, elemento))
+            else:
+                hijos = np.arange(i * self.capacidad, min((i + 1) * self.capacidad, len(self.niveles[nivel - 1])))
+                for hijo, d_hijo in zip(hijos.tolist(), _distancias_cajas(self.niveles[nivel - 1][hijos], x, y).tolist()):
+                    if d_hijo <= maxima:
+                        heapq.heappush(monticulo, (d_hijo, nivel - 1, hijo))
+        return resultado
+
+
+class IndiceEspacial:
+    """
+    Entidades (clave, tipo, capa, vértices) indexadas por su caja en planta,
+    con altas, bajas y modificaciones sin reconstruir el árbol cada vez.
+    """
+
+    def __init__(self, capacidad_nodo=CAPACIDAD_NODO):
+        self.capacidad_nodo = capacidad_nodo
+        self.reconstrucciones = 0
+        self.origen = None  # Lo que identifica los datos de los que sale (documento y revisión, archivos...).
+        self._vaciar()
+
+    def _vaciar(self):
+        self._claves, self._tipos, self._capas, self._vertices = [], [], [], []
+        self._cajas = np.empty((0, 4))
+        self._vivas = np.zeros(0, dtype=bool)
+        self._usadas = 0
+        self._posicion = {}  # clave -> índice
+        self._arbol = None
+        self._en_arbol = 0  # Las entradas [0, _en_arbol) están en el árbol; las demás se recorren aparte.
+        self._muertas_en_arbol = 0
+
+    def __len__(self):
+        return len(self._posicion)
+
+    # --- Carga ----------------------------------------------------------------
+
+    def construir(self, entidades):
+        """Reemplaza el contenido por entidades, un iterable de (clave, tipo, capa, vértices)."""
+        self._vaciar()
+        for clave, tipo, capa, vertices in entidades:
+            if len(vertices):
+                self._claves.append(clave)
+                self._tipos.append(tipo)
+                self._capas.append(capa)
+                self._vertices.append(vertices)
+        n = len(self._claves)
+        if n:
+            todos = np.concatenate(self._vertices)
+            inicios = np.cumsum([0] + [len(v) for v in self._vertices[:-1]])
+            self._cajas = np.column_stack((
+                np.minimum.reduceat(todos[:, 0], inicios), np.minimum.reduceat(todos[:, 1], inicios),
+                np.maximum.reduceat(todos[:, 0], inicios), np.maximum.reduceat(todos[:, 1], inicios)))
+        self._vivas = np.ones(n, dtype=bool)
+        self._usadas = n
+        self._posicion = {clave: i for i, clave in enumerate(self._claves)}
+        self._reconstruir_arbol()
+
+    def poner(self, clave, tipo, capa, vertices):
+        """Añade o sustituye una entidad. Sin vértices, solo la quita."""
+        self.quitar(clave)
+        if not len(vertices):
+            return
+        if self._usadas == len(self._cajas):
+            crecida = max(2 * len(self._cajas), 64)
+            self._cajas = np.resize(self._cajas, (crecida, 4))
+            self._vivas = np.concatenate((self._vivas, np.zeros(crecida - len(self._vivas), dtype=bool)))
+        i = self._usadas
+        self._cajas[i] = geometria.caja(vertices)
+        self._vivas[i] = True
+        self._usadas += 1
+        self._claves.append(clave)
+        self._tipos.append(tipo)
+        self._capas.append(capa)
+        self._vertices.append(vertices)
+        self._posicion[clave] = i
+
+    def quitar(self, clave):
+        i = self._posicion.pop(clave, None)
+        if i is None:
+            return
+        self._vivas[i] = False
+        self._vertices[i] = None
+        if i < self._en_arbol:
+            self._muertas_en_arbol += 1
+
+    def mantener(self):
+        """Reconstruye el árbol si las entradas fuera de él o borradas pesan demasiado."""
+        pendientes = self._usadas - self._en_arbol + self._muertas_en_arbol
+        if pendientes > max(MINIMO_RECONSTRUCCION, FRACCION_RECONSTRUCCION * len(self)):
+            self._compactar()
+            self._reconstruir_arbol()
+
+    def _compactar(self):
+        vivas = np.flatnonzero(self._vivas[:self._usadas]).tolist()
+        self._claves = [self._claves[i] for i in vivas]
+        self._tipos = [self._tipos[i] for i in vivas]
+        self._capas = [self._capas[i] for i in vivas]
+        self._vertices = [self._vertices[i] for i in vivas]
+        self._cajas = self._cajas[vivas]
+        self._usadas = len(vivas)
+        self._vivas = np.ones(self._usadas, dtype=bool)
+        self._posicion = {clave: i for i, clave in enumerate(self._claves)}
+
+    def _reconstruir_arbol(self):
+        self._arbol = ArbolSTR(self._cajas[:self._usadas], self.capacidad_nodo)
+        self._en_arbol = self._usadas
+        self._muertas_en_arbol = 0
+        self.reconstrucciones += 1
+
+    # --- Consultas ------------------------------------------------------------
+
+    def _filtro(self, tipos=None, capas=None):
+        def aceptar(i):
+            return (self._vivas[i] and (tipos is None or self._tipos[i] in tipos)
+                    and (capas is None or self._capas[i] in capas))
+        return aceptar
+
+    def _pendientes(self):
+        return np.arange(self._en_arbol, self._usadas)
+
+    def _distancia(self, i, x, y):
+        return geometria.punto_mas_cercano(self._vertices[i], x, y)[0]
+
+    def entrada(self, i, x=None, y=None):
+        """Dict JSON de la entrada i; con (x, y), también la distancia, el punto y el vértice más cercanos."""
+        resultado = {'id': self._claves[i], 'tipo': self._tipos[i], 'capa': self._capas[i],
+                     'caja': self._cajas[i].tolist()}
+        if x is not None:
+            distancia, punto, vertice = geometria.punto_mas_cercano(self._vertices[i], x, y)
+            resultado.update(distancia=round(distancia, 6), punto=punto.tolist(),
+                             vertice=self._vertices[i][vertice].tolist())
+        return resultado
+
+    def en_ventana(self, caja, tipos=None, capas=None):
+        """Índices de las entradas cuya caja toca caja (xmin, ymin, xmax, ymax)."""
+        candidatas = self._arbol.en_ventana(caja) if self._arbol is not None else np.empty(0, dtype=np.int64)
+        pendientes = self._pendientes()
+        candidatas = np.concatenate((candidatas, pendientes[_cruzan(self._cajas[pendientes], caja)]))
+        aceptar = self._filtro(tipos, capas)
+        return [i for i in np.sort(candidatas).tolist() if aceptar(i)]
+
+    def en_radio(self, x, y, radio, tipos=None, capas=None):
+        """(índice, distancia) de las entradas a menos de radio de (x, y), de la más cercana a la más lejana."""
+        resultado = []
+        for i in self.en_ventana((x - radio, y - radio, x + radio, y + radio), tipos, capas):
+            distancia = self._distancia(i, x, y)
+            if distancia <= radio:
+                resultado.append((i, distancia))
+        return sorted(resultado, key=lambda par: par[1])
+
+    def cercanos(self, x, y, k, tipos=None, capas=None, maxima=math.inf):
+        """Las k entradas más cercanas a (x, y): lista de (índice, distancia) ordenada."""
+        aceptar = self._filtro(tipos, capas)
+        resultado = []
+        if self._arbol is not None:
+            resultado = self._arbol.cercanos(x, y, k, lambda i: self._distancia(i, x, y), aceptar, maxima)
+        pendientes = self._pendientes()
+        if len(pendientes):
+            # Solo las pendientes cuya caja está más cerca que la k-ésima ya encontrada.
+            tope = resultado[-1][1] if len(resultado) == k else maxima
+            cerca = pendientes[_distancias_cajas(self._cajas[pendientes], x, y) <= tope]
+            for i in cerca.tolist():
+                if aceptar(i):
+                    distancia = self._distancia(i, x, y)
+                    if distancia <= maxima:
+                        resultado.append((i, distancia))
+            resultado = sorted(resultado, key=lambda par: par[1])[:k]
+        return resultado
+
+    def estadisticas(self):
+        return {
+            'entidades': len(self),
+            'en_arbol': self._en_arbol - self._muertas_en_arbol,
+            'pendientes': self._usadas - self._en_arbol,
+            'borradas_pendientes': self._muertas_en_arbol,
+            'niveles': len(self._arbol.niveles) if self._arbol is not None else 0,
+            'reconstrucciones': self.reconstrucciones,
+        }
+
+
+# --- Orígenes -------------------------------------------------------------------
+
+indice_dibujo = IndiceEspacial()
+_indice_csv = IndiceEspacial()
+_bloqueo_csv = threading.Lock()
+
+
+def sincronizar_indice_dibujo(backend):
+    """
+    Pone indice_dibujo al día con el inventario del espacio modelo. Solo se
+    leen los vértices de los handles que cambiaron desde la última vez; si
+    el inventario no puede decirlo, se leen todos. Se ejecuta en la sesión CAD.
+    """
+    from obtener_objetos import inventario
+
+    inventario.actualizar(backend)
+    documento, revision = indice_dibujo.origen or (None, None)
+    cambios = inventario.cambios_desde(revision) if documento == inventario.documento else None
+    # Una entidad que no se puede leer se deja fuera del índice en lugar de hacer fallar la consulta.
+    omitidas = 0
+    if cambios is None:
+        def entidades():
+            nonlocal omitidas
+            for objeto in backend.iterar_objetos():
+                try:
+                    handle = backend.handle(objeto)
+                    fila = inventario.fila(handle)
+                    if fila is not None:
+                        yield handle, fila['ObjectName'], fila['Layer'], backend.vertices(objeto)
+                except Exception as e:
+                    omitidas += 1
+                    logger.debug(f"Entidad omitida en el índice espacial: {e}")
+
+        indice_dibujo.construir(entidades())
+        logger.info(f"Índice espacial del dibujo construido: {len(indice_dibujo)} entidades con coordenadas.")
+    else:
+        modificados, quitados = cambios
+        for handle in quitados:
+            indice_dibujo.quitar(handle)
+        for handle in modificados:
+            fila = inventario.fila(handle)
+            try:
+                objeto = backend.obtener_objeto(handle) if fila is not None else None
+                vertices = backend.vertices(objeto) if objeto is not None else None
+            except Exception as e:
+                omitidas += 1
+                logger.debug(f"Entidad {handle} omitida en el índice espacial: {e}")
+                vertices = None
+            if vertices is None:
+                indice_dibujo.quitar(handle)
+            else:
+                indice_dibujo.poner(handle, fila['ObjectName'], fila['Layer'], vertices)
+        indice_dibujo.mantener()
+    if omitidas:
+        logger.warning(f"{omitidas} entidades no se pudieron leer y quedan fuera del índice espacial.")
+    indice_dibujo.origen = (inventario.documento, inventario.revision)
+    return indice_dibujo
+
+
+def indice_csv(ruta_coordenadas=COORDINATES_CSV, ruta_tuberias=PIPES_CSV):
+    """Índice de los puntos y tuberías de los CSV, reconstruido solo si los archivos cambian."""
+    huella = tuple((ruta, os.path.getmtime(ruta)) if os.path.exists(ruta) else (ruta, None)
+                   for ruta in (ruta_coordenadas, ruta_tuberias))
+    with _bloqueo_csv:
+        if _indice_csv.origen != huella:
+            puntos, _ = leer_tabla_csv(ruta_coordenadas, ESQUEMA_COORDENADAS)
+            xyz = puntos.coordenadas()
+            entidades = [(f"punto:{id_punto}", 'AcDbPoint', etiqueta, xyz[i:i + 1])
+                         for i, (id_punto, etiqueta) in enumerate(zip(puntos['ID'].tolist(), puntos['Etiqueta'].tolist()))]
+            if huella[1][1] is not None:
+                tuberias, inicios, fines, validas = extremos_tuberias(ruta_coordenadas, ruta_tuberias)
+                entidades += [(f"tuberia:{id_tuberia}", 'AeccDbPipe', '', np.stack((inicios[i], fines[i])))
+                              for i, id_tuberia in enumerate(tuberias['ID_TUBERIA'][validas].tolist())]
+            _indice_csv.construir(entidades)
+            _indice_csv.origen = huella
+            logger.info(f"Índice espacial de los CSV construido: {len(_indice_csv)} entidades.")
+        return _indice_csv
+
+
+# --- Rutas --------------------------------------------------------------------------
+
+def _punto(data):
+    punto = data.get('punto')
+    if (not isinstance(punto, (list, tuple)) or len(punto) < 2
+            or not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in punto[:2])):
+        raise ValueError("punto debe ser [x, y].")
+    return float(punto[0]), float(punto[1])
+
+
+def _numero(data, clave, defecto, entero=False):
+    valor = data.get(clave, defecto)
+    if not isinstance(valor, (int, float)) or isinstance(valor, bool) or valor < 0 or (entero and valor != int(valor)):
+        raise ValueError(f"{clave} debe ser un número {'entero ' if entero else ''}no negativo.")
+    return int(valor) if entero else float(valor)
+
+
+def _lista(data, clave):
+    valor = data.get(clave)
+    if valor is None:
+        return None
+    if isinstance(valor, str):
+        valor = [valor]
+    if not isinstance(valor, list) or not all(isinstance(v, str) for v in valor):
+        raise ValueError(f"{clave} debe ser un texto o una lista de textos.")
+    return set(valor)
+
+
+def consultar_indice(indice, consulta, parametros):
+    """Ejecuta una consulta ('ventana', 'radio' o 'cercanos') y devuelve el dict de respuesta."""
+    tipos, capas, limite = parametros['tipos'], parametros['capas'], parametros['limite']
+    if consulta == 'ventana':
+        indices = indice.en_ventana(parametros['caja'], tipos, capas)
+        entidades = [indice.entrada(i) for i in indices[:limite]]
+        return {'entidades': entidades, 'total': len(indices), 'truncado': len(indices) > limite}
+    x, y = parametros['punto']
+    if consulta == 'radio':
+        pares = indice.en_radio(x, y, parametros['radio'], tipos, capas)
+    else:
+        pares = indice.cercanos(x, y, min(parametros['k'], limite), tipos, capas, parametros['radio'])
+    entidades = [indice.entrada(i, x, y) for i, _ in pares[:limite]]
+    return {'entidades': entidades, 'total': len(pares), 'truncado': len(pares) > limite}
+
+
+def _consultar_dibujo_acad(backend, consulta, parametros):
+    return consultar_indice(sincronizar_indice_dibujo(backend), consulta, parametros)
+
+
+def _responder(consulta, leer_parametros):
+    try:
+        data = request.get_json(silent=True) or {}
+        try:
+            origen = data.get('origen', 'dibujo')
+            if origen not in ('dibujo', 'csv'):
+                raise ValueError("origen debe ser 'dibujo' o 'csv'.")
+            parametros = {'tipos': _lista(data, 'tipo'), 'capas': _lista(data, 'capa'),
+                          'limite': min(_numero(data, 'limite', LIMITE_RESULTADOS, entero=True), LIMITE_RESULTADOS),
+                          **leer_parametros(data)}
+        except ValueError as e:
+            return jsonify({'error': f'Parámetros no válidos: {e}'}), 400
+
+        if origen == 'csv':
+            resultado = consultar_indice(indice_csv(), consulta, parametros)
+        else:
+            resultado = obtener_sesion().ejecutar(_consultar_dibujo_acad, consulta, parametros)
+        return jsonify({'origen': origen, **resultado}), 200
+
+    except ErrorSesionCAD as e:
+        logger.error(f"Error de conexión al consultar el índice espacial: {e}")
+        return jsonify({'error': 'No se pudo conectar con AutoCAD.'}), 500
+    except OSError as e:
+        logger.error(f"Error al leer los CSV para el índice espacial: {e}")
+        return jsonify({'error': f'No se pudieron leer los archivos: {e}'}), 500
+    except Exception as e:
+        logger.error(f"Error al consultar el índice espacial: {e}")
+        return jsonify({'error': f'Error al consultar el índice espacial: {e}'}), 500
+
+
+def _parametros_ventana(data):
+    caja = data.get('caja')
+    if (not isinstance(caja, list) or len(caja) != 4
+            or not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in caja)
+            or caja[0] > caja[2] or caja[1] > caja[3]):
+        raise ValueError("caja debe ser [xmin, ymin, xmax, ymax].")
+    return {'caja': tuple(float(v) for v in caja)}
+
+
+def _parametros_radio(data):
+    return {'punto': _punto(data), 'radio': _numero(data, 'radio', None)}
+
+
+def _parametros_cercanos(data):
+    maxima = data.get('radio')
+    return {'punto': _punto(data), 'k': max(_numero(data, 'k', 10, entero=True), 1),
+            'radio': _numero(data, 'radio', None) if maxima is not None else math.inf}
+
+
+@indice_espacial_bp.route('/indice_espacial/ventana', methods=['POST'])
+def consultar_ventana():
+    """Entidades cuya caja toca {"caja": [xmin, ymin, xmax, ymax]}."""
+    return _responder('ventana', _parametros_ventana)
+
+
+@indice_espacial_bp.route('/indice_espacial/radio', methods=['POST'])
+def consultar_radio():
+    """Entidades a menos de "radio" de "punto" (distancia en planta a la geometría)."""
+    return _responder('radio', _parametros_radio)
+
+
+@indice_espacial_bp.route('/indice_espacial/cercanos', methods=['POST'])
+def consultar_cercanos():
+    """Las "k" entidades más cercanas a "punto", como mucho a "radio" si se da."""
+    return _responder('cercanos', _parametros_cercanos)
+
+
+@indice_espacial_bp.route('/indice_espacial/estado', methods=['GET'])
+def estado_indices():
+    return jsonify({'dibujo': indice_dibujo.estadisticas(), 'csv': _indice_csv.estadisticas()}), 200
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    consultas = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    azar = np.random.default_rng(0)
+    origenes = azar.uniform(0, 10000, (n, 2))
+    largos = azar.uniform(0, 20, (n, 2)) * (azar.random(n) < 0.5)[:, None]  # la mitad puntos, la mitad tramos
+    entidades = [(format(0x100 + i, 'X'), 'AcDbPoint' if not largos[i].any() else 'AcDb3dPolyline', '0',
+                  np.array([[*origenes[i], 0.0], [*(origenes[i] + largos[i]), 0.0]])[:1 if not largos[i].any() else 2])
+                 for i in range(n)]
+
+    indice = IndiceEspacial()
+    inicio = time.perf_counter()
+    indice.construir(entidades)
+    print(f"{n} entidades indexadas en {(time.perf_counter() - inicio) * 1000:.1f} ms {indice.estadisticas()}")
+
+    puntos = azar.uniform(0, 10000, (consultas, 2)).tolist()
+    for nombre, consulta in (
+            ('ventana 100 x 100', lambda x, y: indice.en_ventana((x, y, x + 100, y + 100))),
+            ('radio 50', lambda x, y: indice.en_radio(x, y, 50)),
+            ('10 más cercanos', lambda x, y: indice.cercanos(x, y, 10))):
+        inicio = time.perf_counter()
+        encontrados = sum(len(consulta(x, y)) for x, y in puntos)
+        print(f"{consultas} consultas {nombre}: {(time.perf_counter() - inicio) * 1000:.1f} ms "
+              f"({encontrados / consultas:.1f} resultados de media)")
+
+    inicio = time.perf_counter()
+    for i in range(2000):
+        indice.poner(format(0x100 + i, 'X'), 'AcDbPoint', '0', np.array([[5000.0 + i, 5000.0, 0.0]]))
+    indice.mantener()
+    print(f"2000 entidades modificadas en {(time.perf_counter() - inicio) * 1000:.1f} ms {indice.estadisticas()}")
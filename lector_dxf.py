@@ -0,0 +1,206 @@
+"""
+Lectura en streaming de archivos DXF (ASCII) hacia el almacén del proyecto.
+
+leer_dxf recorre el archivo par a par (código de grupo, valor) y genera una
+entidad (dict) cada vez que termina una en la sección ENTITIES; solo
+guarda en memoria la entidad en curso. importar_dxf las escribe en el
+AlmacenProyecto por lotes. Tipos que se leen (con el ObjectName de los
+backends):
+
+    POINT -> AcDbPoint              TEXT / MTEXT -> AcDbText / AcDbMText
+    LINE -> AcDbLine                LWPOLYLINE -> AcDbPolyline
+    POLYLINE + VERTEX -> AcDb3dPolyline (o AcDb2dPolyline)
+    ARC / CIRCLE -> AcDbArc / AcDbCircle
+    INSERT -> AcDbBlockReference    3DFACE -> AcDbFace
+
+Las XData se guardan en atributos['xdata'] por aplicación, así las tuberías
+que escribe exportar_dxf.py conservan sus datos de TUBERIA_DATA.
+"""
+import logging
+import math
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+TIPOS_DXF = {
+    'POINT': 'AcDbPoint',
+    'TEXT': 'AcDbText',
+    'MTEXT': 'AcDbMText',
+    'LINE': 'AcDbLine',
+    'LWPOLYLINE': 'AcDbPolyline',
+    'ARC': 'AcDbArc',
+    'CIRCLE': 'AcDbCircle',
+    'INSERT': 'AcDbBlockReference',
+    '3DFACE': 'AcDbFace',
+}
+
+_UNICODE = re.compile(r'\\U\+([0-9A-Fa-f]{4})')
+
+
+def _codificacion(ruta):
+    """Codificación del archivo según la cabecera: UTF-8 desde AutoCAD 2007 (AC1021), si no la $DWGCODEPAGE."""
+    version, pagina, variable = None, None, None
+    with open(ruta, encoding='latin-1') as archivo:
+        for codigo, valor in _pares(archivo):
+            valor = valor.strip()
+            if codigo == 9:
+                variable = valor
+            elif codigo == 1 and variable == '$ACADVER':
+                version = valor
+            elif codigo == 3 and variable == '$DWGCODEPAGE':
+                pagina = valor
+            elif codigo == 0 and valor == 'ENDSEC':
+                break  # fin de la cabecera
+    if version and version >= 'AC1021':
+        return 'utf-8'
+    if pagina and pagina.upper().startswith('ANSI_'):
+        return f"cp{pagina[5:]}"
+    return 'cp1252'
+
+
+def _pares(archivo):
+    """Genera (código, valor) con el código como int."""
+    for codigo, valor in zip(archivo, archivo):
+        yield int(codigo), valor.rstrip('\r\n')
+
+
+def _texto(valor):
+    return _UNICODE.sub(lambda m: chr(int(m.group(1), 16)), valor)
+
+
+def _valor_xdata(codigo, valor):
+    if 1040 <= codigo <= 1042 or 1010 <= codigo <= 1059:
+        return float(valor)
+    if 1060 <= codigo <= 1071:
+        return int(valor)
+    return _texto(valor)
+
+
+def _convertir(tipo_dxf, pares):
+    """Convierte los pares de una entidad en un dict con tipo, handle, capa, nombre, coordenadas y atributos."""
+    entidad = {'tipo': TIPOS_DXF.get(tipo_dxf), 'handle': None, 'capa': None, 'nombre': None, 'atributos': {}}
+    atributos = entidad['atributos']
+    valores = {}
+    vertices = []
+    xdata = {}
+    aplicacion = None
+    textos = []
+    for codigo, valor in pares:
+        if codigo >= 1000:
+            if codigo == 1001:
+                aplicacion = valor.strip()
+                xdata[aplicacion] = []
+            elif aplicacion is not None:
+                xdata[aplicacion].append([codigo, _valor_xdata(codigo, valor)])
+            continue
+        if codigo == 5:
+            entidad['handle'] = valor.strip()
+        elif codigo == 8:
+            entidad['capa'] = valor.strip()
+        elif codigo in (1, 3):
+            textos.append(valor)
+        elif tipo_dxf == 'LWPOLYLINE' and codigo == 10:
+            vertices.append([float(valor), 0.0])
+        elif tipo_dxf == 'LWPOLYLINE' and codigo == 20:
+            vertices[-1][1] = float(valor)
+        else:
+            valores.setdefault(codigo, valor)
+
+    def numero(codigo, defecto=0.0):
+        return float(valores.get(codigo, defecto))
+
+    if tipo_dxf in ('POINT', 'TEXT', 'MTEXT', 'INSERT', 'ARC', 'CIRCLE'):
+        entidad['coordenadas'] = (numero(10), numero(20), numero(30))
+    elif tipo_dxf == 'LINE':
+        entidad['coordenadas'] = (numero(10), numero(20), numero(30), numero(11), numero(21), numero(31))
+    elif tipo_dxf == '3DFACE':
+        entidad['coordenadas'] = tuple(numero(base + i) for i in range(4) for base in (10, 20, 30))
+    elif tipo_dxf == 'LWPOLYLINE':
+        elevacion = numero(38)
+        entidad['coordenadas'] = tuple(v for x, y in vertices for v in (x, y, elevacion))
+        atributos['cerrada'] = bool(int(valores.get(70, 0)) & 1)
+
+    if tipo_dxf in ('TEXT', 'MTEXT'):
+        # En MTEXT los trozos 3 van antes que el 1 final.
+        atributos['texto'] = _texto(''.join(textos))
+        atributos['altura'] = numero(40)
+    elif tipo_dxf in ('ARC', 'CIRCLE'):
+        atributos['radio'] = numero(40)
+        if tipo_dxf == 'ARC':
+            atributos['angulo_inicio'] = math.radians(numero(50))
+            atributos['angulo_fin'] = math.radians(numero(51))
+    elif tipo_dxf == 'INSERT':
+        entidad['nombre'] = valores.get(2, '').strip()
+    if xdata:
+        atributos['xdata'] = xdata
+    return entidad, valores
+
+
+def leer_dxf(ruta):
+    """
+    Genera las entidades de la sección ENTITIES de un DXF ASCII.
+
+    Las entidades de tipos no soportados se generan como
+    {'tipo': None, 'tipo_dxf': ...} para que el llamador las cuente.
+    """
+    with open(ruta, encoding=_codificacion(ruta), errors='replace') as archivo:
+        pares = _pares(archivo)
+        en_entidades = False
+        actual = None          # (tipo DXF, pares) de la entidad en curso
+        polilinea = None       # (entidad POLYLINE, flags, vértices) mientras se leen sus VERTEX
+        for codigo, valor in pares:
+            valor_limpio = valor.strip() if codigo in (0, 2) else valor
+            if codigo != 0:
+                if actual is not None:
+                    actual[1].append((codigo, valor))
+                elif not en_entidades and codigo == 2 and valor_limpio == 'ENTITIES':
+                    en_entidades = True
+                continue
+
+            # Código 0: termina la entidad anterior y empieza otra (o una sección).
+            if actual is not None:
+                tipo_dxf, datos = actual
+                actual = None
+                if tipo_dxf == 'POLYLINE':
+                    entidad, valores = _convertir(tipo_dxf, datos)
+                    polilinea = (entidad, int(valores.get(70, 0)), [])
+                elif tipo_dxf == 'VERTEX' and polilinea is not None:
+                    _, valores = _convertir(tipo_dxf, datos)
+                    if not int(valores.get(70, 0)) & 128:  # 128: vértice de caras de malla poliédrica
+                        polilinea[2].extend(float(valores.get(c, 0.0)) for c in (10, 20, 30))
+                elif tipo_dxf == 'SEQEND' and polilinea is not None:
+                    entidad, banderas, coordenadas = polilinea
+                    polilinea = None
+                    entidad['tipo'] = 'AcDb3dPolyline' if banderas & 8 else 'AcDb2dPolyline'
+                    entidad['coordenadas'] = tuple(coordenadas)
+                    entidad['atributos']['cerrada'] = bool(banderas & 1)
+                    yield entidad
+                elif tipo_dxf in TIPOS_DXF:
+                    yield _convertir(tipo_dxf, datos)[0]
+                else:
+                    yield {'tipo': None, 'tipo_dxf': tipo_dxf}
+
+            if valor_limpio == 'ENDSEC':
+                en_entidades = False
+            elif valor_limpio == 'EOF':
+                return
+            elif en_entidades:
+                actual = (valor_limpio, [])
+
+
+def importar_dxf(almacen, ruta, nombre=None):
+    """Lee un DXF en streaming y lo escribe en el almacén. Devuelve {'entidades_por_tipo': ..., 'omitidos': ...}."""
+    almacen.iniciar_origen(nombre or os.path.basename(ruta), 'dxf')
+    contadores, omitidos = {}, {}
+    for entidad in leer_dxf(ruta):
+        if entidad['tipo'] is None:
+            omitidos[entidad['tipo_dxf']] = omitidos.get(entidad['tipo_dxf'], 0) + 1
+            continue
+        almacen.agregar_entidad(entidad['tipo'], entidad['coordenadas'], handle=entidad['handle'],
+                                capa=entidad['capa'], nombre=entidad['nombre'], atributos=entidad['atributos'])
+        contadores[entidad['tipo']] = contadores.get(entidad['tipo'], 0) + 1
+    almacen.confirmar()
+    if omitidos:
+        logger.info(f"Entidades DXF no soportadas omitidas: {omitidos}")
+    return {'entidades_por_tipo': contadores, 'omitidos': sum(omitidos.values())}
@@ -0,0 +1,266 @@
+"""
+Lectura en streaming de archivos LandXML hacia el almacén del proyecto.
+
+importar_landxml recorre el archivo con ElementTree.iterparse y escribe en
+el AlmacenProyecto cada elemento en cuanto se cierra, después de quitarlo
+del árbol, así la memoria no crece con el tamaño del archivo (salvo los id
+de las estructuras de la red que se está leyendo). Se leen:
+
+- CgPoint            -> AeccDbCogoPoint
+- Surface (TIN)      -> AeccDbSurface, con sus puntos y caras en tablas propias
+- Alignment          -> AeccDbAlignment (curvas discretizadas) y sus perfiles
+                        (ProfSurf / ProfAlign) -> AeccDbProfile
+- PipeNetwork        -> AeccDbStructure y AeccDbPipe
+
+Sirve para los LandXML de Civil 3D y para los que genera exportar_landxml.py.
+"""
+import logging
+import math
+import os
+import xml.etree.ElementTree as ET
+
+logger = logging.getLogger(__name__)
+
+PASO_ANGULAR_CURVAS = math.radians(5)
+
+
+def _etiqueta(elemento):
+    return elemento.tag.rsplit('}', 1)[-1]
+
+
+def _numeros(texto):
+    return [float(v) for v in (texto or '').split()]
+
+
+def _en(texto):
+    """'norte este [cota]' de LandXML -> (x, y, z)."""
+    valores = _numeros(texto)
+    if len(valores) < 2:
+        return None
+    return valores[1], valores[0], valores[2] if len(valores) > 2 else 0.0
+
+
+def _hijo(elemento, nombre):
+    return next((h for h in elemento if _etiqueta(h) == nombre), None)
+
+
+def _flotante(valor, defecto=None):
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return defecto
+
+
+def puntos_curva(inicio, centro, fin, horario):
+    """Discretiza un arco de centro dado en planta. Devuelve los vértices (x, y) sin el inicial."""
+    radio = math.hypot(inicio[0] - centro[0], inicio[1] - centro[1])
+    angulo_inicio = math.atan2(inicio[1] - centro[1], inicio[0] - centro[0])
+    angulo_fin = math.atan2(fin[1] - centro[1], fin[0] - centro[0])
+    barrido = angulo_fin - angulo_inicio
+    if horario and barrido > 0:
+        barrido -= 2 * math.pi
+    elif not horario and barrido < 0:
+        barrido += 2 * math.pi
+    pasos = max(2, math.ceil(abs(barrido) / PASO_ANGULAR_CURVAS))
+    vertices = [(centro[0] + radio * math.cos(angulo_inicio + barrido * i / pasos),
+                 centro[1] + radio * math.sin(angulo_inicio + barrido * i / pasos)) for i in range(1, pasos)]
+    vertices.append((fin[0], fin[1]))
+    return vertices
+
+
+class _LectorLandXML:
+    """Estado de una lectura: qué elemento contenedor está abierto (superficie, red, alineación)."""
+
+    def __init__(self, almacen):
+        self.almacen = almacen
+        self.contadores = {}
+        self.omitidos = 0
+        self._superficie = None
+        self._ids_superficie = None
+        self._caja_superficie = None
+        self._red = None
+        self._estructuras = {}
+
+    def _contar(self, tipo):
+        self.contadores[tipo] = self.contadores.get(tipo, 0) + 1
+
+    # --- Apertura de contenedores ---------------------------------------------
+
+    def abrir(self, elemento):
+        etiqueta = _etiqueta(elemento)
+        if etiqueta == 'Surface':
+            nombre = elemento.get('name')
+            self._superficie = self.almacen.agregar_entidad(
+                'AeccDbSurface', (), nombre=nombre, atributos={'descripcion': elemento.get('desc', '')})
+            self._ids_superficie = {}
+            self._caja_superficie = [math.inf, math.inf, -math.inf, -math.inf]
+            self._contar('AeccDbSurface')
+        elif etiqueta == 'PipeNetwork':
+            self._red = elemento.get('name', '')
+            self._estructuras = {}
+
+    # --- Cierre de elementos -----------------------------------------------------
+
+    def cerrar(self, elemento):
+        """Procesa un elemento cerrado; los que no interesan se ignoran."""
+        etiqueta = _etiqueta(elemento)
+        metodo = getattr(self, f'_leer_{etiqueta}', None)
+        if metodo is None:
+            return
+        try:
+            metodo(elemento)
+        except (AttributeError, TypeError, ValueError, IndexError, KeyError) as e:
+            self.omitidos += 1
+            logger.warning(f"Elemento {etiqueta} '{elemento.get('name', '')}' no válido, se omite: {e}")
+
+    def _leer_CgPoint(self, elemento):
+        punto = _en(elemento.text)
+        if punto is None:
+            self.omitidos += 1  # CgPoint por referencia (pntRef): no trae coordenadas
+            return
+        self.almacen.agregar_entidad('AeccDbCogoPoint', punto, nombre=elemento.get('name'),
+                                     atributos={k: v for k, v in elemento.attrib.items() if k in ('desc', 'code')})
+        self._contar('AeccDbCogoPoint')
+
+    def _leer_P(self, elemento):
+        if self._superficie is None:
+            return
+        x, y, z = _en(elemento.text)
+        identificador = elemento.get('id')
+        try:
+            identificador = int(identificador)
+        except (TypeError, ValueError):
+            identificador = self._ids_superficie.setdefault(identificador, len(self._ids_superficie) + 1)
+        caja = self._caja_superficie
+        caja[0], caja[1], caja[2], caja[3] = min(caja[0], x), min(caja[1], y), max(caja[2], x), max(caja[3], y)
+        self.almacen.agregar_puntos_superficie(self._superficie, ((identificador, x, y, z),))
+
+    def _leer_F(self, elemento):
+        if self._superficie is None or elemento.get('i') == '1':  # i="1": cara invisible (fuera del contorno)
+            return
+        vertices = (elemento.text or '').split()
+        if self._ids_superficie:
+            vertices = [self._ids_superficie[v] for v in vertices]
+        a, b, c = (int(v) for v in vertices[:3])
+        self.almacen.agregar_caras_superficie(self._superficie, ((a, b, c),))
+
+    def _leer_Surface(self, elemento):
+        if self._superficie is not None and math.isfinite(self._caja_superficie[0]):
+            self.almacen.actualizar_caja(self._superficie, self._caja_superficie)
+        self._superficie = None
+        self._ids_superficie = None
+
+    def _leer_Struct(self, elemento):
+        centro = _en(_hijo(elemento, 'Center').text)
+        cota = _flotante(elemento.get('elevSump'), _flotante(elemento.get('elevRim'), centro[2]))
+        x, y = centro[0], centro[1]
+        nombre = elemento.get('name')
+        self._estructuras[nombre] = (x, y, cota)
+        self.almacen.agregar_entidad('AeccDbStructure', (x, y, cota), nombre=nombre, atributos={
+            'red': self._red, 'cota_tapa': _flotante(elemento.get('elevRim')), 'cota_fondo': _flotante(elemento.get('elevSump')),
+        })
+        self._contar('AeccDbStructure')
+
+    def _leer_Pipe(self, elemento):
+        inicio = self._estructuras.get(elemento.get('refStart'))
+        fin = self._estructuras.get(elemento.get('refEnd'))
+        if inicio is None or fin is None:
+            self.omitidos += 1
+            logger.warning(f"La tubería '{elemento.get('name')}' referencia estructuras que no existen; se omite.")
+            return
+        atributos = {'red': self._red, 'inicio': elemento.get('refStart'), 'fin': elemento.get('refEnd')}
+        for clave, atributo in (('longitud', 'length'), ('pendiente', 'slope')):
+            if elemento.get(atributo) is not None:
+                atributos[clave] = _flotante(elemento.get(atributo))
+        if elemento.get('desc'):
+            atributos['descripcion'] = elemento.get('desc')
+        seccion = _hijo(elemento, 'CircPipe')
+        if seccion is not None:
+            atributos['diametro'] = _flotante(seccion.get('diameter'))
+            if seccion.get('material'):
+                atributos['material'] = seccion.get('material')
+        caracteristica = _hijo(elemento, 'Feature')
+        if caracteristica is not None:
+            atributos.update({p.get('label'): p.get('value') for p in caracteristica if _etiqueta(p) == 'Property'})
+        self.almacen.agregar_entidad('AeccDbPipe', (*inicio, *fin), nombre=elemento.get('name'), atributos=atributos)
+        self._contar('AeccDbPipe')
+
+    def _leer_PipeNetwork(self, elemento):
+        self._red = None
+        self._estructuras = {}
+
+    def _leer_Alignment(self, elemento):
+        nombre = elemento.get('name')
+        geometria = _hijo(elemento, 'CoordGeom')
+        vertices, elementos = [], []
+        for tramo in (geometria if geometria is not None else ()):
+            tipo = _etiqueta(tramo)
+            inicio, fin = _en(_hijo(tramo, 'Start').text), _en(_hijo(tramo, 'End').text)
+            if not vertices:
+                vertices.append(inicio[:2])
+            if tipo == 'Curve':
+                centro = _en(_hijo(tramo, 'Center').text)
+                vertices.extend(puntos_curva(inicio, centro, fin, tramo.get('rot') == 'cw'))
+                elementos.append({'tipo': 'Curve', 'inicio': inicio[:2], 'fin': fin[:2], 'centro': centro[:2],
+                                  'radio': _flotante(tramo.get('radius')), 'giro': tramo.get('rot', 'ccw')})
+            else:
+                # Line y, como aproximación, Spiral: de Start a End.
+                vertices.append(fin[:2])
+                elementos.append({'tipo': tipo, 'inicio': inicio[:2], 'fin': fin[:2]})
+        coordenadas = [valor for x, y in vertices for valor in (x, y, 0.0)]
+        alineacion = self.almacen.agregar_entidad('AeccDbAlignment', coordenadas, nombre=nombre, atributos={
+            'estacion_inicial': _flotante(elemento.get('staStart'), 0.0),
+            'longitud': _flotante(elemento.get('length')),
+            'elementos': elementos,
+        })
+        self._contar('AeccDbAlignment')
+
+        for perfil in (h for h in elemento if _etiqueta(h) == 'Profile'):
+            for rasante in perfil:
+                self._leer_perfil(rasante, nombre, alineacion)
+
+    def _leer_perfil(self, elemento, alineacion, id_alineacion):
+        etiqueta = _etiqueta(elemento)
+        if etiqueta == 'ProfSurf':
+            lista = _hijo(elemento, 'PntList2D')
+            valores = _numeros(lista.text if lista is not None else '')
+            puntos = list(zip(valores[0::2], valores[1::2]))
+            tipo = 'Terreno'
+        elif etiqueta == 'ProfAlign':
+            # Vértices de la rasante: PVI y los PVI de las curvas verticales.
+            puntos = [tuple(_numeros(h.text)[:2]) for h in elemento if _etiqueta(h) in ('PVI', 'ParaCurve', 'CircCurve')]
+            tipo = 'Rasante'
+        else:
+            return
+        coordenadas = [valor for estacion, cota in puntos for valor in (estacion, 0.0, cota)]
+        self.almacen.agregar_entidad('AeccDbProfile', coordenadas, nombre=elemento.get('name'), atributos={
+            'alineacion': alineacion, 'id_alineacion': id_alineacion, 'tipo': tipo, 'estilo': elemento.get('desc', ''),
+        })
+        self._contar('AeccDbProfile')
+
+
+def importar_landxml(almacen, ruta, nombre=None):
+    """
+    Lee un LandXML en streaming y lo escribe en el almacén (ver el docstring
+    del módulo). Devuelve {'entidades_por_tipo': ..., 'omitidos': ...}.
+    """
+    almacen.iniciar_origen(nombre or os.path.basename(ruta), 'landxml')
+    lector = _LectorLandXML(almacen)
+    pila = []
+    for evento, elemento in ET.iterparse(ruta, events=('start', 'end')):
+        if evento == 'start':
+            pila.append(elemento)
+            lector.abrir(elemento)
+            continue
+        pila.pop()
+        # Los hijos de Alignment, Pipe y Struct se leen con el elemento padre.
+        if pila and _etiqueta(pila[-1]) in ('Alignment', 'Pipe', 'Struct', 'CoordGeom', 'Profile', 'ProfAlign',
+                                              'ProfSurf', 'Curve', 'Line', 'Spiral', 'Feature'):
+            continue
+        lector.cerrar(elemento)
+        # Ya leído: se quita del árbol para que la memoria no crezca.
+        elemento.clear()
+        if pila:
+            pila[-1].remove(elemento)
+    almacen.confirmar()
+    return {'entidades_por_tipo': lector.contadores, 'omitidos': lector.omitidos}
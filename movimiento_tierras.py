@@ -0,0 +1,354 @@
+"""
+Movimiento de tierras: corte y relleno entre perfiles y excavación de zanjas.
+
+Todas las cuentas se hacen con perfiles lineales a tramos. En cada tramo la
+altura h (terreno menos rasante) varía linealmente y la sección
+transversal es un trapecio de base ancho y taludes talud (H:V):
+
+    A(h) = h · (ancho + talud · h)
+
+así el volumen del tramo tiene fórmula cerrada y se integra de una vez para
+todos los tramos; los tramos donde h cambia de signo se parten en el punto
+de cruce. Con ancho 1 y talud 0 el "volumen" es el área entre perfiles.
+
+- corte_relleno compara dos perfiles (estación, cota) y da las áreas o
+  volúmenes de corte (terreno por encima de la rasante) y de relleno, con
+  sus acumulados.
+- excavacion_tuberias calcula la zanja de cada tubería de
+  info_tuberias.csv: ancho según el diámetro (en mm) más la holgura a cada
+  lado, fondo bajo la cota de batea más la cama, y terreno de la
+  superficie TIN o, si no se da, de la Z de los puntos de coordenadas.csv.
+  La batea de cada extremo queda a recubrimiento + diámetro bajo la Z del
+  punto. Las tuberías se procesan por bloques vectorizados, así una red de
+  decenas de miles de tuberías se resuelve en una petición.
+
+Uso desde la línea de comandos:
+    python movimiento_tierras.py [tuberias] [intervalo]   # mide una red sintética
+"""
+import logging
+
+import numpy as np
+from flask import Blueprint, jsonify, request
+
+from cache_objetos import instantanea
+from estacionamiento import COORDINATES_CSV, PIPES_CSV, estacionamiento_de, extremos_tuberias
+from sesion_cad import obtener_sesion, ErrorSesionCAD
+
+logger = logging.getLogger(__name__)
+
+movimiento_tierras_bp = Blueprint('movimiento_tierras', __name__)
+
+RECUBRIMIENTO = 1.0
+HOLGURA_ZANJA = 0.3
+ANCHO_MINIMO_ZANJA = 0.6
+ESPESOR_CAMA = 0.1
+TALUD_ZANJA = 0.0
+MUESTRAS_POR_BLOQUE = 1_000_000
+
+
+def integral_seccion(longitudes, h0, h1, ancho=1.0, talud=0.0):
+    """
+    Volumen de la parte con h > 0 de cada tramo de longitud dada y h lineal
+    de h0 a h1, con la sección A(h) = h · (ancho + talud · h).
+    """
+    p0, p1 = np.maximum(h0, 0.0), np.maximum(h1, 0.0)
+    cruza = (h0 > 0) != (h1 > 0)
+    # Si cruza, uno de los dos es 0 y el tramo útil va de 0 a p0 + p1.
+    salto = np.abs(h0) + np.abs(h1)
+    fraccion = np.where(cruza, (p0 + p1) / np.where(cruza & (salto > 0), salto, 1.0), 1.0)
+    return longitudes * fraccion * (ancho * (p0 + p1) / 2 + talud * (p0 * p0 + p0 * p1 + p1 * p1) / 3)
+
+
+def _perfil(perfil):
+    estaciones, cotas = (np.asarray(v, dtype=np.float64).ravel() for v in perfil)
+    if len(estaciones) != len(cotas) or len(estaciones) < 2:
+        raise ValueError("Cada perfil necesita al menos dos pares (estación, cota).")
+    orden = np.argsort(estaciones, kind='stable')
+    return estaciones[orden], cotas[orden]
+
+
+def corte_relleno(terreno, rasante, ancho=1.0, talud=0.0, estaciones_informe=None):
+    """
+    Corte y relleno entre dos perfiles (estaciones, cotas) en su tramo común.
+
+    Devuelve un dict con estacion_inicio, estacion_fin, corte y relleno
+    totales y, en las estaciones de informe (por defecto las de ambos
+    perfiles), los acumulados: arrays estaciones, corte_acumulado y
+    relleno_acumulado.
+    """
+    estaciones_terreno, cotas_terreno = _perfil(terreno)
+    estaciones_rasante, cotas_rasante = _perfil(rasante)
+    inicio = max(estaciones_terreno[0], estaciones_rasante[0])
+    fin = min(estaciones_terreno[-1], estaciones_rasante[-1])
+    if fin <= inicio:
+        raise ValueError("Los perfiles no tienen un tramo de estaciones en común.")
+
+    partes = [estaciones_terreno, estaciones_rasante, [inicio, fin]]
+    if estaciones_informe is not None:
+        partes.append(np.asarray(estaciones_informe, dtype=np.float64).ravel())
+    estaciones = np.unique(np.concatenate(partes))
+    estaciones = estaciones[(estaciones >= inicio) & (estaciones <= fin)]
+    alturas = np.interp(estaciones, estaciones_terreno, cotas_terreno) - np.interp(
+        estaciones, estaciones_rasante, cotas_rasante)
+
+    longitudes = np.diff(estaciones)
+    corte = np.concatenate(([0.0], np.cumsum(integral_seccion(longitudes, alturas[:-1], alturas[1:], ancho, talud))))
+    relleno = np.concatenate(([0.0], np.cumsum(integral_seccion(longitudes, -alturas[:-1], -alturas[1:], ancho, talud))))
+    if estaciones_informe is not None:
+        informe = np.isin(estaciones, estaciones_informe)
+        informe[[0, -1]] = True
+        estaciones, corte, relleno = estaciones[informe], corte[informe], relleno[informe]
+    return {
+        'estacion_inicio': float(inicio),
+        'estacion_fin': float(fin),
+        'corte': float(corte[-1]),
+        'relleno': float(relleno[-1]),
+        'estaciones': estaciones,
+        'corte_acumulado': corte,
+        'relleno_acumulado': relleno,
+    }
+
+
+def ancho_zanja(diametros, holgura=HOLGURA_ZANJA, ancho_minimo=ANCHO_MINIMO_ZANJA):
+    """Ancho de fondo de zanja para diámetros en metros."""
+    return np.maximum(np.asarray(diametros, dtype=np.float64) + 2 * holgura, ancho_minimo)
+
+
+def _bloque_zanjas(inicios, fines, diametros, anchos, divisiones, superficie, recubrimiento, cama, talud):
+    """Excavación y profundidad media de un bloque de tuberías muestreado en divisiones + 1 puntos cada una."""
+    n = len(inicios)
+    por_tuberia = divisiones + 1
+    tuberia = np.repeat(np.arange(n), por_tuberia)
+    local = np.arange(len(tuberia)) - np.repeat(np.cumsum(por_tuberia) - por_tuberia, por_tuberia)
+    t = local / divisiones[tuberia]
+
+    delta = fines - inicios
+    terreno = inicios[tuberia, 2] + t * delta[tuberia, 2]
+    if superficie is not None:
+        cotas = superficie.cotas(inicios[tuberia, 0] + t * delta[tuberia, 0], inicios[tuberia, 1] + t * delta[tuberia, 1])
+        terreno = np.where(np.isnan(cotas), terreno, cotas)
+    # Batea lineal entre extremos (Z del punto - recubrimiento - diámetro); el
+    # fondo de la zanja queda la cama por debajo.
+    alturas = terreno - (inicios[tuberia, 2] + t * delta[tuberia, 2]) + recubrimiento + diametros[tuberia] + cama
+
+    tramo = local[:-1] < divisiones[tuberia[:-1]]
+    tuberia_tramo = tuberia[:-1][tramo]
+    h0, h1 = alturas[:-1][tramo], alturas[1:][tramo]
+    longitudes = (np.hypot(delta[:, 0], delta[:, 1]) / divisiones)[tuberia_tramo]
+    excavacion = np.bincount(tuberia_tramo, integral_seccion(longitudes, h0, h1, anchos[tuberia_tramo], talud),
+                             minlength=n)
+    profundidad = np.bincount(tuberia_tramo, integral_seccion(longitudes, h0, h1), minlength=n)
+    return excavacion, profundidad
+
+
+def excavacion_tuberias(ruta_coordenadas=COORDINATES_CSV, ruta_tuberias=PIPES_CSV, superficie=None, intervalo=None,
+                        recubrimiento=RECUBRIMIENTO, holgura=HOLGURA_ZANJA, ancho_minimo=ANCHO_MINIMO_ZANJA,
+                        cama=ESPESOR_CAMA, talud=TALUD_ZANJA):
+    """
+    Zanja de cada tubería de los CSV (ver el docstring del módulo). Con
+    superficie (SuperficieTIN) el terreno se muestrea cada intervalo metros
+    (o solo en los extremos sin intervalo).
+
+    Devuelve (tuberías, totales, omitidas): una lista de dicts con
+    ID_TUBERIA, longitud, diametro, ancho, profundidad_media, excavacion,
+    cama, tuberia, relleno y excavacion_acumulada (en el orden del CSV), los
+    totales de la red y cuántas tuberías se omitieron por no tener puntos
+    o diámetro.
+    """
+    tabla, inicios, fines, validas = extremos_tuberias(ruta_coordenadas, ruta_tuberias)
+    diametros = tabla['DIAMETRO'][validas] / 1000.0
+    con_diametro = ~np.isnan(diametros)
+    ids = tabla['ID_TUBERIA'][validas][con_diametro]
+    inicios, fines, diametros = inicios[con_diametro], fines[con_diametro], diametros[con_diametro]
+    omitidas = len(tabla) - len(ids)
+
+    longitudes = np.hypot(fines[:, 0] - inicios[:, 0], fines[:, 1] - inicios[:, 1])
+    anchos = ancho_zanja(diametros, holgura, ancho_minimo)
+    if superficie is not None and intervalo:
+        divisiones = np.maximum(np.ceil(longitudes / intervalo), 1).astype(np.int64)
+    else:
+        divisiones = np.ones(len(ids), dtype=np.int64)
+
+    excavacion = np.zeros(len(ids))
+    profundidad = np.zeros(len(ids))
+    # Bloques de tuberías de unas MUESTRAS_POR_BLOQUE muestras para acotar la memoria.
+    muestras = np.cumsum(divisiones + 1)
+    inicio = 0
+    while inicio < len(ids):
+        fin = max(int(np.searchsorted(muestras, muestras[inicio] - divisiones[inicio] - 1 + MUESTRAS_POR_BLOQUE,
+                                      side='right')), inicio + 1)
+        bloque = slice(inicio, fin)
+        excavacion[bloque], profundidad[bloque] = _bloque_zanjas(
+            inicios[bloque], fines[bloque], diametros[bloque], anchos[bloque], divisiones[bloque],
+            superficie, recubrimiento, cama, talud)
+        inicio = fin
+
+    volumen_cama = np.minimum(anchos * cama * longitudes, excavacion)
+    volumen_tuberia = np.pi * diametros * diametros / 4 * longitudes
+    relleno = np.maximum(excavacion - volumen_cama - volumen_tuberia, 0.0)
+    acumulada = np.cumsum(excavacion)
+    profundidad_media = np.divide(profundidad, longitudes, out=np.zeros(len(ids)), where=longitudes > 0)
+
+    columnas = [np.round(v, 3).tolist() for v in (longitudes, diametros, anchos, profundidad_media, excavacion,
+                                                   volumen_cama, volumen_tuberia, relleno, acumulada)]
+    claves = ('longitud', 'diametro', 'ancho', 'profundidad_media', 'excavacion', 'cama', 'tuberia', 'relleno',
+              'excavacion_acumulada')
+    tuberias = [{'ID_TUBERIA': id_tuberia, **dict(zip(claves, valores))}
+                for id_tuberia, *valores in zip(ids.tolist(), *columnas)]
+    totales = {
+        'tuberias': len(ids),
+        'longitud': round(float(longitudes.sum()), 3),
+        'excavacion': round(float(excavacion.sum()), 3),
+        'cama': round(float(volumen_cama.sum()), 3),
+        'tuberia': round(float(volumen_tuberia.sum()), 3),
+        'relleno': round(float(relleno.sum()), 3),
+    }
+    return tuberias, totales, omitidas
+
+
+def comparar_perfiles_acad(backend, terreno_id, rasante_id, ancho=1.0, talud=0.0, intervalo=None):
+    """
+    Corte y relleno entre un perfil de terreno y una rasante del dibujo
+    (polilíneas 3D a lo largo del mismo eje). Las estaciones son las del
+    perfil de terreno; los vértices de la rasante se proyectan sobre él.
+    Se ejecuta en la sesión CAD.
+    """
+    try:
+        if not backend:
+            return {'error': 'No hay conexión con AutoCAD.'}
+
+        terreno = instantanea(backend, terreno_id)
+        rasante = instantanea(backend, rasante_id)
+        if terreno is None or rasante is None:
+            return {'error': 'Perfil de terreno o rasante no encontrados'}
+
+        eje = estacionamiento_de(backend, terreno)
+        vertices_rasante = rasante.vertices
+        estaciones_rasante, _ = eje.proyectar(vertices_rasante)
+        informe = eje.estaciones_cada(intervalo, incluir_vertices=False) if intervalo else None
+        resultado = corte_relleno((eje.estaciones, eje.vertices[:, 2]), (estaciones_rasante, vertices_rasante[:, 2]),
+                                  ancho, talud, informe)
+    except ValueError as e:
+        return {'error': str(e)}
+    except Exception as e:
+        logger.error(f"Error al calcular corte y relleno en AutoCAD: {e}")
+        return {'error': f'Error al calcular corte y relleno en AutoCAD: {e}'}
+
+    acumulados = np.column_stack((resultado.pop('estaciones'), resultado.pop('corte_acumulado'),
+                                  resultado.pop('relleno_acumulado')))
+    return {**resultado, 'ancho': ancho, 'talud': talud, 'acumulados': np.round(acumulados, 3).tolist()}
+
+
+def _numero(data, clave, defecto, positivo=False):
+    valor = data.get(clave, defecto)
+    if not isinstance(valor, (int, float)) or isinstance(valor, bool) or valor < 0 or (positivo and valor == 0):
+        raise ValueError(f"{clave} debe ser un número {'positivo' if positivo else 'no negativo'}.")
+    return float(valor)
+
+
+@movimiento_tierras_bp.route('/movimiento_tierras/perfiles', methods=['POST'])
+def corte_relleno_perfiles():
+    """
+    Corte y relleno entre dos perfiles del dibujo: {"terreno_id",
+    "rasante_id", "ancho"?, "talud"?, "diametro"? (mm: sección de zanja),
+    "intervalo"? (acumulados cada intervalo metros)}.
+    """
+    try:
+        data = request.get_json()
+        if not data.get('terreno_id') or not data.get('rasante_id'):
+            return jsonify({'error': 'Se requieren terreno_id y rasante_id.'}), 400
+        try:
+            talud = _numero(data, 'talud', 0.0)
+            if data.get('diametro') is not None:
+                ancho = float(ancho_zanja(_numero(data, 'diametro', None, positivo=True) / 1000.0))
+            else:
+                ancho = _numero(data, 'ancho', 1.0, positivo=True)
+            intervalo = _numero(data, 'intervalo', None, positivo=True) if data.get('intervalo') is not None else None
+        except ValueError as e:
+            return jsonify({'error': f'Parámetros no válidos: {e}'}), 400
+
+        result = obtener_sesion().ejecutar(comparar_perfiles_acad, data['terreno_id'], data['rasante_id'],
+                                           ancho, talud, intervalo)
+        return jsonify(result), 200 if 'error' not in result else 500
+
+    except ErrorSesionCAD as e:
+        logger.error(f"Error de conexión al calcular corte y relleno: {e}")
+        return jsonify({'error': 'No se pudo conectar con AutoCAD.'}), 500
+    except Exception as e:
+        logger.error(f"Error al calcular corte y relleno: {e}")
+        return jsonify({'error': f'Error al calcular corte y relleno: {e}'}), 500
+
+
+@movimiento_tierras_bp.route('/movimiento_tierras/zanjas', methods=['POST'])
+def zanjas():
+    """
+    Excavación de zanjas de las tuberías de info_tuberias.csv: {"superficie"?
+    ('coordenadas' o id de una superficie del almacén), "intervalo"?,
+    "recubrimiento"?, "holgura"?, "ancho_minimo"?, "cama"?, "talud"?}.
+    """
+    from perfiles import superficie_terreno
+
+    try:
+        data = request.get_json(silent=True) or {}
+        try:
+            parametros = {
+                'recubrimiento': _numero(data, 'recubrimiento', RECUBRIMIENTO),
+                'holgura': _numero(data, 'holgura', HOLGURA_ZANJA),
+                'ancho_minimo': _numero(data, 'ancho_minimo', ANCHO_MINIMO_ZANJA),
+                'cama': _numero(data, 'cama', ESPESOR_CAMA),
+                'talud': _numero(data, 'talud', TALUD_ZANJA),
+            }
+            intervalo = _numero(data, 'intervalo', None, positivo=True) if data.get('intervalo') is not None else None
+        except ValueError as e:
+            return jsonify({'error': f'Parámetros no válidos: {e}'}), 400
+        superficie = None
+        if data.get('superficie'):
+            try:
+                superficie = superficie_terreno(data['superficie'])
+            except (LookupError, OSError) as e:
+                return jsonify({'error': f'No se pudo cargar la superficie de terreno: {e}'}), 400
+
+        tuberias, totales, omitidas = excavacion_tuberias(superficie=superficie, intervalo=intervalo, **parametros)
+        return jsonify({'tuberias': tuberias, 'totales': totales, 'omitidas': omitidas, **parametros}), 200
+
+    except OSError as e:
+        logger.error(f"Error al leer los CSV de la red: {e}")
+        return jsonify({'error': f'No se pudieron leer los archivos de la red: {e}'}), 500
+    except Exception as e:
+        logger.error(f"Error al calcular la excavación de zanjas: {e}")
+        return jsonify({'error': f'Error al calcular la excavación de zanjas: {e}'}), 500
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+    import tempfile
+    import time
+
+    from superficie_tin import SuperficieTIN
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    intervalo = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+    generador = np.random.default_rng(0)
+    xy = np.cumsum(generador.uniform(20, 80, (n + 1, 2)) * [1, 0.3], axis=0)
+    z = 100 + 5 * np.sin(xy[:, 0] / 300)
+    with tempfile.TemporaryDirectory() as carpeta:
+        ruta_coordenadas = os.path.join(carpeta, 'coordenadas.csv')
+        ruta_tuberias = os.path.join(carpeta, 'info_tuberias.csv')
+        with open(ruta_coordenadas, 'w') as archivo:
+            archivo.write('ID,X,Y,Z\n')
+            archivo.writelines(f'{i},{x:.3f},{y:.3f},{c:.3f}\n' for i, (x, y), c in zip(range(1, n + 2), xy, z))
+        with open(ruta_tuberias, 'w') as archivo:
+            archivo.write('ID_TUBERIA,PK_INICIO,PK_FIN,DIAMETRO\n')
+            archivo.writelines(f'T{i},{i},{i + 1},{generador.choice((110, 160, 200, 315))}\n' for i in range(1, n + 1))
+
+        malla = np.column_stack((np.repeat(np.linspace(xy[:, 0].min() - 50, xy[:, 0].max() + 50, 400), 40),
+                                 np.tile(np.linspace(xy[:, 1].min() - 50, xy[:, 1].max() + 50, 40), 400)))
+        superficie = SuperficieTIN(np.column_stack((malla, 100 + 5 * np.sin(malla[:, 0] / 300)
+                                                    + np.cos(malla[:, 1] / 50))))
+        for nombre, argumentos in (('sin superficie', {}), (f'TIN cada {intervalo} m', {'superficie': superficie,
+                                                                                         'intervalo': intervalo})):
+            inicio = time.perf_counter()
+            _, totales, _ = excavacion_tuberias(ruta_coordenadas, ruta_tuberias, **argumentos)
+            print(f"{n} tuberías ({nombre}): excavación {totales['excavacion']:.1f} m3, relleno "
+                  f"{totales['relleno']:.1f} m3 en {time.perf_counter() - inicio:.2f} s")
@@ -1,107 +1,355 @@
-from flask import Flask, Blueprint, jsonify
+"""
+Inventario del espacio modelo (GET /obtener_objetos).
+
+InventarioModelo guarda, por handle, el ObjectName, la capa y el ObjectID
+de cada entidad del espacio modelo. El primer listado recorre todo el
+espacio modelo; los siguientes solo vuelven a leer los handles que el
+backend apunta como añadidos o modificados (backend.cambios(), con los
+eventos del documento en AutoCAD) y quitan los borrados. Si el backend no
+lleva registro de cambios, cambia el documento o se pide ?refrescar=1, se
+vuelve a recorrer todo.
+
+Con ?formato=ndjson el inventario entero se transmite, un objeto por línea,
+mientras se recorre (transmitir_objetos_acad).
+
+La respuesta es una página ordenada por handle: ?tipo= y ?capa= filtran
+(admiten varios valores separados por comas), ?limite= fija el tamaño
+(máximo LIMITE_MAXIMO) y ?desde= recibe el handle de siguiente de la página
+anterior. Las páginas con ?desde= no recorren el espacio modelo entero, así
+un listado largo no se repite a mitad. revision cambia con cada recorrido
+completo y cada vez que el backend informa de objetos añadidos,
+modificados o borrados.
+
+Uso desde la línea de comandos:
+    python obtener_objetos.py [entidades] [cambios]   # mide el recorrido completo y el incremental
+"""
+from flask import Blueprint, jsonify, request
+import bisect
+import collections
 import logging
-from pyautocad import Autocad
-import pythoncom
-from autocad_civil import conectar_con_autocad_civil, desconectar_autocad_civil
+import time
+import weakref
+from sesion_cad import obtener_sesion, respuesta_ndjson, ErrorSesionCAD
 
 obtener_objetos_bp = Blueprint('obtener_objetos', __name__)
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.DEBUG)
 
-@obtener_objetos_bp.route('/obtener_objetos', methods=['GET'])
-def obtener_objetos():
-    """Obtiene los IDs y la información de los objetos de AutoCAD/Civil 3D."""
-    acad = None
-    civil3d = None
-    app_name = "AutoCAD"
-    try:
-        pythoncom.CoInitialize()
-        logger.debug("🔧 Llamando a conectar_con_autocad_civil()...")
-        acad, civil3d = conectar_con_autocad_civil()
-
-        if not acad:
-            logger.error("❌ No se pudo establecer conexión con AutoCAD/Civil 3D.")
-            return jsonify({"error": "No se pudo establecer conexión con AutoCAD/Civil 3D."}), 500
-
-        app_name = getattr(acad.Application, "Name", "AutoCAD")
-        logger.info(f"Obteniendo objetos desde: {app_name}")
-        logger.debug("🔍 Verificando si la aplicación AutoCAD/Civil 3D está activa...")
-        doc = acad.ActiveDocument
-        if doc is None:
-            logger.warning("⚠️ No hay un documento activo en AutoCAD/Civil 3D.")
-            return jsonify({"warning": "No hay un documento activo en AutoCAD/Civil 3D."}), 200
+LIMITE_PAGINA = 1000
+LIMITE_MAXIMO = 10000
+HISTORIAL_CAMBIOS = 64
+
+
+def _valor_handle(handle):
+    return int(handle, 16)
+
+
+class InventarioModelo:
+    """Entidades del espacio modelo por handle, actualizadas con el registro de cambios del backend."""
+
+    def __init__(self):
+        self.documento = None
+        self.revision = 0
+        self._backend = None
+        self._completo_pendiente = False
+        self._objetos = {}  # valor del handle -> {'Handle', 'ObjectName', 'Layer', 'ObjectID'}
+        self._por_id = {}  # ObjectID -> valor del handle
+        self._orden = []  # valores de los handles, ordenados
+        # (revisión, handles añadidos o modificados, handles quitados) de las
+        # últimas actualizaciones incrementales, para cambios_desde.
+        self._historial = collections.deque(maxlen=HISTORIAL_CAMBIOS)
+
+    def __len__(self):
+        return len(self._objetos)
+
+    @staticmethod
+    def _leer(backend, objeto):
+        return {
+            'Handle': backend.handle(objeto),
+            'ObjectName': backend.tipo_objeto(objeto),
+            'Layer': backend.capa(objeto),
+            'ObjectID': backend.id_objeto(objeto),
+        }
+
+    def actualizar(self, backend, completo=False, permitir_completo=True):
+        """
+        Pone el inventario al día. completo fuerza a recorrer todo el
+        espacio modelo; con permitir_completo=False, si hiciera falta
+        recorrerlo se deja el inventario como está. Devuelve un resumen.
+        """
+        actualizacion = self.actualizando(backend, completo, permitir_completo)
+        while True:
+            try:
+                next(actualizacion)
+            except StopIteration as fin:
+                return fin.value
+
+    def actualizando(self, backend, completo=False, permitir_completo=True):
+        """Como actualizar, pero entrega cada objeto leído en un recorrido completo mientras se lee."""
+        inicio = time.perf_counter()
+        documento = backend.nombre_documento()
+        if (self._completo_pendiente or self._backend is None or self._backend() is not backend
+                or documento != self.documento):
+            completo = True
+        if not completo:
+            cambios = backend.cambios()
+            completo = cambios is None
+        if completo:
+            if not permitir_completo and self._backend is not None:
+                self._completo_pendiente = True
+                return {'modo': 'sin_actualizar', 'leidos': 0, 'borrados': 0, 'errores': 0, 'ms': 0.0}
+            # El registro se reinicia antes de recorrer: lo que cambie durante
+            # el recorrido quedará para la siguiente actualización. Si el
+            # recorrido no termina (el cliente cierra la transmisión o falla
+            # COM), el siguiente vuelve a ser completo.
+            self._completo_pendiente = True
+            backend.cambios()
+            resumen = yield from self._recorrer(backend)
+            self._completo_pendiente = False
         else:
-            logger.debug(f"📄 Documento activo: {doc.Name}")
+            resumen = self._aplicar(backend, *cambios)
+        self._backend = weakref.ref(backend)
+        self.documento = documento
+        resumen['ms'] = round((time.perf_counter() - inicio) * 1000, 3)
+        if resumen['modo'] != 'sin_cambios':
+            logger.info(f"Inventario del espacio modelo ({resumen['modo']}): {len(self)} objetos, "
+                        f"{resumen['leidos']} leídos, {resumen['borrados']} borrados en {resumen['ms']} ms.")
+        return resumen
 
-        objetos_info = []
+    def _recorrer(self, backend):
+        objetos, errores = {}, 0
+        for objeto in backend.iterar_objetos():
+            try:
+                fila = self._leer(backend, objeto)
+            except Exception as e:
+                errores += 1
+                logger.debug(f"No se pudo leer un objeto del espacio modelo: {e}")
+                continue
+            objetos[_valor_handle(fila['Handle'])] = fila
+            yield fila
+        if errores:
+            logger.warning(f"{errores} objetos del espacio modelo no se pudieron leer.")
+        borrados = len(self._objetos.keys() - objetos.keys())
+        # Un recorrido no ve si cambió la geometría o las XData de un objeto
+        # que conserva tipo y capa: quien siga el historial lo relee todo.
+        self.revision += 1
+        self._historial.clear()
+        self._objetos = objetos
+        self._por_id = {fila['ObjectID']: valor for valor, fila in objetos.items()}
+        self._orden = sorted(objetos)
+        return {'modo': 'completa', 'leidos': len(objetos) + errores, 'borrados': borrados, 'errores': errores}
 
-        try:
-            logger.debug("🔎 Intentando acceder al espacio modelo desde el documento activo...")
-            if hasattr(doc, "ModelSpace"):
-                ms = doc.ModelSpace
-                num_objetos = len(ms)
-                logger.info(f"✨ Se encontraron {num_objetos} objetos en el espacio modelo.")
-                if num_objetos > 0:
-                    for i, obj in enumerate(ms):
-                        try:
-                            logger.debug(f"  ➡️ Procesando objeto {i+1} (Tipo: {obj.ObjectName})...")
-                            handle = getattr(obj, "Handle", "N/A")
-                            object_name = getattr(obj, "ObjectName", "N/A")
-                            objeto_info = {
-                                "Handle": handle,
-                                "ObjectName": object_name,
-                            }
-                            objetos_info.append(objeto_info)
-                            logger.debug(f"    ✅ Objeto {i+1}: Handle='{handle}', ObjectName='{object_name}'")
-                        except Exception as obj_error:
-                            logger.error(f"  ⚠️ Error al acceder a las propiedades del objeto {i+1} (Tipo: {getattr(obj, 'ObjectName', 'Desconocido')}): {obj_error}")
-                            # Considerar añadir información básica del objeto problemático al JSON si es crítico
-                            # objetos_info.append({"Handle": getattr(obj, "Handle", "ERROR"), "ObjectName": "ERROR - Problema al leer"})
-                            continue # Saltar al siguiente objeto en caso de error
-                else:
-                    logger.info("📭 El espacio modelo está vacío.")
-                    return jsonify({"warning": f"El espacio modelo de {app_name} está vacío."}), 200
+    def _quitar(self, valor):
+        fila = self._objetos.pop(valor, None)
+        if fila is None:
+            return None
+        self._por_id.pop(fila['ObjectID'], None)
+        del self._orden[bisect.bisect_left(self._orden, valor)]
+        return fila['Handle']
+
+    def _aplicar(self, backend, modificados, borrados):
+        cambiados, quitados, errores = set(), set(), 0
+        for id_objeto in borrados:
+            valor = self._por_id.get(id_objeto)
+            handle = self._quitar(valor) if valor is not None else None
+            if handle is not None:
+                quitados.add(handle)
+        for handle in modificados:
+            valor = _valor_handle(handle)
+            try:
+                objeto = backend.obtener_objeto(handle)
+                fila = self._leer(backend, objeto) if objeto is not None else None
+            except Exception as e:
+                errores += 1
+                logger.debug(f"No se pudo leer el objeto {handle}: {e}")
+                continue
+            if fila is None:
+                handle = self._quitar(valor)
+                if handle is not None:
+                    quitados.add(handle)
+                continue
+            cambiados.add(fila['Handle'])
+            anterior = self._objetos.get(valor)
+            if anterior == fila:
+                continue  # La fila es la misma, pero la geometría o las XData pueden haber cambiado.
+            if anterior is None:
+                bisect.insort(self._orden, valor)
             else:
-                logger.warning("⚠️ No se pudo acceder a la propiedad 'ModelSpace' del documento.")
-                return jsonify({"warning": f"No se pudo acceder al espacio modelo del documento {doc.Name}."}, 500)
+                self._por_id.pop(anterior['ObjectID'], None)
+            self._objetos[valor] = fila
+            self._por_id[fila['ObjectID']] = valor
+        if cambiados or quitados:
+            self.revision += 1
+            self._historial.append((self.revision, cambiados, quitados))
+        return {'modo': 'incremental' if cambiados or quitados else 'sin_cambios',
+                'leidos': len(modificados) - errores, 'borrados': len(quitados), 'errores': errores}
+
+    def cambios_desde(self, revision):
+        """
+        (handles añadidos o modificados, handles quitados) desde revision,
+        o None si el historial no llega hasta ella (hubo un recorrido
+        completo o demasiadas actualizaciones): entonces hay que leer todo.
+        """
+        if revision == self.revision:
+            return set(), set()
+        if revision is None or not self._historial or self._historial[0][0] > revision + 1:
+            return None
+        modificados, quitados = set(), set()
+        for revision_cambio, cambiados, borrados in self._historial:
+            if revision_cambio <= revision:
+                continue
+            modificados.update(cambiados)
+            quitados.difference_update(cambiados)
+            quitados.update(borrados)
+            modificados.difference_update(borrados)
+        return modificados, quitados
+
+    def fila(self, handle):
+        """Entrada del inventario con ese handle, o None."""
+        return self._objetos.get(_valor_handle(handle))
+
+    def pagina(self, tipos=None, capas=None, desde=None, limite=LIMITE_PAGINA):
+        """
+        Hasta limite objetos con handle posterior a desde que cumplen los
+        filtros (conjuntos de ObjectName y de capas). Devuelve (objetos,
+        handle con el que pedir la página siguiente o None).
+        """
+        inicio = bisect.bisect_right(self._orden, _valor_handle(desde)) if desde else 0
+        objetos = []
+        for i in range(inicio, len(self._orden)):
+            fila = self._objetos[self._orden[i]]
+            if (tipos is None or fila['ObjectName'] in tipos) and (capas is None or fila['Layer'] in capas):
+                objetos.append(fila)
+                if len(objetos) == limite:
+                    break
+        return objetos, objetos[-1]['Handle'] if len(objetos) == limite else None
+
+    def filas(self, tipos=None, capas=None):
+        """Itera, por handle, los objetos que cumplen los filtros."""
+        for valor in list(self._orden):
+            fila = self._objetos[valor]
+            if (tipos is None or fila['ObjectName'] in tipos) and (capas is None or fila['Layer'] in capas):
+                yield fila
 
-        except Exception as e:
-            logger.error(f"❌ No se pudo acceder al espacio modelo del documento: {e}")
-            return jsonify({"error": f"No se pudo acceder al espacio modelo del documento {doc.Name}"}), 500
 
-        if not objetos_info:
-            logger.warning("📭 No se encontraron objetos en el espacio modelo.")
-            return jsonify({"warning": f"No se encontraron objetos en {app_name}."}), 200
+inventario = InventarioModelo()
 
-        logger.info(f"✅ Se obtuvieron {len(objetos_info)} objetos.")
-        return jsonify(objetos_info), 200
 
+def listar_objetos_acad(backend, tipos=None, capas=None, desde=None, limite=LIMITE_PAGINA, refrescar=False):
+    """Actualiza el inventario y devuelve (página, código HTTP). Se ejecuta en la sesión CAD."""
+    doc_name = backend.nombre_documento()
+    if doc_name is None:
+        logger.warning("⚠️ No hay un documento activo en AutoCAD/Civil 3D.")
+        return {"warning": "No hay un documento activo en AutoCAD/Civil 3D."}, 200
+
+    try:
+        actualizacion = inventario.actualizar(backend, completo=refrescar, permitir_completo=desde is None)
     except Exception as e:
-        logger.error(f"❌ Error inesperado: {e}")
-        return jsonify({"error": "Error inesperado durante la ejecución"}), 500
+        logger.error(f"❌ No se pudo acceder al espacio modelo del documento: {e}")
+        return {"error": f"No se pudo acceder al espacio modelo del documento {doc_name}"}, 500
+
+    objetos, siguiente = inventario.pagina(tipos, capas, desde, limite)
+    resultado = {
+        'documento': inventario.documento,
+        'revision': inventario.revision,
+        'total': len(inventario),
+        'objetos': objetos,
+        'siguiente': siguiente,
+        'actualizacion': actualizacion,
+    }
+    if not len(inventario):
+        resultado['warning'] = f"El espacio modelo de {backend.nombre_aplicacion()} está vacío."
+    return resultado, 200
+
 
-    finally:
-        desconectar_autocad_civil(acad, civil3d)
+def transmitir_objetos_acad(backend, tipos=None, capas=None, refrescar=False):
+    """
+    Generador para SesionCAD.transmitir: entrega los objetos del inventario
+    que cumplen los filtros y, al final, {'resumen': ...}. Si hay que
+    recorrer el espacio modelo, cada objeto sale en cuanto se lee.
+    """
+    if backend.nombre_documento() is None:
+        yield {"warning": "No hay un documento activo en AutoCAD/Civil 3D."}
+        return
+    actualizacion = inventario.actualizando(backend, completo=refrescar)
+    emitidos = 0
+    while True:
         try:
-            pythoncom.CoUninitialize()
-            logger.debug("🧹 Recursos COM liberados.")
-        except Exception as e:
-            logger.error(f"⚠️ Error al liberar recursos COM: {e}")
+            fila = next(actualizacion)
+        except StopIteration as fin:
+            resumen = fin.value
+            break
+        if (tipos is None or fila['ObjectName'] in tipos) and (capas is None or fila['Layer'] in capas):
+            emitidos += 1
+            yield fila
+    if resumen['modo'] != 'completa':
+        for fila in inventario.filas(tipos, capas):
+            emitidos += 1
+            yield fila
+    yield {'resumen': {'documento': inventario.documento, 'revision': inventario.revision, 'total': len(inventario),
+                       'emitidos': emitidos, 'actualizacion': resumen}}
+
+
+def _lista_parametro(nombre):
+    valores = {v.strip() for v in request.args.get(nombre, '').split(',') if v.strip()}
+    return valores or None
+
+
+@obtener_objetos_bp.route('/obtener_objetos', methods=['GET'])
+def obtener_objetos():
+    """
+    Página del inventario del espacio modelo: ?tipo=, ?capa=, ?desde=,
+    ?limite= y ?refrescar=1 (vuelve a recorrer todo el espacio modelo).
+    Con ?formato=ndjson se transmite el inventario entero, un objeto por
+    línea, sin paginar.
+    """
+    if request.args.get('formato') == 'ndjson':
+        return respuesta_ndjson(obtener_sesion().transmitir(
+            transmitir_objetos_acad, _lista_parametro('tipo'), _lista_parametro('capa'),
+            request.args.get('refrescar') == '1'))
+
+    try:
+        desde = request.args.get('desde') or None
+        if desde is not None:
+            _valor_handle(desde)
+        limite = int(request.args.get('limite', LIMITE_PAGINA))
+        if not 0 < limite <= LIMITE_MAXIMO:
+            raise ValueError(f"limite debe estar entre 1 y {LIMITE_MAXIMO}")
+    except ValueError as e:
+        return jsonify({"error": f"Parámetro no válido: {e}"}), 400
+
+    try:
+        resultado, codigo = obtener_sesion().ejecutar(
+            listar_objetos_acad, _lista_parametro('tipo'), _lista_parametro('capa'), desde, limite,
+            request.args.get('refrescar') == '1')
+        return jsonify(resultado), codigo
+
+    except ErrorSesionCAD as e:
+        logger.error(f"❌ No se pudo establecer conexión con AutoCAD/Civil 3D: {e}")
+        return jsonify({"error": "No se pudo establecer conexión con AutoCAD/Civil 3D."}), 500
+
+    except Exception as e:
+        logger.error(f"❌ Error inesperado: {e}")
+        return jsonify({"error": "Error inesperado durante la ejecución"}), 500
 
 
 if __name__ == "__main__":
-    import io
     import sys
 
-    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+    from cad_memoria import BackendMemoria
 
-    app = Flask(__name__)
-    app.register_blueprint(obtener_objetos_bp)
+    logging.getLogger().setLevel(logging.WARNING)
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    nuevos = int(sys.argv[2]) if len(sys.argv) > 2 else 100
 
-    with app.app_context():
-        from flask import Response
-        response = obtener_objetos()
-        if isinstance(response, tuple):
-            response, status_code = response
-        print("\n✅ Resultado JSON:")
-        print(response.get_data(as_text=True))
\ No newline at end of file
+    backend = BackendMemoria()
+    backend.agregar_puntos_lote([0.0, 0.0, 0.0] * n)
+    for nombre, operacion in (
+            ('recorrido completo', lambda: inventario.actualizar(backend)),
+            ('sin cambios', lambda: inventario.actualizar(backend)),
+            (f'{nuevos} entidades nuevas', lambda: (backend.agregar_puntos_lote([1.0, 1.0, 1.0] * nuevos),
+                                                   inventario.actualizar(backend))[1]),
+            ('página de 1000', lambda: {'objetos': len(inventario.pagina(limite=1000)[0])})):
+        inicio = time.perf_counter()
+        resumen = operacion()
+        print(f"{nombre}: {(time.perf_counter() - inicio) * 1000:.1f} ms {resumen}")
@@ -1,123 +1,275 @@
+"""
+Listado de los perfiles de Civil 3D.
+
+/obtener_perfiles sale del catálogo de perfiles (CatalogoPerfiles): por
+documento y alineamiento guarda los datos de sus perfiles (nombre, tipo,
+estilo, handle, rango de estaciones y número de vértices). En cada
+consulta solo se vuelven a leer los alineamientos que el registro de
+cambios del inventario da como modificados, ellos o sus perfiles; la
+geometría de sus perfiles, que es lo más lento, se lee por lotes
+repartidos entre las sesiones auxiliares (SesionCAD.repartir).
+?refrescar=1 vuelve a leerlo todo.
+
+Uso desde la línea de comandos:
+    python obtener_perfiles.py [alineamientos] [perfiles] [trabajadores]   # mide el catálogo en memoria
+"""
+import collections
+import itertools
 import logging
-import pythoncom
-from autocad_civil import conectar_con_autocad_civil, desconectar_autocad_civil
+import threading
+import time
+
+from datos_extendidos import atributos_xdata
+from sesion_cad import obtener_sesion, respuesta_ndjson, ErrorSesionCAD
 from flask import jsonify
 
 # Configuración del logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-def obtener_perfiles_autocad():
-    """Obtiene perfiles de Civil 3D si está disponible."""
-    acad = None
-    civil3d = None
-    try:
-        pythoncom.CoInitialize()
-        logger.debug("🔧 Iniciando conexión con AutoCAD/Civil 3D...")
-        acad, civil3d = conectar_con_autocad_civil()
+TAMANO_LOTE_GEOMETRIA = 16
+DOCUMENTOS_EN_CATALOGO = 8
+
+
+def _leer_perfiles(backend, identificadores):
+    """
+    Para SesionCAD.repartir: datos, handle y geometría de cada perfil por
+    su ObjectID, o None si no se pudo leer.
+    """
+    resultado = []
+    for identificador in identificadores:
+        try:
+            perfil = backend.obtener_objeto(identificador)
+            if perfil is None:
+                resultado.append(None)
+                continue
+            inicial, final, vertices = backend.geometria_perfil(perfil)
+            resultado.append({**backend.datos_perfil(perfil), "Handle": backend.handle(perfil),
+                              "EstacionInicial": inicial, "EstacionFinal": final, "Vertices": vertices})
+        except Exception as e:
+            logger.warning(f"No se pudo leer el perfil {identificador}: {e}")
+            resultado.append(None)
+    return resultado
+
+
+class CatalogoPerfiles:
+    """
+    Perfiles por documento y alineamiento. Qué alineamientos hay que volver
+    a leer lo dice el registro de cambios del inventario de /obtener_objetos:
+    los que cambiaron o tienen un perfil que cambió.
+    """
+
+    def __init__(self, documentos=DOCUMENTOS_EN_CATALOGO, tamano_lote=TAMANO_LOTE_GEOMETRIA):
+        self.documentos = documentos
+        self.tamano_lote = tamano_lote
+        # (backend, documento) -> (revisión del inventario, {handle del alineamiento: perfiles})
+        self._catalogo = collections.OrderedDict()
+        self._bloqueo = threading.Lock()
+        self.alineamientos_leidos = 0
+        self.alineamientos_reutilizados = 0
+        self.perfiles_leidos = 0
+
+    def actualizar(self, backend, repartir=None, refrescar=False):
+        """
+        Pone al día el catálogo del documento activo y devuelve (perfiles,
+        resumen). repartir(funcion, lotes) reparte la lectura de la
+        geometría (SesionCAD.repartir); sin él, se lee aquí. Se ejecuta en
+        la sesión CAD.
+        """
+        recorrido = self.recorrer(backend, repartir, refrescar)
+        while True:
+            try:
+                next(recorrido)
+            except StopIteration as fin:
+                return fin.value
 
-        if acad is None:
-            logger.error("❌ No se pudo conectar con AutoCAD.")
-            return {"error": "No se pudo conectar con AutoCAD."}
+    def recorrer(self, backend, repartir=None, refrescar=False):
+        """
+        Como actualizar, pero entrega cada perfil en cuanto está listo: primero
+        los de los alineamientos que no cambiaron, luego los que se leen.
+        """
+        from obtener_objetos import inventario
 
-        if civil3d is None:
-            logger.warning("⚠️ Conexión establecida solo con AutoCAD. No se pueden obtener perfiles de Civil 3D.")
-            return {"warning": "Civil 3D no está disponible o no se pudo conectar."}
+        inicio = time.perf_counter()
+        inventario.actualizar(backend)
+        clave = (backend.nombre, inventario.documento)
+        with self._bloqueo:
+            guardado = None if refrescar else self._catalogo.get(clave)
+        cambios = inventario.cambios_desde(guardado[0]) if guardado is not None else None
+        anteriores = guardado[1] if cambios is not None else {}
+        cambiados = set().union(*cambios) if cambios is not None else set()
+
+        alineamientos, pendientes, leidos = {}, [], 0
+        if cambios is not None and not cambiados:
+            alineamientos = dict(anteriores)  # Nada cambió: ni siquiera se recorren los alineamientos.
+            for perfiles in alineamientos.values():
+                yield from perfiles
+        else:
+            for alineamiento in backend.iterar_alineamientos():
+                handle = backend.handle(alineamiento)
+                perfiles = anteriores.get(handle)
+                if (perfiles is not None and handle not in cambiados
+                        and not any(perfil['Handle'] in cambiados for perfil in perfiles)):
+                    alineamientos[handle] = perfiles
+                    yield from perfiles
+                    continue
+                alineamientos[handle] = []
+                leidos += 1
+                nombre = backend.nombre_alineamiento(alineamiento)
+                # Aquí solo se leen los ObjectID, que valen en cualquier conexión
+                # al mismo documento; los perfiles se leen en las sesiones auxiliares.
+                pendientes.extend((handle, nombre, backend.id_objeto(perfil)) for perfil in backend.perfiles_de(alineamiento))
+
+        identificadores = [identificador for _, _, identificador in pendientes]
+        lotes = [identificadores[i:i + self.tamano_lote] for i in range(0, len(identificadores), self.tamano_lote)]
+        leidas = repartir(_leer_perfiles, lotes) if repartir else [_leer_perfiles(backend, lote) for lote in lotes]
+        incompletos = set()  # Alineamientos con algún perfil sin leer: se vuelven a leer la próxima vez.
+        for (handle, nombre, _), datos in zip(pendientes, itertools.chain.from_iterable(leidas)):
+            if datos is None:
+                incompletos.add(handle)
+            else:
+                fila = {"Alineación": nombre, **datos}
+                alineamientos[handle].append(fila)
+                yield fila
+
+        reutilizados = len(alineamientos) - leidos
+        with self._bloqueo:
+            self._catalogo[clave] = (inventario.revision,
+                                     {h: p for h, p in alineamientos.items() if h not in incompletos})
+            self._catalogo.move_to_end(clave)
+            while len(self._catalogo) > self.documentos:
+                self._catalogo.popitem(last=False)
+            self.alineamientos_leidos += leidos
+            self.alineamientos_reutilizados += reutilizados
+            self.perfiles_leidos += len(pendientes)
+
+        perfiles = [fila for filas in alineamientos.values() for fila in filas]
+        resumen = {'alineamientos': len(alineamientos), 'alineamientos_reutilizados': reutilizados,
+                   'perfiles': len(perfiles), 'perfiles_leidos': len(pendientes),
+                   'duracion_ms': round((time.perf_counter() - inicio) * 1000, 3)}
+        logger.info(f"Catálogo de perfiles de {clave[1]}: {resumen}")
+        return perfiles, resumen
+
+    def invalidar(self):
+        with self._bloqueo:
+            self._catalogo.clear()
+
+    def estadisticas(self):
+        with self._bloqueo:
+            return {'documentos': len(self._catalogo), 'alineamientos_leidos': self.alineamientos_leidos,
+                    'alineamientos_reutilizados': self.alineamientos_reutilizados,
+                    'perfiles_leidos': self.perfiles_leidos}
 
-        logger.debug("✅ Conexión con Civil 3D exitosa. Obteniendo perfiles...")
-        perfiles_info = obtener_perfiles_desde_civil3d(civil3d)
 
-        if not perfiles_info:
-            logger.info("📭 No se encontraron perfiles en el dibujo actual.")
-            return {"warning": "No se encontraron perfiles en el dibujo."}
+catalogo_perfiles = CatalogoPerfiles()
 
-        logger.info(f"✅ Se encontraron {len(perfiles_info)} perfiles.")
-        return perfiles_info
+
+def obtener_perfiles_autocad(refrescar=False):
+    """Obtiene perfiles de Civil 3D si está disponible."""
+    try:
+        logger.debug("🔧 Enviando consulta de perfiles a la sesión AutoCAD/Civil 3D...")
+        return obtener_sesion().ejecutar(obtener_perfiles_acad, refrescar)
+
+    except ErrorSesionCAD as e:
+        logger.error(f"❌ No se pudo conectar con AutoCAD: {e}")
+        return {"error": "No se pudo conectar con AutoCAD."}
 
     except Exception as e:
         logger.exception("❌ Ocurrió un error inesperado.")
         return {"error": f"Error inesperado: {e}"}
 
-    finally:
-        try:
-            logger.debug("🔧 Liberando recursos COM y desconectando AutoCAD/Civil 3D...")
-            desconectar_autocad_civil(acad, civil3d)
-            pythoncom.CoUninitialize()
-            logger.info("🔁 COM liberado correctamente.")
-        except Exception as e:
-            logger.error(f"⚠️ Error al liberar recursos COM: {e}")
 
+def obtener_perfiles_ndjson(refrescar=False):
+    """Transmite los perfiles del catálogo como NDJSON, uno por línea, según están listos."""
+    logger.debug("🔧 Transmitiendo perfiles desde la sesión AutoCAD/Civil 3D...")
+    return respuesta_ndjson(obtener_sesion().transmitir(transmitir_perfiles_acad, refrescar))
 
-def obtener_perfiles_desde_civil3d(civil3d_app):
-    """Obtiene perfiles de alineaciones desde la API COM de Civil 3D."""
-    perfiles = []
-    try:
-        civil_doc = civil3d_app.ActiveDocument
-        alignments = civil_doc.AlignmentsSiteless
-
-        for alignment in alignments:
-            for perfil in alignment.Profiles:
-                perfiles.append({
-                    "Alineación": alignment.Name,
-                    "Perfil": perfil.Name,
-                    "Tipo": str(perfil.Type),
-                    "Estilo": perfil.StyleName,
-                })
 
-    except Exception as e:
-        logger.exception("Error al obtener perfiles desde Civil 3D.")
-        return []
+def transmitir_perfiles_acad(backend, refrescar=False):
+    """
+    Generador para SesionCAD.transmitir: cada perfil del catálogo, con los
+    mismos campos que /obtener_perfiles, y al final {'resumen': {'total': n, ...}}.
+    """
+    if not backend.civil3d_disponible:
+        logger.warning("⚠️ Conexión establecida solo con AutoCAD. No se pueden obtener perfiles de Civil 3D.")
+        yield {"warning": "Civil 3D no está disponible o no se pudo conectar."}
+        return
+
+    _, resumen = yield from catalogo_perfiles.recorrer(backend, obtener_sesion().repartir, refrescar)
+    logger.info(f"✅ Se transmitieron {resumen['perfiles']} perfiles.")
+    yield {'resumen': {'total': resumen['perfiles'], **resumen}}
+
+
+def obtener_perfiles_acad(backend, refrescar=False):
+    """Lista los perfiles del dibujo desde el catálogo. Se ejecuta en la sesión CAD."""
+    if not backend.civil3d_disponible:
+        logger.warning("⚠️ Conexión establecida solo con AutoCAD. No se pueden obtener perfiles de Civil 3D.")
+        return {"warning": "Civil 3D no está disponible o no se pudo conectar."}
+
+    logger.debug("✅ Conexión con Civil 3D exitosa. Obteniendo perfiles...")
+    perfiles_info = obtener_perfiles_desde_civil3d(backend, refrescar)
+
+    if not perfiles_info:
+        logger.info("📭 No se encontraron perfiles en el dibujo actual.")
+        return {"warning": "No se encontraron perfiles en el dibujo."}
 
+    logger.info(f"✅ Se encontraron {len(perfiles_info)} perfiles.")
+    return perfiles_info
+
+
+def obtener_perfiles_desde_civil3d(backend, refrescar=False):
+    """
+    Obtiene perfiles de alineaciones desde el backend de Civil 3D, a través
+    del catálogo. Los errores (una sesión auxiliar que falla o no contesta)
+    se propagan: no son lo mismo que un dibujo sin perfiles.
+    """
+    perfiles, _ = catalogo_perfiles.actualizar(backend, obtener_sesion().repartir, refrescar)
     return perfiles
 
 
-def obtener_xdata(obj):
-    """Obtiene todas las XData del objeto."""
+def obtener_xdata(backend, obj):
+    """Atributos de las XData del objeto por aplicación, leídos una vez y guardados por handle."""
     try:
-        if hasattr(obj, "XData"):
-            return obj.XData
-        else:
-            return None
-    except AttributeError as e:
+        return atributos_xdata(backend, obj)
+    except Exception as e:
         logger.error(f"Error al acceder a XData: {e}")
         return None
 
 
-def obtener_alineacion(obj):
-    """Intenta obtener información de alineación asociada al objeto."""
-    try:
-        if hasattr(obj, "XData"):
-            xdata = obj.XData
-            for data in xdata:
-                if "Alineación" in data:
-                    return data["Alineación"]
-        return None
-    except Exception as e:
-        logger.error(f"Error al obtener alineación: {e}")
-        return None
+if __name__ == "__main__":
+    import sys
 
-def obtener_perfil(obj):
-    """Intenta obtener información de perfil asociada al objeto."""
-    try:
-        if hasattr(obj, "XData"):
-            xdata = obj.XData
-            for data in xdata:
-                if "Perfil" in data:
-                    return data["Perfil"]
-        return None
-    except Exception as e:
-        logger.error(f"Error al obtener perfil: {e}")
-        return None
+    import numpy as np
 
-def obtener_superficie(obj):
-    """Intenta obtener información de superficie asociada al objeto."""
-    try:
-        if hasattr(obj, "XData"):
-            xdata = obj.XData
-            for data in xdata:
-                if "Superficie" in data:
-                    return data["Superficie"]
-        return None
-    except Exception as e:
-        logger.error(f"Error al obtener superficie: {e}")
-        return None
\ No newline at end of file
+    from cad_memoria import crear_conector_memoria
+    from sesion_cad import SesionCAD
+
+    logging.getLogger().setLevel(logging.WARNING)
+    n_alineamientos = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    n_perfiles = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    trabajadores = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+
+    conector = crear_conector_memoria(latencia=0.002)
+    backend = conector.backend
+    estaciones = np.linspace(0, 1000, 200)
+    for a in range(n_alineamientos):
+        alineamiento = backend.agregar_alineamiento(f"Eje {a}", [0, 0, 0, 1000, 0, 0])
+        for p in range(n_perfiles):
+            rasante = np.column_stack((estaciones, np.zeros_like(estaciones), 100 + p + np.sin(estaciones / 50)))
+            backend.agregar_perfil(alineamiento, f"Perfil {p}", rasante.ravel().tolist())
+
+    # El inventario del espacio modelo se recorre una vez, fuera de la medida.
+    from obtener_objetos import inventario
+    inventario.actualizar(backend)
+
+    for n in (1, trabajadores):
+        sesion = SesionCAD(conector, trabajadores=n)
+        catalogo = CatalogoPerfiles()
+        perfiles, resumen = sesion.ejecutar(lambda b: catalogo.actualizar(b, sesion.repartir))
+        print(f"{n} trabajador(es), catálogo nuevo: {len(perfiles)} perfiles, {resumen}")
+        _, resumen = sesion.ejecutar(lambda b: catalogo.actualizar(b, sesion.repartir))
+        print(f"{n} trabajador(es), sin cambios: {resumen}")
+        sesion.ejecutar(lambda b: b.agregar_perfil(next(b.iterar_alineamientos()), "Nuevo", rasante.ravel().tolist()))
+        _, resumen = sesion.ejecutar(lambda b: catalogo.actualizar(b, sesion.repartir))
+        print(f"{n} trabajador(es), un perfil nuevo: {resumen}")
+        sesion.detener()
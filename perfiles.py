@@ -1,57 +1,101 @@
 from flask import Blueprint, jsonify, request
-from pyautocad import Autocad, APoint
 import logging
-import pythoncom
-from autocad_civil import conectar_con_autocad_civil, desconectar_autocad_civil
+import time
+import numpy as np
+import geometria
+from sesion_cad import obtener_sesion, ErrorSesionCAD
+from cache_objetos import instantanea
+from escritor_masivo import EscritorMasivo, TAMANO_LOTE_POR_DEFECTO
+from estacionamiento import estacionamiento_de
+from simplificacion import DOUGLAS_PEUCKER, METODOS, simplificar
+from superficie_tin import SuperficieTIN, superficie_desde_csv
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 perfiles_bp = Blueprint('perfiles', __name__)
 
-def generar_perfil_terreno_acad(acad, alineamiento_id, polilinea_id):
-    """Genera un perfil de terreno en AutoCAD."""
+COORDINATES_CSV = 'coordenadas.csv'
+
+def muestrear_alineamiento(estacionamiento, intervalo=None):
+    """
+    Puntos de muestreo a lo largo de un alineamiento (Estacionamiento): sus
+    vértices y, si se indica intervalo, uno cada intervalo metros de
+    estación. Devuelve las estaciones y un array (N, 3) con los puntos.
+    """
+    if not intervalo:
+        return estacionamiento.estaciones, estacionamiento.vertices
+    estaciones = estacionamiento.estaciones_cada(intervalo)
+    return estaciones, estacionamiento.puntos_en(estaciones)
+
+
+def generar_perfil_terreno_acad(backend, alineamiento_id, polilinea_id=None, intervalo=None, superficie=None):
+    """
+    Genera un perfil de terreno en AutoCAD.
+
+    Las cotas salen de superficie (SuperficieTIN, en una sola consulta
+    vectorizada) o, si no se da, del objeto polilinea_id del dibujo. Con
+    intervalo se muestrea cada intervalo metros además de en los vértices
+    del alineamiento. La polilínea 3D resultante se escribe de una vez.
+    """
     try:
-        if not acad:
+        if not backend:
             return {'error': 'No hay conexión con AutoCAD.'}
 
-        alineamiento = acad.doc.GetObject(alineamiento_id)
-        polilinea = acad.doc.GetObject(polilinea_id)
+        alineamiento = instantanea(backend, alineamiento_id)
+        polilinea = instantanea(backend, polilinea_id) if superficie is None else None
 
-        if not alineamiento or not polilinea:
+        if alineamiento is None or (superficie is None and polilinea is None):
             return {'error': 'Alineamiento o polilínea no encontrados'}
 
-        puntos_alineamiento = [APoint(p.x, p.y, p.z) for p in alineamiento.Coordinates]
+        estaciones, puntos = muestrear_alineamiento(estacionamiento_de(backend, alineamiento), intervalo)
 
-        elevaciones = []
-        for punto in puntos_alineamiento:
-            elevacion = polilinea.GetHeightAtPoint(punto)
-            elevaciones.append(elevacion)
+        if superficie is not None:
+            elevaciones = superficie.cotas(puntos[:, 0], puntos[:, 1])
+        else:
+            elevaciones = np.array([np.nan if e is None else e
+                                    for e in backend.alturas_en_puntos(polilinea.objeto, puntos.tolist())], dtype=np.float64)
 
-        perfil = acad.model.AddPolyline3D([APoint(p.x, p.y, e) for p, e in zip(puntos_alineamiento, elevaciones)])
+        validas = ~np.isnan(elevaciones)
+        if validas.sum() < 2:
+            return {'error': 'El alineamiento queda fuera de la superficie de terreno.'}
 
-        return {'message': 'Perfil de terreno generado correctamente'}
+        backend.agregar_polilinea_3d(geometria.plana(np.column_stack((puntos[validas, :2], elevaciones[validas]))))
+
+        return {
+            'message': 'Perfil de terreno generado correctamente',
+            'muestras': int(validas.sum()),
+            'fuera_de_superficie': int((~validas).sum()),
+            'longitud': float(estaciones[-1] - estaciones[0]),
+        }
 
     except Exception as e:
         logger.error(f"Error al generar perfil de terreno en AutoCAD: {e}")
         return {'error': f'Error al generar perfil de terreno en AutoCAD: {e}'}
 
-def copiar_perfil_tapado_acad(acad, perfil_id, distancia_tapa):
+def copias_tapadas(vertices, distancias):
+    """
+    Copias de un perfil (vértices (N, 3)) desplazadas en vertical las
+    distancias de tapa dadas. Devuelve un array (len(distancias), 3 * N) con
+    una copia plana por fila.
+    """
+    desplazamientos = np.zeros((len(distancias), 3))
+    desplazamientos[:, 2] = distancias
+    return geometria.desplazar(vertices, desplazamientos).reshape(len(distancias), -1)
+
+
+def copiar_perfil_tapado_acad(backend, perfil_id, distancia_tapa):
     """Copia un perfil en AutoCAD con una distancia de tapa vertical."""
     try:
-        if not acad:
+        if not backend:
             return {'error': 'No hay conexión con AutoCAD.'}
 
-        perfil_original = acad.doc.GetObject(perfil_id)
+        perfil_original = instantanea(backend, perfil_id)
 
-        if not perfil_original:
+        if perfil_original is None:
             return {'error': 'Perfil original no encontrado'}
 
-        puntos_original = [APoint(p.x, p.y, p.z) for p in perfil_original.Coordinates]
-
-        puntos_tapado = [APoint(p.x, p.y, p.z + distancia_tapa) for p in puntos_original]
-
-        perfil_tapado = acad.model.AddPolyline3D(puntos_tapado)
+        backend.agregar_polilinea_3d(copias_tapadas(perfil_original.vertices, [distancia_tapa])[0].tolist())
 
         return {'message': 'Perfil copiado con distancia tapada correctamente'}
 
@@ -59,25 +103,67 @@ def copiar_perfil_tapado_acad(acad, perfil_id, distancia_tapa):
         logger.error(f"Error al copiar perfil con distancia tapada en AutoCAD: {e}")
         return {'error': f'Error al copiar perfil con distancia tapada en AutoCAD: {e}'}
 
-def copiar_rasante_acad(acad, perfil_id):
+def copiar_perfiles_tapados_acad(backend, perfil_ids, distancias, tamano_lote=TAMANO_LOTE_POR_DEFECTO):
+    """
+    Copia varios perfiles con varias distancias de tapa: lee las coordenadas
+    de cada perfil una vez, calcula todas sus copias de golpe y las escribe
+    con EscritorMasivo (polilíneas 3D por lotes). Devuelve el tiempo de cada
+    perfil (lectura y cálculo) y las estadísticas de escritura.
+    """
+    try:
+        if not backend:
+            return {'error': 'No hay conexión con AutoCAD.'}
+
+        escritor = EscritorMasivo(backend, tamano_lote)
+        perfiles = []
+        for perfil_id in perfil_ids:
+            inicio = time.perf_counter()
+            perfil = instantanea(backend, perfil_id)
+            if perfil is None:
+                perfiles.append({'perfil_id': perfil_id, 'error': 'Perfil no encontrado'})
+                continue
+            vertices = perfil.vertices
+            leido = time.perf_counter()
+            copias = copias_tapadas(vertices, distancias)
+            calculado = time.perf_counter()
+            escritor.agregar_polilineas_3d(copias.tolist())
+            perfiles.append({
+                'perfil_id': perfil_id,
+                'vertices': len(vertices),
+                'copias': len(copias),
+                'lectura_ms': round((leido - inicio) * 1000, 3),
+                'calculo_ms': round((calculado - leido) * 1000, 3),
+            })
+        escritor.vaciar()
+
+        copiados = sum(1 for perfil in perfiles if 'error' not in perfil)
+        return {
+            'message': f'{copiados * len(distancias)} copias de {copiados} perfiles creadas correctamente',
+            'perfiles': perfiles,
+            'escritura': escritor.estadisticas(),
+        }
+
+    except Exception as e:
+        logger.error(f"Error al copiar perfiles con distancias tapadas en AutoCAD: {e}")
+        return {'error': f'Error al copiar perfiles con distancias tapadas en AutoCAD: {e}'}
+
+def copiar_rasante_acad(backend, perfil_id):
     """Copia la línea de rasante de un perfil de terreno en AutoCAD."""
     try:
-        if not acad:
+        if not backend:
             return {'error': 'No hay conexión con AutoCAD.'}
 
-        perfil_terreno = acad.doc.GetObject(perfil_id)
+        perfil_terreno = instantanea(backend, perfil_id)
 
-        if not perfil_terreno:
+        if perfil_terreno is None:
             return {'error': 'Perfil de terreno no encontrado'}
 
-        linea_rasante = perfil_terreno.GetGradeline()
+        linea_rasante = backend.linea_rasante(perfil_terreno.objeto)
 
-        if not linea_rasante:
+        if linea_rasante is None:
             return {'error': 'Línea de rasante no encontrada en el perfil'}
 
-        puntos_rasante = [APoint(p.x, p.y, p.z) for p in linea_rasante.Coordinates]
-
-        rasante_copiada = acad.model.AddPolyline3D(puntos_rasante)
+        backend.agregar_polilinea_3d(geometria.plana(backend.vertices(linea_rasante)))
 
         return {'message': 'Línea de rasante copiada correctamente'}
 
@@ -85,121 +171,146 @@ def copiar_rasante_acad(acad, perfil_id):
         logger.error(f"Error al copiar línea de rasante en AutoCAD: {e}")
         return {'error': f'Error al copiar línea de rasante en AutoCAD: {e}'}
 
-def minimizar_vertices_rasante_acad(acad, rasante_id, tolerancia):
-    """Minimiza los vértices de una línea de rasante en AutoCAD."""
+def minimizar_vertices_rasante_acad(backend, rasante_id, tolerancia, metodo=DOUGLAS_PEUCKER):
+    """
+    Minimiza los vértices de una línea de rasante en AutoCAD: dibuja la
+    rasante simplificada (simplificacion.py) como una polilínea 3D nueva.
+    """
     try:
-        if not acad:
+        if not backend:
             return {'error': 'No hay conexión con AutoCAD.'}
 
-        linea_rasante = acad.doc.GetObject(rasante_id)
+        linea_rasante = instantanea(backend, rasante_id)
 
-        if not linea_rasante:
+        if linea_rasante is None:
             return {'error': 'Línea de rasante no encontrada'}
 
-       
-        logging.warning("La funcionalidad de minimizar vértices de rasante no está completamente implementada en este ejemplo.")
-        return {'message': 'Vértices de línea de rasante minimizados correctamente (funcionalidad no implementada)'}
+        simplificada, resumen = simplificar(linea_rasante.vertices, tolerancia, metodo)
+        backend.agregar_polilinea_3d(geometria.plana(simplificada))
+
+        return {
+            'message': (f"Vértices de línea de rasante minimizados: {resumen['vertices_originales']} -> "
+                        f"{resumen['vertices_resultantes']} (desviación máxima {resumen['desviacion_maxima']:.3f})"),
+            **resumen,
+        }
 
     except Exception as e:
         logger.error(f"Error al minimizar vértices de línea de rasante en AutoCAD: {e}")
         return {'error': f'Error al minimizar vértices de línea de rasante en AutoCAD: {e}'}
 
+def superficie_terreno(superficie):
+    """
+    SuperficieTIN indicada en la petición: 'coordenadas' triangula
+    coordenadas.csv (reutilizada mientras no cambie); otro valor es el id o
+    handle de una superficie importada en el almacén del proyecto.
+    """
+    if superficie == 'coordenadas':
+        return superficie_desde_csv(COORDINATES_CSV)
+    from almacen_proyecto import AlmacenProyecto
+    with AlmacenProyecto() as almacen:
+        entidad = almacen.obtener(int(superficie) if str(superficie).isdigit() else superficie)
+        if entidad is None or entidad.tipo != 'AeccDbSurface':
+            raise LookupError(f"No existe la superficie '{superficie}' en el almacén del proyecto.")
+        return SuperficieTIN.desde_almacen(almacen, entidad.id)
+
+
 @perfiles_bp.route('/generar_perfil_terreno', methods=['POST'])
 def generar_perfil_terreno():
-    acad = None
-    civil3d = None
     try:
         data = request.get_json()
-        pythoncom.CoInitialize()
-        acad, civil3d = conectar_con_autocad_civil()
-        if not acad:
-            return jsonify({'error': 'No se pudo conectar con AutoCAD.'}), 500
-
-        result = generar_perfil_terreno_acad(acad, data.get('alineamiento_id'), data.get('polilinea_id'))
+        intervalo = data.get('intervalo')
+        if intervalo is not None and (not isinstance(intervalo, (int, float)) or isinstance(intervalo, bool)
+                                      or intervalo <= 0):
+            return jsonify({'error': 'El intervalo debe ser un número positivo.'}), 400
+        superficie = None
+        if data.get('superficie'):
+            # La triangulación se hace aquí, fuera del hilo de la sesión CAD.
+            try:
+                superficie = superficie_terreno(data['superficie'])
+            except (LookupError, ValueError, OSError) as e:
+                return jsonify({'error': f'No se pudo cargar la superficie de terreno: {e}'}), 400
+        elif not data.get('polilinea_id'):
+            return jsonify({'error': 'Indique polilinea_id o superficie.'}), 400
+        result = obtener_sesion().ejecutar(generar_perfil_terreno_acad, data.get('alineamiento_id'),
+                                           data.get('polilinea_id'), intervalo, superficie)
         return jsonify(result), 200 if 'error' not in result else 500
 
+    except ErrorSesionCAD as e:
+        logger.error(f"Error de conexión al generar perfil de terreno: {e}")
+        return jsonify({'error': 'No se pudo conectar con AutoCAD.'}), 500
     except Exception as e:
         logger.error(f"Error al generar perfil de terreno: {e}")
         return jsonify({'error': f'Error al generar perfil de terreno: {e}'}), 500
-    finally:
-        desconectar_autocad_civil(acad, civil3d)
-        try:
-            pythoncom.CoUninitialize()
-            logger.info("Recursos COM liberados.")
-        except Exception as e:
-            logger.error(f"Error al liberar recursos COM: {e}")
 
 @perfiles_bp.route('/copiar_perfil_tapado', methods=['POST'])
 def copiar_perfil_tapado():
-    acad = None
-    civil3d = None
     try:
         data = request.get_json()
-        pythoncom.CoInitialize()
-        acad, civil3d = conectar_con_autocad_civil()
-        if not acad:
-            return jsonify({'error': 'No se pudo conectar con AutoCAD.'}), 500
-
-        result = copiar_perfil_tapado_acad(acad, data.get('perfil_id'), data.get('distancia_tapa'))
+        result = obtener_sesion().ejecutar(copiar_perfil_tapado_acad, data.get('perfil_id'), data.get('distancia_tapa'))
         return jsonify(result), 200 if 'error' not in result else 500
 
+    except ErrorSesionCAD as e:
+        logger.error(f"Error de conexión al copiar perfil con distancia tapada: {e}")
+        return jsonify({'error': 'No se pudo conectar con AutoCAD.'}), 500
     except Exception as e:
         logger.error(f"Error al copiar perfil con distancia tapada: {e}")
         return jsonify({'error': f'Error al copiar perfil con distancia tapada: {e}'}), 500
-    finally:
-        desconectar_autocad_civil(acad, civil3d)
-        try:
-            pythoncom.CoUninitialize()
-            logger.info("Recursos COM liberados.")
-        except Exception as e:
-            logger.error(f"Error al liberar recursos COM: {e}")
+
+@perfiles_bp.route('/copiar_perfiles_tapados', methods=['POST'])
+def copiar_perfiles_tapados():
+    """{"perfil_ids": [...], "distancias": [0.8, 1.0, 1.2], "tamano_lote"?}: una copia por perfil y distancia."""
+    try:
+        data = request.get_json()
+        perfil_ids = data.get('perfil_ids')
+        distancias = data.get('distancias')
+        tamano_lote = data.get('tamano_lote', TAMANO_LOTE_POR_DEFECTO)
+        if not isinstance(perfil_ids, list) or not perfil_ids:
+            return jsonify({'error': 'perfil_ids debe ser una lista no vacía.'}), 400
+        if (not isinstance(distancias, list) or not distancias
+                or not all(isinstance(d, (int, float)) and not isinstance(d, bool) for d in distancias)):
+            return jsonify({'error': 'distancias debe ser una lista no vacía de números.'}), 400
+        if not isinstance(tamano_lote, int) or tamano_lote < 1:
+            return jsonify({'error': 'tamano_lote debe ser un entero positivo.'}), 400
+        result = obtener_sesion().ejecutar(copiar_perfiles_tapados_acad, perfil_ids, distancias, tamano_lote)
+        return jsonify(result), 200 if 'error' not in result else 500
+
+    except ErrorSesionCAD as e:
+        logger.error(f"Error de conexión al copiar perfiles con distancias tapadas: {e}")
+        return jsonify({'error': 'No se pudo conectar con AutoCAD.'}), 500
+    except Exception as e:
+        logger.error(f"Error al copiar perfiles con distancias tapadas: {e}")
+        return jsonify({'error': f'Error al copiar perfiles con distancias tapadas: {e}'}), 500
 
 @perfiles_bp.route('/copiar_rasante', methods=['POST'])
 def copiar_rasante():
-    acad = None
-    civil3d = None
     try:
         data = request.get_json()
-        pythoncom.CoInitialize()
-        acad, civil3d = conectar_con_autocad_civil()
-        if not acad:
-            return jsonify({'error': 'No se pudo conectar con AutoCAD.'}), 500
-
-        result = copiar_rasante_acad(acad, data.get('perfil_id'))
+        result = obtener_sesion().ejecutar(copiar_rasante_acad, data.get('perfil_id'))
         return jsonify(result), 200 if 'error' not in result else 500
 
+    except ErrorSesionCAD as e:
+        logger.error(f"Error de conexión al copiar línea de rasante: {e}")
+        return jsonify({'error': 'No se pudo conectar con AutoCAD.'}), 500
     except Exception as e:
         logger.error(f"Error al copiar línea de rasante: {e}")
         return jsonify({'error': f'Error al copiar línea de rasante: {e}'}), 500
-    finally:
-        desconectar_autocad_civil(acad, civil3d)
-        try:
-            pythoncom.CoUninitialize()
-            logger.info("Recursos COM liberados.")
-        except Exception as e:
-            logger.error(f"Error al liberar recursos COM: {e}")
 
 @perfiles_bp.route('/minimizar_vertices_rasante', methods=['POST'])
 def minimizar_vertices_rasante():
-    acad = None
-    civil3d = None
     try:
         data = request.get_json()
-        pythoncom.CoInitialize()
-        acad, civil3d = conectar_con_autocad_civil()
-        if not acad:
-            return jsonify({'error': 'No se pudo conectar con AutoCAD.'}), 500
-
-        result = minimizar_vertices_rasante_acad(acad, data.get('rasante_id'), data.get('tolerancia'))
+        tolerancia = data.get('tolerancia')
+        metodo = data.get('metodo', DOUGLAS_PEUCKER)
+        if not isinstance(tolerancia, (int, float)) or isinstance(tolerancia, bool) or tolerancia < 0:
+            return jsonify({'error': 'La tolerancia debe ser un número no negativo.'}), 400
+        if metodo not in METODOS:
+            return jsonify({'error': f"Método no válido: '{metodo}'. Use {' o '.join(METODOS)}."}), 400
+        result = obtener_sesion().ejecutar(minimizar_vertices_rasante_acad, data.get('rasante_id'), tolerancia, metodo)
         return jsonify(result), 200 if 'error' not in result else 500
 
+    except ErrorSesionCAD as e:
+        logger.error(f"Error de conexión al minimizar vértices de línea de rasante: {e}")
+        return jsonify({'error': 'No se pudo conectar con AutoCAD.'}), 500
     except Exception as e:
         logger.error(f"Error al minimizar vértices de línea de rasante: {e}")
-        return jsonify({'error': f'Error al minimizar vértices de línea de rasante: {e}'}), 500
-    finally:
-        desconectar_autocad_civil(acad, civil3d)
-        try:
-            pythoncom.CoUninitialize()
-            logger.info("Recursos COM liberados.")
-        except Exception as e:
-            logger.error(f"Error al liberar recursos COM: {e}")
\ No newline at end of file
+        return jsonify({'error': f'Error al minimizar vértices de línea de rasante: {e}'}), 500
\ No newline at end of file
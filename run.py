@@ -1,37 +1,57 @@
-<<<<<<< HEAD
-from flask import Flask, render_template, jsonify
-from crear_puntos import crear_puntos_bp
-from crear_puntos_curva import crear_puntos_curva_bp
-import os
-from flask_cors import CORS
+import time
 
-app = Flask(__name__)
-CORS(app)
+_inicio_arranque = time.perf_counter()
 
-app.register_blueprint(crear_puntos_bp)
-app.register_blueprint(crear_puntos_curva_bp)
-=======
+import importlib
 import logging
 from flask import Flask, render_template, jsonify, request
 from flask_cors import CORS
 import os
 import subprocess
 import multiprocessing
-from crear_puntos import crear_puntos_bp
-from crear_puntos_curva import crear_puntos_curva_bp
-from seleccionar_objetos import seleccionar_objetos_directo_bp
-from perfiles import perfiles_bp
-from etiquetado import etiquetado_bp
-from autocad_civil import conectar_con_autocad_civil, desconectar_autocad_civil
-from obtener_objetos import obtener_objetos_bp
-from cargar_dwg import abrir_dwg
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Tiempos de arranque en milisegundos, por módulo importado. Los módulos
+# compartidos (p. ej. sesion_cad) se cuentan en el primer blueprint que los importa.
+TIEMPOS_ARRANQUE = {'flask_ms': round((time.perf_counter() - _inicio_arranque) * 1000, 2), 'importaciones_ms': {}}
+
+
+def importar_con_tiempo(modulo, nombre):
+    """
+    Importa nombre desde modulo y registra cuánto tardó la importación. Solo
+    cuenta la primera vez: las siguientes encuentran el módulo ya cargado.
+    """
+    inicio = time.perf_counter()
+    objeto = getattr(importlib.import_module(modulo), nombre)
+    TIEMPOS_ARRANQUE['importaciones_ms'].setdefault(modulo, round((time.perf_counter() - inicio) * 1000, 2))
+    return objeto
+
+
+crear_puntos_bp = importar_con_tiempo('crear_puntos', 'crear_puntos_bp')
+crear_puntos_curva_bp = importar_con_tiempo('crear_puntos_curva', 'crear_puntos_curva_bp')
+seleccionar_objetos_pyacad_bp = importar_con_tiempo('seleccionar_objetos', 'seleccionar_objetos_pyacad_bp')
+perfiles_bp = importar_con_tiempo('perfiles', 'perfiles_bp')
+etiquetado_bp = importar_con_tiempo('etiquetado', 'etiquetado_bp')
+obtener_objetos_bp = importar_con_tiempo('obtener_objetos', 'obtener_objetos_bp')
+obtener_perfiles_autocad = importar_con_tiempo('obtener_perfiles', 'obtener_perfiles_autocad')
+obtener_perfiles_ndjson = importar_con_tiempo('obtener_perfiles', 'obtener_perfiles_ndjson')
+sesion_cad_bp = importar_con_tiempo('sesion_cad', 'sesion_cad_bp')
+obtener_sesion = importar_con_tiempo('sesion_cad', 'obtener_sesion')
+trabajos_bp = importar_con_tiempo('civil3d_process', 'trabajos_bp')
+exportar_dxf_bp = importar_con_tiempo('exportar_dxf', 'exportar_dxf_bp')
+exportar_landxml_bp = importar_con_tiempo('exportar_landxml', 'exportar_landxml_bp')
+almacen_bp = importar_con_tiempo('almacen_proyecto', 'almacen_bp')
+estacionamiento_bp = importar_con_tiempo('estacionamiento', 'estacionamiento_bp')
+movimiento_tierras_bp = importar_con_tiempo('movimiento_tierras', 'movimiento_tierras_bp')
+cache_objetos_bp = importar_con_tiempo('cache_objetos', 'cache_objetos_bp')
+indice_espacial_bp = importar_con_tiempo('indice_espacial', 'indice_espacial_bp')
+datos_extendidos_bp = importar_con_tiempo('datos_extendidos', 'datos_extendidos_bp')
+abrir_dwg = importar_con_tiempo('cargar_dwg', 'abrir_dwg')
+
 app = Flask(__name__)
 CORS(app)
->>>>>>> 3a25e43 (fix update)
 
 @app.route('/recibir_datos_civil3d', methods=['POST'])
 def recibir_datos_civil3d():
@@ -44,25 +64,34 @@ def recibir_datos_civil3d():
         logger.error(f"Error al recibir o procesar datos de Civil 3D: {e}")
         return jsonify({'error': f'Error al recibir o procesar datos: {e}'}), 400
 
-@app.route('/listar_scripts')
-def listar_scripts():
-    try:
-        scripts = [f for f in os.listdir('.') if f.endswith('.py') and f not in ['run.py', '__init__.py']]
-        return jsonify(scripts)
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+@app.route('/estado_arranque', methods=['GET'])
+def estado_arranque():
+    """Informe de tiempos de arranque desglosado por importación de blueprint."""
+    return jsonify(TIEMPOS_ARRANQUE), 200
 
 if __name__ == '__main__':
     multiprocessing.freeze_support()
 
     try:
         logger.info("Registrando los blueprints...")
+        inicio_registro = time.perf_counter()
         app.register_blueprint(crear_puntos_bp)
         app.register_blueprint(crear_puntos_curva_bp)
-        app.register_blueprint(seleccionar_objetos_directo_bp)
+        app.register_blueprint(seleccionar_objetos_pyacad_bp)
         app.register_blueprint(perfiles_bp)
         app.register_blueprint(etiquetado_bp)
         app.register_blueprint(obtener_objetos_bp)
+        app.register_blueprint(sesion_cad_bp)
+        app.register_blueprint(trabajos_bp)
+        app.register_blueprint(exportar_dxf_bp)
+        app.register_blueprint(exportar_landxml_bp)
+        app.register_blueprint(almacen_bp)
+        app.register_blueprint(estacionamiento_bp)
+        app.register_blueprint(movimiento_tierras_bp)
+        app.register_blueprint(cache_objetos_bp)
+        app.register_blueprint(indice_espacial_bp)
+        app.register_blueprint(datos_extendidos_bp)
+        TIEMPOS_ARRANQUE['registro_blueprints_ms'] = round((time.perf_counter() - inicio_registro) * 1000, 2)
         logger.info("Blueprints registrados correctamente.")
     except Exception as e:
         logger.error(f"Error al registrar los blueprints: {e}")
@@ -86,19 +115,14 @@ if __name__ == '__main__':
 
     @app.route('/obtener_perfiles', methods=['GET'])
     def obtener_perfiles():
-        try:
-            logger.info("Intentando obtener perfiles de AutoCAD/Civil 3D (vía COM)...")
-            acad = conectar_con_autocad_civil()
-            if acad:
-    
-                perfiles = []
-                desconectar_autocad_civil(acad)
-                return jsonify(perfiles)
-            else:
-                return jsonify({"error": "No se pudo conectar con AutoCAD/Civil 3D"}), 500
-        except Exception as e:
-            logger.error(f"Error al obtener los perfiles de AutoCAD/Civil 3D (vía COM): {e}")
-            return jsonify({"error": f"Error al obtener los perfiles de AutoCAD/Civil 3D (vía COM): {e}"}), 500
+        refrescar = request.args.get('refrescar') == '1'
+        if request.args.get('formato') == 'ndjson':
+            return obtener_perfiles_ndjson(refrescar)
+        logger.info("Obteniendo perfiles de AutoCAD/Civil 3D (sesión COM)...")
+        resultado = obtener_perfiles_autocad(refrescar=refrescar)
+        if isinstance(resultado, dict) and 'error' in resultado:
+            return jsonify(resultado), 500
+        return jsonify(resultado)
 
     # Ruta para abrir un archivo DWG
     @app.route('/abrir_dwg', methods=['POST'])
@@ -193,6 +217,13 @@ if __name__ == '__main__':
             logger.error(f"Ocurrió un error inesperado: {str(e)}")
             return jsonify({'error': f"Ocurrió un error inesperado: {str(e)}"}), 500
 
+    if os.environ.get('ADDEC_PRECALENTAR', '0') == '1':
+        # Conecta con AutoCAD/Civil 3D en segundo plano mientras Flask arranca.
+        obtener_sesion().calentar()
+
+    TIEMPOS_ARRANQUE['total_ms'] = round((time.perf_counter() - _inicio_arranque) * 1000, 2)
+    logger.info(f"Tiempos de arranque: {TIEMPOS_ARRANQUE}")
+
     try:
         logger.info("Iniciando la aplicación Flask...")
         app.run(debug=True, use_reloader=False)
@@ -0,0 +1,459 @@
+"""
+Sesión persistente con AutoCAD/Civil 3D.
+
+Un único hilo de trabajo inicializa COM (su propio apartamento), mantiene el
+backend de dibujo conectado y ejecuta las operaciones que le envían las rutas
+de Flask. Así se evita recorrer los ProgID y llamar a CoUninitialize en cada
+petición.
+
+Con la variable de entorno ADDEC_BACKEND=memoria la sesión usa el backend en
+memoria de cad_memoria.py, útil para pruebas de carga en Linux; con
+ADDEC_BACKEND=almacen lee el almacén local del proyecto (almacen_proyecto.py).
+
+Los listados largos se transmiten mientras se recorren: transmitir(generador)
+entrega sus elementos por bloques desde el hilo de la sesión y
+respuesta_ndjson los escribe como NDJSON (una línea JSON por elemento).
+
+Las lecturas que se pueden hacer por separado (la geometría de cada perfil,
+por ejemplo) se reparten con repartir(funcion, lotes) entre sesiones
+auxiliares, cada una con su hilo, su apartamento COM y su propia conexión.
+ADDEC_TRABAJADORES fija cuántas (4 por defecto; 1 lo hace todo en la sesión).
+"""
+import functools
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FuturesTimeoutError
+
+from flask import Blueprint, Response, jsonify
+
+from backend_dibujo import conectar_backend_com
+
+try:
+    import pythoncom
+except ImportError:  # Linux / backend en memoria
+    pythoncom = None
+
+logger = logging.getLogger(__name__)
+
+sesion_cad_bp = Blueprint('sesion_cad', __name__)
+
+TAMANO_BLOQUE_TRANSMISION = 500
+BLOQUES_EN_VUELO = 8
+TRABAJADORES = 4
+
+
+class ErrorSesionCAD(Exception):
+    """No se pudo conectar con AutoCAD/Civil 3D o la operación no terminó a tiempo."""
+
+
+class SesionCAD:
+    """
+    Broker de la conexión con AutoCAD/Civil 3D.
+
+    Las rutas llaman a ejecutar(funcion, *args) y el hilo de la sesión invoca
+    funcion(backend, *args) dentro de su apartamento COM. Si la conexión se
+    pierde, se reconecta y se reintenta la operación una vez.
+
+    conector(try_create, auxiliar=False) debe devolver un BackendDibujo o
+    None; con auxiliar=True, una conexión más al mismo documento para las
+    sesiones de repartir.
+    """
+
+    def __init__(self, conector=None, intervalo_verificacion=30.0, timeout=300.0, try_create=True,
+                 trabajadores=TRABAJADORES):
+        self._conector = conector or conectar_backend_com
+        self.intervalo_verificacion = intervalo_verificacion
+        self.timeout = timeout
+        self.try_create = try_create
+        self.trabajadores = trabajadores
+        self._auxiliares = []
+
+        self._tareas = queue.Queue()
+        self._hilo = None
+        self._lock = threading.Lock()
+        self._backend = None
+        self._ultima_verificacion = 0.0
+        self._estadisticas = {
+            'conexiones': 0,
+            'reconexiones': 0,
+            'verificaciones': 0,
+            'llamadas': 0,
+            'llamadas_reutilizadas': 0,
+            'errores': 0,
+            'tiempo_conexion_s': 0.0,
+            'tiempo_llamadas_s': 0.0,
+        }
+
+    # --- API pública -----------------------------------------------------
+
+    def iniciar(self):
+        """Arranca el hilo de la sesión si no está en marcha."""
+        with self._lock:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._bucle, name='SesionCAD', daemon=True)
+                self._hilo.start()
+                logger.info("Hilo de la sesión AutoCAD/Civil 3D iniciado.")
+
+    def calentar(self):
+        """
+        Conecta en segundo plano sin bloquear al llamador.
+
+        La primera petición real encuentra la conexión ya abierta. Si falla,
+        solo se registra: la siguiente petición volverá a intentarlo.
+        """
+        def _calentar(backend):
+            logger.info("Conexión con AutoCAD/Civil 3D precalentada.")
+
+        def _registrar_error(futuro):
+            if futuro.exception() is not None:
+                logger.warning(f"No se pudo precalentar la conexión: {futuro.exception()}")
+
+        self.iniciar()
+        futuro = Future()
+        futuro.add_done_callback(_registrar_error)
+        self._tareas.put((futuro, _calentar, (), {}))
+        return futuro
+
+    def detener(self, timeout=10.0):
+        """Cierra la conexión y termina el hilo de la sesión y los de las sesiones auxiliares."""
+        with self._lock:
+            auxiliares, self._auxiliares = self._auxiliares, []
+        for auxiliar in auxiliares:
+            auxiliar.detener(timeout)
+        hilo = self._hilo
+        if hilo is not None and hilo.is_alive():
+            self._tareas.put(None)
+            hilo.join(timeout)
+        self._hilo = None
+
+    def enviar(self, funcion, *args, **kwargs):
+        """Encola funcion(backend, *args, **kwargs) sin esperar y devuelve su Future."""
+        self.iniciar()
+        futuro = Future()
+        self._tareas.put((futuro, funcion, args, kwargs))
+        return futuro
+
+    def ejecutar(self, funcion, *args, timeout=None, **kwargs):
+        """Ejecuta funcion(backend, *args, **kwargs) en el hilo de la sesión y devuelve su resultado."""
+        if threading.current_thread() is self._hilo:
+            # Llamada anidada desde una operación que ya corre en la sesión.
+            return funcion(self._backend, *args, **kwargs)
+
+        futuro = self.enviar(funcion, *args, **kwargs)
+        try:
+            return futuro.result(timeout=timeout or self.timeout)
+        except FuturesTimeoutError:
+            futuro.cancel()
+            raise ErrorSesionCAD(f"La operación {getattr(funcion, '__name__', funcion)} no terminó a tiempo.")
+
+    def transmitir(self, funcion, *args, tamano_bloque=TAMANO_BLOQUE_TRANSMISION,
+                   bloques_en_vuelo=BLOQUES_EN_VUELO, **kwargs):
+        """
+        Ejecuta el generador funcion(backend, *args, **kwargs) en el hilo de
+        la sesión y devuelve un iterador de bloques (listas de hasta
+        tamano_bloque elementos) que se entregan a medida que se producen.
+
+        Los bloques pasan por una cola de bloques_en_vuelo: si el consumidor
+        se retrasa, el generador espera, así la memoria no depende del tamaño
+        del listado. Si el consumidor cierra el iterador o no lee en timeout
+        segundos, el generador se detiene. Los errores se relanzan en el
+        consumidor; no se reintenta tras reconectar porque lo ya entregado no
+        se puede deshacer.
+        """
+        cola = queue.Queue(bloques_en_vuelo)
+        cancelada = threading.Event()
+
+        def poner(mensaje):
+            limite = time.monotonic() + self.timeout
+            while not cancelada.is_set():
+                try:
+                    cola.put(mensaje, timeout=0.5)
+                    return True
+                except queue.Full:
+                    if time.monotonic() > limite:
+                        logger.warning(f"Transmisión de {getattr(funcion, '__name__', funcion)} abandonada: el cliente no lee.")
+                        return False
+            return False
+
+        def producir(backend):
+            generador = funcion(backend, *args, **kwargs)
+            bloque = []
+            try:
+                for elemento in generador:
+                    bloque.append(elemento)
+                    if len(bloque) >= tamano_bloque:
+                        if not poner(('bloque', bloque)):
+                            return
+                        bloque = []
+                if bloque and not poner(('bloque', bloque)):
+                    return
+                poner(('fin', None))
+            except Exception as e:
+                # Lo leído antes del error también llega al consumidor.
+                if not bloque or poner(('bloque', bloque)):
+                    poner(('error', e))
+            finally:
+                generador.close()
+
+        def consumir():
+            futuro = self.enviar(producir)
+            limite = time.monotonic() + self.timeout
+            try:
+                while True:
+                    try:
+                        tipo, valor = cola.get(timeout=0.5)
+                    except queue.Empty:
+                        if futuro.done() and cola.empty():
+                            futuro.result()  # Relanza el error de conexión, si lo hubo.
+                            raise ErrorSesionCAD("La transmisión terminó sin completarse.")
+                        if time.monotonic() > limite:
+                            raise ErrorSesionCAD(f"La transmisión de {getattr(funcion, '__name__', funcion)} no avanzó a tiempo.")
+                        continue
+                    if tipo == 'fin':
+                        return
+                    if tipo == 'error':
+                        raise valor
+                    limite = time.monotonic() + self.timeout
+                    yield valor
+            finally:
+                cancelada.set()
+
+        return consumir()
+
+    def repartir(self, funcion, lotes, timeout=None):
+        """
+        Ejecuta funcion(backend, lote) para cada lote repartiendo los lotes
+        entre las sesiones auxiliares, y devuelve los resultados en el orden
+        de los lotes. funcion solo debe recibir datos que valgan en otra
+        conexión (handles, no objetos COM) y solo debe leer.
+
+        Se puede llamar desde una operación que corre en la sesión: esta
+        espera mientras las auxiliares trabajan con sus conexiones. Con un
+        solo trabajador o un solo lote, todo se ejecuta en la sesión.
+        """
+        lotes = list(lotes)
+        if self.trabajadores <= 1 or len(lotes) <= 1:
+            return [self.ejecutar(funcion, lote, timeout=timeout) for lote in lotes]
+        auxiliares = self._sesiones_auxiliares()
+        futuros = [auxiliares[i % len(auxiliares)].enviar(funcion, lote) for i, lote in enumerate(lotes)]
+        try:
+            return [futuro.result(timeout=timeout or self.timeout) for futuro in futuros]
+        except FuturesTimeoutError:
+            raise ErrorSesionCAD(f"La operación {getattr(funcion, '__name__', funcion)} no terminó a tiempo.")
+        finally:
+            for futuro in futuros:
+                futuro.cancel()
+
+    def _sesiones_auxiliares(self):
+        with self._lock:
+            if not self._auxiliares:
+                conector = functools.partial(self._conector, auxiliar=True)
+                self._auxiliares = [SesionCAD(conector, self.intervalo_verificacion, self.timeout, try_create=False,
+                                              trabajadores=1) for _ in range(self.trabajadores)]
+            return self._auxiliares
+
+    def estadisticas(self):
+        """Devuelve los contadores de reutilización de la conexión."""
+        with self._lock:
+            datos = dict(self._estadisticas)
+        llamadas = datos['llamadas']
+        datos['tasa_reutilizacion'] = round(datos['llamadas_reutilizadas'] / llamadas, 4) if llamadas else 0.0
+        datos['tiempo_medio_llamada_ms'] = round(1000 * datos['tiempo_llamadas_s'] / llamadas, 3) if llamadas else 0.0
+        datos['conectado'] = self._backend is not None
+        datos['backend'] = getattr(self._backend, 'nombre', None)
+        datos['tareas_pendientes'] = self._tareas.qsize()
+        datos['sesiones_auxiliares'] = len(self._auxiliares)
+        return datos
+
+    # --- Implementación ----------------------------------------------------
+
+    def _sumar(self, **incrementos):
+        with self._lock:
+            for clave, valor in incrementos.items():
+                self._estadisticas[clave] += valor
+
+    def _bucle(self):
+        if pythoncom is not None:
+            pythoncom.CoInitialize()
+        try:
+            while True:
+                tarea = self._tareas.get()
+                if tarea is None:
+                    break
+                futuro, funcion, args, kwargs = tarea
+                if not futuro.set_running_or_notify_cancel():
+                    continue
+                try:
+                    futuro.set_result(self._procesar(funcion, args, kwargs))
+                except BaseException as e:
+                    futuro.set_exception(e)
+        finally:
+            self._cerrar_conexion()
+            if pythoncom is not None:
+                pythoncom.CoUninitialize()
+            logger.info("Hilo de la sesión AutoCAD/Civil 3D terminado.")
+
+    def _procesar(self, funcion, args, kwargs):
+        inicio = time.perf_counter()
+        reutilizada = self._asegurar_conexion()
+        try:
+            try:
+                resultado = funcion(self._backend, *args, **kwargs)
+            except Exception as e:
+                if self._conexion_valida():
+                    raise
+                logger.warning(f"Conexión perdida durante {getattr(funcion, '__name__', funcion)}: {e}. Reconectando...")
+                self._reconectar()
+                reutilizada = False
+                resultado = funcion(self._backend, *args, **kwargs)
+        except Exception:
+            self._sumar(errores=1)
+            raise
+        finally:
+            self._sumar(llamadas=1, llamadas_reutilizadas=int(reutilizada),
+                        tiempo_llamadas_s=time.perf_counter() - inicio)
+        return resultado
+
+    def _asegurar_conexion(self):
+        """Conecta si hace falta. Devuelve True si se reutilizó la conexión existente."""
+        if self._backend is None:
+            self._conectar()
+            return False
+        if time.monotonic() - self._ultima_verificacion > self.intervalo_verificacion:
+            if not self._conexion_valida():
+                logger.warning("La conexión con AutoCAD/Civil 3D no responde. Reconectando...")
+                self._reconectar()
+                return False
+        return True
+
+    def _conexion_valida(self):
+        if self._backend is None:
+            return False
+        self._sumar(verificaciones=1)
+        try:
+            valida = bool(self._backend.verificar())
+        except Exception as e:
+            logger.debug(f"Verificación de la conexión fallida: {e}")
+            valida = False
+        if valida:
+            self._ultima_verificacion = time.monotonic()
+        return valida
+
+    def _conectar(self):
+        inicio = time.perf_counter()
+        backend = self._conector(try_create=self.try_create)
+        self._sumar(tiempo_conexion_s=time.perf_counter() - inicio)
+        if backend is None:
+            raise ErrorSesionCAD("No se pudo conectar con AutoCAD/Civil 3D.")
+        self._backend = backend
+        self._ultima_verificacion = time.monotonic()
+        self._sumar(conexiones=1)
+        logger.info("Sesión conectada con AutoCAD/Civil 3D.")
+
+    def _reconectar(self):
+        self._cerrar_conexion()
+        self._sumar(reconexiones=1)
+        self._conectar()
+
+    def _cerrar_conexion(self):
+        if self._backend is None:
+            return
+        try:
+            self._backend.cerrar()
+        except Exception as e:
+            logger.warning(f"Error al cerrar la conexión de la sesión: {e}")
+        finally:
+            self._backend = None
+
+
+_sesion = None
+_sesion_lock = threading.Lock()
+
+
+def crear_sesion_desde_entorno():
+    """Crea una sesión según ADDEC_BACKEND ('com' por defecto, 'memoria' o 'almacen')."""
+    backend = os.environ.get('ADDEC_BACKEND', 'com').lower()
+    intervalo = float(os.environ.get('ADDEC_INTERVALO_VERIFICACION', '30'))
+    trabajadores = int(os.environ.get('ADDEC_TRABAJADORES', TRABAJADORES))
+    if backend == 'memoria':
+        from cad_memoria import crear_conector_memoria
+        latencia = float(os.environ.get('ADDEC_LATENCIA_MEMORIA', '0'))
+        logger.info(f"Sesión CAD con backend en memoria (latencia {latencia} s).")
+        return SesionCAD(crear_conector_memoria(latencia), intervalo_verificacion=intervalo, trabajadores=trabajadores)
+    if backend == 'almacen':
+        from almacen_proyecto import crear_conector_almacen
+        logger.info("Sesión CAD con el almacén local del proyecto (solo lectura).")
+        return SesionCAD(crear_conector_almacen(os.environ.get('ADDEC_ALMACEN')), intervalo_verificacion=intervalo,
+                         trabajadores=trabajadores)
+    return SesionCAD(intervalo_verificacion=intervalo, trabajadores=trabajadores)
+
+
+def obtener_sesion():
+    """Devuelve la sesión compartida por todas las rutas, creándola la primera vez."""
+    global _sesion
+    with _sesion_lock:
+        if _sesion is None:
+            _sesion = crear_sesion_desde_entorno()
+        return _sesion
+
+
+def respuesta_ndjson(bloques):
+    """
+    Response que escribe cada elemento de los bloques (transmitir) como una
+    línea JSON, un bloque por fragmento. Si la transmisión falla a mitad,
+    la última línea es {"error": ...}.
+    """
+    def fragmentos():
+        try:
+            for bloque in bloques:
+                yield ''.join(json.dumps(elemento, ensure_ascii=False) + '\n' for elemento in bloque)
+        except ErrorSesionCAD as e:
+            logger.error(f"Error de conexión durante la transmisión: {e}")
+            yield json.dumps({'error': 'No se pudo conectar con AutoCAD.'}, ensure_ascii=False) + '\n'
+        except Exception as e:
+            logger.error(f"Error durante la transmisión: {e}")
+            yield json.dumps({'error': f'Error durante la transmisión: {e}'}, ensure_ascii=False) + '\n'
+        finally:
+            if hasattr(bloques, 'close'):
+                bloques.close()
+
+    return Response(fragmentos(), mimetype='application/x-ndjson', headers={'X-Accel-Buffering': 'no'})
+
+
+@sesion_cad_bp.route('/estado_sesion', methods=['GET'])
+def estado_sesion():
+    """Estadísticas de reutilización de la conexión con AutoCAD/Civil 3D."""
+    return jsonify(obtener_sesion().estadisticas()), 200
+
+
+if __name__ == "__main__":
+    # Prueba de carga con el backend en memoria: varios hilos de Flask
+    # simulados comparten una única conexión.
+    import sys
+    from concurrent.futures import ThreadPoolExecutor
+    from cad_memoria import crear_conector_memoria
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    hilos = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    peticiones = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    conector = crear_conector_memoria(latencia=0.0005)
+    sesion = SesionCAD(conector, intervalo_verificacion=0.05)
+
+    def peticion(i):
+        if i == peticiones // 2:
+            conector.backend.abierto = False  # Simula que AutoCAD se cerró.
+        return sesion.ejecutar(lambda backend, n: backend.agregar_punto(n, n, 0.0), i)
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(hilos) as ejecutor:
+        handles = list(ejecutor.map(peticion, range(peticiones)))
+    duracion = time.perf_counter() - inicio
+
+    print(f"{len(handles)} peticiones en {duracion:.3f} s ({len(handles) / duracion:.0f} peticiones/s)")
+    print(sesion.estadisticas())
+    sesion.detener()
@@ -0,0 +1,203 @@
+"""
+Simplificación de polilíneas (rasantes, perfiles, alineamientos) con NumPy.
+
+Las funciones reciben un array (N, 2) de (estación, cota) o (N, 3) de
+vértices y devuelven una máscara booleana con los vértices que se
+conservan; el primero y el último se conservan siempre.
+
+- douglas_peucker: conserva los vértices que se apartan más de tolerancia
+  de la cuerda. Se procesan a la vez todos los tramos pendientes de cada
+  nivel de la recursión, así el coste es de unas pocas pasadas
+  vectorizadas sobre el array.
+- visvalingam_whyatt: elimina los vértices cuyo triángulo con sus vecinos
+  tiene un área menor que area_minima. Se quitan por rondas los mínimos
+  locales de área (nunca dos vecinos en la misma ronda) y se recalculan
+  las áreas de los que quedan.
+
+desviacion_maxima mide la distancia máxima de los vértices originales a la
+polilínea simplificada.
+
+Uso desde la línea de comandos:
+    python simplificacion.py [vertices] [tolerancia]   # mide ambos métodos
+"""
+import numpy as np
+
+DOUGLAS_PEUCKER = 'douglas_peucker'
+VISVALINGAM_WHYATT = 'visvalingam_whyatt'
+METODOS = (DOUGLAS_PEUCKER, VISVALINGAM_WHYATT)
+
+RONDAS_POR_MINIMOS = 32
+
+
+def _como_array(puntos):
+    puntos = np.asarray(puntos, dtype=np.float64)
+    if puntos.ndim != 2 or puntos.shape[1] not in (2, 3):
+        raise ValueError("Los vértices deben ser un array (N, 2) o (N, 3).")
+    return puntos
+
+
+def _distancias2_a_segmentos(columnas, indices, inicios, fines):
+    """
+    Distancia al cuadrado de los vértices indices al segmento inicios-fines
+    de su misma posición. columnas son las coordenadas por separado (x, y...).
+    """
+    producto = longitud2 = 0.0
+    relativos, direcciones = [], []
+    for columna in columnas:
+        origen = columna[inicios]
+        direccion = columna[fines] - origen
+        relativo = columna[indices] - origen
+        producto = producto + relativo * direccion
+        longitud2 = longitud2 + direccion * direccion
+        relativos.append(relativo)
+        direcciones.append(direccion)
+    t = producto / np.where(longitud2 > 0, longitud2, 1.0)
+    np.clip(t, 0.0, 1.0, out=t)
+    distancia2 = 0.0
+    for relativo, direccion in zip(relativos, direcciones):
+        resto = relativo - t * direccion
+        distancia2 = distancia2 + resto * resto
+    return distancia2
+
+
+def _interiores(inicios, fines):
+    """Índices de los vértices interiores de cada tramo y el tramo al que pertenece cada uno."""
+    cuantos = fines - inicios - 1
+    tramo = np.repeat(np.arange(len(inicios)), cuantos)
+    indices = np.arange(len(tramo)) + np.repeat(inicios + 1 - (np.cumsum(cuantos) - cuantos), cuantos)
+    return indices, tramo
+
+
+def douglas_peucker(puntos, tolerancia):
+    """Máscara de los vértices que conserva Douglas-Peucker con la tolerancia (distancia) dada."""
+    puntos = _como_array(puntos)
+    n = len(puntos)
+    conservar = np.zeros(n, dtype=bool)
+    if n <= 2:
+        conservar[:] = True
+        return conservar
+    conservar[[0, -1]] = True
+
+    columnas = [np.ascontiguousarray(puntos[:, k]) for k in range(puntos.shape[1])]
+    tolerancia2 = tolerancia * tolerancia
+    inicios, fines = np.array([0]), np.array([n - 1])
+    while len(inicios):
+        con_interiores = fines - inicios > 1
+        inicios, fines = inicios[con_interiores], fines[con_interiores]
+        if not len(inicios):
+            break
+        indices, tramo = _interiores(inicios, fines)
+        distancias2 = _distancias2_a_segmentos(columnas, indices, inicios[tramo], fines[tramo])
+
+        # Máximo de cada tramo y el primer vértice que lo alcanza (los tramos son contiguos).
+        cuantos = fines - inicios - 1
+        maximos = np.maximum.reduceat(distancias2, np.cumsum(cuantos) - cuantos)
+        en_maximo = np.flatnonzero(distancias2 == maximos[tramo])
+        primero = np.flatnonzero(np.diff(tramo[en_maximo], prepend=-1))
+        vertice_maximo = indices[en_maximo[primero]]
+
+        dividir = maximos > tolerancia2
+        corte = vertice_maximo[dividir]
+        conservar[corte] = True
+        inicios, fines = np.concatenate((inicios[dividir], corte)), np.concatenate((corte, fines[dividir]))
+    return conservar
+
+
+def _areas(puntos, vivos):
+    """Área del triángulo de cada vértice interior de vivos con sus vecinos."""
+    a, b, c = puntos[vivos[:-2]], puntos[vivos[1:-1]], puntos[vivos[2:]]
+    u, v = b - a, c - a
+    if puntos.shape[1] == 2:
+        return 0.5 * np.abs(u[:, 0] * v[:, 1] - u[:, 1] * v[:, 0])
+    return 0.5 * np.linalg.norm(np.cross(u, v), axis=1)
+
+
+def visvalingam_whyatt(puntos, area_minima):
+    """Máscara de los vértices que conserva Visvalingam-Whyatt con el área efectiva mínima dada."""
+    puntos = _como_array(puntos)
+    n = len(puntos)
+    vivos = np.arange(n)
+    # Desempate fijo entre áreas iguales (tramos rectos): sin él solo se
+    # quitaría un vértice por ronda en una recta.
+    desempate = np.random.default_rng(0).random(n) * 1e-6
+    rondas = 0
+    while len(vivos) > 2:
+        areas = _areas(puntos, vivos)
+        candidatos = areas < area_minima
+        if not candidatos.any():
+            break
+        if rondas < RONDAS_POR_MINIMOS:
+            # Mínimos locales de área entre los candidatos, en el orden de Visvalingam.
+            clave = np.where(candidatos, areas + desempate[vivos[1:-1]] * (areas + 1e-12), np.inf)
+            izquierda = np.concatenate(([np.inf], clave[:-1]))
+            derecha = np.concatenate((clave[1:], [np.inf]))
+            quitar = candidatos & (clave < izquierda) & (clave < derecha)
+        else:
+            # Tramos largos de áreas monótonas: se quita uno de cada dos candidatos seguidos.
+            seguidos = np.concatenate(([False], candidatos[:-1]))
+            inicio_racha = candidatos & ~seguidos
+            racha = np.cumsum(inicio_racha)
+            posicion = np.arange(len(candidatos)) - np.flatnonzero(inicio_racha)[np.maximum(racha - 1, 0)]
+            quitar = candidatos & (posicion % 2 == 0)
+        vivos = np.delete(vivos, np.flatnonzero(quitar) + 1)
+        rondas += 1
+    conservar = np.zeros(n, dtype=bool)
+    conservar[vivos] = True
+    return conservar
+
+
+def desviacion_maxima(puntos, conservar):
+    """Distancia máxima de los vértices eliminados a la polilínea simplificada."""
+    puntos = _como_array(puntos)
+    conservados = np.flatnonzero(conservar)
+    if len(conservados) < 2 or len(conservados) == len(puntos):
+        return 0.0
+    inicios, fines = conservados[:-1], conservados[1:]
+    con_interiores = fines - inicios > 1
+    inicios, fines = inicios[con_interiores], fines[con_interiores]
+    indices, tramo = _interiores(inicios, fines)
+    columnas = [puntos[:, k] for k in range(puntos.shape[1])]
+    return float(np.sqrt(_distancias2_a_segmentos(columnas, indices, inicios[tramo], fines[tramo]).max()))
+
+
+def simplificar(puntos, tolerancia, metodo=DOUGLAS_PEUCKER):
+    """
+    Simplifica los vértices con el método indicado. Devuelve (vértices
+    conservados, resumen con vertices_originales, vertices_resultantes,
+    reduccion en % y desviacion_maxima).
+    """
+    puntos = _como_array(puntos)
+    if metodo == DOUGLAS_PEUCKER:
+        conservar = douglas_peucker(puntos, tolerancia)
+    elif metodo == VISVALINGAM_WHYATT:
+        conservar = visvalingam_whyatt(puntos, tolerancia)
+    else:
+        raise ValueError(f"Método de simplificación no válido: '{metodo}'. Use {' o '.join(METODOS)}.")
+    resultado = puntos[conservar]
+    return resultado, {
+        'metodo': metodo,
+        'vertices_originales': len(puntos),
+        'vertices_resultantes': len(resultado),
+        'reduccion': round(100.0 * (1 - len(resultado) / len(puntos)), 2) if len(puntos) else 0.0,
+        'desviacion_maxima': desviacion_maxima(puntos, conservar),
+    }
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    tolerancia = float(sys.argv[2]) if len(sys.argv) > 2 else 0.01
+    generador = np.random.default_rng(0)
+    estaciones = np.linspace(0, n * 0.5, n)
+    cotas = 100 + 3 * np.sin(estaciones / 400) + 0.02 * estaciones / 100 + generador.normal(0, 0.002, n)
+    rasante = np.column_stack((estaciones, cotas))
+
+    for metodo, valor in ((DOUGLAS_PEUCKER, tolerancia), (VISVALINGAM_WHYATT, tolerancia * 0.5)):
+        inicio = time.perf_counter()
+        _, resumen = simplificar(rasante, valor, metodo)
+        duracion = time.perf_counter() - inicio
+        print(f"{metodo}: {resumen['vertices_originales']} -> {resumen['vertices_resultantes']} vértices "
+              f"({resumen['reduccion']} %), desviación máxima {resumen['desviacion_maxima']:.4f}, "
+              f"{duracion * 1000:.1f} ms")
@@ -32,17 +32,28 @@ document.addEventListener('DOMContentLoaded', () => {
       return;
     }
 
-    Promise.all([
-      leerArchivoCSV(coordenadasFile),
-      leerArchivoCSV(tuberiasFile)
-    ])
-      .then(([coordenadasData, tuberiasData]) => {
-        enviarDatosAlServidor({ coordenadas: coordenadasData, tuberias: tuberiasData });
-      })
-      .catch(error => {
-        mostrarMensaje('Error al leer los archivos CSV: ' + error, 'error');
-        ocultarSpinner();
-      });
+    enviarArchivosCSV(coordenadasFile, tuberiasFile);
+  });
+
+  // Exportaciones sin AutoCAD: los mismos CSV se convierten en el servidor
+  // y se descargan.
+  const exportaciones = [
+    { boton: 'exportarDXF', ruta: '/exportar_dxf', archivo: 'importacion.dxf', cabecera: 'X-Resumen-DXF', nombre: 'DXF' },
+    { boton: 'exportarLandXML', ruta: '/exportar_landxml', archivo: 'importacion.xml', cabecera: 'X-Resumen-LandXML', nombre: 'LandXML' }
+  ];
+  exportaciones.forEach(exportacion => {
+    const boton = document.getElementById(exportacion.boton);
+    if (!boton) return;
+    boton.addEventListener('click', () => {
+      const coordenadasFile = document.getElementById('coordenadas').files[0];
+      const tuberiasFile = document.getElementById('tuberias').files[0];
+
+      if (!coordenadasFile) {
+        mostrarMensaje('Error: Debe seleccionar al menos el archivo de coordenadas.', 'error');
+        return;
+      }
+      descargarExportacion(exportacion, coordenadasFile, tuberiasFile);
+    });
   });
 
   function cargarScripts() {
@@ -65,111 +76,63 @@ document.addEventListener('DOMContentLoaded', () => {
       });
   }
 
-  function leerArchivoCSV(file) {
-    return new Promise((resolve, reject) => {
-      const reader = new FileReader();
-      reader.onload = (e) => {
-        const csvData = e.target.result;
-        const data = parseCSV(csvData);
-        resolve(data);
-      };
-      reader.onerror = (error) => {
-        reject(error);
-      };
-      reader.readAsText(file);
-    });
-  }
+  // Sube los CSV tal cual (multipart): el servidor los lee y los escribe en
+  // AutoCAD por bloques a medida que llegan, sin cargarlos enteros en memoria.
+  // Las coordenadas van primero para que las tuberías puedan enlazarse sin esperas.
+  function enviarArchivosCSV(archivoCoordenadas, archivoTuberias) {
+    const formData = new FormData();
+    formData.append('coordenadas', archivoCoordenadas);
+    formData.append('tuberias', archivoTuberias);
 
-  function parseCSV(csvData) {
-    const lines = csvData.split('\n');
-    if (lines.length === 0) return [];
-    const headers = lines[0].split(',');
-    const data = [];
-    for (let i = 1; i < lines.length; i++) {
-      const line = lines[i].trim();
-      if (line) {
-        const values = line.split(',');
-        if (values.length === headers.length) {
-          const row = {};
-          for (let j = 0; j < headers.length; j++) {
-            row[headers[j]] = values[j];
-          }
-          data.push(row);
+    fetch('/cargar_csv', {
+      method: 'POST',
+      body: formData
+    })
+      .then(response => response.json())
+      .then(mensaje => {
+        let texto = mensaje.message || mensaje.error;
+        if (mensaje.filas_invalidas) {
+          texto += ` (${mensaje.filas_invalidas} filas inválidas omitidas)`;
         }
-      }
-    }
-    return data;
+        mostrarMensaje(texto, mensaje.error ? 'error' : 'success');
+      })
+      .catch(error => {
+        mostrarMensaje('Error al comunicarse con el servidor: ' + error, 'error');
+      })
+      .finally(ocultarSpinner);
   }
 
-  function enviarDatosAlServidor() {
-    const archivoCoordenadasInput = document.getElementById('coordenadas');
-    const archivoTuberiasInput = document.getElementById('tuberias');
-  
-    const archivoCoordenadas = archivoCoordenadasInput.files[0];
-    const archivoTuberias = archivoTuberiasInput.files[0];
-  
-    if (!archivoCoordenadas || !archivoTuberias) {
-      mostrarMensaje('Por favor, selecciona ambos archivos CSV.', 'error');
-      return;
+  function descargarExportacion(exportacion, archivoCoordenadas, archivoTuberias) {
+    const formData = new FormData();
+    formData.append('coordenadas', archivoCoordenadas);
+    if (archivoTuberias) {
+      formData.append('tuberias', archivoTuberias);
     }
-  
-    const readerCoordenadas = new FileReader();
-    const readerTuberias = new FileReader();
-  
-    readerCoordenadas.onload = function(event) {
-      const coordenadasCSV = event.target.result;
-      const coordenadasArray = csvToArray(coordenadasCSV);
-  
-      readerTuberias.onload = function(event) {
-        const tuberiasCSV = event.target.result;
-        const tuberiasArray = csvToArray(tuberiasCSV);
-  
-        const data = {
-          coordenadas: coordenadasArray,
-          tuberias: tuberiasArray
-        };
-  
-        fetch('/cargar_datos', {
-          method: 'POST',
-          headers: {
-            'Content-Type': 'application/json'
-          },
-          body: JSON.stringify(data)
-        })
-          .then(response => response.json())
-          .then(mensaje => {
-            mostrarMensaje(mensaje.message, mensaje.error ? 'error' : 'success');
-          })
-          .catch(error => {
-            mostrarMensaje('Error al comunicarse con el servidor: ' + error, 'error');
-          });
-      };
-  
-      readerTuberias.onerror = function() {
-        mostrarMensaje('Error al leer el archivo de tuberías.', 'error');
-      };
-      readerTuberias.readAsText(archivoTuberias);
-    };
-  
-    readerCoordenadas.onerror = function() {
-      mostrarMensaje('Error al leer el archivo de coordenadas.', 'error');
-    };
-    readerCoordenadas.readAsText(archivoCoordenadas);
-  }
-  
-  // Función para convertir texto CSV a un array de objetos JavaScript
-  function csvToArray(csvText) {
-    const lines = csvText.trim().split('\n');
-    const headers = lines.shift().split(',');
-    return lines.map(line => {
-      const values = line.split(',');
-      return headers.reduce((obj, header, index) => {
-        obj[header.trim()] = values[index] ? values[index].trim() : '';
-        return obj;
-      }, {});
-    });
+    mostrarSpinner();
+
+    fetch(exportacion.ruta, {
+      method: 'POST',
+      body: formData
+    })
+      .then(response => {
+        if (!response.ok) {
+          return response.json().then(mensaje => { throw new Error(mensaje.error || mensaje.message); });
+        }
+        const resumen = response.headers.get(exportacion.cabecera);
+        return response.blob().then(blob => {
+          const enlace = document.createElement('a');
+          enlace.href = URL.createObjectURL(blob);
+          enlace.download = exportacion.archivo;
+          enlace.click();
+          URL.revokeObjectURL(enlace.href);
+          mostrarMensaje(`${exportacion.nombre} generado (${resumen || 'sin resumen'}).`, 'success');
+        });
+      })
+      .catch(error => {
+        mostrarMensaje(`Error al exportar el ${exportacion.nombre}: ` + error.message, 'error');
+      })
+      .finally(ocultarSpinner);
   }
-  
 
   function mostrarMensaje(mensaje, tipo) {
     mensajesDiv.innerHTML = `<p class="${tipo}">${mensaje}</p>`;
@@ -272,38 +235,55 @@ document.addEventListener('DOMContentLoaded', () => {
 
   generarPerfilTerrenoBtn.addEventListener('click', () => {
     const alineamientoId = prompt('Ingrese el ID del alineamiento:');
-    const polilineaId = prompt('Ingrese el ID de la polilínea 3D:');
+    const polilineaId = prompt('Ingrese el ID de la polilínea 3D (vacío: TIN de coordenadas.csv):');
+    const intervalo = alineamientoId ? prompt('Intervalo de muestreo en metros (vacío: solo los vértices):') : null;
 
-    if (alineamientoId && polilineaId) {
+    if (alineamientoId) {
       fetch('/generar_perfil_terreno', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json'
         },
-        body: JSON.stringify({ alineamiento_id: alineamientoId, polilinea_id: polilineaId })
+        body: JSON.stringify({
+          alineamiento_id: alineamientoId,
+          polilinea_id: polilineaId || undefined,
+          superficie: polilineaId ? undefined : 'coordenadas',
+          intervalo: intervalo ? parseFloat(intervalo) : undefined
+        })
       })
         .then(response => response.json())
         .then(mensaje => mostrarMensaje(mensaje.message, mensaje.error ? 'error' : 'success'))
         .catch(error => mostrarMensaje('Error: ' + error, 'error'));
     } else {
-      mostrarMensaje('Por favor, ingrese los IDs del alineamiento y la polilínea.', 'error');
+      mostrarMensaje('Por favor, ingrese el ID del alineamiento.', 'error');
     }
   });
 
   copiarPerfilTapadoBtn.addEventListener('click', () => {
-    const perfilId = prompt('Ingrese el ID del perfil:');
-    const distanciaTapa = prompt('Ingrese la distancia de la tapa:');
+    const perfilId = prompt('Ingrese el ID del perfil (o varios separados por comas):');
+    const distanciaTapa = prompt('Ingrese la distancia de la tapa (o varias separadas por comas, p. ej. 0.8, 1.0, 1.2):');
 
     if (perfilId && distanciaTapa) {
-      fetch('/copiar_perfil_tapado', {
+      const perfilIds = perfilId.split(',').map(id => id.trim()).filter(id => id);
+      const distancias = distanciaTapa.split(',').map(d => parseFloat(d));
+
+      if (distancias.some(isNaN)) {
+        mostrarMensaje('Las distancias de la tapa deben ser números.', 'error');
+        return;
+      }
+
+      const varios = perfilIds.length > 1 || distancias.length > 1;
+      fetch(varios ? '/copiar_perfiles_tapados' : '/copiar_perfil_tapado', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json'
         },
-        body: JSON.stringify({ perfil_id: perfilId, distancia_tapa: parseFloat(distanciaTapa) })
+        body: JSON.stringify(varios
+          ? { perfil_ids: perfilIds, distancias: distancias }
+          : { perfil_id: perfilIds[0], distancia_tapa: distancias[0] })
       })
         .then(response => response.json())
-        .then(mensaje => mostrarMensaje(mensaje.message, mensaje.error ? 'error' : 'success'))
+        .then(mensaje => mostrarMensaje(mensaje.error || mensaje.message, mensaje.error ? 'error' : 'success'))
         .catch(error => mostrarMensaje('Error: ' + error, 'error'));
     } else {
       mostrarMensaje('Por favor, ingrese el ID del perfil y la distancia de la tapa.', 'error');
@@ -420,38 +400,72 @@ document.addEventListener('DOMContentLoaded', () => {
     }
   });
 
+  // Lee una respuesta NDJSON y llama a alElemento con cada línea en cuanto llega.
+  async function leerNdjson(url, alElemento) {
+    const respuesta = await fetch(url);
+    if (!respuesta.ok || !respuesta.body) throw new Error(`HTTP ${respuesta.status}`);
+    const lector = respuesta.body.getReader();
+    const decodificador = new TextDecoder();
+    let resto = '';
+    while (true) {
+      const { value, done } = await lector.read();
+      if (done) break;
+      resto += decodificador.decode(value, { stream: true });
+      const lineas = resto.split('\n');
+      resto = lineas.pop();
+      lineas.filter(linea => linea.trim()).forEach(linea => alElemento(JSON.parse(linea)));
+    }
+    if (resto.trim()) alElemento(JSON.parse(resto));
+  }
+
+  // Muestra un listado transmitido: las líneas se añaden por tandas mientras
+  // llegan, sin esperar a que el servidor termine de recorrer el dibujo.
+  function mostrarListado(url, nombre) {
+    const salida = document.getElementById('jsonOutput');
+    const estado = document.createElement('p');
+    const listado = document.createElement('pre');
+    salida.replaceChildren(estado, listado);
+    let recibidos = 0;
+    let pendientes = [];
+    let final = null;
+    const volcar = () => {
+      if (pendientes.length) {
+        listado.append(pendientes.join('\n') + '\n');
+        pendientes = [];
+      }
+      estado.textContent = final || `${nombre}: ${recibidos} recibidos...`;
+    };
+    const intervalo = setInterval(volcar, 250);
+
+    leerNdjson(url, elemento => {
+      if (elemento.resumen) {
+        final = `${nombre}: ${recibidos} recibidos.`;
+      } else if (elemento.error || elemento.warning) {
+        final = elemento.error || elemento.warning;
+        estado.style.color = elemento.error ? 'red' : '';
+      } else {
+        recibidos++;
+        pendientes.push(JSON.stringify(elemento));
+      }
+    })
+      .catch(error => {
+        final = `Error al obtener ${nombre.toLowerCase()} de AutoCAD: ${error}`;
+        estado.style.color = 'red';
+      })
+      .finally(() => {
+        clearInterval(intervalo);
+        volcar();
+      });
+  }
+
   document.getElementById('verObjetos').addEventListener('click', function() {
-    fetch('/obtener_objetos')
-        .then(response => response.json())
-        .then(data => {
-            const jsonOutputDiv = document.getElementById('jsonOutput');
-            jsonOutputDiv.innerHTML = '<pre>' + JSON.stringify(data, null, 4) + '</pre>';
-        })
-        .catch(error => {
-            const jsonOutputDiv = document.getElementById('jsonOutput');
-            jsonOutputDiv.innerHTML = `<p style="color: red;">Error al obtener los objetos de AutoCAD: ${error}</p>`;
-        });
+    mostrarListado('/obtener_objetos?formato=ndjson', 'Objetos');
   });
 
   document.getElementById('verPerfiles').addEventListener('click', function() {
-    fetch('/obtener_perfiles')
-        .then(response => response.json())
-        .then(data => {
-            const jsonOutputDiv = document.getElementById('jsonOutput');
-            jsonOutputDiv.innerHTML = '<pre>' + JSON.stringify(data, null, 4) + '</pre>';
-        })
-        .catch(error => {
-            const jsonOutputDiv = document.getElementById('jsonOutput');
-            jsonOutputDiv.innerHTML = `<p style="color: red;">Error al obtener los perfiles de AutoCAD: ${error}</p>`;
-        });
-
-
-
+    mostrarListado('/obtener_perfiles?formato=ndjson', 'Perfiles');
   });
 
- 
-
-
 });
 
 
@@ -0,0 +1,397 @@
+"""
+Superficie TIN local para muestrear cotas de terreno sin AutoCAD.
+
+SuperficieTIN triangula los puntos levantados (coordenadas.csv o los
+puntos de una superficie importada en el almacén del proyecto) y construye
+un índice de rejilla: cada celda guarda los triángulos cuya caja la toca.
+cotas(x, y) responde miles de consultas en una sola llamada vectorizada:
+localiza la celda de cada punto, prueba solo sus triángulos candidatos con
+coordenadas baricéntricas e interpola la cota en el plano del triángulo.
+Los puntos fuera de la superficie devuelven NaN.
+
+La triangulación de Delaunay usa scipy.spatial si está instalado y, si no,
+una inserción incremental (Bowyer-Watson) en orden de Morton, suficiente
+para levantamientos de decenas de miles de puntos.
+
+Uso desde la línea de comandos:
+    python superficie_tin.py [puntos] [consultas]   # mide triangulación y consultas
+"""
+import logging
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+from carga_csv import leer_tabla_csv
+from validacion import ESQUEMA_COORDENADAS
+
+try:
+    from scipy.spatial import Delaunay
+except ImportError:  # Sin SciPy: triangulación incremental propia
+    Delaunay = None
+
+logger = logging.getLogger(__name__)
+
+TRIANGULOS_POR_CELDA = 2
+TAMANO_TRAMO_CONSULTA = 65536
+TOLERANCIA_BARICENTRICA = 1e-9
+
+
+def _orden_morton(xy):
+    """Índices de los puntos ordenados por la curva de Morton (inserciones cercanas entre sí)."""
+    minimo = xy.min(axis=0)
+    escala = max(float(np.ptp(xy, axis=0).max()), 1e-12)
+    celdas = ((xy - minimo) / escala * 65535).astype(np.uint64)
+
+    def separar(v):
+        v = (v | (v << 8)) & 0x00FF00FF
+        v = (v | (v << 4)) & 0x0F0F0F0F
+        v = (v | (v << 2)) & 0x33333333
+        return (v | (v << 1)) & 0x55555555
+
+    return np.argsort(separar(celdas[:, 0]) | (separar(celdas[:, 1]) << np.uint64(1)), kind='stable')
+
+
+def _circunferencia(ax, ay, bx, by, cx, cy):
+    """(centro x, centro y, radio²) de la circunferencia por tres puntos."""
+    d = 2 * (ax * (by - cy) + bx * (cy - ay) + cx * (ay - by))
+    if d == 0:
+        return 0.0, 0.0, math.inf  # triángulo degenerado: su círculo lo contiene todo
+    a2, b2, c2 = ax * ax + ay * ay, bx * bx + by * by, cx * cx + cy * cy
+    ux = (a2 * (by - cy) + b2 * (cy - ay) + c2 * (ay - by)) / d
+    uy = (a2 * (cx - bx) + b2 * (ax - cx) + c2 * (bx - ax)) / d
+    return ux, uy, (ax - ux) ** 2 + (ay - uy) ** 2
+
+
+def _lado(xs, ys, a, b, px, py):
+    """
+    > 0 si el punto queda a la izquierda de la arista a-b. Se calcula
+    siempre desde el vértice de menor índice, así los dos triángulos de una
+    arista ven el mismo signo aunque el punto esté casi alineado con ella.
+    """
+    if a > b:
+        return -_lado(xs, ys, b, a, px, py)
+    return (xs[b] - xs[a]) * (py - ys[a]) - (ys[b] - ys[a]) * (px - xs[a])
+
+
+def _conectados(cavidad, inicio, vecinos):
+    """Triángulos de cavidad conectados con inicio a través de vecinos."""
+    conectados = {inicio}
+    pendientes = [inicio]
+    while pendientes:
+        u = pendientes.pop()
+        for v in vecinos[u]:
+            if v in cavidad and v not in conectados:
+                conectados.add(v)
+                pendientes.append(v)
+    return conectados
+
+
+def _delaunay_incremental(xy):
+    """
+    Triangulación de Delaunay por inserción incremental (Bowyer-Watson).
+
+    Cada punto se localiza caminando por los vecinos desde el último
+    triángulo creado y la cavidad se busca solo entre vecinos, así el coste
+    por punto no depende del total. Devuelve un array (M, 3) de índices en
+    sentido antihorario; los puntos repetidos se ignoran.
+    """
+    n = len(xy)
+    centro = (xy.min(axis=0) + xy.max(axis=0)) / 2
+    escala = max(float(np.ptp(xy, axis=0).max()), 1e-12)
+    normalizados = (xy - centro) / escala
+    # Triángulo envolvente: los puntos quedan en [-0.5, 0.5].
+    xs = normalizados[:, 0].tolist() + [-1e4, 1e4, 0.0]
+    ys = normalizados[:, 1].tolist() + [-1e4, -1e4, 1e4]
+
+    vertices = [[n, n + 1, n + 2]]
+    vecinos = [[-1, -1, -1]]  # vecinos[t][k]: triángulo al otro lado de la arista opuesta al vértice k
+    circulos = [_circunferencia(xs[n], ys[n], xs[n + 1], ys[n + 1], xs[n + 2], ys[n + 2])]
+    ultimo = 0
+    repetido = 1e-12
+
+    for i in _orden_morton(xy).tolist():
+        px, py = xs[i], ys[i]
+
+        # Localización: se cruza una arista que deja el punto fuera hasta
+        # encontrar su triángulo. La primera arista que se mira va rotando
+        # para que el paseo no se quede en un ciclo con puntos cocirculares.
+        t = ultimo
+        for paso in range(4 * len(vertices) + 10):
+            tri = vertices[t]
+            for k in (paso % 3, (paso + 1) % 3, (paso + 2) % 3):
+                if _lado(xs, ys, tri[(k + 1) % 3], tri[(k + 2) % 3], px, py) < 0:
+                    t = vecinos[t][k]
+                    break
+            else:
+                break
+        else:
+            raise ValueError("No se pudo localizar un punto en la triangulación (geometría degenerada).")
+        if any((xs[v] - px) ** 2 + (ys[v] - py) ** 2 < repetido for v in vertices[t]):
+            continue
+
+        # Cavidad: triángulos conectados cuyo círculo circunscrito contiene el punto.
+        cavidad = {t}
+        pendientes = [t]
+        while pendientes:
+            u = pendientes.pop()
+            for v in vecinos[u]:
+                if v >= 0 and v not in cavidad:
+                    ux, uy, r2 = circulos[v]
+                    if (px - ux) ** 2 + (py - uy) ** 2 < r2:
+                        cavidad.add(v)
+                        pendientes.append(v)
+
+        # Cada arista del borde de la cavidad forma un triángulo nuevo con el
+        # punto. Con puntos cocirculares el redondeo puede meter en la cavidad
+        # un triángulo que deja una arista del borde sin ver desde el punto:
+        # se saca de la cavidad y se vuelve a mirar el borde.
+        while True:
+            borde = []
+            ocultos = set()
+            for u in cavidad:
+                tri, vec = vertices[u], vecinos[u]
+                for k in range(3):
+                    if vec[k] not in cavidad:
+                        a, b = tri[(k + 1) % 3], tri[(k + 2) % 3]
+                        if u != t and _lado(xs, ys, a, b, px, py) <= 0:
+                            ocultos.add(u)
+                        borde.append((a, b, vec[k]))
+            if not ocultos:
+                break
+            cavidad -= ocultos
+            cavidad = _conectados(cavidad, t, vecinos)
+        huecos = list(cavidad)
+        por_inicio, por_fin = {}, {}
+        for a, b, exterior in borde:
+            if huecos:
+                nuevo = huecos.pop()
+                vertices[nuevo] = [a, b, i]
+                vecinos[nuevo] = [-1, -1, exterior]
+                circulos[nuevo] = _circunferencia(xs[a], ys[a], xs[b], ys[b], px, py)
+            else:
+                nuevo = len(vertices)
+                vertices.append([a, b, i])
+                vecinos.append([-1, -1, exterior])
+                circulos.append(_circunferencia(xs[a], ys[a], xs[b], ys[b], px, py))
+            if exterior >= 0:
+                tri = vertices[exterior]
+                vecinos[exterior][next(k for k in range(3) if tri[k] != a and tri[k] != b)] = nuevo
+            por_inicio[a] = nuevo
+            por_fin[b] = nuevo
+        for a, b, _ in borde:
+            nuevo = por_inicio[a]
+            vecinos[nuevo][0] = por_inicio[b]
+            vecinos[nuevo][1] = por_fin[a]
+        ultimo = nuevo
+
+    triangulos = np.array(vertices, dtype=np.int64).reshape(-1, 3)
+    return triangulos[(triangulos < n).all(axis=1)]
+
+
+def triangular(xy):
+    """Triangulación de Delaunay de los puntos (N, 2). Devuelve un array (M, 3) de índices."""
+    xy = np.asarray(xy, dtype=np.float64)
+    if len(xy) < 3:
+        return np.empty((0, 3), dtype=np.int64)
+    if Delaunay is not None:
+        try:
+            return Delaunay(xy).simplices.astype(np.int64)
+        except Exception as e:  # QhullError con puntos colineales
+            logger.warning(f"SciPy no pudo triangular los puntos ({e}); se usa la triangulación propia.")
+    return _delaunay_incremental(xy)
+
+
+class SuperficieTIN:
+    """
+    Red de triángulos con índice de rejilla para consultar cotas.
+
+    puntos es un array (N, 3); triangulos un array (M, 3) de índices en
+    puntos (si es None se triangula por Delaunay). Las coordenadas se
+    guardan relativas al centro de la superficie para no perder precisión
+    con coordenadas UTM.
+    """
+
+    def __init__(self, puntos, triangulos=None):
+        puntos = np.asarray(puntos, dtype=np.float64).reshape(-1, 3)
+        if triangulos is None:
+            triangulos = triangular(puntos[:, :2])
+        self.puntos = puntos
+        self.triangulos = np.asarray(triangulos, dtype=np.int64).reshape(-1, 3)
+        self._origen = (puntos[:, :2].min(axis=0) + puntos[:, :2].max(axis=0)) / 2 if len(puntos) else np.zeros(2)
+        self._preparar_triangulos()
+        self._construir_indice()
+
+    def __len__(self):
+        return len(self.triangulos)
+
+    @property
+    def caja(self):
+        """(xmin, ymin, xmax, ymax) de la superficie."""
+        return tuple(float(v) for v in (*(self._minimo + self._origen), *(self._maximo + self._origen)))
+
+    def _preparar_triangulos(self):
+        xy = self.puntos[:, :2] - self._origen
+        a, b, c = (xy[self.triangulos[:, k]] for k in range(3))
+        v0, v1 = b - a, c - a
+        determinante = v0[:, 0] * v1[:, 1] - v1[:, 0] * v0[:, 1]
+        # Los triángulos degenerados (área nula) no pueden contener ningún punto.
+        validos = np.abs(determinante) > 1e-12 * np.maximum(1.0, np.abs(v0).max(axis=1) * np.abs(v1).max(axis=1))
+        self.triangulos = self.triangulos[validos]
+        self._a, self._v0, self._v1 = a[validos], v0[validos], v1[validos]
+        self._inverso = 1.0 / determinante[validos]
+        z = self.puntos[:, 2]
+        self._z = z[self.triangulos]
+
+    def _construir_indice(self):
+        """Rejilla uniforme en formato CSR: _inicio_celda[c]:_inicio_celda[c + 1] indexa _triangulos_celda."""
+        m = len(self.triangulos)
+        if m == 0:
+            self._minimo = self._maximo = np.zeros(2)
+            self._columnas = self._filas = 1
+            self._tamano = np.ones(2)
+            self._inicio_celda = np.zeros(2, dtype=np.int64)
+            self._triangulos_celda = np.empty(0, dtype=np.int64)
+            return
+        esquinas = np.stack((self._a, self._a + self._v0, self._a + self._v1))
+        minimos, maximos = esquinas.min(axis=0), esquinas.max(axis=0)
+        self._minimo, self._maximo = minimos.min(axis=0), maximos.max(axis=0)
+        ancho, alto = np.maximum(self._maximo - self._minimo, 1e-9)
+        celdas = max(1, m // TRIANGULOS_POR_CELDA)
+        self._columnas = max(1, int(round(math.sqrt(celdas * ancho / alto))))
+        self._filas = max(1, int(math.ceil(celdas / self._columnas)))
+        self._tamano = np.array((ancho / self._columnas, alto / self._filas))
+
+        c0, f0 = self._celda(minimos)
+        c1, f1 = self._celda(maximos)
+        ancho_c, alto_c = c1 - c0 + 1, f1 - f0 + 1
+        cuantas = ancho_c * alto_c
+        # Un par (triángulo, celda) por cada celda que toca la caja del triángulo.
+        triangulo = np.repeat(np.arange(m), cuantas)
+        desplazamiento = np.arange(len(triangulo)) - np.repeat(np.cumsum(cuantas) - cuantas, cuantas)
+        columna = c0[triangulo] + desplazamiento % ancho_c[triangulo]
+        fila = f0[triangulo] + desplazamiento // ancho_c[triangulo]
+        celda = fila * self._columnas + columna
+        orden = np.argsort(celda, kind='stable')
+        self._triangulos_celda = triangulo[orden]
+        self._inicio_celda = np.zeros(self._columnas * self._filas + 1, dtype=np.int64)
+        np.cumsum(np.bincount(celda, minlength=self._columnas * self._filas), out=self._inicio_celda[1:])
+
+    def _celda(self, xy):
+        indices = np.floor((xy - self._minimo) / self._tamano).astype(np.int64)
+        return (np.clip(indices[:, 0], 0, self._columnas - 1), np.clip(indices[:, 1], 0, self._filas - 1))
+
+    def cotas(self, x, y):
+        """Cotas interpoladas en los puntos (x, y) (arrays o escalares). NaN fuera de la superficie."""
+        x = np.atleast_1d(np.asarray(x, dtype=np.float64))
+        y = np.atleast_1d(np.asarray(y, dtype=np.float64))
+        resultado = np.full(len(x), np.nan)
+        for inicio in range(0, len(x), TAMANO_TRAMO_CONSULTA):
+            tramo = slice(inicio, inicio + TAMANO_TRAMO_CONSULTA)
+            resultado[tramo] = self._cotas_tramo(x[tramo], y[tramo])
+        return resultado
+
+    def cota(self, x, y):
+        """Cota en un punto, o None fuera de la superficie."""
+        valor = self.cotas(x, y)[0]
+        return None if np.isnan(valor) else float(valor)
+
+    def _cotas_tramo(self, x, y):
+        resultado = np.full(len(x), np.nan)
+        xy = np.column_stack((x, y)) - self._origen
+        dentro = np.flatnonzero(((xy >= self._minimo) & (xy <= self._maximo)).all(axis=1))
+        if not len(dentro) or not len(self.triangulos):
+            return resultado
+        columna, fila = self._celda(xy[dentro])
+        celda = fila * self._columnas + columna
+        inicio, fin = self._inicio_celda[celda], self._inicio_celda[celda + 1]
+        cuantos = fin - inicio
+
+        # Pares (consulta, triángulo candidato) de todas las consultas del tramo.
+        consulta = np.repeat(np.arange(len(dentro)), cuantos)
+        posicion = np.repeat(inicio - (np.cumsum(cuantos) - cuantos), cuantos) + np.arange(len(consulta))
+        triangulo = self._triangulos_celda[posicion]
+        d = xy[dentro][consulta] - self._a[triangulo]
+        v0, v1, inverso = self._v0[triangulo], self._v1[triangulo], self._inverso[triangulo]
+        l1 = (d[:, 0] * v1[:, 1] - v1[:, 0] * d[:, 1]) * inverso
+        l2 = (v0[:, 0] * d[:, 1] - d[:, 0] * v0[:, 1]) * inverso
+        contiene = (l1 >= -TOLERANCIA_BARICENTRICA) & (l2 >= -TOLERANCIA_BARICENTRICA) \
+            & (l1 + l2 <= 1 + TOLERANCIA_BARICENTRICA)
+
+        aciertos = np.flatnonzero(contiene)
+        # Un punto en una arista cae en dos triángulos: vale el primero.
+        consultas_con_acierto, primero = np.unique(consulta[aciertos], return_index=True)
+        elegido = aciertos[primero]
+        z = self._z[triangulo[elegido]]
+        resultado[dentro[consultas_con_acierto]] = (
+            z[:, 0] + l1[elegido] * (z[:, 1] - z[:, 0]) + l2[elegido] * (z[:, 2] - z[:, 0]))
+        return resultado
+
+    # --- Construcción desde los datos del proyecto ------------------------------
+
+    @classmethod
+    def desde_csv(cls, ruta):
+        """Triangula los puntos de un CSV con el formato de coordenadas.csv (filas inválidas omitidas)."""
+        tabla, errores = leer_tabla_csv(ruta, ESQUEMA_COORDENADAS)
+        if errores:
+            logger.warning(f"{len(errores)} errores en {ruta}; esas filas no entran en la superficie.")
+        return cls(tabla.coordenadas())
+
+    @classmethod
+    def desde_almacen(cls, almacen, superficie):
+        """Superficie importada en el almacén del proyecto (id de la entidad AeccDbSurface), con sus caras."""
+        ids, xyz = almacen.puntos_superficie(superficie)
+        caras = almacen.caras_superficie(superficie)
+        if not len(caras):
+            return cls(xyz)
+        # Las caras referencian los id de los puntos, no su posición.
+        posiciones = np.searchsorted(ids, caras)
+        validas = (posiciones < len(ids)).all(axis=1)
+        validas[validas] = (ids[posiciones[validas]] == caras[validas]).all(axis=1)
+        return cls(xyz, posiciones[validas])
+
+
+_superficies_csv = {}
+_bloqueo_superficies = threading.Lock()
+
+
+def superficie_desde_csv(ruta):
+    """SuperficieTIN de un CSV de coordenadas, reutilizada mientras el archivo no cambie."""
+    estado = os.stat(ruta)
+    clave = (os.path.abspath(ruta), estado.st_mtime_ns, estado.st_size)
+    with _bloqueo_superficies:
+        superficie = _superficies_csv.get(clave)
+        if superficie is None:
+            inicio = time.perf_counter()
+            superficie = SuperficieTIN.desde_csv(ruta)
+            logger.info(f"TIN de {ruta}: {len(superficie.puntos)} puntos, {len(superficie)} triángulos "
+                        f"en {time.perf_counter() - inicio:.2f} s.")
+            _superficies_csv.clear()
+            _superficies_csv[clave] = superficie
+        return superficie
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    consultas = int(sys.argv[2]) if len(sys.argv) > 2 else 1000000
+    generador = np.random.default_rng(0)
+    xy = generador.uniform(0, 1000, (n, 2)) + (286000.0, 6351000.0)
+    z = 100 + 0.01 * (xy[:, 0] - 286000) + 5 * np.sin((xy[:, 1] - 6351000) / 50)
+
+    inicio = time.perf_counter()
+    superficie = SuperficieTIN(np.column_stack((xy, z)))
+    duracion = time.perf_counter() - inicio
+    metodo = 'scipy' if Delaunay is not None else 'incremental'
+    print(f"{n} puntos -> {len(superficie)} triángulos ({metodo}) en {duracion:.2f} s")
+
+    muestras = generador.uniform(0, 1000, (consultas, 2)) + (286000.0, 6351000.0)
+    inicio = time.perf_counter()
+    cotas = superficie.cotas(muestras[:, 0], muestras[:, 1])
+    duracion = time.perf_counter() - inicio
+    print(f"{consultas} cotas en {duracion:.2f} s ({consultas / duracion:,.0f} consultas/s, "
+          f"{np.isnan(cotas).sum()} fuera de la superficie)")
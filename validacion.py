@@ -0,0 +1,237 @@
+"""
+Validación por columnas de los datos de entrada (coordenadas y tuberías).
+
+validar_tabla convierte una lista de filas (dicts de csv.DictReader o del
+JSON de la web) en arrays de NumPy tipados, una sola vez, y devuelve los
+errores con el índice de la fila. Las funciones que escriben en AutoCAD
+reciben la Tabla ya convertida, así los valores no se vuelven a parsear.
+"""
+from operator import itemgetter
+from typing import NamedTuple
+
+import numpy as np
+
+ENTERO = 'entero'
+REAL = 'real'
+TEXTO = 'texto'
+
+_DTYPES = {ENTERO: np.int64, REAL: np.float64, TEXTO: object}
+_CONVERSORES = {ENTERO: int, REAL: float}
+
+
+class Columna(NamedTuple):
+    nombre: str
+    tipo: str
+    requerida: bool = True
+    no_negativa: bool = False
+    defecto: object = None
+
+
+ESQUEMA_COORDENADAS = (
+    Columna('ID', ENTERO, no_negativa=True),
+    Columna('X', REAL),
+    Columna('Y', REAL),
+    Columna('Z', REAL),
+    Columna('Etiqueta', TEXTO, requerida=False, defecto='Sin descripción'),
+)
+
+ESQUEMA_TUBERIAS = (
+    Columna('ID_TUBERIA', TEXTO, requerida=False, defecto=''),
+    Columna('PK_INICIO', ENTERO, no_negativa=True),
+    Columna('PK_FIN', ENTERO, no_negativa=True),
+    Columna('DIAMETRO', REAL, requerida=False, no_negativa=True, defecto=np.nan),
+    Columna('MATERIAL', TEXTO, requerida=False, defecto=''),
+    Columna('PRESION_NOMINAL', TEXTO, requerida=False, defecto=''),
+    Columna('CONEXION_INICIO', TEXTO, requerida=False, defecto=''),
+    Columna('CONEXION_FIN', TEXTO, requerida=False, defecto=''),
+    Columna('LONGITUD', TEXTO, requerida=False, defecto=''),
+    Columna('PENDIENTE', TEXTO, requerida=False, defecto=''),
+)
+
+ESQUEMA_TUBERIAS_CURVA = (
+    Columna('ID_TUBERIA', TEXTO),
+    Columna('PK_INICIO', ENTERO, no_negativa=True),
+    Columna('PK_FIN', ENTERO, no_negativa=True),
+    Columna('TIPO_CURVA', TEXTO),
+    Columna('RADIO_CURVA', REAL, requerida=False, no_negativa=True, defecto=np.nan),
+)
+
+# tuberias_con_curva.csv con los atributos de info_tuberias.csv; sin
+# TIPO_CURVA la tubería es recta.
+ESQUEMA_TUBERIAS_CON_GEOMETRIA = ESQUEMA_TUBERIAS + (
+    Columna('TIPO_CURVA', TEXTO, requerida=False, defecto='RECTO'),
+    Columna('RADIO_CURVA', REAL, requerida=False, no_negativa=True, defecto=np.nan),
+)
+
+
+class Tabla:
+    """
+    Filas válidas como columnas de NumPy.
+
+    tabla['X'] es un array float64; tabla.filas guarda el índice que tenía
+    cada fila en la entrada original, para poder citarla en los mensajes.
+    """
+
+    def __init__(self, columnas, filas):
+        self.columnas = columnas
+        self.filas = filas
+
+    def __len__(self):
+        return len(self.filas)
+
+    def __getitem__(self, nombre):
+        return self.columnas[nombre]
+
+    def __contains__(self, nombre):
+        return nombre in self.columnas
+
+    def filtrar(self, mascara):
+        """Devuelve una Tabla solo con las filas donde mascara es True."""
+        return Tabla({nombre: valores[mascara] for nombre, valores in self.columnas.items()}, self.filas[mascara])
+
+    def coordenadas(self, columnas=('X', 'Y', 'Z')):
+        """Array (N, 3) con las columnas indicadas."""
+        return np.column_stack([self.columnas[c] for c in columnas]) if len(self) else np.empty((0, len(columnas)))
+
+
+TAMANO_TRAMO = 4096
+
+
+def _vacios(crudos):
+    # Comparaciones elemento a elemento sobre el array object (bucle en C).
+    return (crudos == None) | (crudos == '')  # noqa: E711
+
+
+def _convertir_rapido(valores, tipo, n=None):
+    """Convierte toda la columna de una vez. Lanza TypeError/ValueError si algún valor no es válido."""
+    return np.fromiter(map(_CONVERSORES[tipo], valores), dtype=_DTYPES[tipo], count=len(valores) if n is None else n)
+
+
+def _convertir(valores, tipo):
+    """
+    Convierte una lista de valores al dtype del tipo. Devuelve (array,
+    máscara de vacíos, máscara de inválidos); los vacíos no son inválidos.
+    """
+    dtype = _DTYPES[tipo]
+    conversor = _CONVERSORES[tipo]
+    # Hay algún valor vacío o inválido: se convierte por tramos y solo los
+    # tramos que fallan se recorren valor a valor.
+    resultado = np.zeros(len(valores), dtype=dtype)
+    vacios = np.zeros(len(valores), dtype=bool)
+    invalidos = np.zeros(len(valores), dtype=bool)
+    for inicio in range(0, len(valores), TAMANO_TRAMO):
+        tramo = valores[inicio:inicio + TAMANO_TRAMO]
+        try:
+            resultado[inicio:inicio + len(tramo)] = _convertir_rapido(tramo, tipo)
+            continue
+        except (TypeError, ValueError, OverflowError):
+            pass
+        for i, valor in enumerate(tramo, start=inicio):
+            if valor is None or valor == '':
+                vacios[i] = True
+                continue
+            try:
+                resultado[i] = conversor(valor)
+            except (TypeError, ValueError, OverflowError):
+                invalidos[i] = True
+    return resultado, vacios, invalidos
+
+
+def _leer_columna(filas, nombre):
+    try:
+        return list(map(itemgetter(nombre), filas))
+    except KeyError:
+        return [fila.get(nombre) for fila in filas]
+
+
+def validar_tabla(filas, esquema, desplazamiento=0):
+    """
+    Valida y convierte filas según el esquema.
+
+    Devuelve (tabla, errores): tabla solo contiene las filas válidas y
+    errores es una lista de dicts {'fila', 'columna', 'valor', 'error'}
+    ordenada por fila. desplazamiento se suma a los índices de fila (útil al
+    validar un archivo por bloques).
+    """
+    n = len(filas)
+    validas = np.ones(n, dtype=bool)
+    columnas = {}
+    errores = []
+
+    for columna in esquema:
+        if columna.tipo != TEXTO:
+            try:
+                # Camino rápido: la columna está en todas las filas y todos sus
+                # valores se convierten; se lee y convierte en una sola pasada.
+                valores = _convertir_rapido(map(itemgetter(columna.nombre), filas), columna.tipo, n)
+            except (KeyError, TypeError, ValueError, OverflowError):
+                valores = None
+            if valores is not None and (columna.tipo == ENTERO or np.isfinite(valores).all()):
+                if columna.no_negativa and (valores < 0).any():
+                    negativos = valores < 0
+                    for i in np.flatnonzero(negativos):
+                        valor = filas[i][columna.nombre]
+                        errores.append({'fila': int(i) + desplazamiento, 'columna': columna.nombre, 'valor': valor,
+                                        'error': f"{columna.nombre} debe ser positivo: {valor!r}."})
+                    validas &= ~negativos
+                columnas[columna.nombre] = valores
+                continue
+
+        lista = _leer_columna(filas, columna.nombre)
+        if columna.tipo == TEXTO:
+            crudos = np.empty(n, dtype=object)
+            crudos[:] = lista
+            vacios = _vacios(crudos)
+        else:
+            # Los valores originales solo hacen falta para citar los erróneos.
+            crudos = lista
+            valores, vacios, invalidos = _convertir(lista, columna.tipo)
+
+        if columna.requerida:
+            for i in np.flatnonzero(vacios):
+                errores.append({'fila': int(i) + desplazamiento, 'columna': columna.nombre, 'valor': crudos[i],
+                                'error': f"Falta el valor de la columna {columna.nombre}."})
+            validas &= ~vacios
+
+        if columna.tipo == TEXTO:
+            crudos[vacios] = columna.defecto
+            columnas[columna.nombre] = crudos
+            continue
+
+        valores[vacios] = columna.defecto if columna.defecto is not None else 0
+        if columna.tipo == REAL:
+            no_finitos = ~np.isfinite(valores) & ~vacios & ~invalidos
+            invalidos |= no_finitos
+        negativos = (valores < 0) & ~invalidos if columna.no_negativa else np.zeros(n, dtype=bool)
+
+        for i in np.flatnonzero(invalidos):
+            errores.append({'fila': int(i) + desplazamiento, 'columna': columna.nombre, 'valor': crudos[i],
+                            'error': f"Valor no válido en {columna.nombre}: {crudos[i]!r}."})
+        for i in np.flatnonzero(negativos):
+            errores.append({'fila': int(i) + desplazamiento, 'columna': columna.nombre, 'valor': crudos[i],
+                            'error': f"{columna.nombre} debe ser positivo: {crudos[i]!r}."})
+        validas &= ~(invalidos | negativos)
+        columnas[columna.nombre] = valores
+
+    errores.sort(key=lambda e: e['fila'])
+    filas_validas = np.flatnonzero(validas) + desplazamiento
+    return Tabla({nombre: valores[validas] for nombre, valores in columnas.items()}, filas_validas), errores
+
+
+def mensajes_de_error(errores, maximo=None):
+    """Textos 'Fila N: error' para las respuestas JSON."""
+    errores = errores if maximo is None else errores[:maximo]
+    return [f"Fila {e['fila']}: {e['error']}" for e in errores]
+
+
+if __name__ == "__main__":
+    import time
+
+    n = 1_000_000
+    filas = [{'ID': str(i), 'X': f"{i * 0.5:.3f}", 'Y': f"{i * 0.25:.3f}", 'Z': '100.0', 'Etiqueta': f"P{i}"}
+             for i in range(n)]
+    filas[10]['X'] = 'abc'
+    filas[20]['ID'] = '-1'
+    inicio = time.perf_counter()
+    tabla, errores = validar_tabla(filas, ESQUEMA_COORDENADAS)
+    print(f"{n} filas validadas en {time.perf_counter() - inicio:.3f} s; {len(tabla)} válidas; errores: {mensajes_de_error(errores)}")